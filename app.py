@@ -5,144 +5,57 @@ import streamlit.components.v1 as components
 import pandas as pd
 import sqlite3
 import threading
+import importlib.util
+import html as html_lib
+import re
 from datetime import datetime
-
-try:
-    import yfinance as yf
-    _YF_OK = True
-except ImportError:
-    _YF_OK = False
-
-# ── 股票名称 → 东方财富 secid 映射（内置兜底表）──
-# 东方财富 secid 格式：市场前缀.代码
-#   A股 沪市(上交所) → 1.xxxxxx
-#   A股 深市(深交所) → 0.xxxxxx
-#   港股            → 116.xxxxx（5位，不足补0）
-#   美股            → 105.XXXX
-# 数据库 stock_info 中用户录入的代码优先，此表仅作兜底
-TICKER_MAP = {
-    # 港股
-    "中芯国际":  "116.00981",
-    "汇丰控股":  "116.00005",
-    "中银香港":  "116.02388",
-    "紫金矿业":  "116.02899",
-    "电能实业":  "116.00006",
-    "福耀玻璃":  "116.03606",
-    # A股 深市
-    "比亚迪":    "0.002594",
-    "阳光电源":  "0.300274",
-    "纳指ETF":   "0.159941",
-    # A股 沪市
-    "长江电力":  "1.600900",
-    # 美股
-    "联合健康":  "105.UNH",
-    "特斯拉":    "105.TSLA",
-    "伯克希尔":  "105.BRK-B",
-}
-
-# yfinance ticker（用于降级回退，stock_info 里存的是东方财富 secid）
-_YF_FALLBACK = {
-    "中芯国际":  "0981.HK",
-    "汇丰控股":  "0005.HK",
-    "中银香港":  "2388.HK",
-    "紫金矿业":  "2899.HK",
-    "电能实业":  "0006.HK",
-    "福耀玻璃":  "3606.HK",
-    "比亚迪":    "002594.SZ",
-    "阳光电源":  "300274.SZ",
-    "长江电力":  "600900.SS",
-    "纳指ETF":   "159941.SZ",
-    "联合健康":  "UNH",
-    "特斯拉":    "TSLA",
-    "伯克希尔":  "BRK-B",
-}
-
+from stock21.history import ensure_history_tables, update_daily_history, history_is_stale
+from stock21.cycles import ensure_cycle_tables, update_price_cycles, cycle_stats, reference_points, current_threshold
+from stock21.signal_refs import (ensure_signal_ref_tables, update_refs_from_quotes, backfill_refs_from_history,
+                                 set_refs, save_signal, recent_audit)
+from stock21.matching import match, MatchResult, POLICIES
+from stock21.checkpoints import book_as_of, closes_as_of
+from stock21.symbols import ensure_symbol_keys, rename_symbol, delete_symbol, UPSERT_SYMBOL_SQL
+from stock21.ledger import LedgerCache
+from stock21.archive import (ensure_archive_tables, history_table, archive_closed, restore_archive, archive_summary,
+                             KEEP_YEARS)
+from stock21.parallel import match_symbols
+from stock21.money import migrate_ledger, mark_to_market, units_array, qty_array, from_units
+from stock21.backtest import load_closes, run_grid, simulate, current_params
+from stock21.nav import ensure_nav_tables, update_nav, load_equity_curve, monthly_pnl
+from stock21.returns import compute_returns, PORTFOLIO
+from stock21.fx import ensure_fx_tables, load_fx, symbol_currencies, BASE_CURRENCY
+from stock21.alerts import ensure_alert_tables, AlertEngine, build_sinks, recent_alerts, DB_TIMEOUT_S
+from stock21.importer import (ensure_import_tables, list_profiles, save_profile, resolve_mapping, preview as import_preview,
+                              import_trades, FIELDS as IMPORT_FIELDS, FIELD_LABELS as IMPORT_FIELD_LABELS)
+from stock21.export import ExportJob, DATASETS as EXPORT_DATASETS, FORMATS as EXPORT_FORMATS, snapshot_bytes
+from stock21.api import start_api_server
+from stock21.diag import RECORDER, TracedConnection, timed, start_metrics_server, BUCKETS as DIAG_BUCKETS
+
+from stock21.quotes import (TICKER_MAP, YF_FALLBACK as _YF_FALLBACK, seed_builtin_tickers, build_ticker_map,
+                            fetch_quotes, fetch_eastmoney as _fetch_eastmoney, store_prices, store_price_edits,
+                            load_quote_snapshots as _load_quote_snapshots)
+
+_YF_OK = importlib.util.find_spec("yfinance") is not None
+
+# 行情抓取与代码映射（TICKER_MAP / YF_FALLBACK）在 stock21.quotes，与命令行共用；这里绑定当前连接
 def _build_ticker_map() -> dict:
-    """合并数据库用户录入代码（优先）和内置 TICKER_MAP（兜底）"""
-    merged = dict(TICKER_MAP)
-    try:
-        rows = conn.execute(
-            "SELECT stock_name, stock_code FROM stock_info WHERE stock_code IS NOT NULL AND stock_code != ''"
-        ).fetchall()
-        for name, code in rows:
-            merged[name] = code  # 用户录入的覆盖内置
-    except Exception:
-        pass
-    return merged
+    return build_ticker_map(conn)
 
-def _fetch_eastmoney(secids: list) -> dict:
-    """
-    东方财富批量行情接口。
-    secids: ['1.600900', '0.002594', '116.00981', '105.TSLA', ...]
-    返回 {股票纯代码: 最新价(float)}
-    f2=现价（交易时段）, f18=昨收（非交易时段兜底）, f12=代码
-    """
-    import urllib.request, json
-    if not secids:
-        return {}
-    fields = "f2,f18,f12"   # f2=现价, f18=昨收（非交易时段兜底）, f12=代码
-    url = (
-        "https://push2.eastmoney.com/api/qt/ulist.np/get"
-        f"?fltt=2&invt=2&fields={fields}&secids={','.join(secids)}"
-    )
-    try:
-        req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-        with urllib.request.urlopen(req, timeout=8) as resp:
-            data = json.loads(resp.read().decode())
-        items = (data.get("data") or {}).get("diff") or []
-        result = {}
-        for item in items:
-            price = item.get("f2")
-            code  = str(item.get("f12", ""))
-            if not code:
-                continue
-            # f2 为 "-"、None 或 0 时，用昨收 f18 兜底
-            if price is None or price == "-" or price == 0:
-                price = item.get("f18")
-            if price is None or price == "-" or price == 0:
-                continue
-            result[code] = round(float(price), 4)
-        return result
-    except Exception:
-        return {}
+def load_quote_snapshots() -> dict:
+    """读取全部行情快照：{股票名称: dict}"""
+    return _load_quote_snapshots(conn)
+
+def fetch_latest_quotes(stock_names: list) -> dict:
+    """批量拉取最新行情快照（东方财富优先，yfinance 兜底），并写入 quote_snapshots 表"""
+    return fetch_quotes(conn, stock_names)
 
 def fetch_latest_prices(stock_names: list) -> dict:
     """
-    批量拉取最新价，优先东方财富接口（低延迟），失败时回退 yfinance。
+    批量拉取最新价（同时落库行情快照）。
     返回 {股票名称: 最新价(float)}
     """
-    ticker_map = _build_ticker_map()
-    result = {}
-
-    # ── 第一步：东方财富批量请求 ──
-    secid_to_name = {}
-    for name in stock_names:
-        secid = ticker_map.get(name)
-        if secid:
-            code_part = secid.split(".", 1)[-1]   # "1.600900" → "600900"
-            secid_to_name[code_part] = (name, secid)
-
-    if secid_to_name:
-        em_result = _fetch_eastmoney([v[1] for v in secid_to_name.values()])
-        for code_part, (name, _) in secid_to_name.items():
-            if code_part in em_result:
-                result[name] = em_result[code_part]
-
-    # ── 第二步：东方财富未能拿到的，用 yfinance 兜底 ──
-    missing = [n for n in stock_names if n not in result]
-    if missing and _YF_OK:
-        for name in missing:
-            yf_ticker = _YF_FALLBACK.get(name)
-            if not yf_ticker:
-                continue
-            try:
-                hist = yf.Ticker(yf_ticker).history(period="2d")
-                if not hist.empty:
-                    result[name] = round(float(hist["Close"].iloc[-1]), 4)
-            except Exception:
-                pass
-
-    return result
+    return {name: q["price"] for name, q in fetch_latest_quotes(stock_names).items()}
 
 
 # ============== 自动备份 GitHub ==============
@@ -175,6 +88,10 @@ def _parse_github_repo_info(repo_url):
 
 def sync_db_to_github():
     """通过 GitHub Contents API 直接上传 db 文件，无需 clone/push。必须先 conn.commit() 再调用。"""
+    with timed("sync", "github"):
+        _sync_db_to_github()
+
+def _sync_db_to_github():
     if not (TOKEN and REPO_URL):
         st.toast("⚠️ 同步跳过：TOKEN 或 REPO_URL 未配置", icon="⚠️")
         return
@@ -205,7 +122,7 @@ def sync_db_to_github():
         })
         sha = None
         try:
-            with urllib.request.urlopen(req, timeout=10) as resp:
+            with timed("network", "github_get"), urllib.request.urlopen(req, timeout=10) as resp:
                 data = json.loads(resp.read().decode())
                 sha = data.get("sha")
                 print(f"[sync] got SHA: {sha}")
@@ -229,7 +146,7 @@ def sync_db_to_github():
             "User-Agent": "Streamlit-Bot",
             "Content-Type": "application/json"
         })
-        with urllib.request.urlopen(put_req, timeout=15) as resp:
+        with timed("network", "github_put"), urllib.request.urlopen(put_req, timeout=15) as resp:
             result = json.loads(resp.read().decode())
             if result.get("commit"):
                 print(f"[sync] SUCCESS: {result['commit'].get('sha', '')}")
@@ -240,11 +157,15 @@ def sync_db_to_github():
 # ==========================================
 
 st.set_page_config(page_title="股票管理系统 Pro", layout="wide", page_icon="📈")
+RECORDER.begin_rerun()
 
 @st.cache_resource
 def get_connection():
     db_path = str(DB_FILE)
-    _conn = sqlite3.connect(db_path, check_same_thread=False)
+    # TracedConnection：给每条语句计时，供 🩺 诊断页与 /metrics 使用
+    # timeout 与提醒引擎的独立连接一致：两边写入冲突时互相等待，而不是 5 秒后报 database is locked
+    _conn = sqlite3.connect(db_path, check_same_thread=False, factory=TracedConnection, timeout=DB_TIMEOUT_S)
+    _conn.execute("PRAGMA foreign_keys = ON")      # symbol_id → stock_info(id) 的引用由数据库强制执行
     # 不使用 WAL 模式，用默认的 DELETE journal
     # 原因：WAL 模式下数据先写 WAL 文件再 checkpoint 到主 db，
     # 但 checkpoint 在 Streamlit Cloud 上不可靠，导致 sync 上传的 db 文件缺少最新数据
@@ -260,7 +181,7 @@ if "db_loaded" not in st.session_state:
             "Authorization": f"token {TOKEN}",
             "User-Agent": "Streamlit-Bot"
         })
-        with urllib.request.urlopen(req, timeout=15) as resp:
+        with timed("network", "github_pull"), urllib.request.urlopen(req, timeout=15) as resp:
             data = json.loads(resp.read().decode())
             db_b64 = data.get("content", "")
             if db_b64:
@@ -303,6 +224,10 @@ c.execute('''CREATE TABLE IF NOT EXISTS decision_history (
     id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT, date TEXT, decision TEXT, reason TEXT)''')
 c.execute('''CREATE TABLE IF NOT EXISTS price_cycles (
     id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT, start_date TEXT, end_date TEXT, change_pct REAL)''')
+c.execute('''CREATE TABLE IF NOT EXISTS quote_snapshots (
+    code TEXT PRIMARY KEY, secid TEXT, price REAL, prev_close REAL, open REAL, high REAL, low REAL,
+    change_pct REAL, change_amt REAL, volume REAL, turnover REAL,
+    source TEXT, quote_time TEXT, fetched_at TEXT)''')
 
 for col_sql in [
     "ALTER TABLE strategy_notes ADD COLUMN annual_return REAL DEFAULT 0.0",
@@ -322,14 +247,27 @@ c.execute('''CREATE TABLE IF NOT EXISTS price_targets (
     code TEXT PRIMARY KEY, base_price REAL DEFAULT 0.0, buy_target REAL DEFAULT 0.0,
     sell_target REAL DEFAULT 0.0, last_updated TEXT)''')
 conn.commit()
+ensure_history_tables(conn)
+ensure_cycle_tables(conn)
+ensure_signal_ref_tables(conn)
+ensure_nav_tables(conn)
+ensure_alert_tables(conn)
+ensure_import_tables(conn)
+ensure_fx_tables(conn)
+# 旧成交价 / 数量规整到定点网格：每个会话开始时检查一次（会话开始时可能刚从 GitHub 拉下旧库）
+if "ledger_migrated" not in st.session_state:
+    migrate_ledger(conn)
+    ensure_archive_tables(conn)
+    # 记录列表按 (date, id) 键集翻页
+    c.execute("CREATE INDEX IF NOT EXISTS idx_journal_date ON journal (date, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_journal_stock_date ON journal (stock_name, date, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_decision_history_code_date ON decision_history (code, date, id)")
+    conn.commit()
+    st.session_state["ledger_migrated"] = True
+ensure_symbol_keys(conn)        # 各表 symbol_id → stock_info.id（整表替换后自动补回）
 
 # ── 将内置 TICKER_MAP 初始化写入 stock_info（INSERT OR IGNORE，不覆盖用户已录入的）──
-for _name, _code in TICKER_MAP.items():
-    try:
-        c.execute("INSERT OR IGNORE INTO stock_info (stock_name, stock_code) VALUES (?, ?)", (_name, _code))
-    except Exception:
-        pass
-conn.commit()
+seed_builtin_tickers(conn)
 
 # 注意：启动时不再自动同步到 GitHub，避免用旧数据覆盖远程
 # 同步只在用户修改数据后触发，确保推送的是最新数据
@@ -1029,8 +967,17 @@ st.sidebar.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-menu = ["🏠 股票详情中心", "📊 实时持仓", "💰 盈利账单", "🎯 价格目标管理", "📝 交易录入", "🔔 买卖信号", "📜 历史明细", "📓 复盘日记"]
+menu = ["🏠 股票详情中心", "📊 实时持仓", "💰 盈利账单", "🎯 价格目标管理", "📝 交易录入", "🔔 买卖信号", "📜 历史明细", "📓 复盘日记", "🩺 诊断"]
 choice = st.sidebar.radio("功能导航", menu, label_visibility="collapsed")
+lot_policy = st.sidebar.selectbox("配对规则", list(POLICIES), format_func=POLICIES.get, key="lot_policy",
+                                  help="平仓时先配对哪一笔未平仓：影响已实现 / 未实现盈亏、配对记录与未平仓单")
+as_of = None     # 'YYYY-MM-DD'：按该日收盘时的账本展示（配对引擎检查点 + 回放其后少量成交）
+if choice in ("🏠 股票详情中心", "📊 实时持仓", "💰 盈利账单"):
+    _as_of_d = st.sidebar.date_input("截至日期", value=None, key="as_of_date",
+                                     help="留空为当前；选定后按该日收盘时的持仓、未平仓单、已实现盈亏与占用资金展示")
+    if _as_of_d and _as_of_d < datetime.now().date():
+        as_of = _as_of_d.strftime('%Y-%m-%d')
+RECORDER.lap("页面主体", page=choice)
 
 # ─── 辅助函数 ───
 def format_number(num):
@@ -1039,6 +986,11 @@ def format_number(num):
     s = f"{num}"
     return s.rstrip('0').rstrip('.') if '.' in s else s
 
+def _as_of_banner():
+    if as_of:
+        st.info(f"🕰 截至 {as_of} 收盘：持仓、未平仓单与已实现盈亏按当日账本还原，现价取当日收盘价（无日线时用当前价），"
+                f"已配对记录只列当日及之前平仓的；清空侧边栏「截至日期」回到当前")
+
 def _metric_card(label, value, sub="", val_color="var(--text-primary)"):
     sub_html = f'<div class="metric-sub" style="color:{val_color}">{sub}</div>' if sub else ""
     return (
@@ -1049,6 +1001,94 @@ def _metric_card(label, value, sub="", val_color="var(--text-primary)"):
         f'</div>'
     )
 
+def refresh_history_and_cycles(stock_names, threshold_pct):
+    """增量拉取日线并识别价格周期（写入 price_cycles / cycle_state），再用日线补齐信号高低点"""
+    with timed("network", "daily_history"):
+        n_rows = update_daily_history(conn, _build_ticker_map(), stock_names, _YF_FALLBACK)
+    n_legs = update_price_cycles(conn, threshold_pct)
+    backfill_refs_from_history(conn)
+    return n_rows, n_legs
+
+def _setting(key, default=None):
+    """读取配置：环境变量（.env）优先，其次 st.secrets"""
+    v = os.getenv(key)
+    if not v:
+        try:
+            v = st.secrets.get(key)
+        except Exception:
+            v = None
+    return v if v not in (None, "") else default
+
+def _poll_alert_prices(db) -> dict:
+    """提醒引擎后台轮询：只拉取设有规则的股票现价，不写 prices / 快照（db 为引擎自己的连接）"""
+    names = set()
+    for table in ("signals", "strategy_notes", "price_targets_v2"):
+        try:
+            names.update(r[0] for r in db.execute(f"SELECT code FROM {table}"))
+        except sqlite3.OperationalError:
+            pass
+    ticker_map = dict(TICKER_MAP)
+    ticker_map.update(db.execute(
+        "SELECT stock_name, stock_code FROM stock_info WHERE stock_code IS NOT NULL AND stock_code != ''").fetchall())
+    secid_to_name = {ticker_map[n].split(".", 1)[-1]: n for n in names if ticker_map.get(n)}
+    if not secid_to_name:
+        return {}
+    got = _fetch_eastmoney([ticker_map[n] for n in secid_to_name.values()])
+    return {secid_to_name[k]: v for k, v in got.items() if k in secid_to_name}
+
+@st.cache_resource
+def get_alert_engine():
+    """
+    进程内唯一的提醒引擎。通道按配置启用：
+      ALERT_WEBHOOK_URL；ALERT_SMTP_HOST / _PORT / _FROM / _TO / _USER / _PASSWORD；
+      ALERT_FILE（默认数据目录下 alerts.jsonl）。ALERT_POLL_SECONDS=0 关闭后台轮询，仅随页面刷新行情判断
+    """
+    sinks = build_sinks({
+        "webhook_url": _setting("ALERT_WEBHOOK_URL"),
+        "smtp_host": _setting("ALERT_SMTP_HOST"), "smtp_port": _setting("ALERT_SMTP_PORT"),
+        "smtp_from": _setting("ALERT_SMTP_FROM"), "smtp_to": _setting("ALERT_SMTP_TO"),
+        "smtp_user": _setting("ALERT_SMTP_USER"), "smtp_password": _setting("ALERT_SMTP_PASSWORD"),
+        "file_path": _setting("ALERT_FILE", str(_DATA_DIR / "alerts.jsonl")),
+    })
+    engine = AlertEngine(str(DB_FILE), sinks, fetch=_poll_alert_prices,
+                         poll_interval=float(_setting("ALERT_POLL_SECONDS", 300)),
+                         cooldown_s=float(_setting("ALERT_COOLDOWN_SECONDS", 1800)),
+                         max_per_minute=int(_setting("ALERT_MAX_PER_MINUTE", 20)))
+    print(f"[alerts] sinks={[s.name for s in sinks]}, poll={engine.poll_interval}s")
+    return engine.start()
+
+@st.cache_resource
+def get_metrics_server():
+    """本机 Prometheus 端点 http://127.0.0.1:<METRICS_PORT>/metrics（默认 9464，设为 0 关闭）"""
+    port = int(_setting("METRICS_PORT", 9464))
+    return start_metrics_server(port) if port else None
+
+get_metrics_server()
+
+@st.cache_resource
+def get_api_server():
+    """本机只读 JSON API http://127.0.0.1:<API_PORT>/api（默认关闭，设置 API_PORT 开启）"""
+    port = int(_setting("API_PORT", 0))
+    return start_api_server(str(DB_FILE), port) if port else None
+
+get_api_server()
+
+@st.cache_resource
+def get_ledger_cache():
+    """进程内共享（跨会话）的成交账本，按版本指纹沿用 / 追加新成交 / 重读，见 stock21.ledger"""
+    return LedgerCache()
+
+def _after_quote_refresh(fetched: dict):
+    """每个行情刷新周期的派生处理：推进买卖信号的运行高低点（一次批量写入），并把行情交给提醒引擎"""
+    try:
+        update_refs_from_quotes(conn, fetched)
+    except Exception as e:
+        print(f"[signals] ref update failed: {e}")
+    try:
+        get_alert_engine().submit(fetched)
+    except Exception as e:
+        print(f"[alerts] submit failed: {e}")
+
 def _page_title(icon, title, subtitle=""):
     sub_html = f'<span style="font-size:0.78em;color:var(--text-muted);font-weight:400;margin-left:8px">{subtitle}</span>' if subtitle else ""
     st.markdown(
@@ -1056,15 +1096,78 @@ def _page_title(icon, title, subtitle=""):
         unsafe_allow_html=True
     )
 
+ENTRY_PAGE = 50     # 记录列表每次加载的条数
+
+def _entry_grid(key, table, columns, labels, where="1 = 1", params=(), page=ENTRY_PAGE, plain=(), empty="暂无记录"):
+    """
+    按 (date, id) 倒序的记录列表（决策历史、复盘日记）：一个 st.dataframe（虚拟滚动、多行选择）代替逐行控件，
+    每次重跑的控件数固定。「加载更多」按 (date, id) 键集翻页：会话里只记已加载到的那一行（floor），
+    重跑时取 floor 及之后的行；选中行确认后一个事务批量删除、只同步一次。plain 中的列在表格里去掉 HTML 标签。
+    返回选中行（含 id）的 DataFrame；没有记录时显示 empty
+    """
+    sel   = f"SELECT id, {', '.join(columns)} FROM {table} WHERE {where}"
+    saved = st.session_state.get(f"{key}_floor")
+    floor = saved[1] if saved and saved[0] == tuple(params) else None     # 筛选条件变了就回到第一页
+    if floor:
+        df = pd.read_sql(sel + " AND (date, id) >= (?, ?) ORDER BY date DESC, id DESC", conn, params=[*params, *floor])
+        more = c.execute(f"SELECT 1 FROM {table} WHERE {where} AND (date, id) < (?, ?) LIMIT 1",
+                         [*params, *floor]).fetchone() is not None
+    else:
+        df = pd.read_sql(sel + " ORDER BY date DESC, id DESC LIMIT ?", conn, params=[*params, page + 1])
+        more = len(df) > page
+        df = df.iloc[:page]
+    if df.empty:
+        st.info(empty)
+        return df
+
+    view = df.drop(columns="id").assign(**{col: df[col].fillna("").astype(str).map(lambda s: re.sub(r"<[^>]+>", "", s))
+                                           for col in plain}).rename(columns=labels)
+    # 行集合变化（新增 / 删除 / 加载更多）时换 key，旧的选中位置不会落到别的行上
+    grid_key = f"{key}_grid_{df['id'].iloc[0] if len(df) else 0}_{len(df)}"
+    event = st.dataframe(view, key=grid_key, on_select="rerun", selection_mode="multi-row",
+                         hide_index=True, use_container_width=True, height=min(38 + 35 * max(len(df), 1), 420))
+    picked = df.iloc[event.selection.rows] if event and event.selection.rows else df.iloc[0:0]
+
+    gc1, gc2, gc3 = st.columns([3, 2, 2])
+    gc1.caption(f"已加载 {len(df)} 条" + (" · 还有更早的记录" if more else "") + " · 勾选行可查看全文或批量删除")
+    if more and gc2.button("⬇️ 加载更多", key=f"{key}_more", use_container_width=True):
+        last = df.iloc[-1]
+        nxt = c.execute(f"""SELECT date, id FROM {table} WHERE {where} AND (date, id) < (?, ?)
+                            ORDER BY date DESC, id DESC LIMIT ?""", [*params, last["date"], int(last["id"]), page]).fetchall()
+        if nxt:
+            st.session_state[f"{key}_floor"] = (tuple(params), tuple(nxt[-1]))
+        st.rerun()
+    with gc3.popover(f"🗑️ 删除选中 {len(picked)} 条", disabled=picked.empty, use_container_width=True):
+        st.caption("删除后不可恢复")
+        if st.button("确认删除", key=f"{key}_del", type="primary"):
+            with conn:
+                conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(int(i),) for i in picked["id"]])
+            sync_db_to_github()
+            st.rerun()
+    return picked
+
+def _journal_card(row):
+    st.markdown(
+        f'<div class="journal-card">'
+        f'<div class="journal-meta">'
+        f'<span style="background:rgba(59,130,246,0.15);color:var(--accent-blue);border-radius:4px;padding:1px 8px;font-weight:600">{row["stock_name"]}</span>'
+        f'<span>{row["date"]}</span>'
+        f'</div>'
+        f'<div class="journal-content">{row["content"]}</div>'
+        f'</div>',
+        unsafe_allow_html=True
+    )
+
 # =====================================================================
 #  🏠 股票详情中心（一体化视图）
 # =====================================================================
 if choice == "🏠 股票详情中心":
     all_stocks = get_dynamic_stock_list()
-    df_trades = pd.read_sql("SELECT * FROM trades ORDER BY date ASC, id ASC", conn)
+    ledger = get_ledger_cache().current(conn)
 
     # ── 顶部标题 ──
     _page_title("🏠", "股票详情中心", "单股全景 · 一页尽览")
+    _as_of_banner()
 
     # ── 股票选择器（原生 selectbox，可靠响应） ──
     if all_stocks:
@@ -1081,6 +1184,7 @@ if choice == "🏠 股票详情中心":
     else:
         selected_stock = None
 
+    RECORDER.lap("行情刷新")
     # ── 自动更新全部现价（带缓存，5分钟内不重复拉取） ──
     _now_ts = datetime.now().timestamp()
     _last_fetch_ts = st.session_state.get("_prices_fetch_ts", 0)
@@ -1091,61 +1195,29 @@ if choice == "🏠 股票详情中心":
         # 无论接口是否返回数据，都更新时间戳，避免每次刷新都重试
         st.session_state["_prices_fetch_ts"] = _now_ts
         if _auto_fetched:
-            for _name, _price in _auto_fetched.items():
-                if _price and _price > 0:   # 只写入有效价格，绝不用0覆盖历史价格
-                    _old = c.execute("SELECT current_price, manual_cost FROM prices WHERE code = ?", (_name,)).fetchone()
-                    _mc  = float(_old[1]) if _old and _old[1] is not None else 0.0
-                    c.execute("INSERT OR REPLACE INTO prices (code, current_price, manual_cost) VALUES (?,?,?)",
-                              (_name, _price, _mc))
-            conn.commit()
+            store_prices(conn, _auto_fetched)   # 只写入有效价格，保留手动成本
+            _after_quote_refresh(_auto_fetched)
             sync_db_to_github()
 
     latest_prices_data = {row[0]: (row[1] or 0.0, row[2] or 0.0) for row in c.execute("SELECT code, current_price, manual_cost FROM prices").fetchall()}
     latest_prices = {k: v[0] for k, v in latest_prices_data.items()}
     manual_costs  = {k: v[1] for k, v in latest_prices_data.items()}
+    quote_snaps   = load_quote_snapshots()
 
     if selected_stock:
-        s_df   = df_trades[df_trades['code'] == selected_stock].copy()
+        s_df   = ledger.trades(selected_stock)
         now_p  = latest_prices.get(selected_stock) or 0.0
 
-        # ── 盈亏计算 ──
-        realized_profit = 0.0
-        max_occupied_amount = 0.0
-        buy_pool  = []
-        sell_pool = []
-        net_q = 0
-
-        for _, t in s_df.iterrows():
-            price = t['price']
-            qty   = t['quantity']
-            if t['action'] == '买入':
-                remaining_to_buy = qty
-                while remaining_to_buy > 0 and sell_pool:
-                    sell_pool.sort(key=lambda x: x['price'], reverse=True)
-                    sp = sell_pool[0]
-                    match_q = min(remaining_to_buy, sp['qty'])
-                    realized_profit += (sp['price'] - price) * match_q
-                    sp['qty'] -= match_q
-                    remaining_to_buy -= match_q
-                    if sp['qty'] <= 0: sell_pool.pop(0)
-                if remaining_to_buy > 0:
-                    buy_pool.append({'price': price, 'qty': remaining_to_buy})
-                net_q += qty
-            else:
-                remaining_to_sell = qty
-                while remaining_to_sell > 0 and buy_pool:
-                    buy_pool.sort(key=lambda x: x['price'])
-                    bp = buy_pool[0]
-                    match_q = min(remaining_to_sell, bp['qty'])
-                    realized_profit += (price - bp['price']) * match_q
-                    bp['qty'] -= match_q
-                    remaining_to_sell -= match_q
-                    if bp['qty'] <= 0: buy_pool.pop(0)
-                if remaining_to_sell > 0:
-                    sell_pool.append({'price': price, 'qty': remaining_to_sell})
-                net_q -= qty
-            current_occ = sum(x['price']*x['qty'] for x in buy_pool) + sum(x['price']*x['qty'] for x in sell_pool)
-            max_occupied_amount = max(max_occupied_amount, current_occ)
+        RECORDER.lap("盈亏计算")
+        # ── 盈亏计算（按侧边栏所选配对规则；下方配对明细共用同一结果）──
+        lot_match = match(ledger.rows(selected_stock), lot_policy, start=ledger.start(selected_stock))
+        lot_book  = lot_match
+        if as_of:
+            lot_book = book_as_of(conn, as_of, lot_policy, [selected_stock]).get(selected_stock) or MatchResult()
+            now_p    = closes_as_of(conn, as_of, [selected_stock]).get(selected_stock, now_p)
+        realized_profit     = lot_book.realized
+        max_occupied_amount = lot_book.max_occupied
+        net_q = lot_book.net_qty
 
         avg_cost = manual_costs.get(selected_stock, 0.0)
         if net_q > 0:
@@ -1179,6 +1251,27 @@ if choice == "🏠 股票详情中心":
         rp_color  = "var(--profit)" if realized_profit >= 0 else "var(--loss)"
         rp_str    = f"+{realized_profit:,.2f}" if realized_profit >= 0 else f"{realized_profit:,.2f}"
 
+        # 行情快照：涨跌幅 / 日内区间 / 行情时间（与现价同一次批量请求取得）
+        q_snap    = quote_snaps.get(selected_stock) or {}
+        q_chg     = q_snap.get('change_pct')
+        q_color   = ("var(--profit)" if q_chg >= 0 else "var(--loss)") if q_chg is not None else "var(--text-primary)"
+        q_chg_str = (f"+{q_chg:.2f}%" if q_chg >= 0 else f"{q_chg:.2f}%") if q_chg is not None else ""
+        q_range   = (f"{q_snap['low']:.3f} ~ {q_snap['high']:.3f}"
+                     if q_snap.get('low') is not None and q_snap.get('high') is not None else "—")
+        q_time    = (q_snap.get('quote_time') or q_snap.get('fetched_at') or "")[5:16]
+
+        # 年化收益：由交易现金流 + 当前市值计算（XIRR），附时间加权与手填值
+        try:
+            _ret = compute_returns(conn)
+            _ret = _ret.loc[selected_stock] if selected_stock in _ret.index else None
+        except Exception as e:
+            print(f"[returns] {e}")
+            _ret = None
+        _fmt_pct = lambda v: (f"+{v * 100:.2f}%" if v >= 0 else f"{v * 100:.2f}%") if v is not None and pd.notna(v) else "—"
+        xirr_val   = _fmt_pct(_ret['xirr']) if _ret is not None else "—"
+        xirr_color = ("var(--profit)" if _ret['xirr'] >= 0 else "var(--loss)") if _ret is not None and pd.notna(_ret['xirr']) else "var(--text-primary)"
+        xirr_sub   = (f"时间加权 {_fmt_pct(_ret['twr_annual'])} · " if _ret is not None else "") + f"手填 {saved_annual:.2f}%"
+
         b_label = ("🟢 买入监控 · 达标" if is_buy_triggered else "📥 买入监控 · 观察")
         s_label = ("🔴 卖出监控 · 达标" if is_sell_triggered else "📤 卖出监控 · 观察")
 
@@ -1199,13 +1292,14 @@ if choice == "🏠 股票详情中心":
             _metric_card("持仓数量",   f"{net_q}"),
             _metric_card("持仓市值",   f"{abs(net_q)*now_p:,.2f}"),
             _metric_card("手动成本价", f"{avg_cost:.3f}"),
-            _metric_card("当前现价",   f"{now_p:.3f}"),
+            _metric_card("当前现价",   f"{now_p:.3f}", val_color=q_color,
+                         sub=(" · ".join(x for x in (q_chg_str, q_time) if x) + f"<br>日内 {q_range}") if q_snap else ""),
             _metric_card("持仓盈亏额", pnl_str, sub=pnl_pct, val_color=pnl_color),
             _metric_card("已实现利润", rp_str,  val_color=rp_color),
         ]
         row2 = [
             _metric_card("最高占用金额",   f"{max_occupied_amount:,.2f}"),
-            _metric_card("历史年化收益",   f"{saved_annual:.2f}%"),
+            _metric_card("年化收益 (XIRR)", xirr_val, sub=xirr_sub, val_color=xirr_color),
             _metric_card(b_label,          buy_val,       val_color=b_color),
             _metric_card(s_label,          sell_val,      val_color=s_color),
             _metric_card("📤 卖出上涨比例", sell_rise_val),
@@ -1463,28 +1557,9 @@ if choice == "🏠 股票详情中心":
         })();
         </script>""", unsafe_allow_html=True)
 
-        decisions = pd.read_sql(
-            "SELECT id, date, decision, reason FROM decision_history WHERE code = ? ORDER BY date DESC LIMIT 15",
-            conn, params=(selected_stock,)
-        )
-        if decisions.empty:
-            st.markdown('<div style="color:var(--text-muted);font-size:0.82em;padding:8px;text-align:center">暂无决策记录</div>', unsafe_allow_html=True)
-        else:
-            for _, row in decisions.iterrows():
-                head_col, del_col = st.columns([20, 1])
-                head_col.markdown(
-                    f'<div class="decision-card" style="display:flex;gap:16px;align-items:baseline">'
-                    f'<div style="flex-shrink:0;font-weight:600;font-size:0.82em;color:var(--accent-blue);min-width:80px">{row["date"]}</div>'
-                    f'<div style="font-size:0.85em;color:var(--text-primary);min-width:120px">{row["decision"]}</div>'
-                    + (f'<div style="font-size:0.77em;color:var(--text-secondary)">{row["reason"]}</div>' if row["reason"] else "")
-                    + '</div>',
-                    unsafe_allow_html=True
-                )
-                if del_col.button("✕", key=f"del_dec_{row['id']}", help="删除"):
-                    c.execute("DELETE FROM decision_history WHERE id = ?", (row['id'],))
-                    conn.commit()
-                    sync_db_to_github()
-                    st.rerun()
+        _entry_grid("decisions", "decision_history", ["date", "decision", "reason"],
+                    {"date": "日期", "decision": "决策内容", "reason": "决策原因"},
+                    "code = ?", (selected_stock,), page=15, empty="暂无决策记录")
 
         st.divider()
 
@@ -1499,57 +1574,21 @@ if choice == "🏠 股票详情中心":
         with col_trade_pair:
             st.markdown('<div style="font-size:0.88em;font-weight:700;color:var(--accent-green);margin-bottom:8px;padding-bottom:4px;border-bottom:1px solid var(--border)">🔗 交易配对与未平仓单</div>', unsafe_allow_html=True)
 
-            # 重新计算本股票配对信息
-            pair_buy_positions  = []
-            pair_sell_positions = []
+            # 本股票配对信息（与上方盈亏计算同一次配对）
+            pair_buy_positions  = [{'date': d, 'price': p, 'qty': q} for d, p, q in lot_book.buy_lots]
+            pair_sell_positions = [{'date': d, 'price': p, 'qty': q} for d, p, q in lot_book.sell_lots]
             pair_paired_trades  = []
-
-            for _, trade in s_df.sort_values(['date', 'id']).iterrows():
-                t_date  = trade['date']
-                t_act   = trade['action']
-                t_price = trade['price']
-                t_qty   = trade['quantity']
-                remaining = t_qty
-
-                if t_act == '买入':
-                    if pair_sell_positions and remaining > 0:
-                        for sp in sorted(pair_sell_positions, key=lambda x: -x['price']):
-                            if remaining <= 0: break
-                            if sp['qty'] <= 0: continue
-                            cover_qty = min(sp['qty'], remaining)
-                            gain = ((sp['price'] - t_price) / sp['price'] * 100) if sp['price'] > 0 else 0.0
-                            pair_paired_trades.append({
-                                "日期": f"{sp['date']} → {t_date}",
-                                "类型": "✅ 配对闭合",
-                                "价格": f"{format_number(sp['price'])} → {format_number(t_price)}",
-                                "数量": cover_qty,
-                                "盈亏%": gain
-                            })
-                            sp['qty'] -= cover_qty
-                            remaining -= cover_qty
-                        pair_sell_positions = [sp for sp in pair_sell_positions if sp['qty'] > 0]
-                    if remaining > 0:
-                        pair_buy_positions.append({'date': t_date, 'price': t_price, 'qty': remaining})
-
-                elif t_act == '卖出':
-                    if pair_buy_positions and remaining > 0:
-                        for bp in sorted(pair_buy_positions, key=lambda x: x['price']):
-                            if remaining <= 0: break
-                            if bp['qty'] <= 0: continue
-                            close_qty = min(bp['qty'], remaining)
-                            gain = ((t_price - bp['price']) / bp['price'] * 100) if bp['price'] > 0 else 0.0
-                            pair_paired_trades.append({
-                                "日期": f"{bp['date']} → {t_date}",
-                                "类型": "✅ 配对闭合",
-                                "价格": f"{format_number(bp['price'])} → {format_number(t_price)}",
-                                "数量": close_qty,
-                                "盈亏%": gain
-                            })
-                            bp['qty'] -= close_qty
-                            remaining -= close_qty
-                        pair_buy_positions = [bp for bp in pair_buy_positions if bp['qty'] > 0]
-                    if remaining > 0:
-                        pair_sell_positions.append({'date': t_date, 'price': t_price, 'qty': remaining})
+            for od, cd, op, cp, q, side in lot_match.pairs:
+                if as_of and str(cd)[:10] > as_of:
+                    break
+                gain = ((cp - op if side == "long" else op - cp) / op * 100) if op > 0 else 0.0
+                pair_paired_trades.append({
+                    "日期": f"{od} → {cd}",
+                    "类型": "✅ 配对闭合",
+                    "价格": f"{format_number(op)} → {format_number(cp)}",
+                    "数量": q,
+                    "盈亏%": gain
+                })
 
             # 未平仓单
             open_positions = []
@@ -1632,32 +1671,12 @@ if choice == "🏠 股票详情中心":
                 else:
                     st.warning("⚠️ 请填写内容")
 
-            journal_rows = pd.read_sql(
-                "SELECT id, date, stock_name, content FROM journal WHERE stock_name = ? ORDER BY date DESC, id DESC",
-                conn, params=(selected_stock,)
-            )
-            if journal_rows.empty:
-                st.info(f"📌 暂无「{selected_stock}」复盘记录")
-            else:
-                for _, jrow in journal_rows.iterrows():
-                    jc1, jc2 = st.columns([12, 1])
-                    with jc1:
-                        st.markdown(
-                            f'<div class="journal-card">'
-                            f'<div class="journal-meta">'
-                            f'<span style="background:rgba(59,130,246,0.15);color:var(--accent-blue);border-radius:4px;padding:1px 8px;font-weight:600">{jrow["stock_name"]}</span>'
-                            f'<span>{jrow["date"]}</span>'
-                            f'</div>'
-                            f'<div class="journal-content">{jrow["content"]}</div>'
-                            f'</div>',
-                            unsafe_allow_html=True
-                        )
-                    with jc2:
-                        if st.button("✕", key=f"jdel_{jrow['id']}", help="删除"):
-                            c.execute("DELETE FROM journal WHERE id = ?", (jrow['id'],))
-                            conn.commit()
-                            sync_db_to_github()
-                            st.rerun()
+            picked = _entry_grid("stock_journal", "journal", ["date", "stock_name", "content"],
+                                 {"date": "日期", "stock_name": "标的", "content": "内容"},
+                                 "stock_name = ?", (selected_stock,), plain=("content",),
+                                 empty=f"📌 暂无「{selected_stock}」复盘记录")
+            for _, jrow in picked.iterrows():
+                _journal_card(jrow)
 
     else:
         st.info("💡 请先在交易录入中添加股票数据")
@@ -1667,11 +1686,12 @@ if choice == "🏠 股票详情中心":
 # =====================================================================
 elif choice == "📊 实时持仓":
     _page_title("📊", "实时持仓", "手动成本模式")
+    _as_of_banner()
 
-    df_trades = pd.read_sql("SELECT * FROM trades ORDER BY date ASC, id ASC", conn)
+    ledger = get_ledger_cache().current(conn)
 
-    if not df_trades.empty:
-        stocks = df_trades['code'].unique()
+    if len(ledger):
+        stocks = ledger.codes
 
         with st.expander("🛠️ 维护现价与手动成本", expanded=True):
             raw_prices  = c.execute("SELECT code, current_price, manual_cost FROM prices").fetchall()
@@ -1685,16 +1705,10 @@ elif choice == "📊 实时持仓":
                         with st.spinner("正在拉取最新行情，请稍候…"):
                             _fetched = fetch_latest_prices(list(stocks))
                     if _fetched:
-                        for _name, _price in _fetched.items():
-                            _old = config_query.get(_name, (0.0, 0.0))
-                            _mc  = float(_old[1]) if _old[1] is not None else 0.0
-                            c.execute(
-                                "INSERT OR REPLACE INTO prices (code, current_price, manual_cost) VALUES (?,?,?)",
-                                (_name, _price, _mc)
-                            )
-                            # 直接更新 session_state 为新价格，让 rerun 后输入框显示最新值
-                            st.session_state[f"p_{_name}"] = _price
-                        conn.commit()
+                        store_prices(conn, _fetched)
+                        # 换一个编辑表的 key，rerun 后表格按库里的最新价格重建（丢弃尚未保存的改动）
+                        st.session_state["price_editor_rev"] = st.session_state.get("price_editor_rev", 0) + 1
+                        _after_quote_refresh(_fetched)
                         sync_db_to_github()
                         _detail = "  |  ".join([f"{k} → {v}" for k, v in _fetched.items()])
                         _tip_col.success(f"✅ 已更新 {len(_fetched)} 只：{_detail}")
@@ -1710,87 +1724,87 @@ elif choice == "📊 实时持仓":
 
             st.markdown("---")
 
-            for stock in stocks:
-                col1, col2 = st.columns(2)
-                stored_vals = config_query.get(stock, (0.0, 0.0))
-                old_p = float(stored_vals[0]) if stored_vals[0] is not None else 0.0
-                old_c = float(stored_vals[1]) if stored_vals[1] is not None else 0.0
-                new_p = col1.number_input(f"{stock} 现价",     value=old_p, key=f"p_{stock}", step=0.0001)
-                new_c = col2.number_input(f"{stock} 手动成本", value=old_c, key=f"c_{stock}", step=0.0001)
-                if new_p != old_p or new_c != old_c:
-                    c.execute("INSERT OR REPLACE INTO prices (code, current_price, manual_cost) VALUES (?, ?, ?)",
-                              (stock, new_p, new_c))
-                    conn.commit()
+            # 全部股票一张表批量编辑：改动暂存在表格里，保存时校验后一个事务写入，只刷新一次派生状态、同步一次
+            price_base = pd.DataFrame(
+                [(s, float(config_query.get(s, (0, 0))[0] or 0.0), float(config_query.get(s, (0, 0))[1] or 0.0))
+                 for s in stocks], columns=["股票", "现价", "手动成本"])
+            with st.form("price_batch_form"):
+                edited_prices = st.data_editor(
+                    price_base, key=f"price_editor_{st.session_state.get('price_editor_rev', 0)}",
+                    hide_index=True, use_container_width=True, num_rows="fixed", disabled=["股票"],
+                    column_config={
+                        "现价":     st.column_config.NumberColumn("现价", min_value=0.0, step=0.0001, format="%.4f"),
+                        "手动成本": st.column_config.NumberColumn("手动成本", min_value=0.0, step=0.0001, format="%.4f"),
+                    })
+                price_saved = st.form_submit_button("💾 保存全部修改", type="primary")
+            if price_saved:
+                _new = edited_prices[["现价", "手动成本"]].apply(pd.to_numeric, errors="coerce").round(4)
+                _bad = edited_prices.loc[_new.isna().any(axis=1) | (_new < 0).any(axis=1), "股票"].tolist()
+                _changed = (_new != price_base[["现价", "手动成本"]].round(4)).any(axis=1)
+                if _bad:
+                    st.error(f"❌ 现价 / 手动成本须为不小于 0 的数字：{'、'.join(_bad)}（未保存任何修改）")
+                elif not _changed.any():
+                    st.info("没有需要保存的修改")
+                else:
+                    _edits = list(zip(edited_prices.loc[_changed, "股票"], _new.loc[_changed, "现价"],
+                                      _new.loc[_changed, "手动成本"]))
+                    store_price_edits(conn, _edits)
+                    _moved = {s: p for s, p, _ in _edits if p > 0 and p != float(config_query.get(s, (0, 0))[0] or 0.0)}
+                    if _moved:
+                        _after_quote_refresh(_moved)
                     sync_db_to_github()
+                    st.session_state["price_editor_rev"] = st.session_state.get("price_editor_rev", 0) + 1
+                    st.success(f"✅ 已保存 {len(_edits)} 只股票的现价 / 手动成本")
 
         final_raw     = c.execute("SELECT code, current_price, manual_cost FROM prices").fetchall()
         latest_config = {row[0]: (row[1] or 0.0, row[2] or 0.0) for row in final_raw}
+        quote_snaps   = load_quote_snapshots()
 
+        RECORDER.lap("配对计算")
         summary = []
         all_active_records = []
+        if as_of:
+            as_of_book   = book_as_of(conn, as_of, lot_policy)
+            as_of_closes = closes_as_of(conn, as_of, list(as_of_book))
+        # 全部股票的配对一次算好（大账本自动分片到进程池，见 stock21.parallel）
+        stock_matches = match_symbols(ledger, stocks, (lot_policy,))
 
         for stock in stocks:
-            s_df   = df_trades[df_trades['code'] == stock].copy()
+            if as_of and stock not in as_of_book:
+                continue
+            s_df   = ledger.trades(stock)
             now_p, manual_cost = latest_config.get(stock, (0.0, 0.0))
-            net_buy  = s_df[s_df['action'] == '买入']['quantity'].sum()
-            net_sell = s_df[s_df['action'] == '卖出']['quantity'].sum()
-            net_q    = net_buy - net_sell
+            if as_of:
+                now_p = as_of_closes.get(stock, now_p)
+                net_q = as_of_book[stock].net_qty
+            else:
+                net_buy  = s_df[s_df['action'] == '买入']['quantity'].sum()
+                net_sell = s_df[s_df['action'] == '卖出']['quantity'].sum()
+                net_q    = net_buy - net_sell
 
             if net_q != 0:
                 if manual_cost > 0:
                     p_rate = ((now_p - manual_cost) / manual_cost * 100) if net_q > 0 else ((manual_cost - now_p) / manual_cost * 100)
                 else:
                     p_rate = 0.0
-                summary.append([stock, net_q, format_number(manual_cost), format_number(now_p), f"{p_rate:.2f}%", p_rate])
+                summary.append([stock, net_q, format_number(manual_cost), format_number(now_p), f"{p_rate:.2f}%", p_rate,
+                                None if as_of else (quote_snaps.get(stock) or {}).get('change_pct')])
 
-            buy_positions  = []
-            sell_positions = []
+            m = stock_matches[stock][lot_policy]
+            book = as_of_book[stock] if as_of else m
+            buy_positions  = [{'date': d, 'price': p, 'qty': q} for d, p, q in book.buy_lots]
+            sell_positions = [{'date': d, 'price': p, 'qty': q} for d, p, q in book.sell_lots]
             paired_trades  = []
-
-            for _, trade in s_df.sort_values(['date', 'id']).iterrows():
-                trade_date = trade['date']
-                action     = trade['action']
-                price      = trade['price']
-                qty        = trade['quantity']
-                remaining  = qty
-
-                if action == '买入':
-                    if sell_positions and remaining > 0:
-                        for sp in sorted(sell_positions, key=lambda x: -x['price']):
-                            if remaining <= 0: break
-                            if sp['qty'] <= 0: continue
-                            cover_qty = min(sp['qty'], remaining)
-                            gain = ((sp['price'] - price) / sp['price'] * 100) if sp['price'] > 0 else 0.0
-                            paired_trades.append({
-                                "date": f"{sp['date']} → {trade_date}", "code": stock,
-                                "type": "✅ 已配对交易对",
-                                "price": f"{format_number(sp['price'])} → {format_number(price)}",
-                                "qty": cover_qty, "gain_str": f"{gain:.2f}%", "gain_val": gain
-                            })
-                            sp['qty'] -= cover_qty
-                            remaining -= cover_qty
-                        sell_positions = [sp for sp in sell_positions if sp['qty'] > 0]
-                    if remaining > 0:
-                        buy_positions.append({'date': trade_date, 'price': price, 'qty': remaining})
-
-                elif action == '卖出':
-                    if buy_positions and remaining > 0:
-                        for bp in sorted(buy_positions, key=lambda x: x['price']):
-                            if remaining <= 0: break
-                            if bp['qty'] <= 0: continue
-                            close_qty = min(bp['qty'], remaining)
-                            gain = ((price - bp['price']) / bp['price'] * 100) if bp['price'] > 0 else 0.0
-                            paired_trades.append({
-                                "date": f"{bp['date']} → {trade_date}", "code": stock,
-                                "type": "✅ 已配对交易对",
-                                "price": f"{format_number(bp['price'])} → {format_number(price)}",
-                                "qty": close_qty, "gain_str": f"{gain:.2f}%", "gain_val": gain
-                            })
-                            bp['qty'] -= close_qty
-                            remaining -= close_qty
-                        buy_positions = [bp for bp in buy_positions if bp['qty'] > 0]
-                    if remaining > 0:
-                        sell_positions.append({'date': trade_date, 'price': price, 'qty': remaining})
+            for od, cd, op, cp, q, side in m.pairs:
+                if as_of and str(cd)[:10] > as_of:
+                    break
+                gain = ((cp - op if side == "long" else op - cp) / op * 100) if op > 0 else 0.0
+                paired_trades.append({
+                    "date": f"{od} → {cd}", "code": stock,
+                    "type": "✅ 已配对交易对",
+                    "price": f"{format_number(op)} → {format_number(cp)}",
+                    "qty": q, "gain_str": f"{gain:.2f}%", "gain_val": gain
+                })
 
             for bp in buy_positions:
                 float_gain = ((now_p - bp['price']) / bp['price'] * 100) if bp['price'] > 0 else 0.0
@@ -1809,6 +1823,7 @@ elif choice == "📊 实时持仓":
 
             all_active_records = paired_trades + all_active_records
 
+        RECORDER.lap("表格渲染")
         # ── 两栏布局：持仓概览 ＋ 未平仓单 ──
         ov_col, open_col = st.columns([4, 5], gap="medium")
 
@@ -1816,10 +1831,12 @@ elif choice == "📊 实时持仓":
             st.markdown('<div style="font-size:0.82em;color:var(--text-muted);text-transform:uppercase;letter-spacing:0.06em;font-weight:600;margin-bottom:8px">1️⃣ 账户持仓概览</div>', unsafe_allow_html=True)
             if summary:
                 summary.sort(key=lambda x: x[5], reverse=True)
-                html = '<table class="pro-table"><thead><tr><th>股票</th><th>净持仓</th><th>手动成本</th><th>现价</th><th>盈亏%</th></tr></thead><tbody>'
+                html = '<table class="pro-table"><thead><tr><th>股票</th><th>净持仓</th><th>手动成本</th><th>现价</th><th>今日涨跌</th><th>盈亏%</th></tr></thead><tbody>'
                 for r in summary:
                     cls = "profit-red" if r[5] > 0 else ("loss-green" if r[5] < 0 else "")
-                    html += f'<tr><td><b>{r[0]}</b></td><td>{r[1]}</td><td>{r[2]}</td><td>{r[3]}</td><td class="{cls}">{r[4]}</td></tr>'
+                    d_cls = ("profit-red" if r[6] > 0 else ("loss-green" if r[6] < 0 else "")) if r[6] is not None else ""
+                    d_str = f"{r[6]:+.2f}%" if r[6] is not None else "—"
+                    html += f'<tr><td><b>{r[0]}</b></td><td>{r[1]}</td><td>{r[2]}</td><td>{r[3]}</td><td class="{d_cls}">{d_str}</td><td class="{cls}">{r[4]}</td></tr>'
                 html += '</tbody></table>'
                 st.markdown(html, unsafe_allow_html=True)
             else:
@@ -1886,99 +1903,156 @@ elif choice == "📊 实时持仓":
 # =====================================================================
 elif choice == "💰 盈利账单":
     _page_title("💰", "盈利账单", "已平仓 + 未平仓")
+    _as_of_banner()
 
-    df_trades = pd.read_sql("SELECT * FROM trades ORDER BY date ASC, id ASC", conn)
+    ledger    = get_ledger_cache().current(conn)
+    df_trades = ledger.frame
     latest_prices_data = {row[0]: (row[1] or 0.0, row[2] or 0.0) for row in c.execute("SELECT code, current_price, manual_cost FROM prices").fetchall()}
     latest_prices = {k: v[0] for k, v in latest_prices_data.items()}
-
-    if not df_trades.empty:
+    if as_of:
+        df_trades = df_trades[df_trades['date'].astype(str).str[:10] <= as_of]
+        as_of_books = {p: book_as_of(conn, as_of, p) for p in POLICIES}
+        latest_prices.update(closes_as_of(conn, as_of, list(as_of_books[lot_policy])))
+    # 各股按交易币种计，账户合计按估值日（当前或截至日期）汇率折成人民币
+    fx        = load_fx(conn)
+    stock_ccy = symbol_currencies(_build_ticker_map())
+
+    if not df_trades.empty or ledger.carry:
+        # 累计投入 / 回收：价格、数量换成 int64 定点整数后整列相乘再分组求和，合计精确；已归档的部分取结转值
+        cash_units = (pd.Series(units_array(df_trades['price']) * qty_array(df_trades['quantity']), index=df_trades.index)
+                      .groupby([df_trades['code'], df_trades['action']], observed=True).sum())
         profit_list = []
-        for stock in df_trades['code'].unique():
-            s_df  = df_trades[df_trades['code'] == stock].copy()
+        policy_rows = {p: [] for p in POLICIES}     # 各配对规则逐股的 (已实现, 未实现)，与 profit_list 同序
+        # 一次扫描同时按全部规则配对（大账本自动分片到进程池）：明细用所选规则，其余只取合计做对比
+        all_matches = {} if as_of else match_symbols(ledger, None, POLICIES, keep_pairs=False)
+        for stock in ledger.codes:
+            if as_of and stock not in as_of_books[lot_policy]:
+                continue
             now_p = latest_prices.get(stock, 0.0)
 
-            realized_profit = unrealized_profit = 0.0
-            buy_pool  = []
-            sell_pool = []
-
-            for _, trade in s_df.sort_values(['date', 'id']).iterrows():
-                action    = trade['action']
-                price     = trade['price']
-                qty       = trade['quantity']
-                remaining = qty
-
-                if action == '买入':
-                    if sell_pool and remaining > 0:
-                        for sp in sorted(sell_pool, key=lambda x: -x['price']):
-                            if remaining <= 0: break
-                            if sp['qty'] <= 0: continue
-                            cover_qty = min(sp['qty'], remaining)
-                            realized_profit += (sp['price'] - price) * cover_qty
-                            sp['qty'] -= cover_qty
-                            remaining -= cover_qty
-                        sell_pool = [sp for sp in sell_pool if sp['qty'] > 0]
-                    if remaining > 0:
-                        buy_pool.append({'price': price, 'qty': remaining})
-                else:
-                    if buy_pool and remaining > 0:
-                        for bp in sorted(buy_pool, key=lambda x: x['price']):
-                            if remaining <= 0: break
-                            if bp['qty'] <= 0: continue
-                            close_qty = min(bp['qty'], remaining)
-                            realized_profit += (price - bp['price']) * close_qty
-                            bp['qty'] -= close_qty
-                            remaining -= close_qty
-                        buy_pool = [bp for bp in buy_pool if bp['qty'] > 0]
-                    if remaining > 0:
-                        sell_pool.append({'price': price, 'qty': remaining})
-
-            for bp in buy_pool:  unrealized_profit += (now_p - bp['price']) * bp['qty']
-            for sp in sell_pool: unrealized_profit += (sp['price'] - now_p) * sp['qty']
-
-            long_value  = sum(bp['qty'] for bp in buy_pool)  * now_p
-            short_value = -sum(sp['qty'] for sp in sell_pool) * now_p
-            current_value = long_value + short_value
+            # 截至历史日期时取各规则的检查点账本
+            matches = {p: as_of_books[p][stock] for p in POLICIES} if as_of else all_matches[stock]
+            for p, pm in matches.items():
+                policy_rows[p].append((pm.realized, mark_to_market(pm.buy_lots, pm.sell_lots, now_p)))
+            m = matches[lot_policy]
+            realized_profit   = m.realized
+            unrealized_profit = policy_rows[lot_policy][-1][1]
+
+            current_value = m.net_qty * now_p
             total_profit  = realized_profit + unrealized_profit
 
-            total_buy_cash  = s_df[s_df['action'] == '买入'].apply(lambda r: r['price'] * r['quantity'], axis=1).sum()
-            total_sell_cash = s_df[s_df['action'] == '卖出'].apply(lambda r: r['price'] * r['quantity'], axis=1).sum()
+            carried = ledger.carry.get(stock) or {}
+            if as_of and carried and carried["through"] > as_of:
+                carried = {}                    # 截至日期早于结转点：只计在用的成交
+            total_buy_cash  = from_units(int(cash_units.get((stock, '买入'), 0)) + carried.get("invested", 0))
+            total_sell_cash = from_units(int(cash_units.get((stock, '卖出'), 0)) + carried.get("recovered", 0))
 
             profit_list.append({
-                "股票名称": stock, "累计投入": total_buy_cash, "累计回收": total_sell_cash,
+                "股票名称": stock, "币种": stock_ccy.get(stock, BASE_CURRENCY), "累计投入": total_buy_cash, "累计回收": total_sell_cash,
                 "已实现盈亏": realized_profit, "未实现盈亏": unrealized_profit,
                 "持仓市值": current_value, "总盈亏": total_profit
             })
 
-        pdf = pd.DataFrame(profit_list).sort_values(by="总盈亏", ascending=False)
-
-        total_realized   = pdf['已实现盈亏'].sum()
-        total_unrealized = pdf['未实现盈亏'].sum()
-        total_overall    = pdf['总盈亏'].sum()
-
-        c1, c2, c3 = st.columns(3)
+        fx_rates = fx.rates([r["币种"] for r in profit_list], as_of)
+        policy_totals = {p: pd.DataFrame(rows, columns=['rz', 'ur']).mul(fx_rates, axis=0).sum().tolist() for p, rows in policy_rows.items()}
+        pdf = pd.DataFrame(profit_list).assign(汇率=fx_rates).sort_values(by="总盈亏", ascending=False)
+        try:
+            ret_df = compute_returns(conn) if not as_of else pd.DataFrame(columns=["xirr", "twr_annual"])
+        except Exception as e:
+            st.warning(f"收益率计算失败：{e}")
+            ret_df = pd.DataFrame(columns=["xirr", "twr_annual"])
+        pdf["年化XIRR"] = pdf["股票名称"].map(ret_df["xirr"])
+        pdf["时间加权年化"] = pdf["股票名称"].map(ret_df["twr_annual"])
+
+        def _pct_cell(v):
+            if pd.isna(v):
+                return "<td>—</td>"
+            cls = "profit-red" if v > 0 else ("loss-green" if v < 0 else "")
+            return f"<td class='{cls}'>{v * 100:.2f}%</td>"
+
+        total_realized   = (pdf['已实现盈亏'] * pdf['汇率']).sum()
+        total_unrealized = (pdf['未实现盈亏'] * pdf['汇率']).sum()
+        total_overall    = (pdf['总盈亏'] * pdf['汇率']).sum()
+
+        c1, c2, c3, c4, c5 = st.columns(5)
         c1.metric("📌 已实现盈亏", f"{total_realized:,.2f}")
         c2.metric("⏳ 未实现盈亏", f"{total_unrealized:,.2f}")
         c3.metric("🏦 账户总体贡献", f"{total_overall:,.2f}")
+        _p = ret_df.loc[PORTFOLIO] if PORTFOLIO in ret_df.index else None
+        c4.metric("📈 账户年化 (XIRR)", f"{_p['xirr'] * 100:.2f}%" if _p is not None and pd.notna(_p['xirr']) else "—")
+        c5.metric("⏱ 时间加权年化", f"{_p['twr_annual'] * 100:.2f}%" if _p is not None and pd.notna(_p['twr_annual']) else "—")
+        _ccys = sorted(set(pdf['币种']) - {BASE_CURRENCY})
+        if _ccys:
+            st.caption("💱 账户合计已折合人民币，汇率 " + " · ".join(f"{c} {fx.rate(c, as_of):.4f}" for c in _ccys)
+                       + "；各股明细为交易币种")
+
+        with st.expander(f"🔀 配对规则对比（当前：{POLICIES[lot_policy]}，可在侧边栏切换）", expanded=False):
+            html = '<table class="pro-table"><thead><tr><th>配对规则</th><th>已实现盈亏</th><th>未实现盈亏</th><th>总盈亏</th></tr></thead><tbody>'
+            for p, (rz, ur) in policy_totals.items():
+                name = f"<b>{POLICIES[p]}</b> ✔" if p == lot_policy else POLICIES[p]
+                cells = "".join(f"<td class='{'profit-red' if v > 0 else ('loss-green' if v < 0 else '')}'>{v:,.2f}</td>" for v in (rz, ur, rz + ur))
+                html += f"<tr><td>{name}</td>{cells}</tr>"
+            html += '</tbody></table>'
+            st.markdown(html, unsafe_allow_html=True)
+            st.caption("总盈亏与配对规则无关，规则只决定盈亏在已实现与未实现之间如何划分")
 
         st.divider()
         st.markdown('<div style="font-size:0.82em;color:var(--text-muted);text-transform:uppercase;letter-spacing:0.06em;font-weight:600;margin-bottom:8px">📊 各股票盈亏明细</div>', unsafe_allow_html=True)
 
-        html = '<table class="pro-table"><thead><tr><th>股票</th><th>累计投入</th><th>累计回收</th><th>已实现盈亏</th><th>未实现盈亏</th><th>持仓市值</th><th>总盈亏</th></tr></thead><tbody>'
+        html = '<table class="pro-table"><thead><tr><th>股票</th><th>币种</th><th>累计投入</th><th>累计回收</th><th>已实现盈亏</th><th>未实现盈亏</th><th>持仓市值</th><th>总盈亏</th><th>年化XIRR</th><th>时间加权年化</th></tr></thead><tbody>'
         for _, r in pdf.iterrows():
             t_cls  = "profit-red" if r['总盈亏']     > 0 else ("loss-green" if r['总盈亏']     < 0 else "")
             r_cls  = "profit-red" if r['已实现盈亏'] > 0 else ("loss-green" if r['已实现盈亏'] < 0 else "")
             u_cls  = "profit-red" if r['未实现盈亏'] > 0 else ("loss-green" if r['未实现盈亏'] < 0 else "")
             html += f"""<tr>
                 <td><b>{r['股票名称']}</b></td>
+                <td>{r['币种']}</td>
                 <td>{r['累计投入']:,.2f}</td>
                 <td>{r['累计回收']:,.2f}</td>
                 <td class='{r_cls}'>{r['已实现盈亏']:,.2f}</td>
                 <td class='{u_cls}'>{r['未实现盈亏']:,.2f}</td>
                 <td>{r['持仓市值']:,.2f}</td>
                 <td class='{t_cls}'>{r['总盈亏']:,.2f}</td>
+                {_pct_cell(r['年化XIRR'])}{_pct_cell(r['时间加权年化'])}
             </tr>"""
         html += '</tbody></table>'
         st.markdown(html, unsafe_allow_html=True)
+
+        RECORDER.lap("净值曲线")
+        # ── 📈 净值曲线：由 trades + 日线逐日重建（nav_daily / nav_portfolio 增量物化）──
+        st.divider()
+        st.markdown('<div style="font-size:0.82em;color:var(--text-muted);text-transform:uppercase;letter-spacing:0.06em;font-weight:600;margin-bottom:8px">📈 净值曲线</div>', unsafe_allow_html=True)
+        nv1, nv2 = st.columns([3, 1])
+        nav_scope = nv1.selectbox("范围", ["全部账户"] + sorted(df_trades['code'].unique().tolist()), label_visibility="collapsed")
+        nav_rebuild = nv2.button("🔁 全部重算", use_container_width=True, help="日线整体复权调整后使用；平时只重算最近一笔新交易之后的日期")
+        try:
+            # 平时上方 compute_returns 已按数据版本增量更新过净值表，这里只在全部重算或截至历史日期时调用
+            if nav_rebuild or as_of:
+                update_nav(conn, rebuild=nav_rebuild)
+        except Exception as e:
+            st.warning(f"净值重建失败：{e}")
+        curve = load_equity_curve(conn, None if nav_scope == "全部账户" else nav_scope, fx=fx, currencies=stock_ccy)
+        if curve.empty:
+            st.info("📌 暂无净值数据，请先在「🔔 买卖信号」页更新日线")
+        else:
+            n1, n2, n3, n4 = st.columns(4)
+            n1.metric("📅 起始日期", curve.index[0].strftime('%Y-%m-%d'))
+            n2.metric("💹 累计盈亏", f"{curve['pnl'].iloc[-1]:,.2f}")
+            n3.metric("🔝 历史最高盈亏", f"{curve['pnl'].max():,.2f}")
+            n4.metric("📉 最大回撤", f"{curve['drawdown'].min():,.2f}")
+            st.line_chart(curve[['pnl', 'market_value']].rename(columns={'pnl': '累计盈亏', 'market_value': '持仓市值'}))
+            st.area_chart(curve[['drawdown']].rename(columns={'drawdown': '回撤'}), height=160)
+
+            cal = monthly_pnl(curve)
+            html_cal = '<table class="pro-table"><thead><tr><th>年份</th>' + ''.join(f'<th>{m}月</th>' for m in range(1, 13)) + '<th>全年</th></tr></thead><tbody>'
+            for year, row in cal.sort_index(ascending=False).iterrows():
+                html_cal += f'<tr><td><b>{year}</b></td>'
+                for v in list(row.values) + [row.sum()]:
+                    cls = "profit-red" if v > 0 else ("loss-green" if v < 0 else "")
+                    html_cal += f"<td class='{cls}'>{v:,.0f}</td>" if pd.notna(v) else '<td>—</td>'
+                html_cal += '</tr>'
+            html_cal += '</tbody></table>'
+            st.markdown(html_cal, unsafe_allow_html=True)
     else:
         st.info("📌 交易数据库为空，请先录入交易记录")
 
@@ -2111,6 +2185,7 @@ elif choice == "🎯 价格目标管理":
                     'to_target_pct': round((sc['base_price'] - curr_price) / curr_price * 100, 2) if curr_price > 0 else None,
                     'break_status': '未突破'})
 
+    RECORDER.lap("监控卡片")
     # ── 实时监控卡片 ──
     st.markdown('<div style="font-size:0.82em;color:var(--text-muted);text-transform:uppercase;letter-spacing:0.06em;font-weight:600;margin-bottom:12px">📡 实时监控</div>', unsafe_allow_html=True)
 
@@ -2365,10 +2440,7 @@ elif choice == "📝 交易录入":
                 # 若是新股票，同步写入 stock_info（含 ticker 代码）
                 if t_code == "【添加新股票】" and new_ticker_inp:
                     try:
-                        c.execute(
-                            "INSERT OR IGNORE INTO stock_info (stock_name, stock_code) VALUES (?, ?)",
-                            (final_code.strip(), new_ticker_inp.strip()),
-                        )
+                        c.execute(UPSERT_SYMBOL_SQL, (final_code.strip(), new_ticker_inp.strip()))
                     except Exception:
                         pass
                 conn.commit()
@@ -2376,6 +2448,107 @@ elif choice == "📝 交易录入":
                 st.success(f"✅ 已保存：{final_code} {a} {q}股 @ {p}")
                 st.rerun()
 
+    # ── 批量导入券商交割单：按块流式读取，一个事务写入，结束后只同步一次 ──
+    with st.expander("📥 批量导入交割单（CSV / Excel）", expanded=False):
+        up = st.file_uploader("选择券商导出的交割单 / 成交明细", type=["csv", "txt", "xlsx"], key="import_file")
+        if up is not None:
+            try:
+                head = import_preview(up, up.name)
+            except Exception as e:
+                head = None
+                st.error(f"❌ 无法读取文件：{e}")
+            if head is not None:
+                st.dataframe(head, use_container_width=True, hide_index=True)
+                profiles = list_profiles(conn)
+                prof_name = st.selectbox("列映射方案", options=list(profiles), key="import_profile")
+                auto = resolve_mapping(profiles[prof_name], list(head.columns))
+                opts = ["（不导入）"] + list(head.columns)
+                mapping = {}
+                cols = st.columns(4)
+                for i, f in enumerate(IMPORT_FIELDS):
+                    sel = cols[i % 4].selectbox(IMPORT_FIELD_LABELS[f], options=opts,
+                                                index=opts.index(auto[f]) if f in auto else 0,
+                                                key=f"import_map_{prof_name}_{f}")
+                    mapping[f] = sel if sel != "（不导入）" else None
+                st.caption("只导入买入 / 卖出记录；与已有记录内容相同（日期、股票、方向、价格、数量）的行自动跳过")
+
+                _ic1, _ic2 = st.columns([3, 1])
+                new_prof = _ic1.text_input("保存当前映射为方案（可选）", placeholder="例如：华泰交割单")
+                if _ic2.button("💾 保存方案", use_container_width=True) and new_prof.strip():
+                    save_profile(conn, new_prof.strip(), mapping)
+                    st.success(f"✅ 已保存方案：{new_prof.strip()}")
+
+                if st.button("🚀 开始导入", type="primary", use_container_width=True):
+                    bar = st.progress(0.0, text="正在导入…")
+                    total = max(up.size, 1)
+                    try:
+                        res = import_trades(conn, up, up.name, mapping,
+                                            progress=lambda n: bar.progress(min(up.tell() / total, 1.0),
+                                                                            text=f"已读取 {n} 行"))
+                    except Exception as e:
+                        bar.empty()
+                        st.error(f"❌ 导入失败，已全部回滚：{e}")
+                    else:
+                        bar.progress(1.0, text="导入完成")
+                        if res["inserted"]:
+                            try:
+                                update_nav(conn)
+                            except Exception as e:
+                                print(f"[import] nav update failed: {e}")
+                            sync_db_to_github()
+                        st.success(f"✅ 读取 {res['read']} 行，新增 {res['inserted']} 笔，重复跳过 {res['duplicates']} 笔，"
+                                   f"无效 / 非买卖 {res['invalid']} 行，新股票 {res['new_stocks']} 只（{res['seconds']} 秒）")
+
+    # ── 股票改名：按 symbol_id 同步全部表（成交、现价、信号、策略、目标、日记及日线等派生表），历史不会脱节 ──
+    with st.expander("✏️ 股票改名", expanded=False):
+        with st.form("rename_stock_form", clear_on_submit=True):
+            _rn1, _rn2 = st.columns(2)
+            rename_from = _rn1.selectbox("原名称", options=full_list, index=None)
+            rename_to   = _rn2.text_input("新名称")
+            if st.form_submit_button("✏️ 改名", use_container_width=True) and rename_from:
+                try:
+                    n = rename_symbol(conn, rename_from, rename_to)
+                    get_ledger_cache().invalidate()
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                else:
+                    sync_db_to_github()
+                    st.success(f"✅ {rename_from} → {rename_to.strip()}，更新 {n} 条关联记录")
+
+    # ── 股票列表管理：只登记股票（不录成交）；删除时成交（含已归档）、复盘日记、决策历史仍有记录则拒绝 ──
+    with st.expander("📋 股票列表管理", expanded=False):
+        with st.form("add_stock_form", clear_on_submit=True):
+            _sm1, _sm2, _sm3 = st.columns([2, 1.2, 1.8])
+            new_stock_name = _sm1.text_input("股票名称", placeholder="例如：腾讯控股")
+            _sm_market     = _sm2.selectbox("所属市场", options=["A股·沪市", "A股·深市", "港股", "美股"], index=0)
+            _sm_prefix     = {"A股·沪市": "1.", "A股·深市": "0.", "港股": "116.", "美股": "105."}[_sm_market]
+            _sm_raw        = _sm3.text_input("股票代码（纯代码）", placeholder="例如：00981")
+            if st.form_submit_button("➕ 添加股票", use_container_width=True):
+                if not new_stock_name.strip() or not _sm_raw.strip():
+                    st.error("❌ 请填写股票名称和代码")
+                elif c.execute(UPSERT_SYMBOL_SQL, (new_stock_name.strip(), _sm_prefix + _sm_raw.strip())).rowcount == 0:
+                    st.error("❌ 该股票名称已存在且已有代码")
+                else:
+                    conn.commit()
+                    sync_db_to_github()
+                    st.success(f"✅ 已添加：{new_stock_name.strip()} ({_sm_prefix + _sm_raw.strip()})")
+
+        stock_list = pd.read_sql("SELECT id, stock_name, stock_code FROM stock_info ORDER BY stock_name", conn)
+        _stock_label = dict(zip(stock_list["id"], stock_list["stock_name"] + "（" + stock_list["stock_code"].fillna("无代码") + "）"))
+        with st.form("delete_stock_form", clear_on_submit=True):
+            del_id = st.selectbox("删除股票", options=list(_stock_label), format_func=_stock_label.get, index=None,
+                                  key="delete_stock_id")
+            if st.form_submit_button("🗑️ 删除", use_container_width=True) and del_id is not None:
+                try:
+                    # 现价、信号、策略、目标等配置随股票一起删除
+                    stock_name = delete_symbol(conn, int(del_id))
+                except ValueError as e:
+                    st.warning(f"⚠️ 该股票仍有记录（{e}），请先删除这些记录再删除股票")
+                else:
+                    if stock_name:
+                        sync_db_to_github()
+                        st.success(f"✅ 已删除：{stock_name}")
+
 # =====================================================================
 #  🔔 买卖信号
 # =====================================================================
@@ -2387,36 +2560,148 @@ elif choice == "🔔 买卖信号":
         s = f"{num}"
         return s.rstrip('0').rstrip('.') if '.' in s else s
 
+    RECORDER.lap("价格周期")
+    # ── 价格周期：每天首次进入时自动增量更新日线与拐点 ──
+    sig_stock_list = get_dynamic_stock_list()
+    cyc_threshold  = current_threshold(conn)
+    _today_str     = datetime.now().strftime('%Y-%m-%d')
+    if st.session_state.get("_cycles_refresh_date") != _today_str and history_is_stale(conn):
+        with st.spinner("正在更新日线与价格周期…"):
+            refresh_history_and_cycles(sig_stock_list, cyc_threshold)
+        st.session_state["_cycles_refresh_date"] = _today_str
+    cycle_refs = reference_points(conn)
+
     with st.expander("➕ 设置 / 更新监控", expanded=False):
         existing_signals = pd.read_sql("SELECT code FROM signals", conn)['code'].tolist()
-        s_code  = st.selectbox("监控股票", options=get_dynamic_stock_list(), index=None)
+        s_code  = st.selectbox("监控股票", options=sig_stock_list, index=None)
         sig_data = None
         if s_code and s_code in existing_signals:
             sig_data = c.execute(
-                "SELECT high_point, low_point, up_threshold, down_threshold, high_date, low_date FROM signals WHERE code = ?",
+                "SELECT high_point, low_point, up_threshold, down_threshold, high_date, low_date, COALESCE(auto_track, 1) FROM signals WHERE code = ?",
                 (s_code,)
             ).fetchone()
+        elif s_code and s_code in cycle_refs:
+            # 尚未设置监控：用自动识别的最近周期拐点预填高低点
+            _rh, _rhd, _rl, _rld = cycle_refs[s_code]
+            sig_data = (_rh, _rl, None, None, _rhd, _rld, 1)
+            st.caption("📐 已按自动识别的最近周期拐点预填高低点")
 
         c1, c2 = st.columns(2)
-        s_high  = c1.number_input("高点参考价", value=float(sig_data[0]) if sig_data else None, step=0.0001)
+        s_high  = c1.number_input("高点参考价", value=float(sig_data[0]) if sig_data and sig_data[0] else None, step=0.0001)
         h_date  = c1.date_input("高点日期",   value=datetime.strptime(sig_data[4], '%Y-%m-%d').date() if sig_data and sig_data[4] else datetime.now())
-        s_low   = c2.number_input("低点参考价", value=float(sig_data[1]) if sig_data else None, step=0.0001)
+        s_low   = c2.number_input("低点参考价", value=float(sig_data[1]) if sig_data and sig_data[1] else None, step=0.0001)
         l_date  = c2.date_input("低点日期",   value=datetime.strptime(sig_data[5], '%Y-%m-%d').date() if sig_data and sig_data[5] else datetime.now())
-        s_up    = c1.number_input("上涨触发 (%)", value=float(sig_data[2]) if sig_data else 20.0, step=0.01)
-        s_down  = c2.number_input("回调触发 (%)", value=float(sig_data[3]) if sig_data else 20.0, step=0.01)
+        s_up    = c1.number_input("上涨触发 (%)", value=float(sig_data[2]) if sig_data and sig_data[2] else 20.0, step=0.01)
+        s_down  = c2.number_input("回调触发 (%)", value=float(sig_data[3]) if sig_data and sig_data[3] else 20.0, step=0.01)
+        s_auto  = st.checkbox("自动跟踪高低点（随行情与日线刷新运行极值）", value=bool(sig_data[6]) if sig_data else True)
 
         if st.button("🚀 启动 / 更新监控", type="primary"):
             if all([s_code, s_high, s_low, s_up, s_down]):
-                c.execute("""INSERT OR REPLACE INTO signals
-                    (code, high_point, low_point, up_threshold, down_threshold, high_date, low_date)
-                    VALUES (?,?,?,?,?,?,?)""",
-                    (s_code, s_high, s_low, s_up, s_down,
-                     h_date.strftime('%Y-%m-%d'), l_date.strftime('%Y-%m-%d')))
-                conn.commit()
+                save_signal(conn, s_code, s_high, h_date.strftime('%Y-%m-%d'), s_low, l_date.strftime('%Y-%m-%d'),
+                            s_up, s_down, s_auto)
                 sync_db_to_github()
                 st.success("✅ 监控已更新")
                 st.rerun()
 
+    with st.expander("🔄 价格周期（自动识别）", expanded=False):
+        st.caption("按反转阈值识别日线收盘价的高低拐点；每次只重算最后一个确认拐点之后的数据")
+        pc1, pc2, pc3 = st.columns([1, 1, 1])
+        new_threshold = pc1.number_input("反转阈值 (%)", value=float(cyc_threshold), min_value=1.0, step=0.5)
+        if pc2.button("🔄 更新日线与周期", use_container_width=True):
+            with st.spinner("正在拉取日线并识别拐点…"):
+                _n_rows, _n_legs = refresh_history_and_cycles(sig_stock_list, new_threshold)
+            sync_db_to_github()
+            st.success(f"✅ 日线 {_n_rows} 条，新增周期 {_n_legs} 段")
+            st.rerun()
+        if pc3.button("📐 用周期拐点更新高低点", use_container_width=True,
+                      help="把已设置监控的股票的高点/低点替换为最近的自动识别拐点"):
+            _upd = [(code, h, hd, l, ld) for code, (h, hd, l, ld) in cycle_refs.items()
+                    if code in existing_signals and h and l]
+            set_refs(conn, _upd, "cycle")
+            sync_db_to_github()
+            st.success(f"✅ 已更新 {len(_upd)} 只股票的高低点")
+            st.rerun()
+
+        cyc_stats = cycle_stats(conn)
+        if cyc_stats:
+            html = '<table class="pro-table"><thead><tr><th>股票</th><th>上涨段数</th><th>平均涨幅</th><th>最大涨幅</th><th>下跌段数</th><th>平均跌幅</th><th>最大跌幅</th><th>最近高点</th><th>最近低点</th></tr></thead><tbody>'
+            for code, cs in sorted(cyc_stats.items()):
+                ref = cycle_refs.get(code)
+                hi_str = f"{fmt(round(ref[0], 3))}<br><small style=\"color:#64748b\">{ref[1]}</small>" if ref and ref[0] else "—"
+                lo_str = f"{fmt(round(ref[2], 3))}<br><small style=\"color:#64748b\">{ref[3]}</small>" if ref and ref[2] else "—"
+                html += f"""<tr>
+                    <td><b>{code}</b></td>
+                    <td>{cs['up_n']}</td>
+                    <td class="profit-red">{f"{cs['up_avg']:.2f}%" if cs['up_avg'] is not None else "—"}</td>
+                    <td>{f"{cs['up_max']:.2f}%" if cs['up_max'] is not None and cs['up_max'] > 0 else "—"}</td>
+                    <td>{cs['down_n']}</td>
+                    <td class="loss-green">{f"{cs['down_avg']:.2f}%" if cs['down_avg'] is not None else "—"}</td>
+                    <td>{f"{cs['down_max']:.2f}%" if cs['down_max'] is not None and cs['down_max'] < 0 else "—"}</td>
+                    <td>{hi_str}</td><td>{lo_str}</td>
+                </tr>"""
+            html += '</tbody></table>'
+            st.markdown(html, unsafe_allow_html=True)
+        else:
+            st.info("📌 暂无自动识别的周期，请先更新日线")
+
+    with st.expander("🧪 参数回测（日线模拟）", expanded=False):
+        st.caption("在已存日线上按规则逐日模拟，每次信号成交 1 手，盈亏按最低成本优先配对；参数网格整体向量化计算，多只股票并行")
+        bt_rule_label = st.radio("回测规则", ["🔔 买卖信号（上涨/回调触发）", "🧠 买卖监控（基准价涨跌幅）"], horizontal=True)
+        bt_rule  = "signal" if bt_rule_label.startswith("🔔") else "monitor"
+        a_label, b_label = ("上涨触发", "回调触发") if bt_rule == "signal" else ("卖出上涨", "买入下跌")
+        _hist_codes = [r[0] for r in c.execute("SELECT DISTINCT code FROM daily_prices").fetchall()]
+        bt_codes = st.multiselect("回测股票", options=_hist_codes, default=_hist_codes)
+        ba1, ba2, ba3, bb1, bb2, bb3 = st.columns(6)
+        a_min  = ba1.number_input(f"{a_label}% 起", value=2.0, min_value=0.1, step=0.5)
+        a_max  = ba2.number_input(f"{a_label}% 止", value=40.0, min_value=0.1, step=0.5)
+        a_step = ba3.number_input(f"{a_label}% 步长", value=1.0, min_value=0.1, step=0.1)
+        b_min  = bb1.number_input(f"{b_label}% 起", value=2.0, min_value=0.1, step=0.5)
+        b_max  = bb2.number_input(f"{b_label}% 止", value=40.0, min_value=0.1, step=0.5)
+        b_step = bb3.number_input(f"{b_label}% 步长", value=1.0, min_value=0.1, step=0.1)
+        bo1, bo2 = st.columns(2)
+        bt_start = bo1.date_input("起始日期", value=datetime(datetime.now().year - 10, 1, 1))
+        bt_short = bo2.checkbox("允许卖空（空仓时卖出信号开空单）", value=False)
+
+        if st.button("▶️ 开始回测", type="primary") and bt_codes:
+            import numpy as np
+            with st.spinner("回测中…"):
+                bt_closes = load_closes(conn, bt_codes, bt_start.strftime('%Y-%m-%d'))
+                bt_df = run_grid(bt_closes, np.arange(a_min, a_max + 1e-9, a_step),
+                                 np.arange(b_min, b_max + 1e-9, b_step), rule=bt_rule, allow_short=bt_short)
+                # 各股票当前配置参数的回测表现
+                bt_cur = []
+                for code, (a_cur, b_cur) in current_params(conn, bt_rule).items():
+                    if code in bt_closes:
+                        r = simulate(bt_closes[code][1], [a_cur], [b_cur], rule=bt_rule, allow_short=bt_short)
+                        bt_cur.append((code, a_cur, b_cur, r["pnl_pct"][0], int(r["trades"][0]), r["max_dd_pct"][0]))
+            st.session_state["_bt_result"] = (bt_rule, bt_df, bt_cur)
+
+        _bt = st.session_state.get("_bt_result")
+        if _bt and _bt[0] == bt_rule and not _bt[1].empty:
+            _, bt_df, bt_cur = _bt
+            st.markdown(f'<div style="font-size:0.82em;color:var(--text-muted);margin:8px 0">参数组合排名（前 20 / 共 {len(bt_df)} 组）</div>', unsafe_allow_html=True)
+            html_bt = (f'<table class="pro-table"><thead><tr><th>排名</th><th>{a_label}%</th><th>{b_label}%</th><th>平均收益%</th>'
+                       '<th>中位收益%</th><th>盈利股票占比</th><th>平仓笔数</th><th>胜率</th><th>最大回撤%</th></tr></thead><tbody>')
+            for i, r in bt_df.head(20).iterrows():
+                cls = "profit-red" if r['平均收益%'] > 0 else ("loss-green" if r['平均收益%'] < 0 else "")
+                win = f"{r['胜率']:.1f}%" if pd.notna(r['胜率']) else "—"
+                dd  = f"{r['最大回撤%']:.2f}%" if pd.notna(r['最大回撤%']) else "—"
+                html_bt += (f'<tr><td>{i + 1}</td><td>{r["a"]:.2f}</td><td>{r["b"]:.2f}</td>'
+                            f'<td class="{cls}">{r["平均收益%"]:.2f}%</td><td>{r["中位收益%"]:.2f}%</td>'
+                            f'<td>{r["盈利股票占比"]:.0f}%</td><td>{int(r["平仓笔数"])}</td><td>{win}</td><td>{dd}</td></tr>')
+            html_bt += '</tbody></table>'
+            st.markdown(html_bt, unsafe_allow_html=True)
+            if bt_cur:
+                st.markdown('<div style="font-size:0.82em;color:var(--text-muted);margin:8px 0">当前配置参数的回测表现</div>', unsafe_allow_html=True)
+                html_cur = (f'<table class="pro-table"><thead><tr><th>股票</th><th>{a_label}%</th><th>{b_label}%</th>'
+                            '<th>收益%</th><th>平仓笔数</th><th>最大回撤%</th></tr></thead><tbody>')
+                for code, a_cur, b_cur, pnl, n_tr, dd in sorted(bt_cur, key=lambda x: -x[3]):
+                    cls = "profit-red" if pnl > 0 else ("loss-green" if pnl < 0 else "")
+                    html_cur += (f'<tr><td><b>{code}</b></td><td>{fmt(a_cur)}</td><td>{fmt(b_cur)}</td>'
+                                 f'<td class="{cls}">{pnl:.2f}%</td><td>{n_tr}</td><td>{dd:.2f}%</td></tr>')
+                html_cur += '</tbody></table>'
+                st.markdown(html_cur, unsafe_allow_html=True)
+
     sig_df     = pd.read_sql("SELECT * FROM signals", conn)
     prices_map = {row[0]: row[1] for row in c.execute("SELECT code, current_price FROM prices").fetchall()}
 
@@ -2449,6 +2734,22 @@ elif choice == "🔔 买卖信号":
         html += '</tbody></table>'
         st.markdown(html, unsafe_allow_html=True)
 
+        with st.expander("📜 高低点变更记录", expanded=False):
+            _audit = recent_audit(conn, 100)
+            if _audit:
+                _src_name = {"quote": "行情", "history": "日线", "manual": "手动", "cycle": "周期拐点"}
+                html_a = '<table class="pro-table"><thead><tr><th>时间</th><th>股票</th><th>字段</th><th>原值</th><th>新值</th><th>来源</th></tr></thead><tbody>'
+                for _at, _code, _field, _ov, _nv, _od, _nd, _src in _audit:
+                    html_a += (f'<tr><td style="font-size:0.85em">{_at}</td><td><b>{_code}</b></td>'
+                               f'<td>{"高点" if _field == "high" else "低点"}</td>'
+                               f'<td>{fmt(_ov)}<br><small style="color:#64748b">{_od or ""}</small></td>'
+                               f'<td>{fmt(_nv)}<br><small style="color:#64748b">{_nd or ""}</small></td>'
+                               f'<td>{_src_name.get(_src, _src)}</td></tr>')
+                html_a += '</tbody></table>'
+                st.markdown(html_a, unsafe_allow_html=True)
+            else:
+                st.caption("暂无变更记录")
+
         if st.button("🗑️ 清空所有监控", type="secondary"):
             c.execute("DELETE FROM signals")
             conn.commit()
@@ -2457,13 +2758,34 @@ elif choice == "🔔 买卖信号":
     else:
         st.info("📌 当前没有设置任何监控信号")
 
+    with st.expander("📨 提醒记录（信号 / 买卖监控 / 价格目标）", expanded=False):
+        _engine = get_alert_engine()
+        st.caption("投递通道：" + ("、".join(s.name for s in _engine.sinks) or "未配置")
+                   + (f" · 后台每 {_engine.poll_interval:g} 秒轮询行情" if _engine.poll_interval else " · 仅随行情刷新判断"))
+        _alerts = recent_alerts(conn, 100)
+        if _alerts:
+            _status_name = {"sent": "✅ 已发送", "suppressed": "⏸️ 限流", "failed": "❌ 失败"}
+            html_n = '<table class="pro-table"><thead><tr><th>时间</th><th>股票</th><th>方向</th><th>内容</th><th>状态</th></tr></thead><tbody>'
+            for _at, _code, _side, _msg, _st in _alerts:
+                html_n += (f'<tr><td style="font-size:0.85em">{_at}</td><td><b>{_code}</b></td><td>{_side}</td>'
+                           f'<td style="text-align:left">{_msg}</td><td>{_status_name.get(_st, _st)}</td></tr>')
+            html_n += '</tbody></table>'
+            st.markdown(html_n, unsafe_allow_html=True)
+        else:
+            st.caption("暂无提醒")
+
 # =====================================================================
 #  📜 历史明细
 # =====================================================================
 elif choice == "📜 历史明细":
     _page_title("📜", "历史明细", "完整交易流水")
 
+    # 含已归档的早年成交（stock21.archive）；下方维护编辑器只改在用的成交
+    _hist_src = history_table(conn)
     df_full = pd.read_sql(
+        f"SELECT id, date, code, action, price, quantity, note FROM {_hist_src} ORDER BY date DESC, id DESC", conn
+    )
+    df_live = df_full if _hist_src == "trades" else pd.read_sql(
         "SELECT id, date, code, action, price, quantity, note FROM trades ORDER BY date DESC, id DESC", conn
     )
 
@@ -2496,12 +2818,39 @@ elif choice == "📜 历史明细":
                     st.success(f"✅ 已录入：{q_code} {q_act} {q_price:.3f} × {int(q_qty)}")
                     st.rerun()
 
+    with st.expander("🗄️ 冷热归档（早年已平仓的成交）", expanded=False):
+        _arc = archive_summary(conn)
+        if _arc["trades"]:
+            st.caption(f"已归档 {_arc['trades']} 笔（{_arc['first_date']} ~ {_arc['last_date']}，{_arc['partitions']} 个年度分区），"
+                       "账本与盈亏页从结转状态续算，本页与导出仍含全部历史；之后补录了归档截止前的成交时，该股归档自动恢复")
+        else:
+            st.caption("暂无归档。归档只移动各股在截止日期前最后一次持仓归零为止的成交，盈亏结果不变")
+        _ac1, _ac2, _ac3 = st.columns([2, 1, 1])
+        _arc_before = _ac1.date_input("归档截止日期（不含）", datetime(datetime.now().year - KEEP_YEARS, 1, 1),
+                                      key="archive_before")
+        if _ac2.button("🗄️ 归档", use_container_width=True):
+            _res = archive_closed(conn, _arc_before.strftime('%Y-%m-%d'))
+            if _res["trades"]:
+                get_ledger_cache().invalidate()
+                sync_db_to_github()
+                st.success(f"✅ 已归档 {_res['trades']} 笔（{_res['codes']} 只股票，年份 {'、'.join(map(str, _res['years']))}）")
+            else:
+                st.info("没有可归档的成交")
+        if _arc["trades"] and _ac3.button("↩️ 全部恢复", use_container_width=True):
+            _n = restore_archive(conn)
+            get_ledger_cache().invalidate()
+            sync_db_to_github()
+            st.success(f"✅ 已恢复 {_n} 笔到交易流水")
+            st.rerun()
+
     st.divider()
 
     if df_full.empty:
         st.info("📌 暂无交易记录")
     else:
         df_full['date'] = pd.to_datetime(df_full['date']).dt.date
+        if df_live is not df_full:
+            df_live['date'] = pd.to_datetime(df_live['date']).dt.date
 
         # ── 统计摘要 ──
         total_count = len(df_full)
@@ -2560,6 +2909,7 @@ elif choice == "📜 历史明细":
             unsafe_allow_html=True
         )
 
+        RECORDER.lap("表格渲染")
         # ── 全宽交易记录表格 ──
         html = '''<table class="pro-table" style="width:100%;table-layout:fixed">
 <colgroup>
@@ -2593,11 +2943,12 @@ elif choice == "📜 历史明细":
 
         st.divider()
 
-        st.warning("⚠️ 下方编辑器操作**全部交易记录**（不受搜索影响），请谨慎！")
+        st.warning("⚠️ 下方编辑器操作**全部交易记录**（不受搜索影响），请谨慎！"
+                   + (f" 已归档的 {len(df_full) - len(df_live)} 笔不在其中，需修改时先全部恢复。" if len(df_live) < len(df_full) else ""))
 
         with st.expander("🛠️ 数据库维护（支持增、删、改）", expanded=False):
             edited_df = st.data_editor(
-                df_full, use_container_width=True, num_rows="dynamic", hide_index=False,
+                df_live, use_container_width=True, num_rows="dynamic", hide_index=False,
                 column_config={
                     "id":       st.column_config.NumberColumn("ID", disabled=True),
                     "date":     st.column_config.DateColumn("日期", format="YYYY-MM-DD", required=True),
@@ -2617,6 +2968,7 @@ elif choice == "📜 历史明细":
                         save_df['date'] = pd.to_datetime(save_df['date']).dt.strftime('%Y-%m-%d')
                         save_df.to_sql('trades', conn, if_exists='replace', index=False)
                         conn.commit()
+                        get_ledger_cache().invalidate()
                         sync_db_to_github()
                         st.success("✅ 交易记录已更新")
                         st.rerun()
@@ -2652,210 +3004,151 @@ elif choice == "📓 复盘日记":
 
     st.markdown('<div style="font-size:0.82em;color:var(--text-muted);text-transform:uppercase;letter-spacing:0.06em;font-weight:600;margin:10px 0 12px">📚 历史复盘记录</div>', unsafe_allow_html=True)
 
-    journal_df = pd.read_sql(
-        "SELECT id, date, stock_name, content FROM journal ORDER BY date DESC, id DESC", conn
-    )
+    journal_stocks = [r[0] for r in c.execute(
+        "SELECT DISTINCT stock_name FROM journal WHERE stock_name IS NOT NULL ORDER BY stock_name")]
 
-    if journal_df.empty:
+    if not journal_stocks:
         st.info("📌 暂无复盘记录")
     else:
-        unique_stocks = ["全部"] + sorted(journal_df['stock_name'].unique().tolist())
-        filter_stock  = st.selectbox("筛选标的", options=unique_stocks, index=0)
-        display_df    = journal_df if filter_stock == "全部" else journal_df[journal_df['stock_name'] == filter_stock]
-
-        if display_df.empty:
-            st.info(f"没有与「{filter_stock}」相关的记录")
-        else:
-            for _, row in display_df.iterrows():
-                col1, col2 = st.columns([12, 1])
-                with col1:
-                    st.markdown(
-                        f'<div class="journal-card">'
-                        f'<div class="journal-meta">'
-                        f'<span style="background:rgba(59,130,246,0.15);color:var(--accent-blue);border-radius:4px;padding:1px 8px;font-weight:600">{row["stock_name"]}</span>'
-                        f'<span>{row["date"]}</span>'
-                        f'</div>'
-                        f'<div class="journal-content">{row["content"]}</div>'
-                        f'</div>',
-                        unsafe_allow_html=True
-                    )
-                with col2:
-                    if st.button("✕", key=f"del_{row['id']}", help="删除"):
-                        if st.session_state.get(f"confirm_{row['id']}", False):
-                            c.execute("DELETE FROM journal WHERE id = ?", (row['id'],))
-                            conn.commit()
-                            sync_db_to_github()
-                            st.rerun()
-                        else:
-                            st.session_state[f"confirm_{row['id']}"] = True
-                            st.warning("再点一次确认删除")
-
-            st.caption(f"共 {len(journal_df)} 条 · 当前显示 {len(display_df)} 条")
+        filter_stock = st.selectbox("筛选标的", options=["全部"] + journal_stocks, index=0)
+        where, params = ("1 = 1", ()) if filter_stock == "全部" else ("stock_name = ?", (filter_stock,))
+        picked = _entry_grid("journal", "journal", ["date", "stock_name", "content"],
+                             {"date": "日期", "stock_name": "标的", "content": "内容"},
+                             where, params, plain=("content",), empty=f"没有与「{filter_stock}」相关的记录")
+        for _, row in picked.iterrows():
+            _journal_card(row)
 
 # =====================================================================
-#  📝 交易录入
+#  🩺 诊断
 # =====================================================================
-elif choice == "📝 交易录入":
-    _page_title("📝", "交易录入", "快速添加交易记录")
-
-    # ── 股票管理区域 ──
-    st.markdown('<div style="font-size:0.95em;font-weight:700;color:var(--text-primary);margin-bottom:10px">📋 股票列表管理</div>', unsafe_allow_html=True)
-
-    col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
-
-    # 添加新股票
-    with st.form("add_stock_form", clear_on_submit=True):
-        _sm1, _sm2, _sm3 = st.columns([2, 1.2, 1.8])
-        new_stock_name  = _sm1.text_input("股票名称", placeholder="例如：腾讯控股")
-        _sm_market      = _sm2.selectbox(
-            "所属市场",
-            options=["A股·沪市", "A股·深市", "港股", "美股"],
-            index=0,
-        )
-        _sm_prefix = {
-            "A股·沪市": "1.",
-            "A股·深市": "0.",
-            "港股":     "116.",
-            "美股":     "105.",
-        }[_sm_market]
-        _sm_hint = {
-            "A股·沪市": "600900",
-            "A股·深市": "002594",
-            "港股":     "00981",
-            "美股":     "TSLA",
-        }[_sm_market]
-        _sm_raw         = _sm3.text_input("股票代码（纯代码）", placeholder=f"例如：{_sm_hint}")
-        new_stock_code  = (_sm_prefix + _sm_raw.strip()) if _sm_raw.strip() else ""
-
-        submitted = st.form_submit_button("➕ 添加股票", type="primary", use_container_width=True)
-
-        if submitted and new_stock_name and new_stock_code:
-            try:
-                c.execute("INSERT INTO stock_info (stock_name, stock_code) VALUES (?, ?)",
-                          (new_stock_name.strip(), new_stock_code.strip()))
-                conn.commit()
-                sync_db_to_github()
-                st.success(f"✅ 已添加：{new_stock_name} ({new_stock_code})")
-                st.rerun()
-            except sqlite3.IntegrityError:
-                st.error("❌ 该股票名称已存在，请使用其他名称或删除后重新添加")
-            except Exception as e:
-                st.error(f"❌ 添加失败：{e}")
-        elif submitted and new_stock_name and not _sm_raw.strip():
-            st.error("❌ 请填写股票代码")
-
-    # 显示股票列表
-    st.markdown("---")
-    st.markdown('<div style="font-size:0.82em;color:var(--text-muted);text-transform:uppercase;letter-spacing:0.06em;font-weight:600;margin-bottom:8px">已管理的股票</div>', unsafe_allow_html=True)
-
-    stock_list = pd.read_sql("SELECT id, stock_name, stock_code FROM stock_info ORDER BY stock_name", conn)
-
-    if not stock_list.empty:
-        html = '<table class="pro-table"><thead><tr><th>股票名称</th><th>股票代码</th><th>操作</th></tr></thead><tbody>'
-        for _, row in stock_list.iterrows():
-            html += f"""<tr>
-                <td><b>{row['stock_name']}</b></td>
-                <td>{row['stock_code']}</td>
-                <td>
-                    <button type="button" onclick="delete_stock({row['id']})" style="background:#f43f5e;color:white;border:none;padding:4px 12px;border-radius:4px;cursor:pointer;font-size:0.85em">删除</button>
-                </td>
-            </tr>"""
-        html += '</tbody></table>'
-        st.markdown(html, unsafe_allow_html=True)
-
-        # JavaScript 删除函数
-        components.html("""
-        <script>
-        function delete_stock(id) {
-            if (confirm('确定要删除这只股票吗？此操作不可撤销。')) {
-                const deleteEvent = new CustomEvent('delete-stock', { detail: { id: id } });
-                window.parent.document.dispatchEvent(deleteEvent);
-            }
-        }
-        </script>
-        <script>
-        window.parent.document.addEventListener('delete-stock', function(e) {
-            const url = new URL(window.location.href);
-            url.searchParams.set('delete_stock_id', e.detail.id);
-            window.location.href = url.toString();
-        });
-        </script>
-        """, height=0)
-
-        # 检查是否有删除请求
-        if 'delete_stock_id' in st.query_params:
-            delete_id = st.query_params['delete_stock_id']
-            try:
-                # 检查该股票是否有交易记录
-                stock_name = c.execute("SELECT stock_name FROM stock_info WHERE id = ?", (delete_id,)).fetchone()
-                if stock_name:
-                    stock_name = stock_name[0]
-                    has_trades = c.execute("SELECT COUNT(*) FROM trades WHERE code = ?", (stock_name,)).fetchone()[0]
-                    if has_trades > 0:
-                        st.warning(f"⚠️ 该股票有 {has_trades} 条交易记录，请先删除交易记录再删除股票")
-                    else:
-                        c.execute("DELETE FROM stock_info WHERE id = ?", (delete_id,))
-                        c.execute("DELETE FROM prices WHERE code = ?", (stock_name,))
-                        c.execute("DELETE FROM strategy_notes WHERE code = ?", (stock_name,))
-                        c.execute("DELETE FROM price_targets WHERE code = ?", (stock_name,))
-                        c.execute("DELETE FROM signals WHERE code = ?", (stock_name,))
-                        conn.commit()
-                        sync_db_to_github()
-                        st.success(f"✅ 已删除：{stock_name}")
-                        st.query_params.clear()
-                        st.rerun()
-            except Exception as e:
-                st.error(f"❌ 删除失败：{e}")
+elif choice == "🩺 诊断":
+    _page_title("🩺", "诊断", "重跑耗时 · SQL · 网络")
+
+    def _ms(sec):
+        return f"{sec * 1000:,.1f} ms"
+
+    def _table(headers, rows):
+        html = '<table class="pro-table"><thead><tr>' + "".join(f"<th>{h}</th>" for h in headers) + '</tr></thead><tbody>'
+        for r in rows:
+            html += "<tr>" + "".join(f"<td>{v}</td>" for v in r) + "</tr>"
+        return html + '</tbody></table>'
+
+    with RECORDER.lock:
+        _runs  = [r for r in RECORDER.reruns if r["status"] == "ok"]
+        _calls = list(RECORDER.calls)
+        _n_sql = sum(1 for q in RECORDER.queries if q[3] == "execute")
+    _secs = [r["seconds"] for r in _runs]
+    c1, c2, c3, c4, c5 = st.columns(5)
+    c1.metric("完成重跑", len(_runs))
+    c2.metric("重跑 p50", _ms(float(pd.Series(_secs).quantile(0.5))) if _secs else "—")
+    c3.metric("重跑 p95", _ms(float(pd.Series(_secs).quantile(0.95))) if _secs else "—")
+    c4.metric("SQL 语句（缓冲内）", _n_sql)
+    c5.metric("外部调用 / 失败", f"{len(_calls)} / {sum(1 for x in _calls if not x[4])}")
+
+    st.markdown("#### ⏱️ 页面重跑")
+    _rs = RECORDER.rerun_stats()
+    if _rs:
+        st.markdown(_table(["页面", "次数", "p50", "p95", "最大", "平均 SQL 条数"],
+                           [(f"<b>{p}</b>", n, _ms(a), _ms(b), _ms(m), f"{q:.0f}") for p, n, a, b, m, q in _rs]),
+                    unsafe_allow_html=True)
+        if _runs:
+            _last = _runs[-1]
+            st.caption(f"最近一次完整重跑：{_last['page']} · {_ms(_last['seconds'])} · SQL {_last['sql_count']} 条 · 取回 {_last['sql_rows']} 行 / {_ms(_last['sql_seconds'])}")
+            st.bar_chart(pd.DataFrame({"毫秒": [sec * 1000 for _, sec in _last["spans"]]},
+                                      index=[name for name, _ in _last["spans"]]), horizontal=True)
     else:
-        st.info("📌 暂无股票，请在上方添加")
-
-    st.divider()
-
-    # ── 交易录入区域 ──
-    st.markdown('<div style="font-size:0.95em;font-weight:700;color:var(--text-primary);margin-bottom:10px">✏️ 录入交易</div>', unsafe_allow_html=True)
+        st.caption("暂无完整重跑记录（切换几次页面后再来看）")
 
-    with st.form("add_trade_form", clear_on_submit=True):
-        col_date, col_stock, col_action = st.columns([2, 2, 1])
-        trade_date = col_date.date_input("交易日期", value=datetime.now())
-        trade_stock = col_stock.selectbox("选择股票", options=sorted(stock_list['stock_name'].tolist()) if not stock_list.empty else [], index=None)
-        trade_action = col_action.selectbox("操作", options=["买入", "卖出"])
+    with st.expander("🧩 分段耗时（按页面）", expanded=False):
+        _ss = RECORDER.span_stats()
+        if _ss:
+            st.markdown(_table(["页面", "分段", "次数", "平均", "p95"],
+                               [(p, n, k, _ms(a), _ms(b)) for p, n, k, a, b in _ss[:40]]), unsafe_allow_html=True)
+        else:
+            st.caption("暂无数据")
+
+    st.markdown("#### 🐢 最慢语句（按总耗时）")
+    _qs = RECORDER.query_stats(20)
+    if _qs:
+        st.markdown(_table(["语句", "执行次数", "总耗时（含取数）", "p95", "最大"],
+                           [(f'<code style="font-size:0.8em;white-space:normal">{html_lib.escape(q)}</code>', n,
+                             _ms(t), _ms(p95), _ms(m)) for q, n, t, p95, m in _qs]),
+                    unsafe_allow_html=True)
+    else:
+        st.caption("暂无 SQL 记录")
+
+    st.markdown("#### 🌐 网络与同步延迟")
+    _hist = RECORDER.call_histogram()
+    if _hist:
+        _labels = [f"≤{b * 1000:g}ms" if b < 1 else f"≤{b:g}s" for b in DIAG_BUCKETS] + [f">{DIAG_BUCKETS[-1]:g}s"]
+        _chart = pd.DataFrame({f"{k} · {n}": counts + [cnt - sum(counts)]
+                               for (k, n), (counts, cnt, _, _) in _hist.items()}, index=_labels)
+        st.bar_chart(_chart)
+        st.markdown(_table(["类型", "目标", "次数", "平均", "失败"],
+                           [(k, n, cnt, _ms(tot / cnt) if cnt else "—", err)
+                            for (k, n), (_, cnt, tot, err) in sorted(_hist.items())]), unsafe_allow_html=True)
+    else:
+        st.caption("暂无网络调用记录")
 
-        col_price, col_qty, col_note = st.columns([2, 2, 3])
-        trade_price = col_price.number_input("成交价格", min_value=0.0, step=0.001, format="%.3f")
-        trade_qty = col_qty.number_input("数量", min_value=1, step=1)
-        trade_note = col_note.text_input("备注（可选）", placeholder="交易说明")
+    with st.expander("📡 Prometheus 指标", expanded=False):
+        _srv = get_metrics_server()
+        if _srv:
+            st.caption(f"抓取地址：http://127.0.0.1:{_srv.server_address[1]}/metrics（仅本机可访问）")
+        else:
+            st.caption("指标端点未启动（METRICS_PORT=0 或端口被占用），以下为当前内容")
+        st.code(RECORDER.prometheus()[:20000], language="text")
 
-        submitted_trade = st.form_submit_button("📥 录入交易", type="primary", use_container_width=True)
-
-        if submitted_trade:
-            if trade_stock and trade_price > 0 and trade_qty > 0:
-                try:
-                    c.execute(
-                        "INSERT INTO trades (date, code, action, price, quantity, note) VALUES (?, ?, ?, ?, ?, ?)",
-                        (trade_date.strftime('%Y-%m-%d'), trade_stock, trade_action, trade_price, int(trade_qty), trade_note.strip())
-                    )
-                    conn.commit()
-                    sync_db_to_github()
-                    st.success(f"✅ 交易已录入：{trade_stock} {trade_action} {trade_qty}股 @ {trade_price}")
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"❌ 录入失败：{e}")
-            else:
-                st.warning("⚠️ 请填写完整的交易信息")
+    if st.button("🧹 清空诊断数据"):
+        RECORDER.reset()
+        st.rerun()
 
 # =====================================================================
 #  底部工具栏
 # =====================================================================
+RECORDER.lap("底部工具栏")
 st.divider()
+
+def _export_status_body():
+    """后台导出进度：运行中每秒刷新（局部），结束后整页重跑一次以停止刷新并给出下载按钮"""
+    job = st.session_state.get("_export_job")
+    if job is None:
+        return
+    if job.status != "running" and st.session_state.pop("_export_polling", False):
+        st.rerun()
+    if job.status == "running":
+        st.caption(f"⏳ 正在导出{('：' + job.current) if job.current else ''}… 已写出 {job.rows:,} 行")
+    elif job.status == "failed":
+        st.error(f"❌ 导出失败：{job.error}")
+    else:
+        with open(job.path, "rb") as f:
+            st.download_button(f"📥 下载 {job.file_name}（{job.rows:,} 行，{job.seconds} 秒）", data=f,
+                               file_name=job.file_name, use_container_width=True)
+
 col_spacer, col_dl = st.columns([8, 1])
+with col_spacer:
+    with st.expander("📤 导出数据", expanded=False):
+        _ec1, _ec2 = st.columns([3, 1])
+        exp_sets = _ec1.multiselect("导出内容", options=list(EXPORT_DATASETS), default=list(EXPORT_DATASETS),
+                                    format_func=lambda k: EXPORT_DATASETS[k][0])
+        exp_fmt = _ec2.selectbox("格式", options=list(EXPORT_FORMATS), format_func=EXPORT_FORMATS.get)
+        _running = getattr(st.session_state.get("_export_job"), "status", None) == "running"
+        if st.button("🚀 生成导出文件", disabled=_running or not exp_sets, use_container_width=True):
+            _old = st.session_state.pop("_export_job", None)
+            if _old is not None:
+                _old.cleanup()
+            st.session_state["_export_job"] = ExportJob(conn, exp_sets, exp_fmt).start()
+            _running = True
+        st.caption("导出基于当前数据的一致快照，在后台生成，完成后在此下载")
+        st.session_state["_export_polling"] = _running
+        st.fragment(run_every=1 if _running else None)(_export_status_body)()
 with col_dl:
-    db_path = pathlib.Path(__file__).with_name("stock_data_v12.db")
-    if db_path.exists():
-        with open(db_path, "rb") as f:
-            st.download_button(
-                label="📥 备份 DB",
-                data=f,
-                file_name="stock_data_v12.db",
-                mime="application/x-sqlite3",
-                help="下载本地数据库备份"
-            )
+    # 用 backup API 取快照而不是直接读文件：拿到的是已提交的完整数据，且始终对应 DB_FILE
+    st.download_button(
+        label="📥 备份 DB",
+        data=snapshot_bytes(conn),
+        file_name=DB_FILE.name,
+        mime="application/x-sqlite3",
+        help="下载本地数据库备份"
+    )
+
+RECORDER.end_rerun()
@@ -0,0 +1 @@
+"""合成账本基准测试（python -m benchmarks.run）"""
@@ -0,0 +1,376 @@
+"""
+被测内核。app.py 是 Streamlit 脚本无法直接导入，页面里内联的计算在这里逐行照搬
+（改动对应页面时请同步更新）；已经抽到 stock21 里的直接调用。
+baseline_* 是页面改用 stock21 之前的配对 / 汇总循环，冻结不再同步，只作为对比的基线
+（现行写法见 ledger_profit、match_policies、ledger_match_* 等）。
+每个内核签名为 fn(ctx)，ctx 由 run.py 按规模准备好（账本、现价、内存库等）。
+"""
+import datetime as _dt
+
+import numpy as np
+import pandas as pd
+
+from stock21.ledger import Ledger
+from stock21.matching import match_lowest_cost, match_policies, POLICIES
+from stock21.money import mark_to_market, units_array, qty_array, from_units
+from stock21.parallel import match_symbols, MAX_WORKERS
+from stock21.returns import xirr_matrix
+
+
+def format_number(num):
+    if num is None or (isinstance(num, float) and pd.isna(num)):
+        return "0"
+    s = f"{num}"
+    return s.rstrip('0').rstrip('.') if '.' in s else s
+
+
+# ── 基线 · 🏠 股票详情中心：选中股票的持仓池配对（原页面写法） ──────────────────
+
+def baseline_detail_pool_matching(ctx):
+    s_df = ctx["ledger"][ctx["ledger"]['code'] == ctx["top_code"]].copy()
+    realized_profit = 0.0
+    max_occupied_amount = 0.0
+    buy_pool = []
+    sell_pool = []
+    net_q = 0
+
+    for _, t in s_df.iterrows():
+        price = t['price']
+        qty = t['quantity']
+        if t['action'] == '买入':
+            remaining_to_buy = qty
+            while remaining_to_buy > 0 and sell_pool:
+                sell_pool.sort(key=lambda x: x['price'], reverse=True)
+                sp = sell_pool[0]
+                match_q = min(remaining_to_buy, sp['qty'])
+                realized_profit += (sp['price'] - price) * match_q
+                sp['qty'] -= match_q
+                remaining_to_buy -= match_q
+                if sp['qty'] <= 0: sell_pool.pop(0)
+            if remaining_to_buy > 0:
+                buy_pool.append({'price': price, 'qty': remaining_to_buy})
+            net_q += qty
+        else:
+            remaining_to_sell = qty
+            while remaining_to_sell > 0 and buy_pool:
+                buy_pool.sort(key=lambda x: x['price'])
+                bp = buy_pool[0]
+                match_q = min(remaining_to_sell, bp['qty'])
+                realized_profit += (price - bp['price']) * match_q
+                bp['qty'] -= match_q
+                remaining_to_sell -= match_q
+                if bp['qty'] <= 0: buy_pool.pop(0)
+            if remaining_to_sell > 0:
+                sell_pool.append({'price': price, 'qty': remaining_to_sell})
+            net_q -= qty
+        current_occ = sum(x['price'] * x['qty'] for x in buy_pool) + sum(x['price'] * x['qty'] for x in sell_pool)
+        max_occupied_amount = max(max_occupied_amount, current_occ)
+    return realized_profit, max_occupied_amount, net_q
+
+
+# ── 基线 · 📊 实时持仓：全部股票的成交配对与未平仓单（原页面写法） ──────────────
+
+def baseline_holdings_pairing(ctx):
+    df_trades = ctx["ledger"]
+    latest_config = ctx["config"]
+    summary = []
+    all_active_records = []
+    for stock in df_trades['code'].unique():
+        s_df = df_trades[df_trades['code'] == stock].copy()
+        now_p, manual_cost = latest_config.get(stock, (0.0, 0.0))
+        net_buy = s_df[s_df['action'] == '买入']['quantity'].sum()
+        net_sell = s_df[s_df['action'] == '卖出']['quantity'].sum()
+        net_q = net_buy - net_sell
+        if net_q != 0:
+            if manual_cost > 0:
+                p_rate = ((now_p - manual_cost) / manual_cost * 100) if net_q > 0 else ((manual_cost - now_p) / manual_cost * 100)
+            else:
+                p_rate = 0.0
+            summary.append([stock, net_q, format_number(manual_cost), format_number(now_p), f"{p_rate:.2f}%", p_rate, None])
+
+        buy_positions = []
+        sell_positions = []
+        paired_trades = []
+        for _, trade in s_df.sort_values(['date', 'id']).iterrows():
+            trade_date = trade['date']
+            action = trade['action']
+            price = trade['price']
+            qty = trade['quantity']
+            remaining = qty
+            if action == '买入':
+                if sell_positions and remaining > 0:
+                    for sp in sorted(sell_positions, key=lambda x: -x['price']):
+                        if remaining <= 0: break
+                        if sp['qty'] <= 0: continue
+                        cover_qty = min(sp['qty'], remaining)
+                        gain = ((sp['price'] - price) / sp['price'] * 100) if sp['price'] > 0 else 0.0
+                        paired_trades.append({
+                            "date": f"{sp['date']} → {trade_date}", "code": stock,
+                            "type": "✅ 已配对交易对",
+                            "price": f"{format_number(sp['price'])} → {format_number(price)}",
+                            "qty": cover_qty, "gain_str": f"{gain:.2f}%", "gain_val": gain
+                        })
+                        sp['qty'] -= cover_qty
+                        remaining -= cover_qty
+                    sell_positions = [sp for sp in sell_positions if sp['qty'] > 0]
+                if remaining > 0:
+                    buy_positions.append({'date': trade_date, 'price': price, 'qty': remaining})
+            elif action == '卖出':
+                if buy_positions and remaining > 0:
+                    for bp in sorted(buy_positions, key=lambda x: x['price']):
+                        if remaining <= 0: break
+                        if bp['qty'] <= 0: continue
+                        close_qty = min(bp['qty'], remaining)
+                        gain = ((price - bp['price']) / bp['price'] * 100) if bp['price'] > 0 else 0.0
+                        paired_trades.append({
+                            "date": f"{bp['date']} → {trade_date}", "code": stock,
+                            "type": "✅ 已配对交易对",
+                            "price": f"{format_number(bp['price'])} → {format_number(price)}",
+                            "qty": close_qty, "gain_str": f"{gain:.2f}%", "gain_val": gain
+                        })
+                        bp['qty'] -= close_qty
+                        remaining -= close_qty
+                    buy_positions = [bp for bp in buy_positions if bp['qty'] > 0]
+                if remaining > 0:
+                    sell_positions.append({'date': trade_date, 'price': price, 'qty': remaining})
+
+        for bp in buy_positions:
+            float_gain = ((now_p - bp['price']) / bp['price'] * 100) if bp['price'] > 0 else 0.0
+            all_active_records.append({
+                "date": bp['date'], "code": stock, "type": "🔴 买入持有",
+                "price": format_number(bp['price']), "qty": bp['qty'],
+                "gain_str": f"{float_gain:.2f}%", "gain_val": float_gain
+            })
+        for sp in sell_positions:
+            float_gain = ((sp['price'] - now_p) / sp['price'] * 100) if sp['price'] > 0 else 0.0
+            all_active_records.append({
+                "date": sp['date'], "code": stock, "type": "🟢 卖空持有",
+                "price": format_number(sp['price']), "qty": sp['qty'],
+                "gain_str": f"{float_gain:.2f}%", "gain_val": float_gain
+            })
+        all_active_records = paired_trades + all_active_records
+    return summary, all_active_records
+
+
+# ── 基线 · 💰 盈利账单：逐股配对 + 投入回收汇总（原页面写法） ──────────────────
+
+def baseline_profit_aggregation(ctx):
+    df_trades = ctx["ledger"]
+    latest_prices = ctx["prices"]
+    profit_list = []
+    for stock in df_trades['code'].unique():
+        s_df = df_trades[df_trades['code'] == stock].copy()
+        now_p = latest_prices.get(stock, 0.0)
+        m = match_lowest_cost(s_df.sort_values(['date', 'id'])[['date', 'action', 'price', 'quantity']].itertuples(index=False))
+        realized_profit = m.realized
+        unrealized_profit = 0.0
+        buy_pool = [{'price': p, 'qty': q} for _, p, q in m.buy_lots]
+        sell_pool = [{'price': p, 'qty': q} for _, p, q in m.sell_lots]
+        for bp in buy_pool: unrealized_profit += (now_p - bp['price']) * bp['qty']
+        for sp in sell_pool: unrealized_profit += (sp['price'] - now_p) * sp['qty']
+        long_value = sum(bp['qty'] for bp in buy_pool) * now_p
+        short_value = -sum(sp['qty'] for sp in sell_pool) * now_p
+        total_buy_cash = s_df[s_df['action'] == '买入'].apply(lambda r: r['price'] * r['quantity'], axis=1).sum()
+        total_sell_cash = s_df[s_df['action'] == '卖出'].apply(lambda r: r['price'] * r['quantity'], axis=1).sum()
+        profit_list.append({
+            "股票名称": stock, "累计投入": total_buy_cash, "累计回收": total_sell_cash,
+            "已实现盈亏": realized_profit, "未实现盈亏": unrealized_profit,
+            "持仓市值": long_value + short_value, "总盈亏": realized_profit + unrealized_profit
+        })
+    return pd.DataFrame(profit_list).sort_values(by="总盈亏", ascending=False)
+
+
+def match_all(ctx):
+    """stock21.matching.match_lowest_cost 本身（不含页面的 DataFrame 切片开销）"""
+    for _, g in ctx["ledger"].groupby("code", sort=False):
+        match_lowest_cost(g[['date', 'action', 'price', 'quantity']].itertuples(index=False, name=None))
+
+
+def match_all_policies(ctx):
+    """stock21.matching.match_policies：一次扫描同时按全部配对规则配对（💰 盈利账单的规则对比）"""
+    for _, g in ctx["ledger"].groupby("code", sort=False):
+        match_policies(g[['date', 'action', 'price', 'quantity']].itertuples(index=False, name=None), POLICIES)
+
+
+# ── stock21.ledger：共享账本 ──────────────────────────────────────────────────
+
+def ledger_build(ctx):
+    """从读出的成交构建分组账本（每次重读时的一次性开销）"""
+    return Ledger(ctx["ledger"].assign(_rowid=np.arange(1, len(ctx["ledger"]) + 1)))
+
+
+def ledger_profit(ctx):
+    """💰 盈利账单现行写法：共享账本的分组切片 + 全部规则一次配对 + int64 投入回收汇总"""
+    ledger, latest_prices = ctx["shared_ledger"], ctx["prices"]
+    df_trades = ledger.frame
+    cash_units = (pd.Series(units_array(df_trades['price']) * qty_array(df_trades['quantity']), index=df_trades.index)
+                  .groupby([df_trades['code'], df_trades['action']], observed=True).sum())
+    profit_list = []
+    for stock in ledger.codes:
+        now_p = latest_prices.get(stock, 0.0)
+        m = match_policies(ledger.rows(stock), POLICIES)["lowest"]
+        unrealized_profit = mark_to_market(m.buy_lots, m.sell_lots, now_p)
+        profit_list.append({
+            "股票名称": stock, "累计投入": from_units(int(cash_units.get((stock, '买入'), 0))),
+            "累计回收": from_units(int(cash_units.get((stock, '卖出'), 0))),
+            "已实现盈亏": m.realized, "未实现盈亏": unrealized_profit,
+            "持仓市值": m.net_qty * now_p, "总盈亏": m.realized + unrealized_profit
+        })
+    return pd.DataFrame(profit_list).sort_values(by="总盈亏", ascending=False)
+
+
+def ledger_match_serial(ctx):
+    """stock21.parallel.match_symbols 单进程：全部股票 × 全部规则（💰 盈利账单的配对部分）"""
+    match_symbols(ctx["shared_ledger"], None, POLICIES, keep_pairs=False, workers=1)
+
+
+def ledger_match_parallel(ctx):
+    """同上，不论规模一律分片到进程池（进程数取 STOCK21_WORKERS，至少 2），与 ledger_match_serial 对照找交叉点"""
+    match_symbols(ctx["shared_ledger"], None, POLICIES, keep_pairs=False, workers=max(2, MAX_WORKERS),
+                  min_trades=0, min_symbols=0)
+
+
+# ── 🎯 价格目标管理：监控项计算 ────────────────────────────────────────────────
+
+def price_target_eval(ctx):
+    c = ctx["conn"]
+
+    def get_current_price(code):
+        r = c.execute("SELECT current_price FROM prices WHERE code = ?", (code,)).fetchone()
+        return float(r[0]) if r and r[0] else 0.0
+
+    def calc_buy_target(config, current_price):
+        r = {'base_price': None, 'buy_target': None, 'rebound_pct': None, 'to_target_pct': None}
+        hp, dp = config.get('buy_high_point'), config.get('buy_drop_pct')
+        if not hp or not dp: return r
+        r['base_price'] = round(hp * (1 - dp / 100), 3)
+        if config.get('buy_break_status') == '已突破':
+            lb = config.get('buy_low_after_break')
+            rb = config.get('buy_rebound_pct', 0.0)
+            if lb:
+                r['buy_target'] = round(lb * (1 + rb / 100), 3)
+                r['rebound_pct'] = rb
+                if current_price > 0:
+                    r['to_target_pct'] = round((r['buy_target'] - current_price) / current_price * 100, 2)
+        return r
+
+    def calc_sell_target(config, current_price):
+        r = {'base_price': None, 'sell_target': None, 'fallback_pct': None, 'to_target_pct': None}
+        lp, rp = config.get('sell_low_point'), config.get('sell_rise_pct')
+        if not lp or not rp: return r
+        r['base_price'] = round(lp * (1 + rp / 100), 3)
+        if config.get('sell_break_status') == '已突破':
+            ha = config.get('sell_high_after_break')
+            fb = config.get('sell_fallback_pct', 0.0)
+            if ha:
+                r['sell_target'] = round(ha * (1 - fb / 100), 3)
+                r['fallback_pct'] = fb
+                if current_price > 0:
+                    r['to_target_pct'] = round((current_price - r['sell_target']) / r['sell_target'] * 100, 2)
+        return r
+
+    all_configs_raw = c.execute("""SELECT code, buy_high_point, buy_drop_pct, buy_break_status, buy_low_after_break,
+                        buy_rebound_pct, sell_low_point, sell_rise_pct, sell_break_status,
+                        sell_high_after_break, sell_fallback_pct FROM price_targets_v2
+                       WHERE buy_high_point IS NOT NULL OR sell_low_point IS NOT NULL""").fetchall()
+    monitor_items = []
+    for row in all_configs_raw:
+        d = {
+            'code': row[0], 'buy_high_point': row[1], 'buy_drop_pct': row[2],
+            'buy_break_status': row[3], 'buy_low_after_break': row[4], 'buy_rebound_pct': row[5] or 0.0,
+            'sell_low_point': row[6], 'sell_rise_pct': row[7], 'sell_break_status': row[8],
+            'sell_high_after_break': row[9], 'sell_fallback_pct': row[10] or 0.0
+        }
+        code = d['code']
+        curr_price = get_current_price(code)
+        if d['buy_high_point'] and d['buy_drop_pct']:
+            bc = calc_buy_target(d, curr_price)
+            if d['buy_break_status'] == '已突破' and bc['buy_target']:
+                monitor_items.append({'code': code, 'type': '买入', 'trend': '反弹中',
+                    'target_price': bc['buy_target'], 'current_price': curr_price,
+                    'to_target_pct': bc['to_target_pct'], 'break_status': '已突破'})
+            elif d['buy_break_status'] == '未突破':
+                monitor_items.append({'code': code, 'type': '买入', 'trend': '等待突破',
+                    'target_price': bc['base_price'], 'current_price': curr_price,
+                    'to_target_pct': round((bc['base_price'] - curr_price) / curr_price * 100, 2) if curr_price > 0 else None,
+                    'break_status': '未突破'})
+        if d['sell_low_point'] and d['sell_rise_pct']:
+            sc = calc_sell_target(d, curr_price)
+            if d['sell_break_status'] == '已突破' and sc['sell_target']:
+                monitor_items.append({'code': code, 'type': '卖出', 'trend': '回调中',
+                    'target_price': sc['sell_target'], 'current_price': curr_price,
+                    'to_target_pct': sc['to_target_pct'], 'break_status': '已突破'})
+            elif d['sell_break_status'] == '未突破':
+                monitor_items.append({'code': code, 'type': '卖出', 'trend': '等待突破',
+                    'target_price': sc['base_price'], 'current_price': curr_price,
+                    'to_target_pct': round((sc['base_price'] - curr_price) / curr_price * 100, 2) if curr_price > 0 else None,
+                    'break_status': '未突破'})
+    monitor_items.sort(key=lambda x: abs(x['to_target_pct']) if x['to_target_pct'] is not None else float('inf'))
+    return monitor_items
+
+
+# ── 📜 历史明细：读取、筛选与 HTML 表格 ───────────────────────────────────────
+
+def history_filter(ctx):
+    df_full = pd.read_sql(
+        "SELECT id, date, code, action, price, quantity, note FROM trades ORDER BY date DESC, id DESC", ctx["conn"])
+    df_full['date'] = pd.to_datetime(df_full['date']).dt.date
+    df_display = df_full.copy()
+    df_display = df_display[df_display['code'].str.contains(ctx["search"], case=False, na=False)]
+    df_display = df_display[df_display['action'] == '买入']
+    cutoff = _dt.date(2016, 1, 4) + _dt.timedelta(days=365)
+    df_display = df_display[df_display['date'] >= cutoff]
+    return df_display.sort_values(['date', 'id'])
+
+
+def history_html(ctx):
+    df_display = ctx["ledger"]
+    html = '''<table class="pro-table" style="width:100%;table-layout:fixed">
+<thead><tr><th>日期</th><th>股票</th><th>操作</th><th>价格</th><th>数量</th><th>总额</th><th>备注</th></tr></thead><tbody>'''
+    for _, r in df_display.iterrows():
+        if r['action'] == '买入':
+            act_html = '<span class="badge badge-buy">买入</span>'
+            row_bg = "background:rgba(239,68,68,0.04)"
+        else:
+            act_html = '<span class="badge badge-sell">卖出</span>'
+            row_bg = "background:rgba(34,197,94,0.04)"
+        note_raw = str(r['note']).strip() if pd.notna(r['note']) and str(r['note']).strip() not in ['', 'nan'] else ''
+        note_html = note_raw if note_raw else f'<span style="color:var(--text-muted);font-size:0.85em">—</span>'
+        amt = r['price'] * r['quantity']
+        html += (
+            f'<tr style="{row_bg}">'
+            f'<td>{r["date"]}</td>'
+            f'<td><b style="color:var(--accent-blue)">{r["code"]}</b></td>'
+            f'<td>{act_html}</td>'
+            f'<td style="font-weight:600">{r["price"]:.3f}</td>'
+            f'<td>{int(r["quantity"])}</td>'
+            f'<td style="font-weight:600">{amt:,.2f}</td>'
+            f'<td style="font-size:0.85em;color:var(--text-secondary);word-break:break-all">{note_html}</td>'
+            f'</tr>'
+        )
+    html += '</tbody></table>'
+    return html
+
+
+# ── stock21.returns：批量 XIRR ────────────────────────────────────────────────
+
+def xirr_batch(ctx):
+    """每只股票一行现金流（投入为负），末笔为按现价计的持仓市值"""
+    return xirr_matrix(ctx["flow_amounts"], ctx["flow_years"])
+
+
+KERNELS = {
+    "baseline_detail_pool_matching": baseline_detail_pool_matching,
+    "baseline_holdings_pairing": baseline_holdings_pairing,
+    "baseline_profit_aggregation": baseline_profit_aggregation,
+    "match_lowest_cost": match_all,
+    "match_policies": match_all_policies,
+    "ledger_build": ledger_build,
+    "ledger_profit": ledger_profit,
+    "ledger_match_serial": ledger_match_serial,
+    "ledger_match_parallel": ledger_match_parallel,
+    "price_target_eval": price_target_eval,
+    "history_filter": history_filter,
+    "history_html": history_html,
+    "xirr_batch": xirr_batch,
+}
@@ -0,0 +1,95 @@
+"""
+带种子的合成账本：按股票生成随机游走价格，交易以多头段 / 空头段交替出现
+（多头段先买后卖，空头段先卖后买），字段与 trades 表一致。
+"""
+import sqlite3
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+BUY, SELL = "买入", "卖出"
+
+
+def make_ledger(n_trades: int, n_symbols: int, seed: int = 0, short_ratio: float = 0.3) -> pd.DataFrame:
+    """
+    n_trades 笔成交分布在 n_symbols 只股票上（股票间笔数按 Zipf 分布，少数股票交易频繁）。
+    返回列 id, date, code, action, price, quantity, note，按 (date, id) 排序
+    """
+    rng = np.random.default_rng(seed)
+    n_symbols = max(1, min(n_symbols, n_trades))
+    weights = 1.0 / np.arange(1, n_symbols + 1)
+    counts = np.maximum(1, np.floor(weights / weights.sum() * n_trades)).astype(int)
+    counts[0] += n_trades - counts.sum()
+    codes = np.repeat([f"股票{i:04d}" for i in range(n_symbols)], counts)
+
+    # 每只股票内：按段交替方向，段内先开仓再平仓
+    seq = np.concatenate([np.arange(c) for c in counts])
+    seg_len = rng.integers(2, 12, size=n_trades)
+    seg_id = np.cumsum(seq == 0) * 100000 + seq // seg_len
+    seg_short = (pd.util.hash_array(seg_id.astype(np.uint64)) % 1000) < short_ratio * 1000
+    opening = rng.random(n_trades) < 0.55
+    long_side = np.where(opening, BUY, SELL)
+    short_side = np.where(opening, SELL, BUY)
+    action = np.where(seg_short, short_side, long_side)
+
+    base = rng.uniform(3, 300, size=n_symbols)
+    steps = rng.normal(0, 0.02, size=n_trades)
+    steps[seq == 0] = 0
+    walk = np.exp(pd.Series(steps).groupby(codes).cumsum().to_numpy())
+    price = np.round(np.repeat(base, counts) * walk, 3)
+    quantity = rng.integers(1, 50, size=n_trades) * 100
+
+    span_days = max(30, min(3650, n_trades // max(n_symbols, 1) * 3))
+    sym = np.repeat(np.arange(n_symbols), counts)
+    day = rng.integers(0, span_days, size=n_trades)
+    day = day[np.lexsort((day, sym))]        # 股票内日期递增（与成交顺序一致）
+    start = date(2016, 1, 4)
+    dates = pd.to_datetime(start) + pd.to_timedelta(day, unit="D")
+    note = np.where(rng.random(n_trades) < 0.2, "合成备注", None)
+
+    df = pd.DataFrame({"date": dates.strftime("%Y-%m-%d"), "code": codes, "action": action,
+                       "price": price, "quantity": quantity, "note": note})
+    df = df.sort_values(["date", "code"], kind="stable").reset_index(drop=True)
+    df.insert(0, "id", np.arange(1, len(df) + 1))
+    return df
+
+
+def make_prices(ledger: pd.DataFrame, seed: int = 0) -> dict:
+    """{股票: 现价}：每只股票最后成交价上下浮动 10% 以内"""
+    rng = np.random.default_rng(seed + 1)
+    last = ledger.groupby("code")["price"].last()
+    return dict(zip(last.index, np.round(last.to_numpy() * rng.uniform(0.9, 1.1, size=len(last)), 3)))
+
+
+def make_price_targets(prices: dict, seed: int = 0) -> list:
+    """price_targets_v2 行（与页面查询的列顺序一致），突破 / 未突破各占一部分"""
+    rng = np.random.default_rng(seed + 2)
+    rows = []
+    for code, p in prices.items():
+        b_break, s_break = rng.random() < 0.4, rng.random() < 0.4
+        rows.append((code, round(p * rng.uniform(1.0, 1.3), 3), float(rng.integers(5, 25)),
+                     "已突破" if b_break else "未突破", round(p * rng.uniform(0.8, 1.0), 3) if b_break else None,
+                     float(rng.integers(1, 8)),
+                     round(p * rng.uniform(0.7, 1.0), 3), float(rng.integers(5, 25)),
+                     "已突破" if s_break else "未突破", round(p * rng.uniform(1.0, 1.2), 3) if s_break else None,
+                     float(rng.integers(1, 8))))
+    return rows
+
+
+def make_db(ledger: pd.DataFrame, prices: dict, targets: list) -> sqlite3.Connection:
+    """内存库：trades / prices / price_targets_v2，表结构与 app.py 启动时建的一致"""
+    conn = sqlite3.connect(":memory:")
+    conn.execute('''CREATE TABLE trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, code TEXT,
+        action TEXT, price REAL, quantity INTEGER, note TEXT)''')
+    conn.execute("CREATE TABLE prices (code TEXT PRIMARY KEY, current_price REAL, manual_cost REAL)")
+    conn.execute('''CREATE TABLE price_targets_v2 (
+        code TEXT PRIMARY KEY, buy_high_point REAL, buy_drop_pct REAL, buy_break_status TEXT,
+        buy_low_after_break REAL, buy_rebound_pct REAL, sell_low_point REAL, sell_rise_pct REAL,
+        sell_break_status TEXT, sell_high_after_break REAL, sell_fallback_pct REAL)''')
+    conn.executemany("INSERT INTO trades VALUES (?,?,?,?,?,?,?)", ledger.itertuples(index=False, name=None))
+    conn.executemany("INSERT INTO prices VALUES (?,?,0)", prices.items())
+    conn.executemany("INSERT INTO price_targets_v2 VALUES (?,?,?,?,?,?,?,?,?,?,?)", targets)
+    conn.commit()
+    return conn
@@ -0,0 +1,468 @@
+"""
+多会话压测：用 streamlit.testing.v1.AppTest 在同一进程里并发驱动 N 个会话，
+按权重混合“切换页面 / 录入交易 / 写日记 / 改现价”等操作。所有会话与真实部署一样
+共用 get_connection() 缓存的同一个连接；行情与 GitHub 接口换成本地模拟（可设延迟）。
+
+    python -m benchmarks.loadtest                                   # 4 个会话 × 每会话 20 次操作
+    python -m benchmarks.loadtest --sessions 8 --actions 50 --mix nav=70,trade=10,journal=10,price=10
+    python -m benchmarks.loadtest --sessions 16 --duration 120 --latency 0.05 --out load.json
+    python -m benchmarks.loadtest --alert-interval 0                # 不启动并发的提醒引擎写入
+
+并发阶段同时运行一个提醒引擎（独立连接的后台线程，与部署时相同），每 --alert-interval 秒
+推入一批在 ×1.5 / ×0.5 之间交替的行情，让规则反复触发、重新待命，持续写 alert_state / alert_log。
+
+报告：各操作 / 各页面的重跑耗时分位数、SQL 执行耗时（与单会话基线对比，膨胀部分即等锁时间）、
+“database is locked”等错误（含提醒引擎的写入）、吞吐（次重跑 / 秒）。数据库是 fixture 的临时副本，不会改动原文件。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, deque
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "app.py")
+FIXTURE_DB = os.path.join(ROOT, "stock_data_v12.db")
+PAGES = ["🏠 股票详情中心", "📊 实时持仓", "💰 盈利账单", "🎯 价格目标管理",
+         "📝 交易录入", "🔔 买卖信号", "📜 历史明细", "📓 复盘日记"]
+DEFAULT_MIX = {"nav": 70, "trade": 10, "journal": 10, "price": 10}
+LOCK_ERRORS = ("database is locked", "Recursive use of cursors", "database table is locked")
+
+
+# ── 模拟外部接口 ────────────────────────────────────────────────────────────
+
+class FakeProviders:
+    """替换 urllib.request.urlopen 与 yfinance.Ticker：东方财富行情 / K 线按 secid 生成随机游走价格，
+    GitHub 读取返回 404（首次上传），写入返回成功；latency / sync_latency 模拟网络耗时"""
+
+    def __init__(self, latency=0.02, sync_latency=0.1, seed=0):
+        self.latency, self.sync_latency = latency, sync_latency
+        self.calls = Counter()
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._prices = {}
+
+    def _price(self, code):
+        with self._lock:
+            p = self._prices.get(code) or 5 + (sum(map(ord, code)) % 200)
+            p = round(max(0.01, p * (1 + self._rnd.gauss(0, 0.002))), 3)
+            self._prices[code] = p
+            return p
+
+    def _json(self, obj, delay):
+        time.sleep(delay)
+        return io.BytesIO(json.dumps(obj).encode())
+
+    def urlopen(self, req, *args, **kwargs):
+        url = req.full_url if isinstance(req, urllib.request.Request) else str(req)
+        method = req.get_method() if isinstance(req, urllib.request.Request) else "GET"
+        host = urllib.parse.urlsplit(url).netloc
+        qs = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        with self._lock:
+            self.calls[host] += 1
+        if "push2his" in host:
+            secid = qs.get("secid", [""])[0]
+            p = self._price(secid.split(".")[-1])
+            bar = f"{datetime.now():%Y-%m-%d},{p},{p},{p},{p},10000"
+            return self._json({"data": {"klines": [bar]}}, self.latency)
+        if "eastmoney" in host:
+            diff = []
+            for secid in ",".join(qs.get("secids", [])).split(","):
+                if "." not in secid:
+                    continue
+                mkt, code = secid.split(".", 1)
+                p = self._price(code)
+                diff.append({"f12": code, "f13": int(mkt), "f2": p, "f18": round(p * 0.99, 3),
+                             "f3": 1.0, "f124": int(time.time())})
+            return self._json({"data": {"diff": diff}}, self.latency)
+        if "github" in host:
+            if method == "PUT":
+                return self._json({"commit": {"sha": "loadtest"}}, self.sync_latency)
+            time.sleep(self.sync_latency)
+            raise urllib.error.HTTPError(url, 404, "Not Found", {}, None)
+        raise urllib.error.URLError(f"loadtest: no simulated provider for {host}")
+
+    @contextlib.contextmanager
+    def install(self):
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch("urllib.request.urlopen", self.urlopen))
+            try:
+                import yfinance
+                # 东方财富模拟覆盖了全部 secid，yfinance 兜底只会在缺代码时触发：返回空表
+                fake = mock.MagicMock()
+                fake.return_value.history.side_effect = lambda *a, **k: pd.DataFrame()
+                stack.enter_context(mock.patch.object(yfinance, "Ticker", fake))
+            except ImportError:
+                pass
+            yield self
+
+
+# ── AppTest 并发适配 ────────────────────────────────────────────────────────
+
+@contextlib.contextmanager
+def shared_runtime():
+    """
+    AppTest 每次运行都会替换全局 Runtime._instance 并新建 ScriptCache（重新编译脚本），
+    并发时互相覆盖，编译也会撞上 ast 的线程问题。这里让所有会话共用一个模拟运行时和
+    一份编译缓存，相当于真实服务器里的单个 Runtime。
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    runtime = mock.MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    try:
+        from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+        runtime.dataframe_source_mgr = DataframeSourceManager()
+    except ImportError:
+        pass
+    script_cache = ScriptCache()
+    saved = Runtime._instance
+    Runtime._instance = runtime
+    config.set_option("global.appTest", True)
+    config.set_option("logger.level", "error")        # 屏蔽弃用提示等控制台噪音
+    try:
+        # app_test 里对 Runtime._instance 的赋值落在这个替身类上，不再影响真正的单例
+        with mock.patch.object(app_test, "Runtime", type("Runtime", (), {})), \
+                mock.patch.object(app_test, "ScriptCache", lambda: script_cache), \
+                mock.patch.object(local_script_runner, "ScriptCache", lambda: script_cache):
+            yield
+    finally:
+        Runtime._instance = saved
+
+
+# ── 会话 ────────────────────────────────────────────────────────────────────
+
+class Session:
+    """一个模拟用户：独立的 AppTest（独立 session_state），按权重随机执行操作"""
+
+    def __init__(self, idx, mix, seed, timeout, think, stocks, prices):
+        from streamlit.testing.v1 import AppTest
+        self.idx, self.timeout, self.think = idx, timeout, think
+        self.rnd = random.Random(seed * 1000 + idx)
+        self.kinds, self.weights = zip(*mix.items())
+        self.stocks, self.prices = stocks, prices
+        self.at = AppTest.from_file(APP, default_timeout=timeout)
+        self.page = PAGES[0]
+        self.samples = []          # (操作, 页面, 秒, ok)
+        self.errors = []           # (操作, 页面, 信息)
+
+    def _run(self, kind, fn):
+        t0 = time.perf_counter()
+        ok = True
+        try:
+            fn()
+        except Exception as e:
+            ok = False
+            self.errors.append((kind, self.page, f"{type(e).__name__}: {e}"[:300]))
+        sec = time.perf_counter() - t0
+        if ok:
+            for ex in self.at.exception:
+                ok = False
+                self.errors.append((kind, self.page, str(ex.value)[:300]))
+        self.samples.append((kind, self.page, sec, ok))
+        return ok
+
+    def _goto(self, page):
+        """切到目标页面（切换本身记作一次 nav）；失败时返回 False"""
+        if self.page == page:
+            return True
+        self.page = page
+        return self._run("nav", lambda: self.at.sidebar.radio[0].set_value(page).run())
+
+    def open(self):
+        self._run("open", self.at.run)
+
+    def nav(self):
+        page = self.rnd.choice([p for p in PAGES if p != self.page])
+        self._goto(page)
+
+    def trade(self):
+        def act():
+            stock = self.rnd.choice(self.stocks)
+            next(w for w in self.at.selectbox if w.label == "选择股票").set_value(stock).run()
+            price = self.prices.get(stock) or 10.0
+            nums = {w.label: w for w in self.at.number_input}
+            nums["成交单价"].set_value(round(price * (1 + self.rnd.uniform(-0.02, 0.02)), 3))
+            nums["成交数量"].set_value(self.rnd.choice([100, 200, 500]))
+            next(b for b in self.at.button if b.label == "✅ 保存交易记录").click().run()
+        if self._goto("📝 交易录入"):
+            self._run("trade", act)
+
+    def journal(self):
+        def act():
+            self.at.selectbox(key="new_journal_stock").set_value("大盘")
+            self.at.text_area(key="new_journal_content").set_value(f"loadtest #{self.idx} {time.time():.0f}")
+            next(b for b in self.at.button if b.label == "📌 存档").click().run()
+        if self._goto("📓 复盘日记"):
+            self._run("journal", act)
+
+    def price(self):
+        def act():
+            # 批量编辑表（st.data_editor）AppTest 不能直接操作：按编辑表的状态格式写入一格改动，再点保存
+            save = next((b for b in self.at.button if b.label == "💾 保存全部修改"), None)
+            if save is None or not self.stocks:
+                return
+            row = self.rnd.randrange(len(self.stocks))
+            price = self.prices.get(self.stocks[row]) or 10.0
+            key = f"price_editor_{self.at.session_state['price_editor_rev'] if 'price_editor_rev' in self.at.session_state else 0}"
+            self.at.session_state[key] = {"edited_rows": {row: {"现价": round(price * (1 + self.rnd.uniform(-0.01, 0.01)), 4)}},
+                                          "added_rows": [], "deleted_rows": []}
+            save.click().run()
+        if self._goto("📊 实时持仓"):
+            self._run("price", act)
+
+    def step(self):
+        getattr(self, self.rnd.choices(self.kinds, self.weights)[0])()
+        if self.think:
+            time.sleep(self.rnd.expovariate(1 / self.think))
+
+
+# ── 提醒引擎 ────────────────────────────────────────────────────────────────
+
+class AlertWriter:
+    """并发阶段的提醒引擎写入方：真实的 AlertEngine 线程 + 一个按间隔推行情的线程，记录每批的成败"""
+
+    def __init__(self, db_path, prices, interval):
+        from stock21.alerts import AlertEngine
+
+        writer = self
+
+        class _Engine(AlertEngine):
+            def process(self, prices, conn=None):
+                try:
+                    sent = super().process(prices, conn)
+                except Exception as e:
+                    writer.errors.append(("alert", "提醒引擎", f"{type(e).__name__}: {e}"[:300]))
+                    raise
+                writer.batches += 1
+                return sent
+
+        self.engine = _Engine(db_path, [])
+        self.prices = {k: v for k, v in prices.items() if v and v > 0}
+        self.interval = interval
+        self.batches = 0
+        self.errors = []           # (操作, 页面, 信息)，与会话的错误同格式
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _feed(self):
+        n = 0
+        while not self._stop.wait(self.interval):
+            k = 1.5 if n % 2 == 0 else 0.5
+            self.engine.submit({code: p * k for code, p in self.prices.items()})
+            n += 1
+
+    def start(self):
+        self.engine.start()
+        self._thread = threading.Thread(target=self._feed, name="alert-feed", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.engine.stop(timeout=30)
+
+
+# ── 执行与汇总 ──────────────────────────────────────────────────────────────
+
+def _pct(values):
+    if not values:
+        return {"n": 0}
+    a = np.asarray(values)
+    return {"n": len(a), "p50": float(np.percentile(a, 50)), "p95": float(np.percentile(a, 95)),
+            "p99": float(np.percentile(a, 99)), "max": float(a.max()), "mean": float(a.mean())}
+
+
+def _sql_times(recorder):
+    with recorder.lock:
+        return [q[2] for q in recorder.queries if q[3] == "execute"]
+
+
+def drive(sessions, actions, duration, barrier=None):
+    """并发执行：每个会话一个线程，先打开首页；之后 duration 秒到期或每会话 actions 次后停止"""
+
+    def loop(s):
+        s.open()
+        if barrier is not None:
+            barrier.wait()
+        deadline = time.perf_counter() + duration if duration else None
+        n = 0
+        while (deadline is None and n < actions) or (deadline is not None and time.perf_counter() < deadline):
+            s.step()
+            n += 1
+
+    threads = [threading.Thread(target=loop, args=(s,), name=f"session-{s.idx}", daemon=True) for s in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run(n_sessions=4, actions=20, duration=None, mix=None, latency=0.02, sync_latency=0.1,
+        think=0.0, timeout=120, seed=0, db=FIXTURE_DB, baseline_actions=10, verbose=False, alert_interval=0.2):
+    from stock21.diag import RECORDER
+
+    mix = mix or DEFAULT_MIX
+    tmp = tempfile.mkdtemp(prefix="stock21_load_")
+    shutil.copy(db, os.path.join(tmp, "stock_data_v12.db"))
+    with sqlite3.connect(os.path.join(tmp, "stock_data_v12.db")) as c:
+        stocks = sorted({r[0] for r in c.execute("SELECT DISTINCT code FROM trades WHERE code IS NOT NULL")})
+        prices = dict(c.execute("SELECT code, current_price FROM prices"))
+    env = {"STREAMLIT_DATA_DIR": tmp, "GITHUB_TOKEN": "loadtest", "REPO_URL": "https://github.com/loadtest/stock21.git",
+           "METRICS_PORT": "0", "ALERT_FILE": os.path.join(tmp, "alerts.jsonl")}
+    providers = FakeProviders(latency, sync_latency, seed)
+    out = io.StringIO()
+    make = lambda i: Session(i, mix, seed, timeout, think, stocks, prices)
+    alerts = None
+
+    try:
+        with mock.patch.dict(os.environ, env), providers.install(), shared_runtime(), \
+                contextlib.redirect_stdout(sys.stdout if verbose else out):
+            # 单会话基线：同样的操作混合，无并发，得到 SQL 执行耗时的无竞争分布
+            with RECORDER.lock:
+                RECORDER.queries = deque(maxlen=500_000)     # 默认只留最近 5000 条，压测需要全部
+            base = make(-1)
+            drive([base], baseline_actions, None)
+            baseline_sql = _sql_times(RECORDER)
+            RECORDER.reset()
+
+            sessions = [make(i) for i in range(n_sessions)]
+            barrier = threading.Barrier(n_sessions + 1)
+            t = threading.Thread(target=drive, args=(sessions, actions, duration, barrier), daemon=True)
+            t.start()
+            barrier.wait()                 # 所有会话打开首页后再开始计时
+            t0 = time.perf_counter()
+            if alert_interval:
+                alerts = AlertWriter(os.path.join(tmp, "stock_data_v12.db"), prices, alert_interval).start()
+            t.join()
+            wall = time.perf_counter() - t0
+            if alerts:
+                alerts.stop()
+            load_sql = _sql_times(RECORDER)
+            reruns = list(RECORDER.reruns)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    samples = [x for s in sessions for x in s.samples if x[0] != "open"]
+    errors = [e for s in sessions for e in s.errors] + (alerts.errors if alerts else [])
+    by_kind, by_page = {}, {}
+    for kind, page, sec, _ in samples:
+        by_kind.setdefault(kind, []).append(sec)
+        by_page.setdefault(page, []).append(sec)
+    base_p, load_p = _pct(baseline_sql), _pct(load_sql)
+    script_runs = [r for r in reruns if r["status"] == "ok"]
+    return {
+        "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "config": {"sessions": n_sessions, "actions": actions, "duration": duration, "mix": mix,
+                   "latency": latency, "sync_latency": sync_latency, "think": think, "seed": seed,
+                   "alert_interval": alert_interval},
+        "wall_s": wall,
+        "operations": len(samples),
+        "script_reruns": len(script_runs),
+        "throughput_ops_s": len(samples) / wall if wall else 0.0,
+        "throughput_reruns_s": len(script_runs) / wall if wall else 0.0,
+        "latency": {"all": _pct([x[2] for x in samples]),
+                    "by_action": {k: _pct(v) for k, v in by_kind.items()},
+                    "by_page": {k: _pct(v) for k, v in by_page.items()}},
+        "sql": {"baseline": base_p, "load": load_p,
+                # 等锁时间估计：并发下每条语句比基线多出的平均耗时 × 语句数
+                "lock_wait_s": max(0.0, (load_p.get("mean", 0) - base_p.get("mean", 0))) * load_p["n"]},
+        "errors": {"total": len(errors),
+                   "lock": sum(any(m in e[2] for m in LOCK_ERRORS) for e in errors),
+                   "by_message": Counter(e[2] for e in errors).most_common(10)},
+        "alert_batches": alerts.batches if alerts else 0,
+        "provider_calls": dict(providers.calls),
+    }
+
+
+def _print_report(r):
+    ms = lambda v: f"{v * 1000:>9.1f}"
+    head = f"  {'':<16}{'次数':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'最大':>10}  (ms)"
+    row = lambda name, p: (f"  {name:<16}{p['n']:>6}{ms(p['p50'])}{ms(p['p95'])}{ms(p['p99'])}{ms(p['max'])}"
+                           if p["n"] else f"  {name:<16}{0:>6}")
+    cfg = r["config"]
+    print(f"\n== {cfg['sessions']} 个会话，{r['operations']} 次操作，{r['wall_s']:.1f}s")
+    print(f"   吞吐 {r['throughput_ops_s']:.2f} 次操作/s，{r['throughput_reruns_s']:.2f} 次重跑/s")
+    if cfg.get("alert_interval"):
+        print(f"   提醒引擎并发写入 {r['alert_batches']} 批（每 {cfg['alert_interval']}s 推一批行情）")
+    print("\n重跑耗时（按操作）\n" + head)
+    print(row("全部", r["latency"]["all"]))
+    for k, p in r["latency"]["by_action"].items():
+        print(row(k, p))
+    print("\n重跑耗时（按页面）\n" + head)
+    for k, p in sorted(r["latency"]["by_page"].items(), key=lambda kv: -kv[1].get("p95", 0)):
+        print(row(k, p))
+    print("\nSQL 执行耗时\n" + head)
+    print(row("单会话基线", r["sql"]["baseline"]))
+    print(row("并发", r["sql"]["load"]))
+    print(f"  估计等锁 {r['sql']['lock_wait_s']:.2f}s")
+    e = r["errors"]
+    print(f"\n错误 {e['total']}（其中锁冲突 {e['lock']}）")
+    for msg, n in e["by_message"]:
+        print(f"  {n:>5} × {msg}")
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        k, _, v = part.partition("=")
+        if k.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"未知操作：{k}（可选 {', '.join(DEFAULT_MIX)}）")
+        mix[k.strip()] = float(v or 1)
+    return mix
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.loadtest", description="多会话压测（AppTest）")
+    ap.add_argument("--sessions", type=int, default=4, help="并发会话数")
+    ap.add_argument("--actions", type=int, default=20, help="每个会话的操作次数")
+    ap.add_argument("--duration", type=float, help="按时长运行（秒），优先于 --actions")
+    ap.add_argument("--mix", type=_parse_mix, default=DEFAULT_MIX, help="操作权重，如 nav=70,trade=10,journal=10,price=10")
+    ap.add_argument("--latency", type=float, default=0.02, help="模拟行情接口耗时（秒）")
+    ap.add_argument("--sync-latency", type=float, default=0.1, help="模拟 GitHub 同步耗时（秒）")
+    ap.add_argument("--think", type=float, default=0.0, help="操作间平均思考时间（秒，指数分布）")
+    ap.add_argument("--baseline-actions", type=int, default=10, help="单会话基线的操作次数")
+    ap.add_argument("--alert-interval", type=float, default=0.2, help="提醒引擎推行情的间隔（秒），0 不启动")
+    ap.add_argument("--timeout", type=float, default=120, help="单次重跑超时（秒）")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--db", default=FIXTURE_DB, help="fixture 数据库（复制后使用）")
+    ap.add_argument("--out", help="结果写入 JSON")
+    ap.add_argument("--verbose", action="store_true", help="显示应用自身的输出")
+    args = ap.parse_args(argv)
+
+    r = run(args.sessions, args.actions, args.duration, args.mix, args.latency, args.sync_latency, args.think,
+            args.timeout, args.seed, args.db, args.baseline_actions, args.verbose, args.alert_interval)
+    _print_report(r)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False, indent=1)
+        print(f"\n结果已写入 {args.out}")
+    return 1 if r["errors"]["total"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+合成账本基准测试。
+
+    python -m benchmarks.run                          # 默认规模，结果写入 benchmarks/results/<commit>.json
+    python -m benchmarks.run --sizes 1000x10,100000x1000 --kernels baseline_holdings_pairing
+    python -m benchmarks.run --compare benchmarks/results/abc1234.json [新结果.json] --threshold 0.2
+
+规模写作 成交笔数x股票数。某内核在较小规模上单次超过 --budget 秒后，更大的规模直接记为 skipped
+（页面里的配对循环是平方级的，百万笔时跑不完）。--compare 对比两份结果，
+最快一次耗时变慢超过阈值（且绝对差超过 --floor 秒，过滤噪声）即视为回退，退出码为 1。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.kernels import KERNELS
+from benchmarks.ledger import make_ledger, make_prices, make_price_targets, make_db
+from stock21.ledger import Ledger
+from stock21.returns import _flow_matrix
+
+DEFAULT_SIZES = [(10, 10), (1_000, 10), (10_000, 100), (100_000, 1_000), (1_000_000, 1_000)]
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _parse_sizes(text):
+    return [tuple(int(x) for x in part.lower().split("x")) for part in text.split(",") if part.strip()]
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(__file__)).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def build_context(n_trades, n_symbols, seed):
+    ledger = make_ledger(n_trades, n_symbols, seed)
+    prices = make_prices(ledger, seed)
+    conn = make_db(ledger, prices, make_price_targets(prices, seed))
+    signed = ledger["action"].map({"买入": 1.0, "卖出": -1.0})
+    flows = pd.DataFrame({"key": ledger["code"], "date": pd.to_datetime(ledger["date"]),
+                          "amount": -signed * ledger["price"] * ledger["quantity"]})
+    qty = (signed * ledger["quantity"]).groupby(ledger["code"]).sum()
+    terminal = pd.DataFrame({"key": qty.index, "date": flows["date"].max() + pd.Timedelta(days=1),
+                             "amount": qty * qty.index.map(prices)})
+    amounts, years, _ = _flow_matrix(pd.concat([flows, terminal], ignore_index=True))
+    return {
+        "ledger": ledger, "prices": prices, "config": {k: (v, 0.0) for k, v in prices.items()},
+        "conn": conn, "top_code": ledger["code"].value_counts().index[0], "search": "股票00",
+        "flow_amounts": amounts, "flow_years": years,
+        "shared_ledger": Ledger(ledger.assign(_rowid=np.arange(1, len(ledger) + 1))),
+    }
+
+
+def time_kernel(fn, ctx, min_time=0.2, max_repeats=5):
+    """先跑一次；单次很快时再重复，直到累计 min_time 秒或 max_repeats 次"""
+    runs = []
+    while True:
+        t0 = time.perf_counter()
+        fn(ctx)
+        runs.append(time.perf_counter() - t0)
+        if len(runs) >= max_repeats or sum(runs) >= min_time:
+            return runs
+
+
+def run(sizes, kernels, seed=0, budget=5.0, log=print):
+    results, over = [], set()
+    for n_trades, n_symbols in sizes:
+        t0 = time.perf_counter()
+        ctx = build_context(n_trades, n_symbols, seed)
+        log(f"== {n_trades} 笔 × {n_symbols} 只（生成 {time.perf_counter() - t0:.2f}s）")
+        for name in kernels:
+            row = {"kernel": name, "trades": n_trades, "symbols": n_symbols}
+            if name in over:
+                row.update(status="skipped")
+            else:
+                runs = time_kernel(KERNELS[name], ctx)
+                row.update(status="ok", median_s=statistics.median(runs), min_s=min(runs), repeats=len(runs))
+                if min(runs) > budget:
+                    over.add(name)
+            results.append(row)
+            log(f"   {name:<30} " + (f"{row['median_s'] * 1000:>12.3f} ms" if row["status"] == "ok" else "     skipped"))
+        ctx["conn"].close()
+    return results
+
+
+def compare(base, new, threshold=0.2, floor=0.0005):
+    """按最快一次耗时比较（比中位数受机器抖动影响小），返回 [(kernel, trades, symbols, base_s, new_s, ratio, regressed)]"""
+    key = lambda r: (r["kernel"], r["trades"], r["symbols"])
+    old = {key(r): r for r in base["results"] if r["status"] == "ok"}
+    out = []
+    for r in new["results"]:
+        b = old.get(key(r))
+        if r["status"] != "ok" or b is None:
+            continue
+        ratio = r["min_s"] / b["min_s"] if b["min_s"] > 0 else float("inf")
+        regressed = ratio > 1 + threshold and r["min_s"] - b["min_s"] > floor
+        out.append(key(r) + (b["min_s"], r["min_s"], ratio, regressed))
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.run", description="合成账本基准测试")
+    ap.add_argument("--sizes", type=_parse_sizes, default=DEFAULT_SIZES, help="如 1000x10,100000x1000")
+    ap.add_argument("--kernels", default=",".join(KERNELS), help="逗号分隔，默认全部：" + ",".join(KERNELS))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--budget", type=float, default=5.0, help="单次超过该秒数后跳过更大规模")
+    ap.add_argument("--out", help="结果文件，默认 benchmarks/results/<commit>.json")
+    ap.add_argument("--compare", nargs="+", metavar="JSON", help="基线结果 [新结果]；只给基线时先跑一遍再比较")
+    ap.add_argument("--threshold", type=float, default=0.2, help="变慢超过该比例视为回退（默认 0.2 = 20%%）")
+    ap.add_argument("--floor", type=float, default=0.0005, help="绝对差小于该秒数不算回退")
+    args = ap.parse_args(argv)
+
+    if args.compare and len(args.compare) > 1:
+        with open(args.compare[1], encoding="utf-8") as f:
+            new = json.load(f)
+    else:
+        kernels = [k.strip() for k in args.kernels.split(",") if k.strip()]
+        unknown = [k for k in kernels if k not in KERNELS]
+        if unknown:
+            ap.error(f"未知内核：{', '.join(unknown)}")
+        new = {"commit": _commit(), "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+               "python": platform.python_version(), "pandas": pd.__version__, "machine": platform.machine(),
+               "cpus": os.cpu_count(), "workers": os.getenv("STOCK21_WORKERS"),
+               "seed": args.seed, "results": run(args.sizes, kernels, args.seed, args.budget)}
+        out = args.out or os.path.join(RESULTS_DIR, f"{new['commit']}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(new, f, ensure_ascii=False, indent=1)
+        print(f"结果已写入 {out}")
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            base = json.load(f)
+        rows = compare(base, new, args.threshold, args.floor)
+        print(f"\n对比 {base.get('commit')} → {new.get('commit')}（阈值 {args.threshold:.0%}）")
+        for kernel, n, s, b, x, ratio, bad in rows:
+            print(f"  {'❌' if bad else '  '} {kernel:<30} {n:>9}×{s:<5} {b * 1000:>11.3f} → {x * 1000:>11.3f} ms  ×{ratio:.2f}")
+        if any(r[-1] for r in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+"""股票管理系统的无界面计算模块（不依赖 Streamlit，可在 app.py 之外单独导入）"""
@@ -0,0 +1,6 @@
+"""python -m stock21 <子命令>：见 stock21.cli"""
+import sys
+
+from stock21.cli import main
+
+sys.exit(main())
@@ -0,0 +1,325 @@
+"""
+提醒引擎：每批行情对 signals / strategy_notes / price_targets_v2 的全部规则做一次批量判断，
+越过阈值的规则通过可插拔的投递通道（webhook / SMTP / 文件）发出。
+  去重：规则触发后即解除待命，价格回到阈值另一侧超过回差（hysteresis）才重新待命；
+  限流：同一规则在冷却时间内不重复发送，全局每分钟发送条数有上限，超出的记为 suppressed。
+"""
+import json
+import queue
+import smtplib
+import sqlite3
+import threading
+import time
+import urllib.request
+from collections import deque
+from datetime import datetime
+from email.mime.text import MIMEText
+
+DEFAULT_HYSTERESIS_PCT = 0.5    # 回差：越过阈值后需反向回撤这么多（百分点）才重新待命
+DEFAULT_COOLDOWN_S = 1800       # 同一规则两次发送的最短间隔
+DEFAULT_MAX_PER_MINUTE = 20     # 全局每分钟最多发送条数
+DB_TIMEOUT_S = 15               # 引擎连接的 busy timeout：页面连接正在写时等待而不是报 database is locked
+
+
+def ensure_alert_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS alert_state (
+        rule TEXT PRIMARY KEY, armed INTEGER DEFAULT 1, last_fired_at REAL, last_excess REAL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS alert_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, rule TEXT, code TEXT, side TEXT, message TEXT,
+        price REAL, threshold REAL, status TEXT, created_at TEXT)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alert_log_created ON alert_log (created_at)")
+    conn.commit()
+
+
+# ── 规则判断 ────────────────────────────────────────────────────────────────
+# 每条规则给出 excess：价格越过阈值的幅度（百分点，>= 0 即触发，负数表示离阈值还差多少）
+
+def _pct_above(price, thr):
+    return (price - thr) / thr * 100
+
+
+def _pct_below(price, thr):
+    return (thr - price) / thr * 100
+
+
+def evaluate_rules(conn, prices: dict) -> list:
+    """
+    一次批量判断全部规则（每张表一次查询）。prices: {股票名称: 现价}
+    返回 [{rule, code, side, excess, price, threshold, message}, ...]
+    """
+    out = []
+
+    def add(rule, code, side, excess, price, thr, msg):
+        out.append({"rule": rule, "code": code, "side": side, "excess": excess,
+                    "price": price, "threshold": thr, "message": msg})
+
+    # 🔔 买卖信号：自低点上涨 ≥ up_threshold 建议卖出；自高点回调 ≥ down_threshold 建议买入
+    for code, hp, lp, up_th, down_th in conn.execute(
+            "SELECT code, high_point, low_point, up_threshold, down_threshold FROM signals"):
+        p = prices.get(code)
+        if not p or p <= 0:
+            continue
+        if lp and lp > 0 and up_th:
+            rise = _pct_above(p, lp)
+            add(f"signal:{code}:sell", code, "卖出", rise - up_th, p, lp * (1 + up_th / 100),
+                f"🟢 {code} 自低点 {lp:.3f} 上涨 {rise:.2f}%（≥ {up_th:.2f}%），建议卖出")
+        if hp and hp > 0 and down_th:
+            drop = _pct_below(p, hp)
+            add(f"signal:{code}:buy", code, "买入", drop - down_th, p, hp * (1 - down_th / 100),
+                f"🔴 {code} 自高点 {hp:.3f} 回调 {drop:.2f}%（≥ {down_th:.2f}%），建议买入")
+
+    # 🧠 买卖监控：基准价 × (1 - 下跌%) 买入达标；基准价 × (1 + 上涨%) 卖出达标
+    for code, bb, bd, sb, sr in conn.execute(
+            "SELECT code, buy_base_price, buy_drop_pct, sell_base_price, sell_rise_pct FROM strategy_notes"):
+        p = prices.get(code)
+        if not p or p <= 0:
+            continue
+        if bb and bb > 0:
+            thr = bb * (1 - (bd or 0) / 100)
+            add(f"monitor:{code}:buy", code, "买入", _pct_below(p, thr), p, thr,
+                f"🟢 {code} 买入监控达标：现价 {p:.3f} ≤ {thr:.3f}")
+        if sb and sb > 0:
+            thr = sb * (1 + (sr or 0) / 100)
+            add(f"monitor:{code}:sell", code, "卖出", _pct_above(p, thr), p, thr,
+                f"🔴 {code} 卖出监控达标：现价 {p:.3f} ≥ {thr:.3f}")
+
+    # 🎯 价格目标：未突破时盯基准价，已突破后盯反弹 / 回落目标
+    try:
+        rows = conn.execute(
+            """SELECT code, buy_high_point, buy_drop_pct, buy_break_status, buy_low_after_break, buy_rebound_pct,
+                      sell_low_point, sell_rise_pct, sell_break_status, sell_high_after_break, sell_fallback_pct
+               FROM price_targets_v2""").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    for code, bhp, bdp, bbs, blb, brb, slp, srp, sbs, shb, sfb in rows:
+        p = prices.get(code)
+        if not p or p <= 0:
+            continue
+        if bhp and bdp:
+            if bbs == "已突破" and blb:
+                thr = blb * (1 + (brb or 0) / 100)
+                add(f"target:{code}:buy_rebound", code, "买入", _pct_above(p, thr), p, thr,
+                    f"📥 {code} 自突破后低点 {blb:.3f} 反弹至 {p:.3f}（目标 {thr:.3f}）")
+            elif bbs != "已突破":
+                thr = bhp * (1 - bdp / 100)
+                add(f"target:{code}:buy_break", code, "买入", _pct_below(p, thr), p, thr,
+                    f"📥 {code} 跌破买入基准价 {thr:.3f}（现价 {p:.3f}）")
+        if slp and srp:
+            if sbs == "已突破" and shb:
+                thr = shb * (1 - (sfb or 0) / 100)
+                add(f"target:{code}:sell_fallback", code, "卖出", _pct_below(p, thr), p, thr,
+                    f"📤 {code} 自突破后高点 {shb:.3f} 回落至 {p:.3f}（目标 {thr:.3f}）")
+            elif sbs != "已突破":
+                thr = slp * (1 + srp / 100)
+                add(f"target:{code}:sell_break", code, "卖出", _pct_above(p, thr), p, thr,
+                    f"📤 {code} 突破卖出基准价 {thr:.3f}（现价 {p:.3f}）")
+    return out
+
+
+# ── 投递通道 ────────────────────────────────────────────────────────────────
+
+class WebhookSink:
+    """POST JSON 到 webhook（本机服务、企业微信 / 钉钉机器人等）"""
+    name = "webhook"
+
+    def __init__(self, url: str, timeout: float = 5):
+        self.url, self.timeout = url, timeout
+
+    def send(self, alerts: list):
+        body = json.dumps({"alerts": alerts, "text": "\n".join(a["message"] for a in alerts)},
+                          ensure_ascii=False).encode("utf-8")
+        req = urllib.request.Request(self.url, data=body, method="POST",
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            resp.read()
+
+
+class SmtpSink:
+    """一批提醒合成一封邮件；本地调试可指向 `python -m aiosmtpd -n -l localhost:1025` 之类的替身服务"""
+    name = "smtp"
+
+    def __init__(self, host: str, port: int, sender: str, recipients: list,
+                 user: str = None, password: str = None, timeout: float = 10):
+        self.host, self.port, self.sender, self.recipients = host, int(port), sender, recipients
+        self.user, self.password, self.timeout = user, password, timeout
+
+    def send(self, alerts: list):
+        msg = MIMEText("\n".join(a["message"] for a in alerts), "plain", "utf-8")
+        msg["Subject"] = f"股票提醒 · {len(alerts)} 条"
+        msg["From"], msg["To"] = self.sender, ", ".join(self.recipients)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as s:
+            if self.user:
+                s.starttls()
+                s.login(self.user, self.password)
+            s.sendmail(self.sender, self.recipients, msg.as_string())
+
+
+class FileSink:
+    """逐条追加 JSON Lines，可被其他进程 tail 消费"""
+    name = "file"
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def send(self, alerts: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for a in alerts:
+                f.write(json.dumps(a, ensure_ascii=False) + "\n")
+
+
+def build_sinks(cfg: dict) -> list:
+    """按配置组装通道：webhook_url / smtp_host, smtp_port, smtp_from, smtp_to, smtp_user, smtp_password / file_path"""
+    sinks = []
+    if cfg.get("webhook_url"):
+        sinks.append(WebhookSink(cfg["webhook_url"]))
+    if cfg.get("smtp_host") and cfg.get("smtp_to"):
+        sinks.append(SmtpSink(cfg["smtp_host"], cfg.get("smtp_port") or 25,
+                              cfg.get("smtp_from") or "stock21@localhost",
+                              [x.strip() for x in str(cfg["smtp_to"]).split(",") if x.strip()],
+                              cfg.get("smtp_user"), cfg.get("smtp_password")))
+    if cfg.get("file_path"):
+        sinks.append(FileSink(cfg["file_path"]))
+    return sinks
+
+
+# ── 引擎 ────────────────────────────────────────────────────────────────────
+
+class AlertEngine:
+    """
+    后台线程消费行情批次（submit 推入，或按 poll_interval 调 fetch(conn) 主动拉取），
+    使用独立的数据库连接（busy timeout 为 DB_TIMEOUT_S），只写 alert_state / alert_log：
+    规则判断、读状态都在事务外完成，写入事务只含这两张表的批量写，投递（网络）在提交之后
+    """
+
+    def __init__(self, db_path: str, sinks: list, fetch=None, poll_interval: float = 0,
+                 hysteresis_pct: float = DEFAULT_HYSTERESIS_PCT, cooldown_s: float = DEFAULT_COOLDOWN_S,
+                 max_per_minute: int = DEFAULT_MAX_PER_MINUTE):
+        self.db_path, self.sinks = db_path, sinks
+        self.fetch, self.poll_interval = fetch, poll_interval
+        self.hysteresis_pct, self.cooldown_s, self.max_per_minute = hysteresis_pct, cooldown_s, max_per_minute
+        self._inbox = queue.Queue(maxsize=16)
+        self._sent_ts = deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+
+    # ---- 线程 ----
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="alert-engine", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        self._inbox.put(None)
+        if self._thread:
+            self._thread.join(timeout)
+
+    def submit(self, prices: dict):
+        """推入一批行情（不阻塞；积压时丢弃最旧一批，只评估最新行情）"""
+        if not prices:
+            return
+        try:
+            self._inbox.put_nowait(dict(prices))
+        except queue.Full:
+            try:
+                self._inbox.get_nowait()
+            except queue.Empty:
+                pass
+            self._inbox.put_nowait(dict(prices))
+
+    def _run(self):
+        self._conn = sqlite3.connect(self.db_path, timeout=DB_TIMEOUT_S)
+        ensure_alert_tables(self._conn)
+        last_poll = time.monotonic()
+        while not self._stop.is_set():
+            wait = None
+            if self.fetch and self.poll_interval:
+                wait = max(0.0, self.poll_interval - (time.monotonic() - last_poll))
+            try:
+                prices = self._inbox.get(timeout=wait)
+            except queue.Empty:
+                prices = None
+                last_poll = time.monotonic()
+                try:
+                    prices = self.fetch(self._conn)
+                except Exception as e:
+                    print(f"[alerts] poll failed: {e}")
+            if self._stop.is_set():
+                break
+            if prices:
+                try:
+                    self.process(prices)
+                except Exception as e:
+                    print(f"[alerts] process failed: {e}")
+        self._conn.close()
+
+    # ---- 单批处理 ----
+    def _allow(self, now: float) -> bool:
+        """全局限流：滑动 60 秒窗口"""
+        while self._sent_ts and now - self._sent_ts[0] > 60:
+            self._sent_ts.popleft()
+        if len(self._sent_ts) >= self.max_per_minute:
+            return False
+        self._sent_ts.append(now)
+        return True
+
+    def process(self, prices: dict, conn=None) -> list:
+        """对一批行情判断全部规则、更新待命状态、记日志并投递；返回本批发送的提醒"""
+        conn = conn or self._conn
+        conds = evaluate_rules(conn, prices)
+        if not conds:
+            return []
+        state = {r[0]: (r[1], r[2]) for r in conn.execute("SELECT rule, armed, last_fired_at FROM alert_state")}
+        now = time.time()
+        now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        state_rows, log_rows, to_send = [], [], []
+        for c in conds:
+            old = state.get(c["rule"], (1, None))
+            armed, last_fired = old
+            if c["excess"] >= 0 and armed:
+                armed = 0
+                if last_fired and now - last_fired < self.cooldown_s:
+                    status = "suppressed"
+                elif not self._allow(now):
+                    status = "suppressed"
+                else:
+                    status, last_fired = "sent", now
+                    to_send.append(dict(c, created_at=now_str))
+                log_rows.append((c["rule"], c["code"], c["side"], c["message"], c["price"], c["threshold"], status, now_str))
+            elif c["excess"] <= -self.hysteresis_pct and not armed:
+                armed = 1
+            # 只落库待命 / 冷却状态有变化的规则；last_excess 记的是状态变化那一刻的越线幅度
+            if (armed, last_fired) != old:
+                state_rows.append((c["rule"], armed, last_fired, c["excess"]))
+        if not state_rows and not log_rows:
+            return []
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO alert_state (rule, armed, last_fired_at, last_excess) VALUES (?,?,?,?)",
+                             state_rows)
+            if log_rows:
+                conn.executemany("""INSERT INTO alert_log (rule, code, side, message, price, threshold, status, created_at)
+                                    VALUES (?,?,?,?,?,?,?,?)""", log_rows)
+        if to_send:
+            self._deliver(conn, to_send, now_str)
+        return to_send
+
+    def _deliver(self, conn, alerts: list, created_at: str):
+        ok = 0
+        for sink in self.sinks:
+            try:
+                sink.send(alerts)
+                ok += 1
+            except Exception as e:
+                print(f"[alerts] {sink.name} failed: {e}")
+        if self.sinks and not ok:
+            with conn:
+                conn.executemany("UPDATE alert_log SET status = 'failed' WHERE rule = ? AND created_at = ?",
+                                 [(a["rule"], created_at) for a in alerts])
+
+
+def recent_alerts(conn, limit: int = 50) -> list:
+    return conn.execute(
+        "SELECT created_at, code, side, message, status FROM alert_log ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
@@ -0,0 +1,230 @@
+"""
+只读 JSON API（可选，随 app 或命令行启动）：持仓、未平仓批次、成交配对、盈亏、价格目标、信号状态。
+
+    GET /api                      端点列表
+    GET /api/positions[?code=..]  当前持仓             GET /api/lots[?code=..]    未平仓批次
+    GET /api/pairs[?code=..]      已配对成交           GET /api/pnl[?code=..]     逐股盈亏与合计
+    GET /api/targets              价格目标与当前状态   GET /api/signals           买卖信号、规则触发与提醒待命状态
+
+持仓 / 批次 / 配对 / 盈亏可加 ?policy=fifo|lifo|hifo|average 切换配对规则（默认最低成本优先）。
+
+用只读连接访问数据库，不与页面争写锁。数据版本取 PRAGMA data_version（其他连接 / 进程每次提交都会变化，
+查询本身几乎无开销）：同一版本下的响应整体缓存在进程内，ETag 即版本号，带 If-None-Match 的轮询直接回 304。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from stock21.alerts import evaluate_rules
+from stock21.archive import history_table
+from stock21.matching import match, POLICIES, DEFAULT_POLICY
+from stock21.money import unit_rows, from_units
+from stock21.fx import load_fx
+from stock21.portfolio import trade_groups, iter_positions, load_prices, pnl_summary, with_currencies
+
+MAX_CACHE = 256
+
+
+def _codes(query):
+    codes = [c.strip() for v in query.get("code", []) for c in v.split(",") if c.strip()]
+    return codes or None
+
+
+def _policy(query):
+    policy = (query.get("policy") or [DEFAULT_POLICY])[0]
+    if policy not in POLICIES:
+        raise ValueError(f"unknown policy: {policy}")
+    return policy
+
+
+def _rows(conn, sql, args=()):
+    try:
+        cur = conn.execute(sql, args)
+    except sqlite3.OperationalError:      # 表尚未建立
+        return []
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+# ── 各端点 ──────────────────────────────────────────────────────────────────
+
+def _positions(conn, q):
+    return [r for r in iter_positions(conn, codes=_codes(q), policy=_policy(q)) if r["long_qty"] or r["short_qty"]]
+
+
+def _lots(conn, q):
+    out, policy = [], _policy(q)
+    for code, rows in trade_groups(conn, _codes(q)):
+        m = match(rows, policy)
+        out += [{"code": code, "side": "long", "date": d, "price": p, "quantity": qty} for d, p, qty in m.buy_lots]
+        out += [{"code": code, "side": "short", "date": d, "price": p, "quantity": qty} for d, p, qty in m.sell_lots]
+    return out
+
+
+def _pairs(conn, q):
+    out, policy = [], _policy(q)
+    for code, rows in trade_groups(conn, _codes(q), history_table(conn)):        # 含已归档的成交
+        for od, cd, op, cp, qty, side in match(list(unit_rows(rows)), policy, exact=False).pairs:   # 定点整数
+            out.append({"code": code, "side": side, "open_date": od, "close_date": cd, "open_price": from_units(op),
+                        "close_price": from_units(cp), "quantity": qty,
+                        "pnl": from_units((cp - op) * qty if side == "long" else (op - cp) * qty)})
+    return out
+
+
+def _pnl(conn, q):
+    rows = with_currencies(conn, list(iter_positions(conn, codes=_codes(q), policy=_policy(q))))
+    return {"rows": rows, "total": pnl_summary(rows, load_fx(conn))}
+
+
+def _rules_by_code(conn, prefix):
+    by = {}
+    for c in evaluate_rules(conn, load_prices(conn)):
+        if c["rule"].startswith(prefix):
+            by.setdefault(c["code"], []).append(c)
+    return by
+
+
+def _targets(conn, q):
+    rules = _rules_by_code(conn, "target:")
+    rows = _rows(conn, "SELECT * FROM price_targets_v2 ORDER BY code")
+    for r in rows:
+        r["rules"] = rules.get(r["code"], [])
+    return rows
+
+
+def _signals(conn, q):
+    armed = {r["rule"]: r for r in _rows(conn, "SELECT rule, armed, last_fired_at, last_excess FROM alert_state")}
+    rules = _rules_by_code(conn, "")
+    out = []
+    for code in sorted(rules):
+        for c in rules[code]:
+            st = armed.get(c["rule"], {})
+            out.append(dict(c, triggered=c["excess"] >= 0, armed=bool(st.get("armed", 1)),
+                            last_fired_at=st.get("last_fired_at")))
+    return {"signals": _rows(conn, "SELECT * FROM signals ORDER BY code"), "rules": out}
+
+
+ENDPOINTS = {
+    "positions": (_positions, "当前持仓（按配对规则配对后的未平仓部分）"),
+    "lots": (_lots, "未平仓批次"),
+    "pairs": (_pairs, "已配对成交"),
+    "pnl": (_pnl, "逐股盈亏（交易币种）与折合人民币的合计"),
+    "targets": (_targets, "价格目标与当前规则状态"),
+    "signals": (_signals, "买卖信号、规则触发与提醒待命状态"),
+}
+
+
+# ── 服务 ────────────────────────────────────────────────────────────────────
+
+class ApiServer:
+    """单个只读连接 + 按数据版本失效的响应缓存；计算串行进行，命中缓存与 304 只读一次 PRAGMA"""
+
+    def __init__(self, db_path: str, port: int, host: str = "127.0.0.1"):
+        self.db_path, self.host, self.port = db_path, host, port
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False, timeout=15)
+        self._lock = threading.Lock()
+        self._cache = {}                       # (端点, 查询串) → (版本, body)
+        self._epoch = f"{int(time.time()):x}"  # 进程重启后 data_version 从头计，ETag 带上启动时间避免撞号
+        self.hits = self.misses = self.not_modified = 0
+        self._httpd = None
+
+    def version(self) -> str:
+        with self._lock:
+            return f"{self._epoch}-{self._conn.execute('PRAGMA data_version').fetchone()[0]}"
+
+    def etag(self, version: str) -> str:
+        return f'"{version}"'
+
+    def body(self, name: str, query: str, version: str) -> bytes:
+        key = (name, query)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit and hit[0] == version:
+                self.hits += 1
+                return hit[1]
+            self.misses += 1
+            t0 = time.perf_counter()
+            data = ENDPOINTS[name][0](self._conn, parse_qs(query))
+            payload = {"endpoint": name, "version": version,
+                       "generated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                       "compute_ms": round((time.perf_counter() - t0) * 1000, 2), "data": data}
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            if len(self._cache) >= MAX_CACHE:
+                self._cache.clear()
+            self._cache[key] = (version, body)
+            return body
+
+    def index(self) -> bytes:
+        return json.dumps({"endpoints": {f"/api/{k}": v[1] for k, v in ENDPOINTS.items()},
+                           "cache": {"entries": len(self._cache), "hits": self.hits, "misses": self.misses,
+                                     "not_modified": self.not_modified}}, ensure_ascii=False).encode("utf-8")
+
+    def start(self):
+        api = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def _send(self, code, body=b"", headers=None):
+                self.send_response(code)
+                self.send_header("Access-Control-Allow-Origin", "*")
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                if code != 304:
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if code != 304 and self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                name = parts.path.rstrip("/").removeprefix("/api").lstrip("/")
+                if not name:
+                    return self._send(200, api.index())
+                if name not in ENDPOINTS:
+                    return self._send(404, json.dumps({"error": f"unknown endpoint: {name}"}).encode())
+                try:
+                    version = api.version()
+                    etag = api.etag(version)
+                    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+                    if etag in [t.strip() for t in (self.headers.get("If-None-Match") or "").split(",")]:
+                        api.not_modified += 1
+                        return self._send(304, headers=headers)
+                    self._send(200, api.body(name, parts.query, version), headers)
+                except ValueError as e:
+                    self._send(400, json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8"))
+                except Exception as e:
+                    self._send(500, json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8"))
+
+            do_HEAD = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self._httpd = ThreadingHTTPServer((self.host, self.port), _Handler)
+        except OSError as e:
+            print(f"[api] server not started: {e}")
+            return None
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, name="api", daemon=True).start()
+        print(f"[api] serving http://{self.host}:{self.port}/api (db={os.path.basename(self.db_path)})")
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+        self._conn.close()
+
+
+def start_api_server(db_path: str, port: int, host: str = "127.0.0.1"):
+    """后台线程提供只读 API；端口被占用或数据库不存在时返回 None"""
+    if not os.path.exists(db_path):
+        print(f"[api] server not started: {db_path} not found")
+        return None
+    return ApiServer(db_path, port, host).start()
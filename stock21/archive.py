@@ -0,0 +1,250 @@
+"""
+成交冷热分区：早年已全部平仓的成交移出 trades，按年份压缩归档，账本、持仓、盈亏这些热路径只读仍在用的成交。
+
+归档点取每只股票在截止日期（默认 KEEP_YEARS 年前的元旦）之前最后一次净持仓归零的那个交易日收盘：
+此时任何配对规则下都没有未平仓批次，之后的配对与更早的成交无关，只需带上累计值——
+各配对规则的 LotMatcher 状态（已实现盈亏、历史最高占用，定点整数）、累计投入 / 回收与笔数，存在 trade_carry（每股一行），
+配对从这里续算（stock21.matching 的 start 参数），结果与不归档时一致。
+前提是结转点之后不再出现更早的成交：导入、手工录入或 📜 编辑器补录了结转日当天或之前的成交时，
+load_carry 先把这些股票的归档成交放回 trades、删掉结转状态（restore_backdated），配对改回从完整历史算起。
+
+归档的成交按年份存入 trade_archive（每年一行），整行 JSON 经 zlib 压缩为 BLOB，与检查点同一做法；
+归档仍在主库里，GitHub 同步的单个数据库文件即包含全部历史。
+需要完整历史的地方（📜 历史明细、导出、净值 / 收益率、导入去重、历史日期账本）用 history_table(conn) 取表名：
+没有归档时就是 trades；有归档时把归档解压进本连接的临时表，返回 trades 与其 UNION ALL 的临时视图 all_trades。
+视图带 rowid 列（归档行保留原 rowid），按 trades 写的 ORDER BY date, id, rowid 查询原样可用。
+"""
+import itertools
+import json
+import sqlite3
+import threading
+import zlib
+from datetime import date, datetime
+
+from stock21.matching import LotMatcher, POLICIES, BUY, SELL
+from stock21.money import to_units
+
+KEEP_YEARS = 1                 # 默认只归档上一年元旦之前的成交
+HISTORY_VIEW = "all_trades"
+_COLUMNS = "id, date, code, action, price, quantity, note"
+_SIG_SQL = "SELECT COUNT(*), TOTAL(trades), TOTAL(length(rows)), MAX(updated_at) FROM trade_archive"
+
+_lock = threading.Lock()       # 页面各会话共用一个连接，解压进临时表时串行
+
+
+def ensure_archive_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS trade_archive (
+        year INTEGER PRIMARY KEY, trades INTEGER, first_date TEXT, last_date TEXT, rows BLOB, updated_at TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS trade_carry (
+        code TEXT PRIMARY KEY, through_date TEXT, trades INTEGER, state BLOB)''')
+    conn.commit()
+
+
+def _pack(obj) -> bytes:
+    return zlib.compress(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(blob: bytes):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def load_carry(conn) -> dict:
+    """
+    {code: {through, trades, invested, recovered, policies: {policy: LotMatcher.state()}}}；
+    金额为定点整数（stock21.money），尚未建表时为空。读取前先恢复补录了结转日及之前成交的股票（只读连接上跳过）
+    """
+    try:
+        restore_backdated(conn)
+    except sqlite3.OperationalError:
+        pass
+    try:
+        rows = conn.execute("SELECT code, through_date, trades, state FROM trade_carry").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {code: dict(_unpack(blob), through=d, trades=n) for code, d, n, blob in rows}
+
+
+def archived_trade_count(conn, code: str) -> int:
+    """该股已归档的成交笔数（取结转状态里的累计笔数，不解压归档）"""
+    try:
+        row = conn.execute("SELECT trades FROM trade_carry WHERE code = ?", (code,)).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return int(row[0] or 0) if row else 0
+
+
+def archive_summary(conn) -> dict:
+    """{partitions, trades, first_date, last_date}：已归档的年份数、笔数与日期范围"""
+    try:
+        n, trades, first, last = conn.execute(
+            "SELECT COUNT(*), TOTAL(trades), MIN(first_date), MAX(last_date) FROM trade_archive").fetchone()
+    except sqlite3.OperationalError:
+        n, trades, first, last = 0, 0, None, None
+    return {"partitions": n, "trades": int(trades or 0), "first_date": first, "last_date": last}
+
+
+def _split_closed(rows, carry: dict) -> dict:
+    """
+    rows：截止日期前的成交 (rowid, id, date, code, action, price, quantity, note)，按 code, date, id, rowid 排序。
+    返回 {code: (可归档的行, 新的结转状态)}：每股到最后一次净持仓归零、且当天已无后续成交为止
+    """
+    out = {}
+    for code, grp in itertools.groupby(rows, key=lambda r: r[3]):
+        grp = list(grp)
+        net, cut = 0, 0
+        for i, r in enumerate(grp):
+            q = int(round(float(r[6] or 0)))
+            net += q if r[4] == BUY else -q
+            if net == 0 and (i + 1 == len(grp) or grp[i + 1][2][:10] > r[2][:10]):
+                cut = i + 1
+        if not cut:
+            continue
+        moved = grp[:cut]
+        prev = carry.get(code) or {"trades": 0, "invested": 0, "recovered": 0, "policies": {}}
+        engines = [LotMatcher.from_state(prev["policies"][p], keep_pairs=False) if p in prev["policies"]
+                   else LotMatcher(p, keep_pairs=False) for p in POLICIES]
+        cash = {BUY: prev["invested"], SELL: prev["recovered"]}
+        for _, _, d, _, a, p, q, _ in moved:
+            pu, qu = to_units(p), int(round(float(q or 0)))
+            cash[a] += pu * qu
+            for e in engines:
+                e.feed(d, a, pu, qu)
+        out[code] = (moved, {"through": moved[-1][2][:10], "trades": prev["trades"] + len(moved),
+                             "invested": cash[BUY], "recovered": cash[SELL],
+                             "policies": {e.policy: e.state() for e in engines}})
+    return out
+
+
+def archive_closed(conn, before: str = None) -> dict:
+    """
+    把 before（YYYY-MM-DD，不含当天；默认 KEEP_YEARS 年前的元旦）之前、各股最后一次持仓归零为止的成交移入归档，
+    一个事务内完成。返回 {trades, codes, years}；调用方之后需让进程内账本重读（LedgerCache.invalidate）
+    """
+    ensure_archive_tables(conn)
+    before = before or f"{date.today().year - KEEP_YEARS}-01-01"
+    rows = conn.execute(
+        f"""SELECT rowid, {_COLUMNS} FROM trades
+            WHERE code IS NOT NULL AND action IN (?, ?) AND date IS NOT NULL AND date < ?
+            ORDER BY code, date, id, rowid""", (BUY, SELL, before)).fetchall()
+    split = _split_closed(rows, load_carry(conn))
+    moved = sorted((r for rows_, _ in split.values() for r in rows_), key=lambda r: (r[2], r[1] or 0, r[0]))
+    if not moved:
+        return {"trades": 0, "codes": 0, "years": []}
+    now = datetime.now().isoformat(timespec="seconds")
+    years = {int(y): list(g) for y, g in itertools.groupby(moved, key=lambda r: r[2][:4])}
+    with conn:
+        for year, new in years.items():
+            row = conn.execute("SELECT rows FROM trade_archive WHERE year = ?", (year,)).fetchone()
+            part = sorted((_unpack(row[0]) if row else []) + [list(r) for r in new],
+                          key=lambda r: (r[2], r[1] or 0, r[0]))
+            conn.execute("INSERT OR REPLACE INTO trade_archive VALUES (?, ?, ?, ?, ?, ?)",
+                         (year, len(part), part[0][2][:10], part[-1][2][:10], _pack(part), now))
+        conn.executemany("INSERT OR REPLACE INTO trade_carry VALUES (?, ?, ?, ?)",
+                         [(code, st["through"], st["trades"],
+                           _pack({k: st[k] for k in ("invested", "recovered", "policies")}))
+                          for code, (_, st) in split.items()])
+        conn.executemany("DELETE FROM trades WHERE rowid = ?", [(r[0],) for r in moved])
+    return {"trades": len(moved), "codes": len(split), "years": sorted(years)}
+
+
+def _restore(conn, codes: set = None) -> int:
+    """把 codes（None 为全部）的归档成交放回 trades（保留原 id，rowid 另配），删掉其归档与结转状态；不提交"""
+    n, now = 0, datetime.now().isoformat(timespec="seconds")
+    for year, blob in conn.execute("SELECT year, rows FROM trade_archive ORDER BY year").fetchall():
+        rows = _unpack(blob)
+        back = [r for r in rows if codes is None or r[3] in codes]
+        if not back:
+            continue
+        conn.executemany(f"INSERT INTO trades ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", [r[1:] for r in back])
+        keep = [r for r in rows if codes is not None and r[3] not in codes]
+        if keep:
+            conn.execute("UPDATE trade_archive SET trades = ?, first_date = ?, last_date = ?, rows = ?, updated_at = ? "
+                         "WHERE year = ?", (len(keep), keep[0][2][:10], keep[-1][2][:10], _pack(keep), now, year))
+        else:
+            conn.execute("DELETE FROM trade_archive WHERE year = ?", (year,))
+        n += len(back)
+    if codes is None:
+        conn.execute("DELETE FROM trade_carry")
+    else:
+        conn.executemany("DELETE FROM trade_carry WHERE code = ?", [(c,) for c in codes])
+    return n
+
+
+def restore_archive(conn) -> int:
+    """把全部归档放回 trades，清空归档与结转状态；返回恢复的笔数"""
+    ensure_archive_tables(conn)
+    with conn:
+        return _restore(conn)
+
+
+def restore_backdated(conn) -> int:
+    """
+    trades 里出现结转日当天或之前的买卖成交（归档后补录）的股票：归档成交放回 trades、结转状态删除，一个事务；
+    返回恢复的笔数。没有这种股票时只有一条查询
+    """
+    try:
+        codes = {r[0] for r in conn.execute(
+            """SELECT DISTINCT t.code FROM trade_carry c JOIN trades t ON t.code = c.code
+               WHERE t.action IN (?, ?) AND substr(t.date, 1, 10) <= c.through_date""", (BUY, SELL))}
+    except sqlite3.OperationalError:        # 尚未建归档表
+        return 0
+    if not codes:
+        return 0
+    with conn:
+        n = _restore(conn, codes)
+    print(f"[archive] 补录了结转日之前的成交，已恢复归档：{'、'.join(sorted(codes))}（{n} 笔）")
+    return n
+
+
+def rename_archived(conn, old: str, new: str) -> int:
+    """归档里的股票名称 old → new（不提交，由 stock21.symbols.rename_symbol 在同一事务内调用）；返回改动的行数"""
+    try:
+        parts = conn.execute("SELECT year, rows FROM trade_archive").fetchall()
+    except sqlite3.OperationalError:
+        return 0
+    n, now = 0, datetime.now().isoformat(timespec="seconds")
+    for year, blob in parts:
+        rows = _unpack(blob)
+        hit = [r for r in rows if r[3] == old]
+        if hit:
+            for r in hit:
+                r[3] = new
+            conn.execute("UPDATE trade_archive SET rows = ?, updated_at = ? WHERE year = ?", (_pack(rows), now, year))
+            n += len(hit)
+    return n
+
+
+def history_table(conn) -> str:
+    """
+    完整成交历史的表名：没有归档时为 trades（只多一条查询）；
+    有归档时确保本连接的临时视图 all_trades 与归档同步（归档变化后首次调用时解压重建），返回 all_trades
+    """
+    try:
+        sig = tuple(conn.execute(_SIG_SQL).fetchone())
+    except sqlite3.OperationalError:        # 尚未建归档表
+        return "trades"
+    if not sig[0]:
+        return "trades"
+    sig = repr(sig)
+    with _lock:
+        try:
+            loaded = conn.execute("SELECT sig FROM temp.archive_loaded").fetchone()
+        except sqlite3.OperationalError:
+            loaded = None
+        if not loaded or loaded[0] != sig:
+            pending = conn.in_transaction
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_loaded (sig TEXT)")
+            conn.execute("""CREATE TEMP TABLE IF NOT EXISTS archived_trades (
+                rowid_ INTEGER, id INTEGER, date TEXT, code TEXT, action TEXT, price REAL, quantity REAL, note TEXT)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS temp.idx_archived_code_date ON archived_trades (code, date)")
+            conn.execute(f"""CREATE TEMP VIEW IF NOT EXISTS {HISTORY_VIEW} AS
+                             SELECT rowid AS rowid, {_COLUMNS} FROM main.trades
+                             UNION ALL SELECT rowid_, {_COLUMNS} FROM temp.archived_trades""")
+            conn.execute("DELETE FROM temp.archived_trades")
+            for (blob,) in conn.execute("SELECT rows FROM trade_archive ORDER BY year").fetchall():
+                conn.executemany("INSERT INTO temp.archived_trades VALUES (?, ?, ?, ?, ?, ?, ?, ?)", _unpack(blob))
+            conn.execute("DELETE FROM temp.archive_loaded")
+            conn.execute("INSERT INTO temp.archive_loaded VALUES (?)", (sig,))
+            if not pending:
+                conn.commit()
+    return HISTORY_VIEW
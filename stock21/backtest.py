@@ -0,0 +1,192 @@
+"""
+参数回测：在已存日线上模拟两套规则，按参数网格批量回测并排名。
+
+  rule="signal"  买卖信号（signals）：价格较运行低点上涨 ≥ a% → 卖出；较运行高点回调 ≥ b% → 买入。
+                 与页面判定顺序一致（先判卖出）；每次成交后以成交价重置高低点。
+  rule="monitor" 买卖监控（strategy_notes）：价格 ≥ 基准价×(1+a%) → 卖出；≤ 基准价×(1-b%) → 买入。
+                 基准价取最近一次成交价。
+
+每次信号成交 1 手；盈亏按最低成本优先配对计算（max_lots=1 时直接向量化结算，
+多手时记录成交后交给 matching.match_lowest_cost）。内层按交易日循环、参数维度用
+numpy 向量化；多只股票分发到进程池并行。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from stock21.matching import match_lowest_cost, BUY, SELL
+
+RULES = ("signal", "monitor")
+_PARALLEL_MIN_WORK = 5_000_000   # 交易日 × 参数组合 × 股票数 小于该值时单进程执行
+
+
+def load_closes(conn, codes: list, start: str = None, end: str = None) -> dict:
+    """{code: (dates(list), closes(np.ndarray))}"""
+    out = {}
+    for code in codes:
+        sql = "SELECT date, close FROM daily_prices WHERE code = ? AND close > 0"
+        params = [code]
+        if start:
+            sql += " AND date >= ?"
+            params.append(start)
+        if end:
+            sql += " AND date <= ?"
+            params.append(end)
+        rows = conn.execute(sql + " ORDER BY date", params).fetchall()
+        if len(rows) >= 2:
+            out[code] = ([r[0] for r in rows], np.array([r[1] for r in rows], dtype=np.float64))
+    return out
+
+
+def simulate(close, a, b, rule: str = "signal", allow_short: bool = False, max_lots: int = 1) -> dict:
+    """
+    单只股票、整组参数同时模拟。a/b 为等长参数数组（百分比）。
+    返回各参数的指标数组：pnl_pct（总盈亏/首日收盘）、trades（平仓笔数）、wins、max_dd_pct、final_pos
+    """
+    close = np.asarray(close, dtype=np.float64)
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    P, T = a.size, close.size
+    up = 1 + a / 100
+    dn = 1 - b / 100
+    lo_limit = -max_lots if allow_short else 0
+
+    ref_hi = np.full(P, close[0])
+    ref_lo = np.full(P, close[0])   # monitor 规则下 ref_lo 即基准价
+    pos = np.zeros(P)               # 持仓手数（用 float，避免 int×float 的类型转换开销）
+    entry = np.zeros(P)
+    realized = np.zeros(P)
+    trades = np.zeros(P, dtype=np.int64)
+    wins = np.zeros(P, dtype=np.int64)
+    peak_eq = np.zeros(P)
+    max_dd = np.zeros(P)
+    eq = np.empty(P)
+    lvl = np.empty(P)
+    fills = []   # max_lots > 1 时记录 (t, 买入参数下标, 卖出参数下标)
+    track_dd = max_lots == 1
+
+    for t in range(1, T):
+        p = close[t]
+        if rule == "signal":
+            np.maximum(ref_hi, p, out=ref_hi)
+            np.minimum(ref_lo, p, out=ref_lo)
+            np.multiply(ref_lo, up, out=lvl)
+            sell = lvl <= p
+            np.multiply(ref_hi, dn, out=lvl)
+        else:
+            np.multiply(ref_lo, up, out=lvl)
+            sell = lvl <= p
+            np.multiply(ref_lo, dn, out=lvl)
+        buy = lvl >= p
+        buy &= ~sell
+        sell &= pos > lo_limit
+        buy &= pos < max_lots
+        fill = sell | buy
+        if fill.any():
+            if max_lots == 1:
+                closing = (sell & (pos == 1)) | (buy & (pos == -1))
+                pnl = np.where(closing, pos * (p - entry), 0.0)
+                realized += pnl
+                trades += closing
+                wins += closing & (pnl > 0)
+                np.copyto(entry, p, where=fill & ~closing)
+            else:
+                fills.append((t, np.flatnonzero(buy), np.flatnonzero(sell)))
+            pos += buy
+            pos -= sell
+            np.copyto(ref_hi, p, where=fill)
+            np.copyto(ref_lo, p, where=fill)
+        if track_dd:
+            # 权益 = 已实现 + 持仓×(现价-成本)，逐日更新峰值与最大回撤
+            np.subtract(p, entry, out=eq)
+            eq *= pos
+            eq += realized
+            np.maximum(peak_eq, eq, out=peak_eq)
+            np.subtract(peak_eq, eq, out=eq)
+            np.maximum(max_dd, eq, out=max_dd)
+
+    base = close[0]
+    if max_lots == 1:
+        total = realized + pos * (close[-1] - entry)
+        return {"pnl_pct": total / base * 100, "trades": trades, "wins": wins,
+                "max_dd_pct": max_dd / base * 100, "final_pos": pos.astype(np.int64)}
+
+    # 多手：按参数重建成交序列，用最低成本优先配对结算（回撤不计算）
+    per_param = [[] for _ in range(P)]
+    for t, bi, si in fills:
+        for i in bi:
+            per_param[i].append((t, BUY, close[t], 1))
+        for i in si:
+            per_param[i].append((t, SELL, close[t], 1))
+    pnl = np.zeros(P)
+    for i, seq in enumerate(per_param):
+        if not seq:
+            continue
+        r = match_lowest_cost(seq)
+        unreal = sum((close[-1] - pr) * q for _, pr, q in r.buy_lots) + sum((pr - close[-1]) * q for _, pr, q in r.sell_lots)
+        pnl[i] = r.realized + unreal
+        trades[i] = len(r.pairs)
+        wins[i] = sum(1 for p in r.pairs if (p[3] - p[2]) * (1 if p[5] == "long" else -1) > 0)
+    return {"pnl_pct": pnl / base * 100, "trades": trades, "wins": wins,
+            "max_dd_pct": np.full(P, np.nan), "final_pos": pos.astype(np.int64)}
+
+
+def _simulate_task(args):
+    code, close, a, b, rule, allow_short, max_lots = args
+    return code, simulate(close, a, b, rule, allow_short, max_lots)
+
+
+def param_grid(a_values, b_values):
+    """笛卡尔积展开为两个等长数组"""
+    aa, bb = np.meshgrid(np.asarray(a_values, dtype=np.float64), np.asarray(b_values, dtype=np.float64), indexing="ij")
+    return aa.ravel(), bb.ravel()
+
+
+def run_grid(closes: dict, a_values, b_values, rule: str = "signal", allow_short: bool = False,
+             max_lots: int = 1, workers: int = None) -> pd.DataFrame:
+    """
+    closes: load_closes 的返回值。对每只股票跑整组参数，再按参数汇总排名。
+    返回 DataFrame（按平均收益降序）：a, b, 平均收益%, 中位收益%, 盈利股票占比, 平仓笔数, 胜率, 最大回撤%
+    """
+    if rule not in RULES:
+        raise ValueError(f"unknown rule: {rule}")
+    a, b = param_grid(a_values, b_values)
+    tasks = [(code, c, a, b, rule, allow_short, max_lots) for code, (_, c) in closes.items()]
+    if not tasks:
+        return pd.DataFrame()
+
+    work = a.size * sum(len(t[1]) for t in tasks)
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(tasks) > 1 and work >= _PARALLEL_MIN_WORK:
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=ctx) as pool:
+            results = list(pool.map(_simulate_task, tasks))
+    else:
+        results = [_simulate_task(t) for t in tasks]
+
+    pnl = np.vstack([r["pnl_pct"] for _, r in results])          # (股票数, 参数数)
+    trades = np.vstack([r["trades"] for _, r in results]).sum(axis=0)
+    wins = np.vstack([r["wins"] for _, r in results]).sum(axis=0)
+    dd = np.vstack([r["max_dd_pct"] for _, r in results])
+    df = pd.DataFrame({
+        "a": a, "b": b,
+        "平均收益%": pnl.mean(axis=0),
+        "中位收益%": np.median(pnl, axis=0),
+        "盈利股票占比": (pnl > 0).mean(axis=0) * 100,
+        "平仓笔数": trades,
+        "胜率": np.where(trades > 0, wins / np.maximum(trades, 1) * 100, np.nan),
+        "最大回撤%": np.nanmax(dd, axis=0) if not np.isnan(dd).all() else np.nan,
+    })
+    return df.sort_values("平均收益%", ascending=False).reset_index(drop=True)
+
+
+def current_params(conn, rule: str) -> dict:
+    """当前库中配置的参数：{code: (a, b)}；signal → (up_threshold, down_threshold)，monitor → (sell_rise_pct, buy_drop_pct)"""
+    if rule == "signal":
+        rows = conn.execute("SELECT code, up_threshold, down_threshold FROM signals").fetchall()
+    else:
+        rows = conn.execute("SELECT code, sell_rise_pct, buy_drop_pct FROM strategy_notes").fetchall()
+    return {r[0]: (r[1], r[2]) for r in rows if r[1] and r[2]}
@@ -0,0 +1,153 @@
+"""
+配对引擎检查点：按股票、配对规则定期保存 LotMatcher 的状态（未平仓池、已实现盈亏、占用金额），
+任意历史日期的账本 = 该日之前最近的检查点 + 回放其后到该日的少量成交，不必从头重放。
+
+检查点总在某个交易日收盘后取（同一天的成交要么全在检查点之前，要么全在之后）：
+当月最后一个交易日、且距上一个检查点已累计 CHECKPOINT_EVERY 笔成交时保存一次。
+状态按定点整数（stock21.money）保存，JSON 经 zlib 压缩存为 BLOB。
+
+失效规则：trades 上的触发器在增删改某股某日成交时，删除该股该日及之后的检查点；
+整表替换（to_sql replace）会连带删掉触发器，ensure_checkpoint_tables 发现触发器缺失时清空全部检查点。
+
+成交归档（stock21.archive）删除的行同样触发失效；此后没有检查点的股票从结转状态续算，
+截至日期早于结转点时改从含归档的完整历史从头回放。
+"""
+import json
+import zlib
+
+from stock21.archive import load_carry, history_table
+from stock21.matching import LotMatcher, BUY, SELL, DEFAULT_POLICY, result_in_yuan
+from stock21.money import unit_rows
+
+CHECKPOINT_EVERY = 50
+_TRIGGERS = ("trg_match_ckpt_ins", "trg_match_ckpt_upd", "trg_match_ckpt_del")
+
+
+def ensure_checkpoint_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS match_checkpoints (
+        code TEXT, policy TEXT, date TEXT, trades INTEGER, state BLOB,
+        PRIMARY KEY (code, policy, date))''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trades_code_date ON trades (code, date)")
+    have = {r[0] for r in conn.execute(
+        f"SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN ({','.join('?' * len(_TRIGGERS))})",
+        _TRIGGERS)}
+    if len(have) < len(_TRIGGERS):
+        conn.execute("DELETE FROM match_checkpoints")
+        stale = "DELETE FROM match_checkpoints WHERE code = {0}.code AND date >= substr({0}.date, 1, 10);"
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_match_ckpt_ins AFTER INSERT ON trades
+                         BEGIN {stale.format('NEW')} END""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_match_ckpt_upd AFTER UPDATE ON trades
+                         BEGIN {stale.format('OLD')} {stale.format('NEW')} END""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_match_ckpt_del AFTER DELETE ON trades
+                         BEGIN {stale.format('OLD')} END""")
+    conn.commit()
+
+
+def _pack(state: dict) -> bytes:
+    return zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(blob: bytes) -> dict:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def _trades_after(conn, code: str, after: str = None, until: str = None, table: str = "trades"):
+    """
+    该股 (after, until] 日期区间内的成交，按 (日期, id, rowid) 排序，与账本（stock21.ledger）同序——
+    整表替换后 id 不再是 rowid 的别名，同一天的成交只按 rowid 排可能与当前配对顺序不同。
+    日期截取前 10 位；table 可为含归档的完整历史
+    """
+    where, args = ["code = ?", "action IN (?, ?)", "date IS NOT NULL"], [code, BUY, SELL]
+    # 用 date 原值做范围比较以便走 (code, date) 索引："D\uffff" 大于任何以 D 开头的日期 / 时间串
+    if after:
+        where.append("date > ?")
+        args.append(after + "\uffff")
+    if until:
+        where.append("date < ?")
+        args.append(until + "\uffff")
+    return conn.execute(
+        f"""SELECT substr(date, 1, 10), action, price, quantity FROM {table}
+            WHERE {' AND '.join(where)} ORDER BY date, id, rowid""", args).fetchall()
+
+
+def _latest(conn, code: str, policy: str, until: str = None):
+    """(date, LotMatcher) 或 None：until 当天及之前最近的检查点"""
+    sql = "SELECT date, state FROM match_checkpoints WHERE code = ? AND policy = ?"
+    args = [code, policy]
+    if until:
+        sql += " AND date <= ?"
+        args.append(until)
+    row = conn.execute(sql + " ORDER BY date DESC LIMIT 1", args).fetchone()
+    return (row[0], LotMatcher.from_state(_unpack(row[1]), keep_pairs=False)) if row else None
+
+
+def _start(conn, code: str, policy: str, carry: dict, until: str = None):
+    """续算起点 (date, LotMatcher)：until 及之前最近的检查点，其次是归档结转状态，都没有时 (None, 新引擎)"""
+    last = _latest(conn, code, policy, until)
+    if last:
+        return last
+    c = carry.get(code)
+    if c and (until is None or c["through"] <= until):
+        return c["through"], LotMatcher.from_state(c["policies"][policy], keep_pairs=False)
+    return None, LotMatcher(policy, keep_pairs=False)
+
+
+def update_checkpoints(conn, policy: str = DEFAULT_POLICY, codes: list = None, every: int = CHECKPOINT_EVERY) -> int:
+    """从每只股票最后一个有效检查点续算到最新成交，按月末 + 累计笔数补存检查点；返回新增条数"""
+    ensure_checkpoint_tables(conn)
+    if codes is None:
+        codes = [r[0] for r in conn.execute("SELECT DISTINCT code FROM trades WHERE code IS NOT NULL")]
+    rows, carry = [], load_carry(conn)
+    for code in codes:
+        after, engine = _start(conn, code, policy, carry)
+        trades = _trades_after(conn, code, after)
+        since = 0
+        for i, (d, a, p, q) in enumerate(unit_rows(trades)):
+            engine.feed(d, a, p, q)
+            since += 1
+            nxt = trades[i + 1][0] if i + 1 < len(trades) else None
+            # 月末最后一个交易日（下一笔已是下个月），且攒够了笔数；最后一笔之后不存（当月还可能有新成交）
+            if nxt and nxt[:7] != d[:7] and since >= every:
+                rows.append((code, policy, d, engine.seq, _pack(engine.state())))
+                since = 0
+    if rows:
+        conn.executemany("INSERT OR REPLACE INTO match_checkpoints VALUES (?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    return len(rows)
+
+
+def book_as_of(conn, as_of: str, policy: str = DEFAULT_POLICY, codes: list = None) -> dict:
+    """
+    {code: MatchResult}：as_of（YYYY-MM-DD，含当天）收盘时各股的未平仓批次、已实现盈亏与历史最高占用；
+    pairs 为空（历史配对可直接按平仓日期筛选当前配对结果，配对规则只依赖过去的成交）
+    """
+    update_checkpoints(conn, policy, codes)
+    carry = load_carry(conn)
+    full = history_table(conn) if carry else "trades"
+    if codes is None:
+        codes = [r[0] for r in conn.execute(
+            f"SELECT DISTINCT code FROM {full} WHERE code IS NOT NULL AND substr(date, 1, 10) <= ?", (as_of,))]
+    out = {}
+    for code in codes:
+        after, engine = _start(conn, code, policy, carry, as_of)
+        # 截至日期早于结转点的已归档股票：从完整历史从头回放
+        table = full if after is None and code in carry else "trades"
+        for d, a, p, q in unit_rows(_trades_after(conn, code, after, as_of, table)):
+            engine.feed(d, a, p, q)
+        if engine.seq:
+            out[code] = result_in_yuan(engine.result())
+    return out
+
+
+def closes_as_of(conn, as_of: str, codes) -> dict:
+    """{code: as_of 当天或之前最近一个交易日的收盘价}（daily_prices），没有日线的不返回"""
+    out = {}
+    for code in codes:
+        try:
+            row = conn.execute("SELECT close FROM daily_prices WHERE code = ? AND date <= ? ORDER BY date DESC LIMIT 1",
+                               (code, as_of)).fetchone()
+        except Exception:       # 尚未建 daily_prices
+            return out
+        if row and row[0]:
+            out[code] = row[0]
+    return out
@@ -0,0 +1,243 @@
+"""
+命令行入口（不依赖 Streamlit），适合 cron 定时跑批，默认输出 JSON：
+
+    python -m stock21 positions                     # 当前持仓
+    python -m stock21 pnl --codes 比亚迪,特斯拉      # 逐股盈亏与合计
+    python -m stock21 pnl --policy fifo             # 配对规则：lowest / fifo / lifo / hifo / average
+    python -m stock21 refresh-prices                # 拉取最新行情写入 prices / quote_snapshots，并推进信号高低点
+    python -m stock21 check-signals --notify        # 判断全部提醒规则，按 ALERT_* 配置投递触发的提醒
+    python -m stock21 export --datasets trades,pnl --format csv --out backup.zip
+    python -m stock21 serve --port 8765             # 只读 JSON API（持仓 / 批次 / 配对 / 盈亏 / 目标 / 信号）
+    python -m stock21 archive --before 2024-01-01   # 已平仓的早年成交移入按年压缩的归档（--restore 全部放回）
+
+数据库默认与 app.py 相同：$STREAMLIT_DATA_DIR（缺省 /mnt/data，不存在时为仓库目录）下的 stock_data_v12.db，
+也可用 --db 或 STOCK21_DB 指定。
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+from stock21.matching import POLICIES, DEFAULT_POLICY
+
+DB_NAME = "stock_data_v12.db"
+
+
+def default_db_path() -> str:
+    if os.getenv("STOCK21_DB"):
+        return os.environ["STOCK21_DB"]
+    data_dir = os.environ.get("STREAMLIT_DATA_DIR", "/mnt/data")
+    if not os.path.isdir(data_dir):
+        data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(data_dir, DB_NAME)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    if not os.path.exists(path):
+        raise SystemExit(f"数据库不存在：{path}（用 --db 指定）")
+    conn = sqlite3.connect(path, timeout=15)
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def _codes(text):
+    return [c.strip() for c in text.split(",") if c.strip()] if text else None
+
+
+def _all_codes(conn) -> list:
+    return [r[0] for r in conn.execute("SELECT DISTINCT code FROM trades WHERE code IS NOT NULL ORDER BY code")]
+
+
+def _round(obj, nd=4):
+    if isinstance(obj, float):
+        return round(obj, nd)
+    if isinstance(obj, dict):
+        return {k: _round(v, nd) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_round(v, nd) for v in obj]
+    return obj
+
+
+# ── 子命令 ──────────────────────────────────────────────────────────────────
+
+def cmd_positions(conn, args):
+    from stock21.portfolio import positions
+    return positions(conn, codes=_codes(args.codes), policy=args.policy)
+
+
+def cmd_pnl(conn, args):
+    from stock21.portfolio import iter_positions, pnl_summary, with_currencies
+    from stock21.fx import load_fx
+    rows = with_currencies(conn, list(iter_positions(conn, codes=_codes(args.codes), policy=args.policy)))
+    return {"rows": rows, "total": pnl_summary(rows, load_fx(conn))}
+
+
+def cmd_refresh_prices(conn, args):
+    from stock21.quotes import fetch_quotes, store_prices
+    from stock21.signal_refs import update_refs_from_quotes
+    names = _codes(args.codes) or _all_codes(conn)
+    quotes = fetch_quotes(conn, names, save=not args.dry_run)
+    prices = {name: q["price"] for name, q in quotes.items()}
+    out = {"requested": len(names), "fetched": len(prices), "missing": [n for n in names if n not in prices],
+           "prices": prices}
+    if not args.dry_run and prices:
+        out["stored"] = store_prices(conn, prices)
+        try:
+            out["signal_refs_updated"] = update_refs_from_quotes(conn, prices)
+            conn.commit()
+        except sqlite3.OperationalError as e:      # 尚未建 signals 表
+            out["signal_refs_updated"] = 0
+            print(f"[signals] ref update skipped: {e}", file=sys.stderr)
+    return out
+
+
+def cmd_check_signals(conn, args):
+    from stock21.alerts import evaluate_rules, ensure_alert_tables, build_sinks, AlertEngine
+    from stock21.portfolio import load_prices
+    prices = load_prices(conn)
+    if args.refresh:
+        args.codes, args.dry_run = None, False
+        prices.update(cmd_refresh_prices(conn, args)["prices"])
+    conds = sorted(evaluate_rules(conn, prices), key=lambda c: -c["excess"])
+    out = {"checked": len(conds), "triggered": [c for c in conds if c["excess"] >= 0]}
+    if args.all:
+        out["rules"] = conds
+    if args.notify:
+        # 与页面里的提醒引擎共用 alert_state（待命 / 冷却状态）与 alert_log，不会重复投递
+        ensure_alert_tables(conn)
+        env = os.environ.get
+        sinks = build_sinks({
+            "webhook_url": env("ALERT_WEBHOOK_URL"),
+            "smtp_host": env("ALERT_SMTP_HOST"), "smtp_port": env("ALERT_SMTP_PORT"),
+            "smtp_from": env("ALERT_SMTP_FROM"), "smtp_to": env("ALERT_SMTP_TO"),
+            "smtp_user": env("ALERT_SMTP_USER"), "smtp_password": env("ALERT_SMTP_PASSWORD"),
+            "file_path": env("ALERT_FILE", os.path.join(os.path.dirname(os.path.abspath(args.db)), "alerts.jsonl")),
+        })
+        engine = AlertEngine(args.db, sinks, cooldown_s=float(env("ALERT_COOLDOWN_SECONDS", 1800)),
+                             max_per_minute=int(env("ALERT_MAX_PER_MINUTE", 20)))
+        out["sent"] = engine.process(prices, conn)
+    return out
+
+
+def cmd_export(conn, args):
+    from stock21.export import ExportJob, DATASETS, FORMATS
+    names = _codes(args.datasets) or list(DATASETS)
+    unknown = [n for n in names if n not in DATASETS]
+    if unknown or args.format not in FORMATS:
+        raise SystemExit(f"未知数据集或格式：{', '.join(unknown) or args.format}")
+    job = ExportJob(conn, names, args.format).start().wait()
+    try:
+        if job.status != "done":
+            raise SystemExit(f"导出失败：{job.error}")
+        out = args.out or job.file_name
+        shutil.move(job.path, out)
+    finally:
+        job.cleanup()
+    return {"path": os.path.abspath(out), "rows": job.rows, "seconds": job.seconds}
+
+
+def cmd_archive(conn, args):
+    from stock21.archive import archive_closed, restore_archive, archive_summary
+    out = {"restored": restore_archive(conn)} if args.restore else archive_closed(conn, args.before)
+    out["archive"] = archive_summary(conn)
+    return out
+
+
+def cmd_serve(conn, args):
+    from stock21.api import start_api_server
+    conn.close()
+    server = start_api_server(args.db, args.port, args.host)
+    if server is None:
+        raise SystemExit(1)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return {"served": f"http://{args.host}:{args.port}/api", "hits": server.hits, "misses": server.misses,
+            "not_modified": server.not_modified}
+
+
+COMMANDS = {
+    "positions": cmd_positions, "pnl": cmd_pnl, "refresh-prices": cmd_refresh_prices,
+    "check-signals": cmd_check_signals, "export": cmd_export, "archive": cmd_archive, "serve": cmd_serve,
+}
+
+
+# ── 文本输出 ────────────────────────────────────────────────────────────────
+
+def _print_table(rows: list, file=sys.stdout):
+    if not rows:
+        print("（无）", file=file)
+        return
+    cols = list(rows[0])
+    fmt = lambda v: f"{v:,.2f}" if isinstance(v, float) else str(v)
+    cells = [[fmt(r.get(c)) for c in cols] for r in rows]
+    widths = [max(len(c), *(len(row[i]) for row in cells)) for i, c in enumerate(cols)]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)), file=file)
+    for row in cells:
+        print("  ".join(v.rjust(w) for v, w in zip(row, widths)), file=file)
+
+
+def _print_text(result):
+    if isinstance(result, list):
+        _print_table(result)
+        return
+    for k, v in result.items():
+        if isinstance(v, list) and v and isinstance(v[0], dict):
+            print(f"\n[{k}]")
+            _print_table(v)
+        elif isinstance(v, dict) and v and all(not isinstance(x, (dict, list)) for x in v.values()):
+            print(f"\n[{k}]")
+            _print_table([v])
+        else:
+            print(f"{k}: {v}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m stock21", description="股票管理系统命令行（无界面）")
+    ap.add_argument("--db", default=default_db_path(), help="数据库路径（默认与 app.py 相同）")
+    ap.add_argument("--text", action="store_true", help="输出对齐的文本表格（默认 JSON）")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("positions", help="当前持仓（按配对规则配对后的未平仓部分）")
+    p.add_argument("--codes", help="只看这些股票，逗号分隔")
+    p.add_argument("--policy", choices=list(POLICIES), default=DEFAULT_POLICY, help="配对规则，默认最低成本优先")
+    p = sub.add_parser("pnl", help="逐股盈亏（已实现 / 未实现）与合计")
+    p.add_argument("--codes", help="只看这些股票，逗号分隔")
+    p.add_argument("--policy", choices=list(POLICIES), default=DEFAULT_POLICY, help="配对规则，默认最低成本优先")
+    p = sub.add_parser("refresh-prices", help="拉取最新行情写入数据库")
+    p.add_argument("--codes", help="只刷新这些股票，默认全部有成交的股票")
+    p.add_argument("--dry-run", action="store_true", help="只拉取不写库")
+    p = sub.add_parser("check-signals", help="判断买卖信号 / 买卖监控 / 价格目标规则")
+    p.add_argument("--refresh", action="store_true", help="先刷新行情再判断")
+    p.add_argument("--all", action="store_true", help="同时输出未触发的规则")
+    p.add_argument("--notify", action="store_true", help="按 ALERT_* 环境变量投递触发的提醒")
+    p = sub.add_parser("export", help="导出交易流水 / 成交配对 / 盈亏账单 / 复盘日记")
+    p.add_argument("--datasets", help="trades,pairs,pnl,journal，默认全部")
+    p.add_argument("--format", choices=["csv", "parquet", "xlsx"], default="csv")
+    p.add_argument("--out", help="输出文件，默认当前目录下 stock21_export_<时间>.<扩展名>")
+    p = sub.add_parser("archive", help="归档已全部平仓的早年成交（按年压缩，存在同一个数据库里）")
+    p.add_argument("--before", help="只归档此日期（YYYY-MM-DD，不含）之前的成交，默认上一年元旦")
+    p.add_argument("--restore", action="store_true", help="把全部归档放回交易流水")
+    p = sub.add_parser("serve", help="启动只读 JSON API（Ctrl+C 退出）")
+    p.add_argument("--port", type=int, default=int(os.getenv("API_PORT") or 8765))
+    p.add_argument("--host", default="127.0.0.1", help="监听地址，默认仅本机")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    conn = _connect(args.db)
+    try:
+        result = _round(COMMANDS[args.command](conn, args))
+    finally:
+        conn.close()
+    if args.text:
+        _print_text(result)
+    else:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=1)
+        print()
+    print(f"[{args.command}] {time.perf_counter() - t0:.3f}s", file=sys.stderr)
+    return 0
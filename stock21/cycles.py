@@ -0,0 +1,188 @@
+"""
+价格周期（zigzag 摆动）识别：按反转阈值在日线收盘价上寻找交替的高点/低点，
+把相邻拐点之间的每一段写入 price_cycles。
+
+增量：cycle_state 记录每只股票最后一个已确认拐点，下次只从该拐点开始重算尾部。
+阈值变化时该股票的自动周期整体重建；threshold 为空的旧记录（手工/历史数据）不受影响。
+"""
+import numpy as np
+
+PEAK, TROUGH = 1, -1
+DEFAULT_THRESHOLD_PCT = 10.0
+_SEARCH_WINDOW = 512   # 逐段搜索窗口，找不到反转再倍增，避免每个拐点都扫描整条尾部
+
+
+def ensure_cycle_tables(conn):
+    try:
+        conn.execute("ALTER TABLE price_cycles ADD COLUMN threshold REAL")
+    except Exception:
+        pass
+    conn.execute('''CREATE TABLE IF NOT EXISTS cycle_state (
+        code TEXT PRIMARY KEY, threshold REAL,
+        pivot_date TEXT, pivot_price REAL, pivot_kind INTEGER,
+        prev_date TEXT, prev_price REAL,
+        tent_date TEXT, tent_price REAL, last_date TEXT)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_price_cycles_code ON price_cycles (code, end_date)")
+    conn.commit()
+
+
+def _first_reversal(seg: np.ndarray, kind: int, th: float):
+    """
+    在 seg 中寻找上一拐点(kind)之后的反向拐点。
+    kind=PEAK 时找低点：价格从运行最低点反弹 ≥ th 即确认；kind=TROUGH 时对称。
+    返回 (拐点在 seg 中的下标, 是否已确认)；seg 为空返回 (None, False)
+    """
+    n = len(seg)
+    if n == 0:
+        return None, False
+    w = _SEARCH_WINDOW
+    while True:
+        win = seg[:w]
+        if kind == PEAK:
+            ext = np.minimum.accumulate(win)
+            hit = np.flatnonzero(win >= ext * (1 + th))
+        else:
+            ext = np.maximum.accumulate(win)
+            hit = np.flatnonzero(win <= ext * (1 - th))
+        if hit.size:
+            j = hit[0]
+            part = win[:j + 1]
+            return int(np.argmin(part) if kind == PEAK else np.argmax(part)), True
+        if w >= n:
+            return int(np.argmin(win) if kind == PEAK else np.argmax(win)), False
+        w *= 2
+
+
+def find_pivots(prices, threshold_pct: float, anchor_kind: int = None):
+    """
+    prices: 收盘价序列；anchor_kind 给定时 prices[0] 即为已确认拐点（增量续算）。
+    返回 (confirmed, tentative)
+      confirmed: [(下标, PEAK/TROUGH), ...]，含锚点
+      tentative: 最后一个确认拐点之后尚未确认的极值 (下标, kind) 或 None
+    """
+    p = np.asarray(prices, dtype=np.float64)
+    th = threshold_pct / 100.0
+    n = len(p)
+    if n == 0:
+        return [], None
+
+    if anchor_kind is None:
+        # 首个拐点：谁先出现 th 幅度的反转，谁就确认
+        dn = np.flatnonzero(p <= np.maximum.accumulate(p) * (1 - th))
+        up = np.flatnonzero(p >= np.minimum.accumulate(p) * (1 + th))
+        i_dn = dn[0] if dn.size else n
+        i_up = up[0] if up.size else n
+        if i_dn == n and i_up == n:
+            return [], None
+        if i_dn < i_up:
+            confirmed = [(int(np.argmax(p[:i_dn + 1])), PEAK)]
+        else:
+            confirmed = [(int(np.argmin(p[:i_up + 1])), TROUGH)]
+    else:
+        confirmed = [(0, anchor_kind)]
+
+    while True:
+        k, kind = confirmed[-1]
+        j, ok = _first_reversal(p[k + 1:], kind, th)
+        if j is None:
+            return confirmed, None
+        if not ok:
+            return confirmed, (k + 1 + j, -kind)
+        confirmed.append((k + 1 + j, -kind))
+
+
+def update_price_cycles(conn, threshold_pct: float = DEFAULT_THRESHOLD_PCT, codes: list = None) -> int:
+    """
+    增量识别所有股票（或指定 codes）的价格周期并写入 price_cycles。
+    每只股票只读取"最后确认拐点之后"的尾部日线，numpy 计算拐点，最后批量写入。
+    返回新增周期段数
+    """
+    th = float(threshold_pct)
+    # 阈值变更的股票：清掉自动周期与状态，整体重建
+    stale = [r[0] for r in conn.execute("SELECT code FROM cycle_state WHERE threshold != ?", (th,)).fetchall()]
+    if stale:
+        conn.executemany("DELETE FROM price_cycles WHERE code = ? AND threshold IS NOT NULL", [(s,) for s in stale])
+        conn.executemany("DELETE FROM cycle_state WHERE code = ?", [(s,) for s in stale])
+
+    state = {r[0]: r for r in conn.execute(
+        "SELECT code, pivot_date, pivot_price, pivot_kind, prev_date, prev_price FROM cycle_state").fetchall()}
+    if codes is None:
+        codes = [r[0] for r in conn.execute("SELECT DISTINCT code FROM daily_prices").fetchall()]
+
+    new_legs, new_state = [], []
+    for code in codes:
+        # 走 (code, date) 主键索引，只读取最后确认拐点之后的尾部
+        st_row = state.get(code)
+        rows = conn.execute(
+            "SELECT date, close FROM daily_prices WHERE code = ? AND date >= ? AND close > 0 ORDER BY date",
+            (code, st_row[1] if st_row else "")).fetchall()
+        if not rows:
+            continue
+        dates = [r[0] for r in rows]
+        close = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+        anchor = st_row[3] if st_row and dates[0] == st_row[1] else None
+        confirmed, tentative = find_pivots(close, th, anchor)
+        if not confirmed:
+            continue
+        prev_date, prev_price = (st_row[4], st_row[5]) if anchor is not None else (None, None)
+        for (i0, _), (i1, _) in zip(confirmed[:-1], confirmed[1:]):
+            new_legs.append((code, dates[i0], dates[i1],
+                             round((close[i1] - close[i0]) / close[i0] * 100, 2), th))
+            prev_date, prev_price = dates[i0], float(close[i0])
+        last_i, last_kind = confirmed[-1]
+        tent_date, tent_price = (dates[tentative[0]], float(close[tentative[0]])) if tentative else (None, None)
+        new_state.append((code, th, dates[last_i], float(close[last_i]), last_kind,
+                          prev_date, prev_price, tent_date, tent_price, dates[-1]))
+
+    if new_legs:
+        conn.executemany(
+            "INSERT INTO price_cycles (code, start_date, end_date, change_pct, threshold) VALUES (?,?,?,?,?)",
+            new_legs)
+    if new_state:
+        conn.executemany("""INSERT OR REPLACE INTO cycle_state
+            (code, threshold, pivot_date, pivot_price, pivot_kind, prev_date, prev_price,
+             tent_date, tent_price, last_date) VALUES (?,?,?,?,?,?,?,?,?,?)""", new_state)
+    conn.commit()
+    return len(new_legs)
+
+
+def current_threshold(conn) -> float:
+    """当前使用的反转阈值（取状态表中最常见的一个，没有则用默认值）"""
+    try:
+        row = conn.execute(
+            "SELECT threshold FROM cycle_state GROUP BY threshold ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+        return float(row[0]) if row and row[0] else DEFAULT_THRESHOLD_PCT
+    except Exception:
+        return DEFAULT_THRESHOLD_PCT
+
+
+def cycle_stats(conn) -> dict:
+    """
+    各股票自动周期统计：{code: {up_n, up_avg, up_max, down_n, down_avg, down_max}}
+    （仅统计 threshold 非空的自动识别周期）
+    """
+    rows = conn.execute("""SELECT code,
+            SUM(change_pct > 0), AVG(CASE WHEN change_pct > 0 THEN change_pct END), MAX(change_pct),
+            SUM(change_pct < 0), AVG(CASE WHEN change_pct < 0 THEN change_pct END), MIN(change_pct)
+        FROM price_cycles WHERE threshold IS NOT NULL GROUP BY code""").fetchall()
+    return {
+        r[0]: {"up_n": r[1] or 0, "up_avg": r[2], "up_max": r[3],
+               "down_n": r[4] or 0, "down_avg": r[5], "down_max": r[6]}
+        for r in rows
+    }
+
+
+def reference_points(conn) -> dict:
+    """
+    买卖信号用的最近高点/低点：{code: (high, high_date, low, low_date)}
+    最后确认拐点 + 其后的未确认极值（没有则用上一个拐点）
+    """
+    refs = {}
+    for code, p_date, p_price, p_kind, prev_date, prev_price, t_date, t_price in conn.execute(
+            "SELECT code, pivot_date, pivot_price, pivot_kind, prev_date, prev_price, tent_date, tent_price FROM cycle_state"):
+        other = (t_price, t_date) if t_date else (prev_price, prev_date)
+        if p_kind == PEAK:
+            refs[code] = (p_price, p_date) + other
+        else:
+            refs[code] = other + (p_price, p_date)
+    return refs
@@ -0,0 +1,337 @@
+"""
+性能诊断：SQL / 网络 / 每次重跑的分段耗时。
+  TracedConnection 作为 sqlite3.connect 的 factory，给每条语句（含游标上的 execute 与取数）计时；
+  timed(kind, name) 包住行情抓取、GitHub 同步等网络调用；
+  begin_rerun / lap / end_rerun 记录一次页面重跑里各段的耗时。
+明细放在有界环形缓冲里（只保留最近 N 条），Prometheus 用的累计计数与直方图另行维护。
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# 直方图桶上限（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_WS = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    return _WS.sub(" ", sql).strip()[:300]
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        self.total += v
+        self.count += 1
+        for i, b in enumerate(BUCKETS):
+            if v <= b:
+                self.counts[i] += 1
+                break
+
+
+class Recorder:
+    """进程内唯一的记录器；各会话的脚本线程并发写入，统一加锁"""
+
+    def __init__(self, max_queries=5000, max_calls=1000, max_reruns=500):
+        self.lock = threading.Lock()
+        self.queries = deque(maxlen=max_queries)   # (ts, sql, seconds, phase, rows)  phase: execute / fetch
+        self.calls = deque(maxlen=max_calls)       # (ts, kind, name, seconds, ok)
+        self.reruns = deque(maxlen=max_reruns)     # {ts, page, seconds, status, spans: [(name, seconds)], sql_count, sql_rows, sql_seconds}
+        self.hist = {}                             # {(metric, label): _Histogram}
+        self.errors = {}                           # {(kind, name): count}
+        self._local = threading.local()
+
+    def reset(self):
+        with self.lock:
+            self.queries.clear()
+            self.calls.clear()
+            self.reruns.clear()
+            self.hist.clear()
+            self.errors.clear()
+
+    def _observe(self, metric, label, seconds):
+        h = self.hist.get((metric, label))
+        if h is None:
+            h = self.hist[(metric, label)] = _Histogram()
+        h.observe(seconds)
+
+    # ---- SQL ----
+    def record_query(self, sql, seconds, phase="execute", rows=0):
+        with self.lock:
+            self.queries.append((time.time(), sql, seconds, phase, rows))
+            self._observe("sql", phase, seconds)
+        run = getattr(self._local, "run", None)
+        if run is not None:
+            run["sql_count"] += phase == "execute"
+            run["sql_rows"] += rows
+            run["sql_seconds"] += seconds
+
+    # ---- 网络等外部调用 ----
+    def record_call(self, kind, name, seconds, ok=True):
+        with self.lock:
+            self.calls.append((time.time(), kind, name, seconds, ok))
+            self._observe(kind, name, seconds)
+            if not ok:
+                self.errors[(kind, name)] = self.errors.get((kind, name), 0) + 1
+
+    # ---- 重跑分段 ----
+    def begin_rerun(self, page=""):
+        # 上一轮没走到 end_rerun（被 st.rerun / st.stop 打断）时按中断收尾
+        if getattr(self._local, "run", None) is not None:
+            self.end_rerun(status="interrupted")
+        now = time.perf_counter()
+        self._local.run = {"ts": time.time(), "page": page, "t0": now, "mark": now, "section": "初始化",
+                           "spans": [], "sql_count": 0, "sql_rows": 0, "sql_seconds": 0.0}
+
+    def lap(self, section, page=None):
+        """结束当前分段并开始下一段"""
+        run = getattr(self._local, "run", None)
+        if run is None:
+            return
+        now = time.perf_counter()
+        run["spans"].append((run["section"], now - run["mark"]))
+        run["section"], run["mark"] = section, now
+        if page is not None:
+            run["page"] = page
+
+    def end_rerun(self, status="ok"):
+        run = getattr(self._local, "run", None)
+        if run is None:
+            return
+        self._local.run = None
+        now = time.perf_counter()
+        run["spans"].append((run["section"], now - run["mark"]))
+        total = now - run["t0"]
+        rec = {"ts": run["ts"], "page": run["page"], "seconds": total, "status": status, "spans": run["spans"],
+               "sql_count": run["sql_count"], "sql_rows": run["sql_rows"], "sql_seconds": run["sql_seconds"]}
+        with self.lock:
+            self.reruns.append(rec)
+            self._observe("rerun", run["page"], total)
+
+    # ---- 汇总 ----
+    def query_stats(self, top=20) -> list:
+        """按语句归并：[(sql, 执行次数, 总耗时（含取数）, 执行 p95, 执行最大)]，按总耗时降序"""
+        with self.lock:
+            rows = list(self.queries)
+        by = {}
+        for _, sql, sec, phase, _ in rows:
+            ex, total = by.setdefault(sql, ([], [0.0]))
+            total[0] += sec
+            if phase == "execute":
+                ex.append(sec)
+        out = [(sql, len(ex), total[0], float(np.percentile(ex, 95)) if ex else 0.0, max(ex, default=0.0))
+               for sql, (ex, total) in by.items()]
+        out.sort(key=lambda r: r[2], reverse=True)
+        return out[:top]
+
+    def rerun_stats(self) -> list:
+        """[(页面, 次数, p50, p95, 最大, 平均 SQL 条数)]"""
+        with self.lock:
+            rows = [r for r in self.reruns if r["status"] == "ok"]
+        by = {}
+        for r in rows:
+            by.setdefault(r["page"], []).append(r)
+        out = []
+        for page, rs in by.items():
+            secs = [r["seconds"] for r in rs]
+            out.append((page, len(rs), float(np.percentile(secs, 50)), float(np.percentile(secs, 95)), max(secs),
+                        sum(r["sql_count"] for r in rs) / len(rs)))
+        out.sort(key=lambda r: r[3], reverse=True)
+        return out
+
+    def span_stats(self) -> list:
+        """[(页面, 分段, 次数, 平均, p95)]"""
+        with self.lock:
+            rows = list(self.reruns)
+        by = {}
+        for r in rows:
+            for name, sec in r["spans"]:
+                by.setdefault((r["page"], name), []).append(sec)
+        out = [(p, n, len(v), sum(v) / len(v), float(np.percentile(v, 95))) for (p, n), v in by.items()]
+        out.sort(key=lambda r: r[4], reverse=True)
+        return out
+
+    def call_histogram(self) -> dict:
+        """{(kind, name): ([各桶计数], 次数, 总耗时, 失败次数)}（非累计，便于画直方图）"""
+        with self.lock:
+            return {k: (list(h.counts), h.count, h.total, self.errors.get(k, 0))
+                    for k, h in self.hist.items() if k[0] not in ("sql", "rerun")}
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式（直方图为累计桶）"""
+        lines = []
+        with self.lock:
+            hist = {k: (list(h.counts), h.count, h.total) for k, h in self.hist.items()}
+            errors = dict(self.errors)
+        groups = {}
+        for (metric, label), v in sorted(hist.items()):
+            groups.setdefault(metric, []).append((label, v))
+        names = {"sql": ("stock21_sql_duration_seconds", "phase", "SQLite 语句耗时（执行 / 取数）"),
+                 "rerun": ("stock21_rerun_duration_seconds", "page", "页面重跑总耗时")}
+        for metric, items in groups.items():
+            name, lbl, help_ = names.get(metric, (f"stock21_{metric}_duration_seconds", "target", f"{metric} 调用耗时"))
+            lines.append(f"# HELP {name} {help_}")
+            lines.append(f"# TYPE {name} histogram")
+            for label, (counts, count, total) in items:
+                base = f'{lbl}="{_esc(label)}",' if lbl else ""
+                acc = 0
+                for b, c in zip(BUCKETS, counts):
+                    acc += c
+                    lines.append(f'{name}_bucket{{{base}le="{b}"}} {acc}')
+                lines.append(f'{name}_bucket{{{base}le="+Inf"}} {count}')
+                suffix = f"{{{base[:-1]}}}" if base else ""
+                lines.append(f"{name}_sum{suffix} {total:.6f}")
+                lines.append(f"{name}_count{suffix} {count}")
+        if errors:
+            lines.append("# HELP stock21_call_errors_total 外部调用失败次数")
+            lines.append("# TYPE stock21_call_errors_total counter")
+            for (kind, name), n in sorted(errors.items()):
+                lines.append(f'stock21_call_errors_total{{kind="{_esc(kind)}",target="{_esc(name)}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+def _esc(s):
+    return str(s).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+RECORDER = Recorder()
+
+
+@contextmanager
+def timed(kind: str, name: str, recorder: Recorder = None):
+    """给一次外部调用计时：with timed("network", "eastmoney"): ..."""
+    rec = recorder or RECORDER
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        rec.record_call(kind, name, time.perf_counter() - t0, ok)
+
+
+# ── 带计时的连接 ──────────────────────────────────────────────────────────────
+
+class TracedCursor(sqlite3.Cursor):
+    """execute 计时；随后的 fetch 耗时与取回行数并入同一条语句（直接迭代游标取回的行在迭代结束时一并计入）"""
+
+    _iter_rows = 0
+    _iter_seconds = 0.0
+
+    def _trace(self, fn, sql, *args):
+        self._flush_iter()
+        t0 = time.perf_counter()
+        try:
+            return fn(sql, *args)
+        finally:
+            self._sql = normalize_sql(sql)
+            RECORDER.record_query(self._sql, time.perf_counter() - t0)
+
+    def execute(self, sql, *args):
+        return self._trace(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._trace(super().executemany, sql, *args)
+
+    def _flush_iter(self):
+        """for row in cursor 逐行取回的行数与耗时：迭代结束、下一次 execute / fetch、关闭游标时记一条 fetch"""
+        if self._iter_rows and getattr(self, "_sql", None):
+            RECORDER.record_query(self._sql, self._iter_seconds, "fetch", self._iter_rows)
+        self._iter_rows, self._iter_seconds = 0, 0.0
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._iter_seconds += time.perf_counter() - t0
+            self._flush_iter()
+            raise
+        self._iter_rows += 1
+        self._iter_seconds += time.perf_counter() - t0
+        return row
+
+    def __del__(self):
+        self._flush_iter()
+
+    def close(self):
+        self._flush_iter()
+        super().close()
+
+    def _fetch(self, fn, *args):
+        self._flush_iter()
+        t0 = time.perf_counter()
+        rows = fn(*args)
+        if getattr(self, "_sql", None):
+            RECORDER.record_query(self._sql, time.perf_counter() - t0, "fetch", len(rows))
+        return rows
+
+    def fetchone(self):
+        self._flush_iter()
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        if getattr(self, "_sql", None):
+            RECORDER.record_query(self._sql, time.perf_counter() - t0, "fetch", int(row is not None))
+        return row
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def fetchmany(self, *args):
+        return self._fetch(super().fetchmany, *args)
+
+
+class TracedConnection(sqlite3.Connection):
+    """sqlite3.connect(..., factory=TracedConnection)；连接上的 execute 系列也走计时游标"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+
+# ── Prometheus 端点 ──────────────────────────────────────────────────────────
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", recorder: Recorder = None):
+    """后台线程提供 GET /metrics；端口被占用时返回 None"""
+    rec = recorder or RECORDER
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = rec.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        srv = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f"[diag] metrics server not started: {e}")
+        return None
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="metrics", daemon=True).start()
+    return srv
@@ -0,0 +1,219 @@
+"""
+数据导出：先用 SQLite backup API 取一份一致的快照，再在后台线程里按块写出
+交易流水、成交配对、盈亏账单、复盘日记，格式 CSV（zip）/ Parquet（zip）/ XLSX。
+每次只在内存里保留一块数据；Parquet 需要 pyarrow，XLSX 需要 openpyxl（可选依赖）。
+交易流水与成交配对含已归档的成交（stock21.archive），在快照连接上按需解压。
+"""
+import io
+import itertools
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+
+from stock21.archive import history_table
+from stock21.matching import match_lowest_cost
+from stock21.money import unit_rows, from_units
+from stock21.portfolio import trade_groups, iter_positions
+
+CHUNK_ROWS = 20000
+XLSX_MAX_ROWS = 1_000_000      # 单个工作表上限（Excel 为 1048576 行），超出自动续表
+
+# 数据集：标题、列（名称, 类型）
+DATASETS = {
+    "trades": ("交易流水", [("日期", "str"), ("股票", "str"), ("操作", "str"), ("单价", "float"),
+                          ("数量", "float"), ("成交额", "float"), ("备注", "str")]),
+    "pairs": ("成交配对", [("股票", "str"), ("方向", "str"), ("开仓日期", "str"), ("平仓日期", "str"),
+                         ("开仓价", "float"), ("平仓价", "float"), ("数量", "float"), ("盈亏", "float")]),
+    "pnl": ("盈亏账单", [("股票", "str"), ("累计投入", "float"), ("累计回收", "float"), ("持仓数量", "float"),
+                       ("现价", "float"), ("持仓市值", "float"), ("已实现盈亏", "float"),
+                       ("未实现盈亏", "float"), ("总盈亏", "float")]),
+    "journal": ("复盘日记", [("日期", "str"), ("股票", "str"), ("内容", "str")]),
+}
+FORMATS = {"csv": "CSV（zip）", "parquet": "Parquet（zip）", "xlsx": "Excel（xlsx）"}
+
+
+def snapshot(conn, path: str):
+    """一致性快照：backup API 在一个读事务内复制全部页面"""
+    dst = sqlite3.connect(path)
+    try:
+        conn.backup(dst)
+    finally:
+        dst.close()
+
+
+def snapshot_bytes(conn) -> bytes:
+    """整库快照的字节内容（用于直接下载数据库文件）"""
+    mem = sqlite3.connect(":memory:")
+    try:
+        conn.backup(mem)
+        return mem.serialize()
+    finally:
+        mem.close()
+
+
+# ── 数据集按块产出 ──────────────────────────────────────────────────────────
+
+def _frames(rows, columns, chunk_rows):
+    """把行迭代器切成 DataFrame 块"""
+    names = [c for c, _ in columns]
+    it = iter(rows)
+    while True:
+        batch = list(itertools.islice(it, chunk_rows))
+        if not batch:
+            return
+        yield pd.DataFrame(batch, columns=names)
+
+
+def _pair_rows(snap):
+    for code, rows in trade_groups(snap, table=history_table(snap)):
+        for od, cd, op, cp, q, side in match_lowest_cost(unit_rows(rows)).pairs:      # 定点整数配对
+            pnl = (cp - op) * q if side == "long" else (op - cp) * q
+            yield (code, "多" if side == "long" else "空", od, cd, from_units(op), from_units(cp), q, from_units(pnl))
+
+
+def _pnl_rows(snap):
+    for r in iter_positions(snap):
+        yield (r["code"], r["invested"], r["recovered"], r["quantity"], r["price"], r["market_value"],
+               r["realized"], r["unrealized"], r["total_pnl"])
+
+
+def iter_dataset(snap, name: str, chunk_rows: int = CHUNK_ROWS):
+    columns = DATASETS[name][1]
+    if name == "trades":
+        rows = snap.execute(f"""SELECT substr(date, 1, 10), code, action, price, quantity,
+                                      round(price * quantity, 4), note FROM {history_table(snap)}
+                               ORDER BY date, rowid""")
+    elif name == "pairs":
+        rows = _pair_rows(snap)
+    elif name == "pnl":
+        rows = _pnl_rows(snap)
+    else:
+        rows = snap.execute("SELECT date, stock_name, content FROM journal ORDER BY date, id")
+    yield from _frames(rows, columns, chunk_rows)
+
+
+# ── 各格式写出 ──────────────────────────────────────────────────────────────
+
+def _write_csv(snap, names, path, progress):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name in names:
+            title, columns = DATASETS[name]
+            with zf.open(f"{title}.csv", "w") as raw:
+                text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+                text.write(",".join(c for c, _ in columns) + "\r\n")
+                for df in iter_dataset(snap, name):
+                    df.to_csv(text, header=False, index=False, lineterminator="\r\n")
+                    progress(name, len(df))
+                text.flush()
+                text.detach()
+
+
+def _write_parquet(snap, names, path, progress):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("导出 Parquet 需要安装 pyarrow（pip install pyarrow）")
+    types = {"str": pa.string(), "float": pa.float64()}
+    tmp = tempfile.mkdtemp(prefix="stock21_pq_")
+    try:
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zf:
+            for name in names:
+                title, columns = DATASETS[name]
+                schema = pa.schema([(c, types[t]) for c, t in columns])
+                part = os.path.join(tmp, f"{name}.parquet")
+                with pq.ParquetWriter(part, schema) as w:
+                    wrote = False
+                    for df in iter_dataset(snap, name):
+                        w.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+                        progress(name, len(df))
+                        wrote = True
+                    if not wrote:
+                        w.write_table(schema.empty_table())
+                zf.write(part, f"{title}.parquet")
+                os.remove(part)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _write_xlsx(snap, names, path, progress):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError("导出 Excel 需要安装 openpyxl（pip install openpyxl）")
+    wb = Workbook(write_only=True)       # 只写模式：逐行落盘，不在内存里保留整张表
+    for name in names:
+        title, columns = DATASETS[name]
+        header = [c for c, _ in columns]
+        sheet_no, ws, used = 1, wb.create_sheet(title), 1
+        ws.append(header)
+        for df in iter_dataset(snap, name):
+            for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+                if used >= XLSX_MAX_ROWS:
+                    sheet_no += 1
+                    ws, used = wb.create_sheet(f"{title}_{sheet_no}"), 1
+                    ws.append(header)
+                ws.append(row)
+                used += 1
+            progress(name, len(df))
+    wb.save(path)
+
+
+_WRITERS = {"csv": (_write_csv, "zip"), "parquet": (_write_parquet, "zip"), "xlsx": (_write_xlsx, "xlsx")}
+
+
+# ── 后台任务 ────────────────────────────────────────────────────────────────
+
+class ExportJob:
+    """
+    在调用线程里取快照（保证与界面看到的数据一致），在后台线程里写出文件。
+    status: running / done / failed；rows 为已写出的行数；完成后 path 指向结果文件
+    """
+
+    def __init__(self, conn, names: list, fmt: str):
+        if fmt not in _WRITERS:
+            raise ValueError(f"不支持的格式：{fmt}")
+        self.names, self.fmt = [n for n in DATASETS if n in names], fmt
+        self.dir = tempfile.mkdtemp(prefix="stock21_export_")
+        self.snapshot_path = os.path.join(self.dir, "snapshot.db")
+        snapshot(conn, self.snapshot_path)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.file_name = f"stock21_export_{stamp}.{_WRITERS[fmt][1]}"
+        self.path = os.path.join(self.dir, self.file_name)
+        self.status, self.error, self.rows, self.current = "running", None, 0, None
+        self.started_at, self.seconds = time.time(), None
+        self._thread = threading.Thread(target=self._run, name="export", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _progress(self, name, n):
+        self.current = DATASETS[name][0]
+        self.rows += n
+
+    def _run(self):
+        snap = sqlite3.connect(self.snapshot_path)
+        try:
+            _WRITERS[self.fmt][0](snap, self.names, self.path, self._progress)
+            self.status = "done"
+        except Exception as e:
+            self.status, self.error = "failed", str(e)
+        finally:
+            snap.close()
+            os.remove(self.snapshot_path)
+            self.seconds = round(time.time() - self.started_at, 2)
+
+    def wait(self, timeout: float = None):
+        self._thread.join(timeout)
+        return self
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
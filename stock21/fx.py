@@ -0,0 +1,117 @@
+"""
+多币种：按东方财富 secid 的市场前缀判断各股交易币种，汇率历史存 fx_rates（随行情的同一次批量请求拉取），
+账户层面的汇总统一折算成本位币（人民币）。
+
+折算按日期向量化查表：取当天及之前最近一日的汇率，早于首条记录的日期用首条；
+某币种还没有任何记录时用 DEFAULT_RATES 兜底。汇率表按 (数据库, 当天, 数据版本) 缓存在进程内。
+"""
+from datetime import datetime
+
+import numpy as np
+
+BASE_CURRENCY = "CNY"
+# secid 市场前缀 → 交易币种（0 深市 / 1 沪市 / 116 港股 / 105~107 美股）
+MARKET_CURRENCY = {"0": "CNY", "1": "CNY", "116": "HKD", "105": "USD", "106": "USD", "107": "USD"}
+# 东方财富离岸人民币行情（与个股放在同一个 ulist 请求里），yfinance 兜底
+FX_SECIDS = {"USD": "133.USDCNH", "HKD": "133.HKDCNH"}
+FX_YF = {"USD": "CNY=X", "HKD": "HKDCNY=X"}
+DEFAULT_RATES = {"USD": 7.1, "HKD": 0.91}      # 每 1 单位外币折合人民币；仅在从未取到汇率时使用
+
+_cache = {}                                   # {数据库文件: (版本, FxRates)}
+
+
+def currency_of(secid) -> str:
+    """'116.00981' → 'HKD'；未知或缺失的按本位币处理"""
+    if not secid or "." not in str(secid):
+        return BASE_CURRENCY
+    return MARKET_CURRENCY.get(str(secid).split(".", 1)[0], BASE_CURRENCY)
+
+
+def symbol_currencies(ticker_map: dict) -> dict:
+    """{股票名称: 币种}（ticker_map 为 quotes.build_ticker_map 的结果）"""
+    return {name: currency_of(secid) for name, secid in ticker_map.items()}
+
+
+def ensure_fx_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS fx_rates (
+        currency TEXT, date TEXT, rate REAL, source TEXT, fetched_at TEXT,
+        PRIMARY KEY (currency, date))''')
+    conn.commit()
+
+
+def store_fx_rates(conn, rates: dict, source: str = "eastmoney", date: str = None) -> int:
+    """{币种: 人民币汇率} 写入当天（或 date）一行，同一天重复写入时覆盖"""
+    rows = [(ccy, r) for ccy, r in rates.items() if r and r > 0]
+    if not rows:
+        return 0
+    ensure_fx_tables(conn)
+    now = datetime.now()
+    day = date or now.strftime('%Y-%m-%d')
+    conn.executemany("INSERT OR REPLACE INTO fx_rates (currency, date, rate, source, fetched_at) VALUES (?,?,?,?,?)",
+                     [(ccy, day, float(r), source, now.strftime('%Y-%m-%d %H:%M:%S')) for ccy, r in rows])
+    conn.commit()
+    return len(rows)
+
+
+class FxRates:
+    """按币种排好序的 (日期, 汇率) 数组；rates() 对任意长度的 (币种, 日期) 序列一次查表。只依赖 numpy"""
+
+    def __init__(self, rows):
+        by = {}
+        for ccy, day, rate in sorted(rows):
+            by.setdefault(ccy, ([], []))
+            by[ccy][0].append(day[:10])
+            by[ccy][1].append(rate)
+        self._hist = {c: (np.array(d, dtype="datetime64[D]"), np.array(r, dtype=float)) for c, (d, r) in by.items()}
+
+    @staticmethod
+    def _days(dates, n):
+        if dates is None:
+            return np.full(n, np.datetime64("9999-12-31"))
+        if isinstance(dates, str):
+            return np.full(n, np.datetime64(dates[:10], "D"))
+        if isinstance(dates, np.ndarray) and np.issubdtype(dates.dtype, np.datetime64):
+            return dates.astype("datetime64[D]")
+        return np.array([str(d)[:10] for d in dates], dtype="datetime64[D]")
+
+    def rates(self, currencies, dates=None) -> np.ndarray:
+        """每个 (币种, 日期) 的人民币汇率；dates 为空取最新，也可以是单个日期或与 currencies 等长的序列"""
+        ccy = np.array([c if isinstance(c, str) else BASE_CURRENCY for c in currencies], dtype=object)
+        days = self._days(dates, len(ccy))
+        out = np.ones(len(ccy))
+        for c in set(ccy) - {BASE_CURRENCY}:
+            mask = ccy == c
+            if c not in self._hist:
+                out[mask] = DEFAULT_RATES.get(c, 1.0)
+                continue
+            hd, hr = self._hist[c]
+            idx = np.searchsorted(hd, days[mask], side="right") - 1
+            out[mask] = hr[np.clip(idx, 0, None)]
+        return out
+
+    def rate(self, currency: str, date: str = None) -> float:
+        return float(self.rates([currency], date)[0])
+
+    def convert(self, amounts, currencies, dates=None) -> np.ndarray:
+        return np.asarray(amounts, dtype=float) * self.rates(currencies, dates)
+
+
+def fx_version(conn) -> tuple:
+    """汇率表的轻量版本指纹（行数、最后写入时间）；表未建时为 (0, None)"""
+    try:
+        return tuple(conn.execute("SELECT COUNT(*), MAX(fetched_at) FROM fx_rates").fetchone())
+    except Exception:
+        return (0, None)
+
+
+def load_fx(conn) -> FxRates:
+    """当天的汇率表（表未建或没有数据时全部走兜底汇率）"""
+    db = conn.execute("PRAGMA database_list").fetchone()[2]
+    sig = fx_version(conn)
+    version = (datetime.now().strftime('%Y-%m-%d'),) + sig
+    hit = _cache.get(db)
+    if hit and hit[0] == version:
+        return hit[1]
+    fx = FxRates(conn.execute("SELECT currency, date, rate FROM fx_rates WHERE rate > 0").fetchall() if sig[0] else [])
+    _cache[db] = (version, fx)
+    return fx
@@ -0,0 +1,111 @@
+"""日线历史：东方财富 K 线接口增量拉取，写入 daily_prices 表"""
+import json
+import urllib.request
+from datetime import datetime, timedelta
+
+try:
+    import yfinance as yf
+    _YF_OK = True
+except ImportError:
+    _YF_OK = False
+
+HISTORY_START = "20150101"   # 首次拉取的起始日期（约 10 年）
+MARKET_CLOSE_HOUR = 16       # 本地时间几点后当天日线视为收盘定稿（A 股 / 港股）
+
+
+def ensure_history_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_prices (
+        code TEXT, date TEXT, open REAL, high REAL, low REAL, close REAL, volume REAL,
+        PRIMARY KEY (code, date))''')
+    conn.execute("CREATE TABLE IF NOT EXISTS history_state (key TEXT PRIMARY KEY, value TEXT)")
+    conn.commit()
+
+
+def _fetch_eastmoney_klines(secid: str, beg: str) -> list:
+    """
+    东方财富日 K 线（前复权）。
+    返回 [(date, open, high, low, close, volume), ...]
+    f51=日期 f52=开 f53=收 f54=高 f55=低 f56=成交量
+    """
+    url = (
+        "https://push2his.eastmoney.com/api/qt/stock/kline/get"
+        f"?secid={secid}&fields1=f1,f2,f3&fields2=f51,f52,f53,f54,f55,f56"
+        f"&klt=101&fqt=1&beg={beg}&end=20500101"
+    )
+    try:
+        req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            data = json.loads(resp.read().decode())
+        rows = []
+        for line in (data.get("data") or {}).get("klines") or []:
+            d, o, c, h, l, v = line.split(",")[:6]
+            rows.append((d, float(o), float(h), float(l), float(c), float(v)))
+        return rows
+    except Exception:
+        return []
+
+
+def _fetch_yf_klines(yf_ticker: str, beg: str) -> list:
+    if not (_YF_OK and yf_ticker):
+        return []
+    try:
+        start = datetime.strptime(beg, "%Y%m%d").strftime("%Y-%m-%d")
+        hist = yf.Ticker(yf_ticker).history(start=start, auto_adjust=True)
+        return [
+            (idx.strftime("%Y-%m-%d"), float(r["Open"]), float(r["High"]),
+             float(r["Low"]), float(r["Close"]), float(r["Volume"]))
+            for idx, r in hist.iterrows()
+        ]
+    except Exception:
+        return []
+
+
+def update_daily_history(conn, ticker_map: dict, stock_names: list, yf_map: dict = None) -> int:
+    """
+    增量更新日线：每只股票只拉取库中最新日期之后的数据（最新一天重拉以覆盖盘中值）。
+    返回写入的行数
+    """
+    yf_map = yf_map or {}
+    last_dates = dict(conn.execute("SELECT code, MAX(date) FROM daily_prices GROUP BY code").fetchall())
+    all_rows = []
+    for name in stock_names:
+        last = last_dates.get(name)
+        beg = last.replace("-", "") if last else HISTORY_START
+        rows = []
+        if ticker_map.get(name):
+            rows = _fetch_eastmoney_klines(ticker_map[name], beg)
+        if not rows:
+            rows = _fetch_yf_klines(yf_map.get(name), beg)
+        all_rows.extend((name,) + r for r in rows)
+    if all_rows:
+        conn.executemany(
+            "INSERT OR REPLACE INTO daily_prices (code, date, open, high, low, close, volume) VALUES (?,?,?,?,?,?,?)",
+            all_rows,
+        )
+        # 接口总会返回库中最新那天，拿不到任何数据视为拉取失败，不记刷新时间
+        conn.execute("INSERT OR REPLACE INTO history_state (key, value) VALUES ('refreshed_at', ?)",
+                     (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+        conn.commit()
+    return len(all_rows)
+
+
+def last_close(now: datetime = None) -> datetime:
+    """不晚于 now 的最近一个工作日收盘时刻（MARKET_CLOSE_HOUR 点）"""
+    now = now or datetime.now()
+    t = now.replace(hour=MARKET_CLOSE_HOUR, minute=0, second=0, microsecond=0)
+    if t > now:
+        t -= timedelta(days=1)
+    while t.weekday() >= 5:
+        t -= timedelta(days=1)
+    return t
+
+
+def history_is_stale(conn, now: datetime = None) -> bool:
+    """
+    上次成功刷新早于最近一个工作日收盘（或从未刷新）时返回 True。
+    按刷新时间而不是最新日线的日期判断：周末、节假日没有新日线，不会每个会话都重拉一遍
+    """
+    row = conn.execute("SELECT value FROM history_state WHERE key = 'refreshed_at'").fetchone()
+    if not row or not row[0]:
+        return True
+    return datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S") < last_close(now)
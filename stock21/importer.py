@@ -0,0 +1,245 @@
+"""
+券商交割单批量导入：CSV / Excel 按块流式读取，按列映射方案转换成 trades 行。
+去重按内容哈希（日期、股票、方向、价格、数量）并计出现次数：同一文件重复导入不会多出记录，
+同一天同价同量的多笔成交仍能全部保留。全部插入在一个事务内用 executemany 完成。
+"""
+import csv
+import hashlib
+import io
+import json
+import time
+from collections import Counter
+from datetime import datetime
+
+import pandas as pd
+
+from stock21.archive import history_table
+from stock21.symbols import UPSERT_SYMBOL_SQL
+
+BUY, SELL = "买入", "卖出"
+FIELDS = ["date", "code", "ticker", "action", "price", "quantity", "note"]
+FIELD_LABELS = {"date": "成交日期", "code": "股票名称", "ticker": "证券代码", "action": "买卖方向",
+                "price": "成交价格", "quantity": "成交数量", "note": "备注"}
+REQUIRED = ["date", "action", "price", "quantity"]      # code / ticker 至少一个
+
+# 内置映射方案：每个字段的候选表头（按顺序匹配第一个存在的列）
+BUILTIN_PROFILES = {
+    "通用（自动识别表头）": {
+        "date": ["成交日期", "交易日期", "发生日期", "日期", "date", "trade_date"],
+        "code": ["证券名称", "股票名称", "名称", "name", "stock_name"],
+        "ticker": ["证券代码", "股票代码", "代码", "code", "symbol", "ticker"],
+        "action": ["买卖标志", "操作", "业务名称", "买卖方向", "交易类别", "方向", "action", "side"],
+        "price": ["成交均价", "成交价格", "成交价", "价格", "price"],
+        "quantity": ["成交数量", "成交股数", "数量", "quantity", "qty", "shares"],
+        "note": ["备注", "摘要", "note", "memo"],
+    },
+}
+CHUNK_ROWS = 20000
+
+
+def ensure_import_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS import_profiles (
+        name TEXT PRIMARY KEY, mapping TEXT, updated_at TEXT)''')
+    conn.commit()
+
+
+def list_profiles(conn) -> dict:
+    """内置方案 + 用户保存的方案（用户方案的值是单个表头名）"""
+    out = dict(BUILTIN_PROFILES)
+    for name, mapping in conn.execute("SELECT name, mapping FROM import_profiles ORDER BY name"):
+        out[name] = json.loads(mapping)
+    return out
+
+
+def save_profile(conn, name: str, mapping: dict):
+    conn.execute("INSERT OR REPLACE INTO import_profiles (name, mapping, updated_at) VALUES (?,?,?)",
+                 (name, json.dumps({k: v for k, v in mapping.items() if v}, ensure_ascii=False),
+                  datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    conn.commit()
+
+
+def resolve_mapping(profile: dict, columns: list) -> dict:
+    """方案 → {字段: 实际表头}；候选列表取第一个存在的表头"""
+    cols = {str(c).strip(): c for c in columns}
+    out = {}
+    for field in FIELDS:
+        cands = profile.get(field) or []
+        for cand in [cands] if isinstance(cands, str) else cands:
+            if cand in cols:
+                out[field] = cols[cand]
+                break
+    return out
+
+
+# ── 流式读取 ────────────────────────────────────────────────────────────────
+
+def _sniff_text(head: bytes):
+    """探测编码（国内券商导出多为 GBK）与分隔符"""
+    for enc in ("utf-8-sig", "gbk"):
+        try:
+            text = head.decode(enc)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        enc, text = "gb18030", head.decode("gb18030", errors="ignore")
+    first = text.splitlines()[0] if text else ""
+    try:
+        sep = csv.Sniffer().sniff(first, delimiters=",\t;|").delimiter
+    except csv.Error:
+        sep = ","
+    return enc, sep
+
+
+def iter_chunks(file, filename: str, chunk_rows: int = CHUNK_ROWS):
+    """按块产出 DataFrame（全部按字符串读入）；file 为二进制文件对象"""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise RuntimeError("读取 Excel 需要安装 openpyxl（pip install openpyxl），或先另存为 CSV")
+        ws = load_workbook(file, read_only=True, data_only=True).active
+        rows = ws.iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else f"列{i + 1}" for i, h in enumerate(next(rows, []))]
+        buf = []
+        for r in rows:
+            vals = ["" if v is None else str(v) for v in r[:len(header)]]
+            buf.append(vals + [""] * (len(header) - len(vals)))
+            if len(buf) >= chunk_rows:
+                yield pd.DataFrame(buf, columns=header)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=header)
+        return
+    enc, sep = _sniff_text(file.read(65536))
+    file.seek(0)
+    text = io.TextIOWrapper(file, encoding=enc, errors="replace", newline="")
+    try:
+        for chunk in pd.read_csv(text, sep=sep, dtype=str, chunksize=chunk_rows,
+                                 skipinitialspace=True, keep_default_na=False):
+            chunk.columns = [str(c).strip() for c in chunk.columns]
+            yield chunk
+    finally:
+        text.detach()
+
+
+# ── 转换 ────────────────────────────────────────────────────────────────────
+
+def _clean(s: pd.Series) -> pd.Series:
+    # Excel 防科学计数的 ="600900" 写法、千分位逗号、首尾空白
+    return s.astype(str).str.strip().str.replace(r'^="?|"$', "", regex=True).str.strip()
+
+
+def _to_action(s: pd.Series) -> pd.Series:
+    s = _clean(s).str.lower()
+    buy = s.str.contains("买") | s.isin(["b", "buy", "证券买入"])
+    sell = s.str.contains("卖") | s.isin(["s", "sell", "证券卖出"])
+    return pd.Series(pd.NA, index=s.index, dtype=object).mask(buy & ~sell, BUY).mask(sell & ~buy, SELL)
+
+
+def guess_secid(ticker: str) -> str:
+    """纯代码 → 东方财富 secid（与交易录入页的市场前缀规则一致）"""
+    t = ticker.strip().upper()
+    if "." in t or not t:
+        return t
+    if t.isdigit():
+        if len(t) == 5:
+            return "116." + t
+        return ("1." if t[0] in "5689" else "0.") + t.zfill(6)
+    return "105." + t
+
+
+def normalize_chunk(df: pd.DataFrame, mapping: dict, ticker_names: dict) -> tuple:
+    """
+    一块原始行 → (trades 行 DataFrame, 无效行数, 新股票 {名称: secid})。
+    只保留买入 / 卖出；分红、转账等其他业务及缺字段的行计入无效
+    """
+    n = len(df)
+    col = lambda f: _clean(df[mapping[f]]) if mapping.get(f) else pd.Series("", index=df.index)
+    ticker = col("ticker")
+    name = col("code")
+    secid = ticker.where(ticker == "", ticker.map(lambda t: guess_secid(t) if t else ""))
+    # 没有名称列时按代码反查已录入的股票名称，查不到就用代码本身
+    name = name.where(name != "", secid.map(ticker_names)).fillna(ticker)
+    raw_date = (col("date").str.replace(r"^(\d{4})(\d{2})(\d{2})", r"\1-\2-\3", regex=True)
+                .str.replace(r"[./年月]", "-", regex=True).str.replace("日", ""))
+    date = pd.to_datetime(raw_date, errors="coerce", format="mixed")
+    price = pd.to_numeric(col("price").str.replace(",", ""), errors="coerce")
+    qty = pd.to_numeric(col("quantity").str.replace(",", ""), errors="coerce").abs()
+    note = col("note")
+    out = pd.DataFrame({
+        "date": date.dt.strftime("%Y-%m-%d"), "code": name, "action": _to_action(col("action")),
+        "price": price.round(4), "quantity": qty.round(), "note": note.astype(object).where(note != "", None),
+    })
+    ok = out["date"].notna() & (out["code"] != "") & out["action"].notna() & (out["price"] > 0) & (out["quantity"] > 0)
+    out = out[ok].astype({"quantity": "int64"})
+    new = {}
+    if mapping.get("ticker"):
+        pairs = pd.DataFrame({"name": name, "secid": secid})[ok & (secid != "") & (name != ticker)]
+        new = dict(pairs.drop_duplicates("name").itertuples(index=False, name=None))
+    return out, n - int(ok.sum()), new
+
+
+def content_hash(date, code, action, price, quantity) -> str:
+    return hashlib.md5(f"{date}|{code}|{action}|{float(price):.4f}|{int(quantity)}".encode("utf-8")).hexdigest()
+
+
+# ── 导入 ────────────────────────────────────────────────────────────────────
+
+def import_trades(conn, file, filename: str, mapping: dict, chunk_rows: int = CHUNK_ROWS, progress=None) -> dict:
+    """
+    流式导入：逐块转换、按内容哈希去重，全部插入在同一事务内完成（出错整体回滚）。
+    progress(已读行数) 每块回调一次。返回 {read, inserted, duplicates, invalid, new_stocks, seconds}
+    """
+    if not any(mapping.get(f) for f in ("code", "ticker")) or not all(mapping.get(f) for f in REQUIRED):
+        missing = [FIELD_LABELS[f] for f in REQUIRED if not mapping.get(f)]
+        raise ValueError("列映射不完整：" + "、".join(missing or ["股票名称 / 证券代码"]))
+    t0 = time.perf_counter()
+    existing = Counter(
+        content_hash(*r) for r in conn.execute(
+            f"SELECT substr(date, 1, 10), code, action, price, quantity FROM {history_table(conn)} "
+            "WHERE date IS NOT NULL AND price IS NOT NULL AND quantity IS NOT NULL"))
+    ticker_names = {sid: name for name, sid in conn.execute(
+        "SELECT stock_name, stock_code FROM stock_info WHERE stock_code IS NOT NULL AND stock_code != ''")}
+    seen = Counter()
+    stats = {"read": 0, "inserted": 0, "duplicates": 0, "invalid": 0, "new_stocks": 0}
+    new_stocks = {}
+    try:
+        for chunk in iter_chunks(file, filename, chunk_rows):
+            rows, invalid, new = normalize_chunk(chunk, mapping, ticker_names)
+            stats["read"] += len(chunk)
+            stats["invalid"] += invalid
+            for k, v in new.items():
+                new_stocks.setdefault(k, v)
+            batch = []
+            for r in rows.itertuples(index=False, name=None):
+                h = content_hash(*r[:5])
+                seen[h] += 1
+                # 文件内第 k 次出现的同一内容，库里已有 ≥ k 条即视为重复
+                if seen[h] <= existing[h]:
+                    stats["duplicates"] += 1
+                else:
+                    batch.append(r)
+            if batch:
+                conn.executemany("INSERT INTO trades (date, code, action, price, quantity, note) VALUES (?,?,?,?,?,?)",
+                                 batch)
+                stats["inserted"] += len(batch)
+            if progress:
+                progress(stats["read"])
+        if new_stocks:
+            before = conn.total_changes
+            conn.executemany(UPSERT_SYMBOL_SQL, list(new_stocks.items()))
+            stats["new_stocks"] = conn.total_changes - before
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    stats["seconds"] = round(time.perf_counter() - t0, 2)
+    return stats
+
+
+def preview(file, filename: str, nrows: int = 5):
+    """读取第一块的表头和前几行（用于界面上选择列映射），读完复位文件指针"""
+    chunk = next(iter_chunks(file, filename, chunk_rows=max(nrows, 1)), pd.DataFrame())
+    file.seek(0)
+    return chunk.head(nrows)
@@ -0,0 +1,179 @@
+"""
+进程内共享的成交账本：trades 只读一次，按股票分组连续存放。股票名称、买卖方向为 Categorical（int8 编码），
+价格 float64、数量 int64；offsets 记录每只股票的行区间，取单只股票是 iloc 切片，不做布尔筛选也不拷贝。
+组内保持 (date, id) 顺序，与各页面原先 ORDER BY date, id 的结果一致。
+
+版本取 trade_version(conn)（returns.data_version 的成交部分同此）：trade_version 表里的写入计数由触发器维护——
+trades 每插入一行 inserts 加一，改动成交字段或删除一行、以及归档结转 trade_carry 的任何写入 edits 加一，
+计数存在库里，其他连接 / 进程（CLI 导入、归档）的写入和重新拉取的库同样可见；另附行数、最大 rowid 等内容指纹兜底。
+只追加了新成交时（edits 不变，inserts、行数与最大 rowid 同步增长）只读新增的行并入，其余变化整表重读。
+整表替换（to_sql replace）会丢掉触发器，发现触发器缺失时补建并把 edits 加一，随后整表重读。
+
+账本只含 trades 里仍在用的成交；已归档股票的结转状态（carry）随整表重读一起载入，
+只剩结转、没有在用成交的股票也列在 codes 里（行区间为空），配对时用 start(code) 续算。
+新追加的成交落在某股结转日当天或之前时不并入，整表重读（load_carry 会先恢复该股的归档）。
+"""
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from stock21.archive import load_carry, ensure_archive_tables
+from stock21.matching import BUY, SELL
+
+_SELECT = "SELECT rowid AS _rowid, id, date, code, action, price, quantity, note FROM trades"
+_CONTENT_SQL = "SELECT COUNT(*), MAX(rowid), TOTAL(price * quantity), MAX(date) FROM trades"
+_SIG_SQL = """SELECT v.inserts, v.edits, t.*,
+                     (SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_trade_version_%')
+              FROM trade_version v, (SELECT COUNT(*), MAX(rowid), TOTAL(price * quantity), MAX(date) FROM trades) t"""
+# 触发器：表 → 触发事件；trades 的 UPDATE 只看成交字段（symbol_id 由 stock21.symbols 的触发器回填，不算改动）
+_VERSION_TRIGGERS = {
+    ("trades", "ins"): "AFTER INSERT ON trades BEGIN UPDATE trade_version SET inserts = inserts + 1; END",
+    ("trades", "upd"): "AFTER UPDATE OF date, code, action, price, quantity, note ON trades "
+                       "BEGIN UPDATE trade_version SET edits = edits + 1; END",
+    ("trades", "del"): "AFTER DELETE ON trades BEGIN UPDATE trade_version SET edits = edits + 1; END",
+    ("carry", "ins"): "AFTER INSERT ON trade_carry BEGIN UPDATE trade_version SET edits = edits + 1; END",
+    ("carry", "upd"): "AFTER UPDATE ON trade_carry BEGIN UPDATE trade_version SET edits = edits + 1; END",
+    ("carry", "del"): "AFTER DELETE ON trade_carry BEGIN UPDATE trade_version SET edits = edits + 1; END",
+}
+
+
+def ensure_trade_version(conn):
+    """建 trade_version 计数表与触发器；触发器有缺失（新库、整表替换之后）时补建并把 edits 加一"""
+    ensure_archive_tables(conn)
+    conn.execute("CREATE TABLE IF NOT EXISTS trade_version (id INTEGER PRIMARY KEY CHECK (id = 0), inserts INTEGER, edits INTEGER)")
+    conn.execute("INSERT OR IGNORE INTO trade_version VALUES (0, 0, 0)")
+    have = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_trade_version_%'")}
+    missing = {f"trg_trade_version_{t}_{e}": body for (t, e), body in _VERSION_TRIGGERS.items()
+               if f"trg_trade_version_{t}_{e}" not in have}
+    for name, body in missing.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    if missing:
+        conn.execute("UPDATE trade_version SET edits = edits + 1")
+    conn.commit()
+
+
+def trade_version(conn) -> tuple:
+    """
+    (inserts, edits, 行数, 最大 rowid, 成交额合计, 最新日期, 触发器数)；一条语句。
+    计数表或触发器缺失时先补建；只读连接上无法补建时退回内容指纹（计数位为 None，不走追加并入）
+    """
+    try:
+        sig = tuple(conn.execute(_SIG_SQL).fetchone())
+        if sig[-1] == len(_VERSION_TRIGGERS):
+            return sig
+    except sqlite3.OperationalError:           # 计数表未建
+        pass
+    try:
+        ensure_trade_version(conn)
+        return tuple(conn.execute(_SIG_SQL).fetchone())
+    except sqlite3.OperationalError:           # 只读连接
+        return (None, None) + tuple(conn.execute(_CONTENT_SQL).fetchone()) + (0,)
+
+
+class Ledger:
+    """不可变快照；frame 按股票分组，codes 按首笔成交先后排列"""
+
+    def __init__(self, raw: pd.DataFrame, carry: dict = None):
+        df = raw.assign(price=pd.to_numeric(raw["price"], errors="coerce").fillna(0.0).astype("float64"),
+                        quantity=pd.to_numeric(raw["quantity"], errors="coerce").fillna(0).round().astype("int64"))
+        df = df.sort_values(["date", "id", "_rowid"], kind="stable", na_position="first")
+        self.codes = [c for c in pd.unique(df["code"]) if pd.notna(c)]
+        self.carry = carry or {}
+        live = set(self.codes)
+        self.codes += [c for c in self.carry if c not in live]
+        code = pd.Categorical(df["code"], categories=self.codes)
+        actions = [BUY, SELL] + sorted({a for a in pd.unique(df["action"]) if pd.notna(a)} - {BUY, SELL})
+        order = np.argsort(code.codes, kind="stable")          # 无名称的行（编码 -1）排在最前，不属于任何分组
+        self.frame = df.iloc[order].assign(
+            code=code[order], action=pd.Categorical(df["action"].iloc[order], categories=actions)).reset_index(drop=True)
+        counts = np.bincount(code.codes[code.codes >= 0], minlength=len(self.codes))
+        ends = np.cumsum(counts) + int((code.codes < 0).sum())
+        self.offsets = {c: (int(e - n), int(e)) for c, n, e in zip(self.codes, counts, ends)}
+        self.max_rowid = int(df["_rowid"].max()) if len(df) else 0
+        # 配对引擎的输入直接从列数组切片
+        self._dates = self.frame["date"].to_numpy(dtype=object)
+        self._actions = np.asarray(self.frame["action"].cat.categories, dtype=object)[self.frame["action"].cat.codes]
+        self._prices = self.frame["price"].to_numpy()
+        self._qty = self.frame["quantity"].to_numpy()
+
+    def __len__(self):
+        return len(self.frame)
+
+    def trades(self, code: str) -> pd.DataFrame:
+        """单只股票的成交（视图，按 date, id 排序）；没有成交时为空表"""
+        a, b = self.offsets.get(code, (0, 0))
+        return self.frame.iloc[a:b]
+
+    def rows(self, code: str) -> list:
+        """[(date, action, price, qty), ...]，即 stock21.matching 的输入"""
+        a, b = self.offsets.get(code, (0, 0))
+        return list(zip(self._dates[a:b], self._actions[a:b], self._prices[a:b].tolist(), self._qty[a:b].tolist()))
+
+    def start(self, code: str):
+        """该股归档后的结转状态 {policy: LotMatcher.state()}（stock21.matching 的 start 参数），没有归档时为 None"""
+        c = self.carry.get(code)
+        return c["policies"] if c else None
+
+    @property
+    def action_names(self) -> list:
+        return list(self.frame["action"].cat.categories)
+
+    def columns(self) -> dict:
+        """配对所需的定长列数组（date 为定宽字符串，action 为 int8 编码），供 stock21.parallel 放进共享内存"""
+        return {"date": np.asarray(self._dates, dtype=str),
+                "action": np.asarray(self.frame["action"].cat.codes, dtype=np.int8),
+                "price": np.ascontiguousarray(self._prices, dtype=np.float64),
+                "quantity": np.ascontiguousarray(self._qty, dtype=np.int64)}
+
+    def extend(self, new: pd.DataFrame) -> "Ledger":
+        """并入新追加的成交，返回新快照（不重新读库）"""
+        old = self.frame.assign(code=self.frame["code"].astype(object), action=self.frame["action"].astype(object))
+        return Ledger(pd.concat([old, new], ignore_index=True), self.carry)
+
+
+def _backdated(rows: pd.DataFrame, carry: dict) -> bool:
+    """rows 里有没有落在对应股票结转日当天或之前的成交"""
+    if not carry or rows.empty:
+        return False
+    hit = rows[rows["code"].isin(list(carry))]
+    return any(str(d)[:10] <= carry[c]["through"] for c, d in zip(hit["code"], hit["date"]))
+
+
+class LedgerCache:
+    """跨会话共享的账本持有者（app 中由 st.cache_resource 持有）；current() 每次只查一条指纹语句"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ledger = None
+        self._sig = None
+        self.loads = self.appends = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._sig = None
+
+    def current(self, conn) -> Ledger:
+        sig = trade_version(conn)
+        with self._lock:
+            old, prev = self._ledger, self._sig
+            if old is not None and sig == prev:
+                return old
+            # 只有插入：edits 不变，插入计数、行数、最大 rowid 三者增量一致
+            added = sig[0] - prev[0] if prev and None not in (sig[0], prev[0], sig[3], prev[3]) else 0
+            new = None
+            if added > 0 and sig[1] == prev[1] and sig[2] - prev[2] == added and sig[3] - prev[3] == added:
+                new = pd.read_sql(_SELECT + " WHERE rowid > ?", conn, params=(prev[3],))
+                if _backdated(new, old.carry):
+                    new = None
+            if new is not None:
+                self._ledger = old.extend(new)
+                self.appends += 1
+            else:
+                carry = load_carry(conn)
+                sig = trade_version(conn)          # load_carry 可能刚恢复了归档
+                self._ledger = Ledger(pd.read_sql(_SELECT, conn), carry)
+                self.loads += 1
+            self._sig = sig
+            return self._ledger
@@ -0,0 +1,283 @@
+"""
+成交配对（最低成本优先）：
+  卖出 → 优先平掉价格最低的买入持仓；买入 → 优先回补价格最高的卖空持仓。
+与各页面原先内联的循环规则一致（同价时先开的仓先配对），用堆实现 O(log n) 取仓。
+
+其他配对规则（POLICIES）共用同一个平仓循环，只是未平仓池的数据结构不同：
+  fifo / lifo      → deque 两端取仓，O(1)
+  lowest / hifo    → 以价格为键的堆，O(log n)
+  average          → 只保留数量与总成本的滚动合计（移动平均成本），O(1)
+match_policies 一次扫描成交即可同时得到多种规则的结果，页面切换规则无需重新读库；
+LotMatcher 可导出 / 恢复状态，供 stock21.checkpoints 做检查点；stock21.archive 归档后的结转状态也由 start 参数接着算。
+
+match / match_policies 默认按定点整数配对（stock21.money：价格 1e-4 元、数量整股），
+已实现盈亏与占用金额都是整数累加，结果出口处才折回元；backtest 等直接用 match_lowest_cost 的仍按浮点算。
+移动平均成本的均价本身不是整数，average 规则的均价按整数单位的浮点保存。
+"""
+import heapq
+from collections import deque
+
+from stock21.money import unit_rows, from_units
+
+BUY, SELL = "买入", "卖出"
+
+
+class MatchResult:
+    __slots__ = ("realized", "buy_lots", "sell_lots", "pairs", "max_occupied")
+
+    def __init__(self):
+        self.realized = 0
+        self.buy_lots = []       # 未平仓多头 [(date, price, qty), ...]（按建仓顺序）
+        self.sell_lots = []      # 未平仓空头 [(date, price, qty), ...]
+        self.pairs = []          # 已配对 [(open_date, close_date, open_price, close_price, qty, side), ...]
+        self.max_occupied = 0    # 历史最高占用金额（多空未平仓成本之和的最大值）
+
+    @property
+    def net_qty(self):
+        return sum(q for _, _, q in self.buy_lots) - sum(q for _, _, q in self.sell_lots)
+
+
+def match_lowest_cost(trades) -> MatchResult:
+    """
+    trades: 已按 (date, id) 排序的 (date, action, price, qty) 序列
+    返回 MatchResult；pairs 中 side='long' 表示先买后卖，'short' 表示先卖后买
+    """
+    res = MatchResult()
+    buy_heap, sell_heap = [], []   # 元素 [price_key, seq, date, price, qty]
+    occupied = 0
+    seq = 0
+    for date, action, price, qty in trades:
+        remaining = qty
+        if action == BUY:
+            while remaining > 0 and sell_heap:
+                lot = sell_heap[0]
+                q = min(lot[4], remaining)
+                res.realized += (lot[3] - price) * q
+                res.pairs.append((lot[2], date, lot[3], price, q, "short"))
+                occupied -= lot[3] * q
+                lot[4] -= q
+                remaining -= q
+                if lot[4] <= 0:
+                    heapq.heappop(sell_heap)
+            if remaining > 0:
+                heapq.heappush(buy_heap, [price, seq, date, price, remaining])
+                occupied += price * remaining
+        else:
+            while remaining > 0 and buy_heap:
+                lot = buy_heap[0]
+                q = min(lot[4], remaining)
+                res.realized += (price - lot[3]) * q
+                res.pairs.append((lot[2], date, lot[3], price, q, "long"))
+                occupied -= lot[3] * q
+                lot[4] -= q
+                remaining -= q
+                if lot[4] <= 0:
+                    heapq.heappop(buy_heap)
+            if remaining > 0:
+                heapq.heappush(sell_heap, [-price, seq, date, price, remaining])
+                occupied += price * remaining
+        seq += 1
+        if occupied > res.max_occupied:
+            res.max_occupied = occupied
+    res.buy_lots = [(l[2], l[3], l[4]) for l in sorted(buy_heap, key=lambda l: l[1])]
+    res.sell_lots = [(l[2], l[3], l[4]) for l in sorted(sell_heap, key=lambda l: l[1])]
+    return res
+
+
+# ── 可选配对规则 ────────────────────────────────────────────────────────────
+
+POLICIES = {
+    "lowest": "最低成本优先",
+    "fifo": "先进先出 FIFO",
+    "lifo": "后进先出 LIFO",
+    "hifo": "最高成本优先 HIFO",
+    "average": "移动平均成本",
+}
+DEFAULT_POLICY = "lowest"
+
+
+class _DequeBook:
+    """FIFO / LIFO 未平仓池；仓位为 [seq, date, price, qty]"""
+    __slots__ = ("lots", "lifo")
+
+    def __init__(self, lifo: bool):
+        self.lots, self.lifo = deque(), lifo
+
+    def __bool__(self):
+        return bool(self.lots)
+
+    def push(self, seq, date, price, qty):
+        self.lots.append([seq, date, price, qty])
+
+    def head(self):
+        return self.lots[-1] if self.lifo else self.lots[0]
+
+    def pop(self):
+        self.lots.pop() if self.lifo else self.lots.popleft()
+
+    def open_lots(self):
+        return list(self.lots)
+
+    def restore(self, lots):
+        self.lots = deque(lots)
+
+
+class _HeapBook:
+    """按价格取仓的未平仓池：sign=1 先取最低价，-1 先取最高价；同价时先开的仓先取"""
+    __slots__ = ("heap", "sign")
+
+    def __init__(self, sign: int):
+        self.heap, self.sign = [], sign
+
+    def __bool__(self):
+        return bool(self.heap)
+
+    def push(self, seq, date, price, qty):
+        heapq.heappush(self.heap, (self.sign * price, seq, [seq, date, price, qty]))
+
+    def head(self):
+        return self.heap[0][2]
+
+    def pop(self):
+        heapq.heappop(self.heap)
+
+    def open_lots(self):
+        return sorted((e[2] for e in self.heap), key=lambda l: l[0])
+
+    def restore(self, lots):
+        self.heap = [(self.sign * l[2], l[0], l) for l in lots]
+        heapq.heapify(self.heap)
+
+
+class _AverageBook:
+    """移动平均成本：所有未平仓合并为一笔，日期取最早的建仓日"""
+    __slots__ = ("lot",)
+
+    def __init__(self):
+        self.lot = None
+
+    def __bool__(self):
+        return self.lot is not None
+
+    def push(self, seq, date, price, qty):
+        if self.lot is None:
+            self.lot = [seq, date, price, qty]
+        else:
+            total = self.lot[3] + qty
+            self.lot[2] = (self.lot[2] * self.lot[3] + price * qty) / total
+            self.lot[3] = total
+
+    def head(self):
+        return self.lot
+
+    def pop(self):
+        self.lot = None
+
+    def open_lots(self):
+        return [self.lot] if self.lot else []
+
+    def restore(self, lots):
+        self.lot = lots[0] if lots else None
+
+
+# policy → (多头池, 空头池) 工厂；空头池的取仓方向与多头相反（lowest 回补最高价卖空，hifo 回补最低价卖空）
+_BOOKS = {
+    "lowest": lambda: (_HeapBook(1), _HeapBook(-1)),
+    "hifo": lambda: (_HeapBook(-1), _HeapBook(1)),
+    "fifo": lambda: (_DequeBook(False), _DequeBook(False)),
+    "lifo": lambda: (_DequeBook(True), _DequeBook(True)),
+    "average": lambda: (_AverageBook(), _AverageBook()),
+}
+
+
+class LotMatcher:
+    """
+    可续算的单规则配对引擎：逐笔 feed，随时 result() 取当前结果；
+    state() 导出可 JSON 序列化的全部状态（未平仓池、已实现盈亏、占用金额），from_state() 从检查点接着算
+    """
+    __slots__ = ("policy", "res", "buys", "sells", "occupied", "seq", "keep_pairs")
+
+    def __init__(self, policy: str = DEFAULT_POLICY, keep_pairs: bool = True):
+        if policy not in _BOOKS:
+            raise ValueError(f"未知配对规则：{policy}")
+        self.policy, self.keep_pairs = policy, keep_pairs
+        self.res = MatchResult()
+        self.buys, self.sells = _BOOKS[policy]()
+        self.occupied = 0
+        self.seq = 0
+
+    def feed(self, date, action, price, qty):
+        res = self.res
+        # 买入先回补空头（side=short），卖出先平多头（side=long），剩余部分开新仓
+        book, opp, side = (self.sells, self.buys, "short") if action == BUY else (self.buys, self.sells, "long")
+        remaining = qty
+        while remaining > 0 and book:
+            lot = book.head()
+            q = min(lot[3], remaining)
+            res.realized += (price - lot[2]) * q if side == "long" else (lot[2] - price) * q
+            if self.keep_pairs:
+                res.pairs.append((lot[1], date, lot[2], price, q, side))
+            self.occupied -= lot[2] * q
+            lot[3] -= q
+            remaining -= q
+            if lot[3] <= 0:
+                book.pop()
+        if remaining > 0:
+            opp.push(self.seq, date, price, remaining)
+            self.occupied += price * remaining
+        if self.occupied > res.max_occupied:
+            res.max_occupied = self.occupied
+        self.seq += 1
+
+    def result(self) -> MatchResult:
+        self.res.buy_lots = [(l[1], l[2], l[3]) for l in self.buys.open_lots()]
+        self.res.sell_lots = [(l[1], l[2], l[3]) for l in self.sells.open_lots()]
+        return self.res
+
+    def state(self) -> dict:
+        return {"policy": self.policy, "seq": self.seq, "realized": self.res.realized,
+                "max_occupied": self.res.max_occupied, "occupied": self.occupied,
+                "buys": [list(l) for l in self.buys.open_lots()], "sells": [list(l) for l in self.sells.open_lots()]}
+
+    @classmethod
+    def from_state(cls, state: dict, keep_pairs: bool = True) -> "LotMatcher":
+        m = cls(state["policy"], keep_pairs)
+        m.seq, m.occupied = state["seq"], state["occupied"]
+        m.res.realized, m.res.max_occupied = state["realized"], state["max_occupied"]
+        m.buys.restore([list(l) for l in state["buys"]])
+        m.sells.restore([list(l) for l in state["sells"]])
+        return m
+
+
+def result_in_yuan(res: MatchResult) -> MatchResult:
+    """按定点整数配对的结果（价格、金额为 1e-4 元单位）原地折回元"""
+    res.realized, res.max_occupied = from_units(res.realized), from_units(res.max_occupied)
+    res.buy_lots = [(d, from_units(p), q) for d, p, q in res.buy_lots]
+    res.sell_lots = [(d, from_units(p), q) for d, p, q in res.sell_lots]
+    res.pairs = [(od, cd, from_units(op), from_units(cp), q, side) for od, cd, op, cp, q, side in res.pairs]
+    return res
+
+
+def match_policies(trades, policies=(DEFAULT_POLICY,), exact: bool = True, keep_pairs: bool = True,
+                   start: dict = None) -> dict:
+    """
+    一次扫描 trades（同 match_lowest_cost 的输入），同时按多种规则配对。
+    返回 {policy: MatchResult}；lowest 的结果与 match_lowest_cost 完全一致。
+    exact=True 时按定点整数配对（见模块说明），False 时直接用传入的数值；keep_pairs=False 时不保留配对明细。
+    start 为 {policy: LotMatcher.state()}（定点整数）时各规则从该状态续算
+    """
+    engines = [LotMatcher.from_state(start[p], keep_pairs) if start and p in start else LotMatcher(p, keep_pairs)
+               for p in policies]
+    for date, action, price, qty in (unit_rows(trades) if exact else trades):
+        for e in engines:
+            e.feed(date, action, price, qty)
+    return {e.policy: result_in_yuan(e.result()) if exact else e.result() for e in engines}
+
+
+def match(trades, policy: str = DEFAULT_POLICY, exact: bool = True, start: dict = None) -> MatchResult:
+    """按单一规则配对；默认规则且没有续算起点时走 match_lowest_cost 的专用实现"""
+    if policy != DEFAULT_POLICY or start:
+        return match_policies(trades, (policy,), exact, start=start)[policy]
+    if not exact:
+        return match_lowest_cost(trades)
+    return result_in_yuan(match_lowest_cost(unit_rows(trades)))
@@ -0,0 +1,61 @@
+"""
+定点金额：价格按 1e-4 元为单位的整数（SCALE），数量为整数股。
+
+库里的 price 仍是 REAL（页面、导入导出、GitHub 同步都按它读写），进入配对 / 汇总前统一换成整数，
+累加全程是整数运算（Python int 不会溢出，批量汇总用 int64 数组），到展示前才除回浮点；
+旧数据由 migrate_ledger 一次性规整到 1e-4 网格，数量规整为整数。
+"""
+SCALE = 10_000
+LEDGER_VERSION = 1                 # PRAGMA user_version：已规整过的账本版本
+
+
+def to_units(x) -> int:
+    """元 → 1e-4 元整数"""
+    return int(round(float(x or 0.0) * SCALE))
+
+
+def from_units(n) -> float:
+    return n / SCALE
+
+
+def units_array(values):
+    """价格序列 → int64 数组（批量版 to_units）"""
+    import numpy as np
+    return np.rint(np.nan_to_num(np.asarray(values, dtype=float)) * SCALE).astype(np.int64)
+
+
+def qty_array(values):
+    """数量序列 → int64 数组"""
+    import numpy as np
+    return np.rint(np.nan_to_num(np.asarray(values, dtype=float))).astype(np.int64)
+
+
+def unit_rows(trades):
+    """(date, action, price, qty) → (date, action, 价格整数, 数量整数)"""
+    for d, a, p, q in trades:
+        yield d, a, to_units(p), int(round(float(q or 0)))
+
+
+def mark_to_market(buy_lots, sell_lots, price) -> float:
+    """未平仓批次按现价的浮动盈亏（多头 (现价 - 成本) × 数量，空头相反），整数累加"""
+    now = to_units(price)
+    return from_units(sum((now - to_units(p)) * int(round(q)) for _, p, q in buy_lots)
+                      + sum((to_units(p) - now) * int(round(q)) for _, p, q in sell_lots))
+
+
+def migrate_ledger(conn) -> int:
+    """把已有的 trades / prices 规整到定点网格（只做一次，以 user_version 记录）；返回改动行数"""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= LEDGER_VERSION:
+        return 0
+    n = conn.execute("UPDATE trades SET price = round(price, 4) WHERE price <> round(price, 4)").rowcount
+    n += conn.execute("""UPDATE trades SET quantity = CAST(round(quantity) AS INTEGER)
+                         WHERE quantity IS NOT NULL AND typeof(quantity) <> 'integer'""").rowcount
+    n += conn.execute("""UPDATE prices SET current_price = round(current_price, 4), manual_cost = round(manual_cost, 4)
+                         WHERE current_price <> round(current_price, 4) OR manual_cost <> round(manual_cost, 4)""").rowcount
+    try:
+        conn.execute("DELETE FROM match_checkpoints")      # 旧检查点按浮点状态保存
+    except Exception:
+        pass
+    conn.execute(f"PRAGMA user_version = {LEDGER_VERSION}")
+    conn.commit()
+    return n
@@ -0,0 +1,313 @@
+"""
+账户净值重建：由 trades + daily_prices 逐日还原每只股票及整个账户的
+持仓数量、市值、累计投入/回收与累计盈亏，物化到 nav_daily / nav_portfolio。
+
+增量规则：nav_daily 的交易日行记有当日成交的摘要（trade_digest）。
+每次更新只从「最早一处摘要不一致的日期」与「上次算到的最后一天」两者
+中较早的那天开始重算，之前的行保持不动。
+成交含已归档的部分（stock21.archive.history_table），归档前后摘要不变，不会引起重算。
+"""
+import hashlib
+from itertools import groupby
+
+import numpy as np
+import pandas as pd
+
+from stock21.archive import history_table
+from stock21.fx import BASE_CURRENCY
+
+BUY, SELL = "买入", "卖出"
+
+
+def ensure_nav_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS nav_daily (
+        code TEXT, date TEXT, quantity REAL, close REAL, market_value REAL,
+        invested REAL, recovered REAL, pnl REAL, trade_digest TEXT,
+        PRIMARY KEY (code, date))''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS nav_portfolio (
+        date TEXT PRIMARY KEY, market_value REAL, invested REAL, recovered REAL,
+        pnl REAL, positions INTEGER)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nav_daily_date ON nav_daily (date)")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_nav_daily_digest ON nav_daily (code, date, trade_digest)
+                    WHERE trade_digest IS NOT NULL""")
+    # last_date：上次算到的最后一天；hist_start：当时该股最早一天日线（日线往前回补时触发整只重算）
+    conn.execute('''CREATE TABLE IF NOT EXISTS nav_state (
+        code TEXT PRIMARY KEY, last_date TEXT, hist_start TEXT)''')
+    # twr_index：时间加权净值指数（起点 1.0）；exposure：多空持仓市值绝对值之和。新增列时清空 nav_state 以触发全部重算
+    added = False
+    for col_sql in [
+        "ALTER TABLE nav_daily ADD COLUMN twr_index REAL",
+        "ALTER TABLE nav_portfolio ADD COLUMN twr_index REAL",
+        "ALTER TABLE nav_portfolio ADD COLUMN exposure REAL",
+    ]:
+        try:
+            conn.execute(col_sql)
+            added = True
+        except Exception:
+            pass
+    if added:
+        conn.execute("DELETE FROM nav_state")
+    conn.commit()
+
+
+def _load_trades(conn, table: str = None) -> pd.DataFrame:
+    df = pd.read_sql(f"SELECT code, date, action, price, quantity FROM {table or history_table(conn)}", conn)
+    df = df[df["action"].isin([BUY, SELL]) & df["date"].notna()].copy()
+    df["date"] = df["date"].astype(str).str[:10]
+    df["price"] = df["price"].astype(float)
+    df["quantity"] = df["quantity"].astype(float)
+    return df
+
+
+def _day_digests(trades: pd.DataFrame) -> dict:
+    """{(code, date): digest}，同一天成交的顺序不影响摘要"""
+    if trades.empty:
+        return {}
+    key = (trades["action"] + "," + trades["price"].map("{:.6f}".format)
+           + "," + trades["quantity"].map("{:.6f}".format))
+    rows = sorted(zip(trades["code"], trades["date"], key))
+    return {
+        cd: hashlib.md5("|".join(r[2] for r in grp).encode("utf-8")).hexdigest()[:16]
+        for cd, grp in groupby(rows, key=lambda r: (r[0], r[1]))
+    }
+
+
+def _recompute_start(code, first_trade, state, stored, current, hist_starts, rebuild):
+    """该股需要重算的起始日期"""
+    if rebuild or code not in state or hist_starts.get(code) != state[code][1]:
+        return first_trade
+    start = state[code][0]
+    stored_c, current_c = stored.get(code, {}), current.get(code, {})
+    diff = [d for d in set(stored_c) | set(current_c) if stored_c.get(d) != current_c.get(d)]
+    if diff:
+        start = min(start, min(diff))
+    return start
+
+
+def _opening(qty, buys, sells):
+    """当日开仓额：收盘为多头计买入额、为空头计卖出额；收盘空仓时只计当日来回成交的部分"""
+    return np.where(qty > 0, buys, np.where(qty < 0, sells, np.minimum(buys, sells)))
+
+
+def _twr_index(df: pd.DataFrame, key: str, prev: pd.DataFrame) -> pd.Series:
+    """
+    时间加权净值指数：逐日子区间收益 r = 当日盈亏变化 / (前一日持仓市值绝对值 + 当日开仓额) 连乘。
+    df 含 exposure / opening / pnl，按 key、日期排序；prev 为各组重算起点前一行的 exposure / pnl / twr_index
+    """
+    first = ~df[key].duplicated()
+    p = prev.astype(float).reindex(df[key].to_numpy()).set_axis(df.index)
+    g = df.groupby(key, sort=False)
+    prev_exp = g["exposure"].shift().where(~first, p["exposure"]).fillna(0.0)
+    dpnl = g["pnl"].diff().where(~first, df["pnl"] - p["pnl"].fillna(0.0))
+    base = prev_exp + df["opening"]
+    r = (dpnl / base.where(base > 0)).fillna(0.0).clip(lower=-0.9999)
+    return p["twr_index"].fillna(1.0) * np.exp(np.log1p(r).groupby(df[key], sort=False).cumsum())
+
+
+def _nav_frame(conn, trades: pd.DataFrame, starts: dict, digests: dict) -> pd.DataFrame:
+    """
+    各股从各自 start 起的逐日净值。所有股票拼成一张长表后按 code 分组累加，
+    start 之前的成交折算为期初值
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _nav_starts (code TEXT PRIMARY KEY, start TEXT)")
+    conn.execute("DELETE FROM _nav_starts")
+    conn.executemany("INSERT INTO _nav_starts VALUES (?, ?)", list(starts.items()))
+    closes = pd.read_sql(
+        """SELECT p.code, p.date, p.close
+           FROM _nav_starts s CROSS JOIN daily_prices p ON p.code = s.code AND p.date >= s.start""", conn).astype({"close": float})
+    prev_close = dict(conn.execute(
+        """SELECT s.code, (SELECT close FROM daily_prices WHERE code = s.code AND date < s.start
+                           ORDER BY date DESC LIMIT 1) FROM _nav_starts s""").fetchall())
+
+    buy = trades["action"] == BUY
+    t = trades.assign(
+        start=trades["code"].map(starts),
+        dq=np.where(buy, trades["quantity"], -trades["quantity"]),
+        buy=np.where(buy, trades["price"] * trades["quantity"], 0.0),
+        sell=np.where(buy, 0.0, trades["price"] * trades["quantity"]),
+    )
+    first = t.drop_duplicates("code").set_index("code")["date"]   # trades 已按日期排序
+    before, after = t[t["date"] < t["start"]], t[t["date"] >= t["start"]]
+    base = before.groupby("code")[["dq", "buy", "sell"]].sum()
+    base_px = before.groupby("code")["price"].last()
+    day = after.groupby(["code", "date"]).agg(
+        dq=("dq", "sum"), buy=("buy", "sum"), sell=("sell", "sum"), px=("price", "last"))
+
+    keys = pd.concat([closes[["code", "date"]], day.index.to_frame(index=False)]).drop_duplicates()
+    keys = keys[keys["date"] >= keys["code"].map(first)].sort_values(["code", "date"])
+    idx = pd.MultiIndex.from_frame(keys)
+    codes = idx.get_level_values("code")
+    day = day.reindex(idx)
+
+    cum = day[["dq", "buy", "sell"]].fillna(0.0).groupby(level="code").cumsum()
+    cum += base.reindex(codes).fillna(0.0).to_numpy()
+    # 收盘价缺失（停牌、无日线）时先沿用前一收盘，再退回最近一笔成交价
+    close = closes.set_index(["code", "date"])["close"].reindex(idx).groupby(level="code").ffill()
+    close = close.fillna(pd.Series(codes.map(prev_close), index=idx, dtype=float))
+    close = close.fillna(day["px"].groupby(level="code").ffill())
+    close = close.fillna(pd.Series(codes.map(base_px), index=idx, dtype=float)).fillna(0.0).astype(float)
+
+    mv = cum["dq"] * close
+    out = pd.DataFrame({
+        "code": codes, "date": idx.get_level_values("date"), "quantity": cum["dq"].values,
+        "close": close.values, "market_value": mv.values, "invested": cum["buy"].values,
+        "recovered": cum["sell"].values, "pnl": (cum["sell"] + mv - cum["buy"]).values,
+        "trade_digest": [digests.get(k) for k in idx],
+    })
+    prev = pd.read_sql(
+        """SELECT n.code, ABS(n.market_value) AS exposure, n.pnl, n.twr_index
+           FROM _nav_starts s CROSS JOIN nav_daily n ON n.code = s.code
+            AND n.date = (SELECT MAX(date) FROM nav_daily WHERE code = s.code AND date < s.start)""",
+        conn).set_index("code")
+    opening = _opening(cum["dq"].values, day["buy"].fillna(0.0).values, day["sell"].fillna(0.0).values)
+    out["twr_index"] = _twr_index(out.assign(exposure=mv.abs().values, opening=opening), "code", prev).values
+    return out
+
+
+def _aggregate(wide: pd.DataFrame, rates=None) -> pd.DataFrame:
+    """
+    各股逐日宽表（列为 (字段, code)，已补齐）按日合计出账户的金额、持仓数、exposure 与当日开仓额；
+    rates 为与各字段同形状的逐日汇率矩阵，给出时先折成本位币再合计
+    """
+    k = 1.0 if rates is None else rates
+    qty = wide["quantity"].fillna(0.0)
+    out = pd.DataFrame({c: (wide[c] * k).sum(axis=1) for c in ["market_value", "invested", "recovered", "pnl"]})
+    out["positions"] = (qty != 0).sum(axis=1)
+    out["exposure"] = (wide["market_value"].abs() * k).sum(axis=1)
+    # 各股当日开仓额（由补齐后的累计投入/回收差分得到）折算后再合计
+    buys = wide["invested"].diff().fillna(wide["invested"]).fillna(0.0)
+    sells = wide["recovered"].diff().fillna(wide["recovered"]).fillna(0.0)
+    out["opening"] = (_opening(qty.values, buys.values, sells.values) * k).sum(axis=1)
+    return out
+
+
+def _update_portfolio(conn, start: str):
+    """
+    按日汇总 nav_daily（原币直接相加，全部是人民币计价时即本位币；含外币时由 portfolio_in_base 另行折算）；
+    各股日历不一致（停牌、不同市场）时用各自最近一天的值补齐
+    """
+    cols = ["market_value", "invested", "recovered", "pnl", "quantity"]
+    df = pd.read_sql(
+        f"""SELECT n.code, n.date, {', '.join('n.' + c for c in cols)} FROM nav_state s
+            CROSS JOIN nav_daily n ON n.code = s.code
+             AND n.date = (SELECT MAX(date) FROM nav_daily WHERE code = s.code AND date < ?)
+            UNION ALL
+            SELECT code, date, {', '.join(cols)} FROM nav_daily WHERE date >= ?""",
+        conn, params=(start, start))
+    conn.execute("DELETE FROM nav_portfolio WHERE date >= ?", (start,))
+    if df.empty:
+        return
+    wide = df.pivot(index="date", columns="code", values=cols).sort_index().ffill()
+    out = _aggregate(wide)
+    out = out[out.index >= start].assign(key=0)
+    prev = pd.read_sql("SELECT 0 AS key, exposure, pnl, twr_index FROM nav_portfolio "
+                       "WHERE date < ? ORDER BY date DESC LIMIT 1", conn, params=(start,)).set_index("key")
+    out["twr_index"] = _twr_index(out, "key", prev).values
+    conn.executemany(
+        """INSERT OR REPLACE INTO nav_portfolio (date, market_value, invested, recovered, pnl, positions, exposure, twr_index)
+           VALUES (?,?,?,?,?,?,?,?)""",
+        [(d, float(r.market_value), float(r.invested), float(r.recovered), float(r.pnl), int(r.positions),
+          float(r.exposure), float(r.twr_index))
+         for d, r in zip(out.index, out.itertuples(index=False))])
+
+
+def update_nav(conn, rebuild: bool = False, table: str = None) -> int:
+    """
+    增量物化净值表。rebuild=True 时全部重算（例如前复权日线整体调整之后）；
+    table 为完整成交历史的表名（已由调用方取得 history_table 时传入）。返回重写的 nav_daily 行数
+    """
+    trades = _load_trades(conn, table).sort_values("date", kind="stable")
+    digests = _day_digests(trades)
+    current = {}
+    for (code, date), dg in digests.items():
+        current.setdefault(code, {})[date] = dg
+    stored = {}
+    for code, date, dg in conn.execute("SELECT code, date, trade_digest FROM nav_daily WHERE trade_digest IS NOT NULL"):
+        stored.setdefault(code, {})[date] = dg
+    state = {r[0]: (r[1], r[2]) for r in conn.execute("SELECT code, last_date, hist_start FROM nav_state")}
+    hist_starts = dict(conn.execute(
+        "SELECT s.code, (SELECT MIN(date) FROM daily_prices WHERE code = s.code) FROM nav_state s").fetchall())
+
+    first = trades.drop_duplicates("code").set_index("code")["date"].to_dict()   # 各股首笔成交日
+    starts = {}
+    for code in set(state) - set(first):           # 交易已被全部删除的股票
+        starts[code] = conn.execute("SELECT MIN(date) FROM nav_daily WHERE code = ?", (code,)).fetchone()[0] or state[code][0]
+    for code, first_trade in first.items():
+        starts[code] = _recompute_start(code, first_trade, state, stored, current, hist_starts, rebuild)
+    if not starts:
+        return 0
+
+    new = _nav_frame(conn, trades, {c: starts[c] for c in first}, digests) if first else pd.DataFrame()
+    with conn:
+        conn.executemany("DELETE FROM nav_daily WHERE code = ? AND date >= ?", list(starts.items()))
+        for code in set(starts) - set(first):
+            conn.execute("DELETE FROM nav_daily WHERE code = ?", (code,))
+            conn.execute("DELETE FROM nav_state WHERE code = ?", (code,))
+        if not new.empty:
+            conn.executemany(
+                """INSERT OR REPLACE INTO nav_daily
+                   (code, date, quantity, close, market_value, invested, recovered, pnl, trade_digest, twr_index)
+                   VALUES (?,?,?,?,?,?,?,?,?,?)""",
+                new.astype(object).where(new.notna(), None).itertuples(index=False, name=None))
+            last = new.groupby("code")["date"].max()
+            conn.executemany(
+                """INSERT OR REPLACE INTO nav_state (code, last_date, hist_start)
+                   VALUES (?, ?, (SELECT MIN(date) FROM daily_prices WHERE code = ?))""",
+                [(code, d, code) for code, d in last.items()])
+        _update_portfolio(conn, min(starts.values()))
+    return len(new)
+
+
+def portfolio_in_base(conn, fx, currencies: dict):
+    """
+    含外币股票时，账户逐日曲线（market_value / invested / recovered / pnl / positions / exposure / twr_index，日期索引）
+    按各股币种、逐日汇率折成人民币后重新合计，时间加权指数也由折算后的盈亏与 exposure 连乘（补齐方式同 _update_portfolio）；
+    全部是人民币计价时 nav_portfolio 本身就是本位币，返回 None
+    """
+    codes = [r[0] for r in conn.execute("SELECT code FROM nav_state")]
+    if fx is None or all((currencies or {}).get(c, BASE_CURRENCY) == BASE_CURRENCY for c in codes):
+        return None
+    cols = ["market_value", "invested", "recovered", "pnl", "quantity"]
+    df = pd.read_sql(f"SELECT code, date, {', '.join(cols)} FROM nav_daily", conn)
+    if df.empty:
+        return pd.DataFrame(columns=cols[:4] + ["positions", "exposure", "twr_index"])
+    wide = df.pivot(index="date", columns="code", values=cols).sort_index().ffill().fillna(0.0)
+    codes = wide["pnl"].columns
+    days = np.repeat(wide.index.to_numpy(dtype="datetime64[D]"), len(codes))
+    rates = fx.rates([currencies.get(c) for c in codes] * len(wide), days).reshape(len(wide), len(codes))
+    out = _aggregate(wide, rates).assign(key=0)
+    out["twr_index"] = _twr_index(out, "key", pd.DataFrame(columns=["exposure", "pnl", "twr_index"])).values
+    return out.drop(columns=["opening", "key"])
+
+
+def load_equity_curve(conn, code: str = None, fx=None, currencies: dict = None) -> pd.DataFrame:
+    """
+    净值曲线（日期索引）：market_value / invested / recovered / pnl / twr_index / drawdown；code 为空时为整个账户。
+    账户曲线给出 fx（stock21.fx.FxRates）与 {股票: 币种} 时，金额与时间加权指数按当日汇率折成人民币计算
+    """
+    if code:
+        df = pd.read_sql("SELECT date, market_value, invested, recovered, pnl, twr_index FROM nav_daily WHERE code = ? ORDER BY date",
+                         conn, params=(code,))
+    else:
+        base = portfolio_in_base(conn, fx, currencies)
+        if base is None:
+            df = pd.read_sql("SELECT date, market_value, invested, recovered, pnl, positions, twr_index FROM nav_portfolio ORDER BY date", conn)
+        else:
+            df = base.drop(columns="exposure").rename_axis("date").reset_index()
+    df["date"] = pd.to_datetime(df["date"])
+    df = df.set_index("date")
+    # 账户无现金账户可依，回撤按累计盈亏距历史最高点的金额计算
+    df["drawdown"] = df["pnl"] - df["pnl"].cummax()
+    return df
+
+
+def monthly_pnl(curve: pd.DataFrame) -> pd.DataFrame:
+    """月度盈亏日历：行=年，列=1..12 月，值=当月累计盈亏的变化"""
+    if curve.empty:
+        return pd.DataFrame()
+    month_end = curve["pnl"].resample("ME").last().dropna()
+    change = month_end.diff()
+    change.iloc[0] = month_end.iloc[0]
+    cal = change.to_frame("pnl")
+    cal["year"], cal["month"] = cal.index.year, cal.index.month
+    return cal.pivot(index="year", columns="month", values="pnl").reindex(columns=range(1, 13))
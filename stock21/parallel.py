@@ -0,0 +1,214 @@
+"""
+按股票并行配对：账本（stock21.ledger.Ledger）的列数组——日期、方向编码、价格、数量——放进一块共享内存，
+工作进程按名称挂载后直接切片；提交给进程池的只有共享内存名、列布局和各自负责的行区间，成交本身不经 pickle。
+各股每种规则的 MatchResult 回传主进程。
+
+进程间调度有固定开销，小账本反而更慢：成交不足 PARALLEL_MIN_TRADES 笔、股票少于 PARALLEL_MIN_SYMBOLS 只、
+或工作进程数为 1 时，直接在本进程逐只计算。进程池以 spawn 方式启动（页面进程是多线程的，不宜 fork），进程内复用；
+池不可用时退回单进程。
+
+进程池默认不启用（MAX_WORKERS 为 1）：目前只有单核机器上的实测（2 个工作进程：1 万笔 × 40 只时连同建池
+602 ms 对单进程 112 ms，6 万笔 × 40 只 730 对 732 ms，20 万笔 × 200 只 2628 对 2552 ms），多核上的加速比与交叉点尚未实测。
+多核机器上先用
+python -m benchmarks.run --sizes 10000x40,60000x40,200000x200 --kernels ledger_match_serial,ledger_match_parallel
+测出进程池开始快于单进程的规模，再用环境变量 STOCK21_WORKERS（工作进程数）、STOCK21_PARALLEL_MIN_TRADES、
+STOCK21_PARALLEL_MIN_SYMBOLS 打开并设定阈值。
+
+spawn 默认会在子进程里重新执行 __main__，而 Streamlit 下的 __main__ 就是 app.py 本身。
+工作进程改由 _WorkerContext 启动：准备数据里不带主模块，子进程只按需 import 本模块（可导入的入口），
+不读也不改进程级的 sys.modules["__main__"]，页面线程不受影响；建池时一次性启动全部工作进程。
+"""
+import atexit
+import io
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import context, reduction, shared_memory, spawn, util
+
+import numpy as np
+
+from stock21.matching import match_policies, DEFAULT_POLICY
+
+PARALLEL_MIN_TRADES = int(os.getenv("STOCK21_PARALLEL_MIN_TRADES", "50000"))
+PARALLEL_MIN_SYMBOLS = int(os.getenv("STOCK21_PARALLEL_MIN_SYMBOLS", "32"))
+SHARDS_PER_WORKER = 4          # 分片数为进程数的几倍，按行数装箱，避免大股票拖慢整批
+MAX_WORKERS = int(os.getenv("STOCK21_WORKERS", "1")) or 1     # 默认单进程，见模块说明
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+_blocks = weakref.WeakKeyDictionary()     # Ledger → _SharedColumns（账本被替换回收时释放共享内存）
+_attached = {}                            # 工作进程内：共享内存名 → (SharedMemory, {列名: ndarray})
+
+
+class _SharedColumns:
+    """主进程持有的共享内存块；layout 为 [(列名, dtype, 偏移, 长度)]"""
+
+    def __init__(self, arrays: dict):
+        self.shm = shared_memory.SharedMemory(create=True, size=max(sum(a.nbytes for a in arrays.values()), 1))
+        self.layout, off = [], 0
+        for name, a in arrays.items():
+            np.ndarray(a.shape, a.dtype, buffer=self.shm.buf, offset=off)[:] = a
+            self.layout.append((name, a.dtype.str, off, len(a)))
+            off += a.nbytes
+        self.name = self.shm.name
+        weakref.finalize(self, _release, self.shm)
+
+
+def _release(shm):
+    try:
+        shm.close()
+        shm.unlink()
+    except Exception:
+        pass
+
+
+def _share(ledger) -> _SharedColumns:
+    block = _blocks.get(ledger)
+    if block is None:
+        block = _SharedColumns(ledger.columns())
+        _blocks[ledger] = block
+    return block
+
+
+def _attach(name: str, layout) -> dict:
+    """
+    工作进程内挂载共享内存（只保留最近一块：账本重读后旧块已由主进程释放）。
+    spawn 出来的工作进程与主进程共用同一个 resource_tracker，挂载不会另行登记，由主进程负责 unlink
+    """
+    hit = _attached.get(name)
+    if hit:
+        return hit[1]
+    for old in list(_attached):
+        shm, cols = _attached.pop(old)
+        del cols
+        try:
+            shm.close()
+        except BufferError:
+            pass
+    shm = shared_memory.SharedMemory(name=name)
+    cols = {n: np.ndarray((ln,), np.dtype(dt), buffer=shm.buf, offset=off) for n, dt, off, ln in layout}
+    _attached[name] = (shm, cols)
+    return cols
+
+
+def _match_shard(name, layout, actions, shard, policies, exact, keep_pairs, starts):
+    """工作进程：shard 为 [(code, 起始行, 结束行)]，starts 为各股归档结转状态；返回 {code: {policy: MatchResult}}"""
+    cols = _attach(name, layout)
+    d, a, p, q = cols["date"], cols["action"], cols["price"], cols["quantity"]
+    acts = np.asarray(actions, dtype=object)
+    return {code: match_policies(zip(d[s:e].tolist(), acts[a[s:e]].tolist(), p[s:e].tolist(), q[s:e].tolist()),
+                                 policies, exact, keep_pairs, starts.get(code))
+            for code, s, e in shard}
+
+
+def _pid(_):
+    return os.getpid()
+
+
+if os.name == "posix":
+    from multiprocessing import popen_spawn_posix, resource_tracker
+
+    class _WorkerPopen(popen_spawn_posix.Popen):
+        """与 spawn 相同，只是准备数据里去掉主模块（init_main_from_path / init_main_from_name），子进程不执行 app.py"""
+
+        def _launch(self, process_obj):
+            tracker_fd = resource_tracker.getfd()
+            self._fds.append(tracker_fd)
+            prep_data = spawn.get_preparation_data(process_obj._name)
+            prep_data.pop("init_main_from_path", None)
+            prep_data.pop("init_main_from_name", None)
+            fp = io.BytesIO()
+            context.set_spawning_popen(self)
+            try:
+                reduction.dump(prep_data, fp)
+                reduction.dump(process_obj, fp)
+            finally:
+                context.set_spawning_popen(None)
+            parent_r = child_w = child_r = parent_w = None
+            try:
+                parent_r, child_w = os.pipe()
+                child_r, parent_w = os.pipe()
+                cmd = spawn.get_command_line(tracker_fd=tracker_fd, pipe_handle=child_r)
+                self._fds.extend([child_r, child_w])
+                self.pid = util.spawnv_passfds(spawn.get_executable(), cmd, self._fds)
+                self.sentinel = parent_r
+                with open(parent_w, "wb", closefd=False) as f:
+                    f.write(fp.getbuffer())
+            finally:
+                self.finalizer = util.Finalize(self, util.close_fds, [fd for fd in (parent_r, parent_w) if fd is not None])
+                for fd in (child_r, child_w):
+                    if fd is not None:
+                        os.close(fd)
+
+    class _WorkerProcess(context.SpawnProcess):
+        @staticmethod
+        def _Popen(process_obj):
+            return _WorkerPopen(process_obj)
+
+    class _WorkerContext(context.SpawnContext):
+        Process = _WorkerProcess
+
+    _WORKER_CONTEXT = _WorkerContext()
+else:                                       # Windows 等：沿用标准 spawn（主模块需有 __main__ 保护）
+    _WORKER_CONTEXT = context.SpawnContext()
+
+
+def _get_pool(workers: int):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None and _pool_workers != workers:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=_WORKER_CONTEXT)
+            list(pool.map(_pid, range(workers)))           # 启动全部工作进程
+            _pool, _pool_workers = pool, workers
+            atexit.register(pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def _shards(ledger, codes, n: int) -> list:
+    """按行数从大到小依次放进当前最轻的分片（LPT 装箱）"""
+    sizes = sorted(((ledger.offsets[c][1] - ledger.offsets[c][0], c) for c in codes), reverse=True)
+    bins = [[0, []] for _ in range(max(1, min(n, len(sizes))))]
+    for size, code in sizes:
+        b = min(bins, key=lambda x: x[0])
+        b[0] += size
+        b[1].append((code,) + ledger.offsets[code])
+    return [b[1] for b in bins if b[1]]
+
+
+def match_symbols(ledger, codes=None, policies=(DEFAULT_POLICY,), exact: bool = True, keep_pairs: bool = True,
+                  workers: int = None, min_trades: int = None, min_symbols: int = None) -> dict:
+    """
+    {code: {policy: MatchResult}}：对 codes（默认全部股票）逐只按 policies 配对，结果与 match_policies 相同。
+    workers > 1 且达到阈值（默认 PARALLEL_MIN_TRADES / PARALLEL_MIN_SYMBOLS，基准测试传 0 强制走进程池）时分片到进程池，
+    否则或池不可用时在本进程计算；不需要配对明细时传 keep_pairs=False，回传的结果小得多
+    """
+    min_trades = PARALLEL_MIN_TRADES if min_trades is None else min_trades
+    min_symbols = PARALLEL_MIN_SYMBOLS if min_symbols is None else min_symbols
+    codes = list(ledger.codes) if codes is None else [c for c in codes if c in ledger.offsets]
+    global _pool
+    workers = MAX_WORKERS if workers is None else workers
+    total = sum(ledger.offsets[c][1] - ledger.offsets[c][0] for c in codes)
+    if workers > 1 and total >= min_trades and len(codes) >= min_symbols:
+        try:
+            block = _share(ledger)
+            actions = ledger.action_names
+            pool = _get_pool(workers)
+            futures = [pool.submit(_match_shard, block.name, block.layout, actions, shard, tuple(policies), exact,
+                                   keep_pairs, {c: ledger.start(c) for c, _, _ in shard if c in ledger.carry})
+                       for shard in _shards(ledger, codes, workers * SHARDS_PER_WORKER)]
+            out = {}
+            for f in futures:
+                out.update(f.result())
+            return {c: out[c] for c in codes}
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                with _pool_lock:
+                    _pool = None                      # 下次重建
+            print(f"[parallel] falling back to single process: {e}")
+    return {c: match_policies(ledger.rows(c), policies, exact, keep_pairs, ledger.start(c)) for c in codes}
@@ -0,0 +1,97 @@
+"""
+持仓与盈亏：按股票流式读取成交，按所选配对规则（stock21.matching.POLICIES，默认最低成本优先）配对，
+得出每只股票的未平仓数量、持仓成本、已实现 / 未实现盈亏。只用标准库，命令行下启动很快。
+金额按定点整数（stock21.money）配对与累加，逐股结果出口处折回元。
+已归档的成交（stock21.archive）不再读取，配对、累计投入 / 回收从结转状态接着算。
+"""
+import itertools
+
+from stock21.archive import load_carry
+from stock21.matching import match, BUY, SELL, DEFAULT_POLICY
+from stock21.money import unit_rows, from_units, to_units
+
+
+def trade_groups(conn, codes: list = None, table: str = "trades"):
+    """
+    按股票分组的成交 (code, [(date, action, price, qty), ...])，组内按 date, id, rowid（与账本同序）；
+    游标流式读取，同一时间只持有一只股票的成交。
+    table 传 stock21.archive.history_table(conn) 时含已归档的成交
+    """
+    where, args = "", [BUY, SELL]
+    if codes:
+        where = f" AND code IN ({','.join('?' * len(codes))})"
+        args += list(codes)
+    cur = conn.execute(
+        f"""SELECT code, substr(date, 1, 10), action, price, quantity FROM {table}
+            WHERE action IN (?, ?) AND date IS NOT NULL{where} ORDER BY code, date, id, rowid""", args)
+    for code, rows in itertools.groupby(cur, key=lambda r: r[0]):
+        yield code, [(d, a, float(p or 0), float(q or 0)) for _, d, a, p, q in rows]
+
+
+def load_prices(conn) -> dict:
+    """{股票: 现价}（prices 表）"""
+    return {code: p or 0.0 for code, p in conn.execute("SELECT code, current_price FROM prices")}
+
+
+def iter_positions(conn, prices: dict = None, codes: list = None, policy: str = DEFAULT_POLICY):
+    """
+    逐只股票产出 {code, quantity, long_qty, short_qty, cost, price, market_value, invested, recovered,
+    realized, unrealized, total_pnl, trades}；quantity 为净持仓（空头为负），cost 为未平仓部分的平均成本
+    """
+    prices = load_prices(conn) if prices is None else prices
+    carry = load_carry(conn)
+    seen = set()
+    for code, rows in trade_groups(conn, codes):
+        seen.add(code)
+        yield _position(code, rows, carry.get(code), prices.get(code) or 0.0, policy)
+    # 成交已全部归档的股票只剩结转的已实现盈亏
+    for code in sorted(set(carry) - seen):
+        if not codes or code in codes:
+            yield _position(code, [], carry[code], prices.get(code) or 0.0, policy)
+
+
+def _position(code, rows, carried, now_p, policy):
+    units = list(unit_rows(rows))
+    carried = carried or {"trades": 0, "invested": 0, "recovered": 0, "policies": None}
+    m = match(units, policy, exact=False, start=carried["policies"])      # 已是整数单位
+    now_u = to_units(now_p)
+    long_q = sum(q for _, _, q in m.buy_lots)
+    short_q = sum(q for _, _, q in m.sell_lots)
+    open_cost = sum(p * q for _, p, q in m.buy_lots) + sum(p * q for _, p, q in m.sell_lots)
+    unrealized = (sum((now_u - p) * q for _, p, q in m.buy_lots)
+                  + sum((p - now_u) * q for _, p, q in m.sell_lots))
+    return {
+        "code": code, "quantity": long_q - short_q, "long_qty": long_q, "short_qty": short_q,
+        "cost": from_units(open_cost / (long_q + short_q)) if long_q + short_q else 0.0,
+        "price": now_p, "market_value": from_units((long_q - short_q) * now_u),
+        "invested": from_units(carried["invested"] + sum(p * q for _, a, p, q in units if a == BUY)),
+        "recovered": from_units(carried["recovered"] + sum(p * q for _, a, p, q in units if a == SELL)),
+        "realized": from_units(m.realized), "unrealized": from_units(unrealized),
+        "total_pnl": from_units(m.realized + unrealized), "trades": carried["trades"] + len(rows),
+    }
+
+
+def positions(conn, prices: dict = None, codes: list = None, policy: str = DEFAULT_POLICY) -> list:
+    """当前仍有未平仓数量的股票"""
+    return [r for r in iter_positions(conn, prices, codes, policy) if r["long_qty"] or r["short_qty"]]
+
+
+def with_currencies(conn, rows: list) -> list:
+    """给逐股行补上交易币种（currency），见 stock21.fx"""
+    from stock21.quotes import build_ticker_map
+    from stock21.fx import symbol_currencies, BASE_CURRENCY
+    ccy = symbol_currencies(build_ticker_map(conn))
+    for r in rows:
+        r["currency"] = ccy.get(r["code"], BASE_CURRENCY)
+    return rows
+
+
+def pnl_summary(rows: list, fx=None) -> dict:
+    """逐股盈亏行 → 合计；给出 fx（stock21.fx.FxRates）时按各行 currency 的最新汇率折成人民币再合计"""
+    keys = ("market_value", "invested", "recovered", "realized", "unrealized", "total_pnl")
+    if fx is None:
+        return {k: sum(r[k] for r in rows) for k in keys}
+    rates = fx.rates([r.get("currency") for r in rows])
+    out = {k: float(sum(r[k] * x for r, x in zip(rows, rates))) for k in keys}
+    out["currency"] = "CNY"
+    return out
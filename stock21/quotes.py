@@ -0,0 +1,261 @@
+"""
+行情抓取：东方财富批量快照接口优先，拿不到的用 yfinance 兜底；快照写入 quote_snapshots，
+现价写入 prices（保留手动成本）。股票名称 → secid 以 stock_info 中用户录入的为准，内置表兜底。
+持仓涉及外币时，汇率行情（stock21.fx.FX_SECIDS）并入同一次批量请求，写入 fx_rates。
+"""
+import json
+import urllib.request
+from datetime import datetime
+
+from stock21.diag import timed
+from stock21.fx import FX_SECIDS, FX_YF, currency_of, store_fx_rates
+from stock21.symbols import UPSERT_SYMBOL_SQL
+
+# ── 股票名称 → 东方财富 secid 映射（内置兜底表）──
+# 东方财富 secid 格式：市场前缀.代码
+#   A股 沪市(上交所) → 1.xxxxxx
+#   A股 深市(深交所) → 0.xxxxxx
+#   港股            → 116.xxxxx（5位，不足补0）
+#   美股            → 105.XXXX
+# 数据库 stock_info 中用户录入的代码优先，此表仅作兜底
+TICKER_MAP = {
+    # 港股
+    "中芯国际":  "116.00981",
+    "汇丰控股":  "116.00005",
+    "中银香港":  "116.02388",
+    "紫金矿业":  "116.02899",
+    "电能实业":  "116.00006",
+    "福耀玻璃":  "116.03606",
+    # A股 深市
+    "比亚迪":    "0.002594",
+    "阳光电源":  "0.300274",
+    "纳指ETF":   "0.159941",
+    # A股 沪市
+    "长江电力":  "1.600900",
+    # 美股
+    "联合健康":  "105.UNH",
+    "特斯拉":    "105.TSLA",
+    "伯克希尔":  "105.BRK-B",
+}
+
+# yfinance ticker（用于降级回退，stock_info 里存的是东方财富 secid）
+YF_FALLBACK = {
+    "中芯国际":  "0981.HK",
+    "汇丰控股":  "0005.HK",
+    "中银香港":  "2388.HK",
+    "紫金矿业":  "2899.HK",
+    "电能实业":  "0006.HK",
+    "福耀玻璃":  "3606.HK",
+    "比亚迪":    "002594.SZ",
+    "阳光电源":  "300274.SZ",
+    "长江电力":  "600900.SS",
+    "纳指ETF":   "159941.SZ",
+    "联合健康":  "UNH",
+    "特斯拉":    "TSLA",
+    "伯克希尔":  "BRK-B",
+}
+
+# 东方财富 ulist 字段 → 快照列（一次批量请求全部带回，无需额外往返）
+#   f2=现价 f3=涨跌幅% f4=涨跌额 f5=成交量 f6=成交额 f12=代码 f13=市场
+#   f15=最高 f16=最低 f17=今开 f18=昨收 f124=行情时间戳(秒)
+EM_QUOTE_FIELDS = {
+    "f2": "price", "f3": "change_pct", "f4": "change_amt", "f5": "volume", "f6": "turnover",
+    "f15": "high", "f16": "low", "f17": "open", "f18": "prev_close",
+}
+
+
+def seed_builtin_tickers(conn):
+    """内置 TICKER_MAP 写入 stock_info（不覆盖用户已录入的代码，只补上尚未录入代码的名称）"""
+    conn.executemany(UPSERT_SYMBOL_SQL, TICKER_MAP.items())
+    conn.commit()
+
+
+def build_ticker_map(conn) -> dict:
+    """合并数据库用户录入代码（优先）和内置 TICKER_MAP（兜底）"""
+    merged = dict(TICKER_MAP)
+    try:
+        merged.update(conn.execute(
+            "SELECT stock_name, stock_code FROM stock_info WHERE stock_code IS NOT NULL AND stock_code != ''"
+        ).fetchall())
+    except Exception:
+        pass
+    return merged
+
+
+def _em_num(v):
+    """东方财富 fltt=2 下缺失值为 "-"，统一转成 float 或 None"""
+    if v is None or v == "-" or v == "":
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_eastmoney_quotes(secids: list) -> dict:
+    """
+    东方财富批量行情接口（扩展字段版）。
+    secids: ['1.600900', '0.002594', '116.00981', '105.TSLA', ...]
+    返回 {股票纯代码: 行情快照 dict}，price 为 f2 现价，非交易时段用 f18 昨收兜底
+    """
+    if not secids:
+        return {}
+    fields = ",".join(list(EM_QUOTE_FIELDS) + ["f12", "f13", "f124"])
+    url = (
+        "https://push2.eastmoney.com/api/qt/ulist.np/get"
+        f"?fltt=2&invt=2&fields={fields}&secids={','.join(secids)}"
+    )
+    try:
+        req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+        with timed("network", "eastmoney"), urllib.request.urlopen(req, timeout=8) as resp:
+            data = json.loads(resp.read().decode())
+        items = (data.get("data") or {}).get("diff") or []
+        result = {}
+        for item in items:
+            code = str(item.get("f12", ""))
+            if not code:
+                continue
+            q = {col: _em_num(item.get(f)) for f, col in EM_QUOTE_FIELDS.items()}
+            # f2 为 "-"、None 或 0 时，用昨收 f18 兜底
+            price = q["price"] or q["prev_close"]
+            if not price:
+                continue
+            q["price"] = round(price, 4)
+            ts = _em_num(item.get("f124"))
+            q["quote_time"] = datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') if ts else None
+            q["secid"] = f"{item.get('f13')}.{code}" if item.get("f13") is not None else None
+            q["source"] = "eastmoney"
+            result[code] = q
+        return result
+    except Exception:
+        return {}
+
+
+def fetch_eastmoney(secids: list) -> dict:
+    """{股票纯代码: 最新价(float)}"""
+    return {code: q["price"] for code, q in fetch_eastmoney_quotes(secids).items()}
+
+
+def _fetch_yfinance_quote(yf_ticker: str, secid) -> dict:
+    import yfinance as yf       # 导入较慢，只在需要兜底时才加载
+    with timed("network", "yfinance"):
+        hist = yf.Ticker(yf_ticker).history(period="2d")
+    if hist.empty:
+        return None
+    last = hist.iloc[-1]
+    price = round(float(last["Close"]), 4)
+    prev = float(hist["Close"].iloc[-2]) if len(hist) > 1 else None
+    return {
+        "price": price, "prev_close": prev,
+        "open": float(last["Open"]), "high": float(last["High"]), "low": float(last["Low"]),
+        "change_pct": round((price - prev) / prev * 100, 2) if prev else None,
+        "change_amt": round(price - prev, 4) if prev else None,
+        "volume": float(last["Volume"]), "turnover": None,
+        "quote_time": hist.index[-1].strftime('%Y-%m-%d %H:%M:%S'),
+        "secid": secid, "source": "yfinance",
+    }
+
+
+def fetch_quotes(conn, stock_names: list, save: bool = True) -> dict:
+    """
+    批量拉取最新行情快照，优先东方财富接口（低延迟），失败时回退 yfinance。
+    返回 {股票名称: 行情快照 dict}；save 时写入 quote_snapshots 表
+    """
+    ticker_map = build_ticker_map(conn)
+    result = {}
+
+    # ── 第一步：东方财富批量请求（所需外币的汇率一并带上）──
+    secid_to_name = {}
+    for name in stock_names:
+        secid = ticker_map.get(name)
+        if secid:
+            secid_to_name[secid.split(".", 1)[-1]] = (name, secid)   # "1.600900" → "600900"
+    fx_needed = {currency_of(v[1]) for v in secid_to_name.values()} & set(FX_SECIDS)
+    fx_rates = {}
+    if secid_to_name:
+        em_result = fetch_eastmoney_quotes([v[1] for v in secid_to_name.values()] + [FX_SECIDS[c] for c in fx_needed])
+        for code_part, (name, secid) in secid_to_name.items():
+            if code_part in em_result:
+                q = em_result[code_part]
+                q["secid"] = q.get("secid") or secid
+                result[name] = q
+        fx_rates = {c: em_result[FX_SECIDS[c].split(".", 1)[-1]]["price"] for c in fx_needed
+                    if FX_SECIDS[c].split(".", 1)[-1] in em_result}
+
+    # ── 第二步：东方财富未能拿到的，用 yfinance 兜底 ──
+    for name in stock_names:
+        if name in result or not YF_FALLBACK.get(name):
+            continue
+        try:
+            q = _fetch_yfinance_quote(YF_FALLBACK[name], ticker_map.get(name))
+        except Exception:      # 未安装 yfinance 或网络失败
+            q = None
+        if q:
+            result[name] = q
+    fx_yf = {}
+    for ccy in fx_needed - set(fx_rates):
+        try:
+            q = _fetch_yfinance_quote(FX_YF[ccy], None)
+        except Exception:
+            q = None
+        if q:
+            fx_yf[ccy] = q["price"]
+
+    if save:
+        save_quote_snapshots(conn, result)
+        store_fx_rates(conn, fx_rates)
+        store_fx_rates(conn, fx_yf, source="yfinance")
+    return result
+
+
+def save_quote_snapshots(conn, quotes: dict):
+    """将 {股票名称: 行情快照} 批量写入 quote_snapshots（每只股票仅保留最新一条）"""
+    if not quotes:
+        return
+    fetched_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows = [
+        (name, q.get("secid"), q.get("price"), q.get("prev_close"), q.get("open"), q.get("high"),
+         q.get("low"), q.get("change_pct"), q.get("change_amt"), q.get("volume"), q.get("turnover"),
+         q.get("source"), q.get("quote_time"), fetched_at)
+        for name, q in quotes.items()
+    ]
+    try:
+        conn.executemany("""INSERT OR REPLACE INTO quote_snapshots
+            (code, secid, price, prev_close, open, high, low, change_pct, change_amt,
+             volume, turnover, source, quote_time, fetched_at)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", rows)
+        conn.commit()
+    except Exception as e:
+        print(f"[quote] snapshot save failed: {e}")
+
+
+def load_quote_snapshots(conn) -> dict:
+    """读取全部行情快照：{股票名称: dict}"""
+    try:
+        cur = conn.execute("SELECT * FROM quote_snapshots")
+        cols = [d[0] for d in cur.description]
+        return {row[0]: dict(zip(cols, row)) for row in cur.fetchall()}
+    except Exception:
+        return {}
+
+
+def store_prices(conn, prices: dict) -> int:
+    """现价批量写入 prices（保留手动成本；只写正数，绝不用 0 覆盖历史价格），返回写入条数"""
+    rows = [(name, p) for name, p in prices.items() if p and p > 0]
+    conn.executemany("""INSERT INTO prices (code, current_price, manual_cost) VALUES (?, ?, 0.0)
+                        ON CONFLICT(code) DO UPDATE SET current_price = excluded.current_price""", rows)
+    conn.commit()
+    return len(rows)
+
+
+def store_price_edits(conn, edits: list) -> int:
+    """
+    页面批量维护的 [(股票, 现价, 手动成本), ...] 在一个事务内写入 prices（按定点网格取 4 位小数），
+    出错整体回滚；返回写入条数
+    """
+    rows = [(code, round(float(p), 4), round(float(cost), 4)) for code, p, cost in edits]
+    with conn:
+        conn.executemany("""INSERT INTO prices (code, current_price, manual_cost) VALUES (?, ?, ?)
+                            ON CONFLICT(code) DO UPDATE SET current_price = excluded.current_price,
+                                                            manual_cost = excluded.manual_cost""", rows)
+    return len(rows)
@@ -0,0 +1,166 @@
+"""
+收益率引擎：由 trades 现金流 + 当前市值计算资金加权（XIRR）与时间加权（TWR）年化收益。
+XIRR 把各股现金流补齐成矩阵后同时求解：带区间保护的牛顿法，步子越出区间时退回二分。
+各股按交易币种计算；账户整体的现金流先按各自日期的汇率折成人民币（stock21.fx）再求解。
+结果按数据版本缓存，交易 / 现价 / 日线 / 汇率没有变化时直接复用。
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from stock21.archive import history_table
+from stock21.fx import load_fx, fx_version, symbol_currencies
+from stock21.ledger import trade_version
+from stock21.nav import update_nav, portfolio_in_base, BUY, SELL
+from stock21.quotes import build_ticker_map
+
+PORTFOLIO = "__portfolio__"       # 结果表中代表整个账户的行
+_LO = -0.9999
+# 求根前先扫描的利率网格（含两端），及各区间到 0 的距离
+_GRID = np.array([_LO, -0.99, -0.9, -0.7, -0.5, -0.3, -0.1, 0.0, 0.1, 0.3, 0.5, 1.0, 2.0, 5.0, 10.0, 100.0, 1e3, 1e4])
+_GRID_DIST = np.where((_GRID[:-1] <= 0) & (_GRID[1:] >= 0), 0.0, np.minimum(np.abs(_GRID[:-1]), np.abs(_GRID[1:])))
+_cache = {}                       # {数据库文件: (数据版本, 结果)}
+
+
+def _npv(r, amounts, years):
+    """各行在利率 r 下的净现值及其导数；amounts / years 为补齐后的矩阵（补位金额为 0）"""
+    disc = np.exp(-years * np.log1p(r)[:, None])
+    f = (amounts * disc).sum(axis=1)
+    df = -(years * amounts * disc).sum(axis=1) / (1.0 + r)
+    return f, df
+
+
+def xirr_matrix(amounts: np.ndarray, years: np.ndarray, tol: float = 1e-10, max_iter: int = 100) -> np.ndarray:
+    """
+    批量 XIRR。amounts[i, j] 为第 i 组第 j 笔现金流（投入为负），years 为距该组首笔的年数。
+    先在利率网格上找净现值变号的区间或恰好为 0 的网格点（多个根时取离 0 最近的），再在区间内迭代；
+    网格点本身就是根时（持平、整数收益率）直接取该点；两者都没有（无解）的行返回 NaN
+    """
+    n = len(amounts)
+    f_grid = np.column_stack([_npv(np.full(n, g), amounts, years)[0] for g in _GRID])
+    flips = np.sign(f_grid[:, :-1]) * np.sign(f_grid[:, 1:]) < 0
+    zero_dist = np.where(f_grid == 0, np.abs(_GRID), np.inf)
+    z = zero_dist.argmin(axis=1)
+    dist = np.where(flips, _GRID_DIST, np.inf)
+    k = dist.argmin(axis=1)
+    exact = np.isfinite(zero_dist[np.arange(n), z]) & (zero_dist[np.arange(n), z] <= dist[np.arange(n), k])
+    ok = flips.any(axis=1) & ~exact
+    lo, hi = _GRID[k], _GRID[k + 1]
+    f_lo = f_grid[np.arange(n), k]
+    r = np.where((lo < 0.1) & (0.1 < hi), 0.1, (lo + hi) / 2)
+    for _ in range(max_iter):
+        f, df = _npv(r, amounts, years)
+        # 收紧区间：与下端同号则替换下端，否则替换上端
+        same = np.sign(f) == np.sign(f_lo)
+        lo, f_lo = np.where(same, r, lo), np.where(same, f, f_lo)
+        hi = np.where(same, hi, r)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            nxt = r - f / df
+        bad = ~np.isfinite(nxt) | (nxt <= lo) | (nxt >= hi)
+        nxt = np.where(bad, (lo + hi) / 2, nxt)
+        done = np.abs(nxt - r) < tol
+        r = nxt
+        if done[ok].all():
+            break
+    return np.where(exact, _GRID[z], np.where(ok, r, np.nan))
+
+
+def _flow_matrix(flows: pd.DataFrame):
+    """flows(key, date, amount) → 按 key 补齐的金额矩阵、年数矩阵和 key 顺序"""
+    flows = flows.groupby(["key", "date"], as_index=False)["amount"].sum()
+    flows["t"] = (flows["date"] - flows.groupby("key")["date"].transform("min")).dt.days / 365.0
+    flows["j"] = flows.groupby("key").cumcount()
+    keys = flows["key"].drop_duplicates().tolist()
+    row = flows["key"].map({k: i for i, k in enumerate(keys)}).to_numpy()
+    amounts = np.zeros((len(keys), flows["j"].max() + 1))
+    years = np.zeros_like(amounts)
+    amounts[row, flows["j"]] = flows["amount"].to_numpy()
+    years[row, flows["j"]] = flows["t"].to_numpy()
+    return amounts, years, keys
+
+
+def data_version(conn) -> tuple:
+    """
+    交易、现价、日线、汇率的轻量版本指纹：交易取触发器维护的写入计数（stock21.ledger.trade_version），
+    其余 INSERT OR REPLACE 会产生新 rowid，MAX(rowid) 即可反映变化
+    """
+    t = trade_version(conn)
+    p = conn.execute("SELECT COUNT(*), TOTAL(current_price) FROM prices").fetchone()
+    d = conn.execute("SELECT MAX(rowid) FROM daily_prices").fetchone()
+    return t + p + d + fx_version(conn)
+
+
+def _last_nav(conn, fx, currencies: dict) -> pd.DataFrame:
+    """
+    各股 nav_daily 最后一行（market_value / exposure / close / twr_index，原币）；
+    账户行取 nav_portfolio 最后一行，含外币股票时取折成人民币重算的账户曲线最后一行
+    """
+    last = pd.read_sql(
+        """SELECT n.code, n.market_value, ABS(n.market_value) AS exposure, n.close, n.twr_index FROM nav_state s
+           CROSS JOIN nav_daily n ON n.code = s.code AND n.date = s.last_date""", conn).set_index("code")
+    base = portfolio_in_base(conn, fx, currencies)
+    if base is None:
+        port = conn.execute("SELECT market_value, exposure, twr_index FROM nav_portfolio ORDER BY date DESC LIMIT 1").fetchone()
+    else:
+        port = tuple(base[["market_value", "exposure", "twr_index"]].iloc[-1]) if len(base) else None
+    if port:
+        last.loc[PORTFOLIO, ["market_value", "exposure", "twr_index"]] = port
+    return last
+
+
+def compute_returns(conn, asof: str = None) -> pd.DataFrame:
+    """
+    各股及整个账户（index=PORTFOLIO）的收益率，列：
+    xirr / twr / twr_annual（小数，0.12 即 12%）、days（首笔交易至今天数）、value（当前市值）
+    """
+    asof = asof or datetime.now().strftime('%Y-%m-%d')
+    db = conn.execute("PRAGMA database_list").fetchone()[2]
+    version = data_version(conn) + (asof,)
+    hit = _cache.get(db)
+    if hit and hit[0] == version:
+        return hit[1]
+
+    src = history_table(conn)                 # 现金流含已归档的成交
+    update_nav(conn, table=src)
+    trades = pd.read_sql(f"SELECT code, date, action, price, quantity FROM {src}", conn)
+    trades = trades[trades["action"].isin([BUY, SELL]) & trades["date"].notna()]
+    if trades.empty:
+        return pd.DataFrame(columns=["xirr", "twr", "twr_annual", "days", "value"])
+    asof_ts = pd.Timestamp(asof)
+    trades = trades.assign(date=pd.to_datetime(trades["date"].astype(str).str[:10]),
+                           price=trades["price"].astype(float), quantity=trades["quantity"].astype(float))
+    signed = np.where(trades["action"] == BUY, 1.0, -1.0)
+    flows = pd.DataFrame({"key": trades["code"], "date": trades["date"],
+                          "amount": -signed * trades["price"] * trades["quantity"]})
+
+    # 当前市值：现价优先，缺失时用净值表最后一天的收盘
+    qty = pd.Series(signed * trades["quantity"].to_numpy(), index=trades.index).groupby(trades["code"]).sum()
+    px_now = pd.Series(dict(conn.execute("SELECT code, current_price FROM prices WHERE current_price > 0").fetchall()), dtype=float)
+    fx, ccy = load_fx(conn), symbol_currencies(build_ticker_map(conn))
+    last = _last_nav(conn, fx, ccy)
+    px = px_now.reindex(qty.index).fillna(last["close"].reindex(qty.index)).fillna(0.0)
+    value = qty * px
+
+    terminal = pd.DataFrame({"key": value.index, "date": asof_ts, "amount": value.to_numpy()})
+    all_flows = pd.concat([flows, terminal], ignore_index=True)
+    amounts, years, keys = _flow_matrix(all_flows)
+    out = pd.DataFrame({"xirr": xirr_matrix(amounts, years)}, index=keys)
+    base_flows = all_flows.assign(key=PORTFOLIO, amount=fx.convert(
+        all_flows["amount"], all_flows["key"].map(ccy), all_flows["date"].to_numpy()))
+    p_amounts, p_years, _ = _flow_matrix(base_flows)
+    out.loc[PORTFOLIO, "xirr"] = xirr_matrix(p_amounts, p_years)[0]
+    out["value"] = value.reindex(out.index)
+    out.loc[PORTFOLIO, "value"] = fx.convert(value, value.index.map(ccy), asof).sum()
+
+    # 时间加权：净值表里的连乘指数，再接上最新日线收盘到当前现价这一段（账户行两端都是人民币）
+    last = last.reindex(out.index)
+    tail = ((out["value"] - last["market_value"]) / last["exposure"].where(last["exposure"] > 0)).fillna(0.0)
+    out["twr"] = last["twr_index"] * (1 + tail.clip(lower=-0.9999)) - 1
+    first = trades.groupby("code")["date"].min()
+    out["days"] = (asof_ts - first.reindex(out.index)).dt.days
+    out.loc[PORTFOLIO, "days"] = (asof_ts - first.min()).days
+    out["twr_annual"] = np.where(out["days"] > 0, (1 + out["twr"]) ** (365.0 / out["days"].clip(lower=1)) - 1, np.nan)
+
+    _cache[db] = (version, out)
+    return out
@@ -0,0 +1,151 @@
+"""
+买卖信号高低点自动维护：
+  high_point = high_date 以来的运行最高价，low_point = low_date 以来的运行最低价。
+行情每来一笔只做 O(1) 比较；一个刷新周期内的全部变更合并成一次批量写入，
+每次变更都记入 signal_ref_audit 审计表。
+"""
+from datetime import datetime
+
+
+def ensure_signal_ref_tables(conn):
+    try:
+        conn.execute("ALTER TABLE signals ADD COLUMN auto_track INTEGER DEFAULT 1")
+    except Exception:
+        pass
+    conn.execute('''CREATE TABLE IF NOT EXISTS signal_ref_audit (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT, field TEXT,
+        old_value REAL, new_value REAL, old_date TEXT, new_date TEXT,
+        source TEXT, changed_at TEXT)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_signal_ref_audit_code ON signal_ref_audit (code, id)")
+    conn.commit()
+
+
+def load_tracked_refs(conn) -> dict:
+    """{code: [high, high_date, low, low_date]}（仅 auto_track=1 的信号）"""
+    return {
+        r[0]: [r[1], r[2], r[3], r[4]]
+        for r in conn.execute(
+            "SELECT code, high_point, high_date, low_point, low_date FROM signals WHERE COALESCE(auto_track, 1) = 1")
+    }
+
+
+def track_tick(refs: dict, code: str, price: float, date: str, changes: list):
+    """单笔行情：与运行极值比较（O(1)），有新极值时就地更新 refs 并追加到 changes"""
+    ref = refs.get(code)
+    if ref is None or not price or price <= 0:
+        return
+    high, high_date, low, low_date = ref
+    if high and price > high:
+        changes.append((code, "high", high, price, high_date, date))
+        ref[0], ref[1] = price, date
+    if low and price < low:
+        changes.append((code, "low", low, price, low_date, date))
+        ref[2], ref[3] = price, date
+
+
+def _write_changes(conn, changes: list, source: str) -> dict:
+    """变更合并后写入 signals、逐条写审计（不提交，由调用方放进同一个事务）；返回合并后的 {(code, field): (值, 日期)}"""
+    final = {}
+    for code, field, _, new_v, _, new_d in changes:
+        final[(code, field)] = (new_v, new_d)
+    highs = [(v, d, code) for (code, f), (v, d) in final.items() if f == "high"]
+    lows  = [(v, d, code) for (code, f), (v, d) in final.items() if f == "low"]
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if highs:
+        conn.executemany("UPDATE signals SET high_point = ?, high_date = ? WHERE code = ?", highs)
+    if lows:
+        conn.executemany("UPDATE signals SET low_point = ?, low_date = ? WHERE code = ?", lows)
+    conn.executemany("""INSERT INTO signal_ref_audit
+        (code, field, old_value, new_value, old_date, new_date, source, changed_at)
+        VALUES (?,?,?,?,?,?,?,?)""", [ch + (source, now) for ch in changes])
+    return final
+
+
+def apply_ref_changes(conn, changes: list, source: str) -> int:
+    """把一个周期内的全部高低点变更合并后一次写入 signals，并逐条写审计记录"""
+    if not changes:
+        return 0
+    with conn:
+        return len(_write_changes(conn, changes, source))
+
+
+def update_refs_from_quotes(conn, prices: dict, date: str = None) -> int:
+    """行情刷新周期：{code: 最新价} 逐笔推进运行极值，最后批量落库"""
+    date = date or datetime.now().strftime('%Y-%m-%d')
+    refs = load_tracked_refs(conn)
+    changes = []
+    for code, price in prices.items():
+        track_tick(refs, code, price, date, changes)
+    return apply_ref_changes(conn, changes, "quote")
+
+
+def backfill_refs_from_history(conn) -> int:
+    """用已存日线补齐：高点取 high_date 以来最高收盘，低点取 low_date 以来最低收盘"""
+    refs = load_tracked_refs(conn)
+    changes = []
+    for code, (high, high_date, low, low_date) in refs.items():
+        if high and high_date:
+            row = conn.execute(
+                "SELECT close, date FROM daily_prices WHERE code = ? AND date >= ? ORDER BY close DESC, date LIMIT 1",
+                (code, high_date)).fetchone()
+            if row and row[0] > high:
+                changes.append((code, "high", high, row[0], high_date, row[1]))
+        if low and low_date:
+            row = conn.execute(
+                "SELECT close, date FROM daily_prices WHERE code = ? AND date >= ? ORDER BY close ASC, date LIMIT 1",
+                (code, low_date)).fetchone()
+            if row and 0 < row[0] < low:
+                changes.append((code, "low", low, row[0], low_date, row[1]))
+    return apply_ref_changes(conn, changes, "history")
+
+
+def set_refs(conn, rows: list, source: str) -> int:
+    """
+    手动/周期拐点整体设置高低点并审计。
+    rows: [(code, high, high_date, low, low_date), ...]
+    """
+    current = {r[0]: r[1:] for r in conn.execute(
+        "SELECT code, high_point, high_date, low_point, low_date FROM signals")}
+    changes = []
+    for row in rows:
+        changes += _ref_changes(row, current.get(row[0], (None, None, None, None)))
+    return apply_ref_changes(conn, changes, source)
+
+
+def _ref_changes(row, old) -> list:
+    """row = (code, high, high_date, low, low_date)，old = 原 (high, high_date, low, low_date)；返回审计用的变更"""
+    code, high, high_date, low, low_date = row
+    out = []
+    if (high, high_date) != (old[0], old[1]):
+        out.append((code, "high", old[0], high, old[1], high_date))
+    if (low, low_date) != (old[2], old[3]):
+        out.append((code, "low", old[2], low, old[3], low_date))
+    return out
+
+
+def save_signal(conn, code: str, high, high_date: str, low, low_date: str, up: float, down: float,
+                auto_track: bool, source: str = "manual") -> int:
+    """
+    手动设置一只股票的监控（一个事务）：先 upsert signals 整行（新股票也有行可改），
+    再按与原值的差异写高低点审计；返回变更的高低点个数
+    """
+    old = conn.execute("SELECT high_point, high_date, low_point, low_date FROM signals WHERE code = ?",
+                       (code,)).fetchone() or (None, None, None, None)
+    changes = _ref_changes((code, high, high_date, low, low_date), old)
+    with conn:
+        conn.execute("""INSERT INTO signals (code, high_point, low_point, up_threshold, down_threshold, high_date, low_date, auto_track)
+                        VALUES (?,?,?,?,?,?,?,?)
+                        ON CONFLICT (code) DO UPDATE SET
+                            high_point = excluded.high_point, low_point = excluded.low_point,
+                            up_threshold = excluded.up_threshold, down_threshold = excluded.down_threshold,
+                            high_date = excluded.high_date, low_date = excluded.low_date, auto_track = excluded.auto_track""",
+                     (code, high, low, up, down, high_date, low_date, int(auto_track)))
+        if changes:
+            _write_changes(conn, changes, source)
+    return len(changes)
+
+
+def recent_audit(conn, limit: int = 50) -> list:
+    return conn.execute(
+        """SELECT changed_at, code, field, old_value, new_value, old_date, new_date, source
+           FROM signal_ref_audit ORDER BY id DESC LIMIT ?""", (limit,)).fetchall()
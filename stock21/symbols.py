@@ -0,0 +1,154 @@
+"""
+股票整数主键：stock_info.id 即 symbol_id，各业务表在原有名称列之外增加 symbol_id（REFERENCES stock_info(id)）。
+
+名称列仍保留（页面、导入导出、GitHub 同步的库都按名称读写），symbol_id 由触发器维护：
+插入或改名时按名称查 stock_info，没有登记的名称自动登记一行（代码留空，之后录入代码时补上），
+因此每个出现过的名称都有唯一 id。改名走 rename_symbol：按 id 更新全部表，历史不会脱节。
+
+整表替换（to_sql replace）会丢掉触发器和 symbol_id 列，ensure_symbol_keys 发现触发器缺失时补列、回填并重建。
+v_<表名> 视图带出当前名称（symbol）与 secid。
+
+REFERENCES 由数据库强制执行：app 与 CLI 的连接都开启 PRAGMA foreign_keys，仍被引用的 stock_info 行删不掉。
+删除股票走 delete_symbol：成交（含已归档）、复盘日记、决策历史有记录时拒绝删除，配置类的行随股票一起删除。
+"""
+from stock21.archive import rename_archived, archived_trade_count
+
+# 表 → 名称列
+SYMBOL_TABLES = {
+    "trades": "code",
+    "prices": "code",
+    "signals": "code",
+    "strategy_notes": "code",
+    "price_targets_v2": "code",
+    "journal": "stock_name",
+}
+# 删除股票时随之删除的配置类表（表 → 名称列），其余引用（成交、日记、决策历史、归档）有记录时不允许删除
+SYMBOL_SETTINGS = {"prices": "code", "signals": "code", "strategy_notes": "code",
+                   "price_targets": "code", "price_targets_v2": "code"}
+# 登记名称；已登记但代码为空的补上代码，已有代码的不覆盖
+UPSERT_SYMBOL_SQL = """INSERT INTO stock_info (stock_name, stock_code) VALUES (?, ?)
+                       ON CONFLICT (stock_name) DO UPDATE SET stock_code = excluded.stock_code
+                       WHERE COALESCE(stock_info.stock_code, '') = '' AND COALESCE(excluded.stock_code, '') <> ''"""
+
+
+def _attach(table: str, col: str) -> str:
+    return f"""INSERT OR IGNORE INTO stock_info (stock_name) VALUES (NEW.{col});
+               UPDATE {table} SET symbol_id = (SELECT id FROM stock_info WHERE stock_name = NEW.{col})
+               WHERE rowid = NEW.rowid;"""
+
+
+def ensure_symbol_keys(conn):
+    """给已存在的业务表补 symbol_id 列、索引、触发器与视图；全部就绪时只查一次 sqlite_master"""
+    have = {(t, n) for t, n in conn.execute(
+        "SELECT type, name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+    todo = [(t, col) for t, col in SYMBOL_TABLES.items()
+            if ("table", t) in have and ("trigger", f"trg_symbol_{t}_ins") not in have]
+    for table, col in todo:
+        try:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN symbol_id INTEGER REFERENCES stock_info(id)")
+        except Exception:
+            pass
+        conn.execute(f"""INSERT OR IGNORE INTO stock_info (stock_name)
+                         SELECT DISTINCT {col} FROM {table} WHERE {col} IS NOT NULL""")
+        conn.execute(f"""UPDATE {table} SET symbol_id = (SELECT id FROM stock_info WHERE stock_name = {table}.{col})
+                         WHERE {col} IS NOT NULL""")
+        idx = "symbol_id, date" if table in ("trades", "journal") else "symbol_id"
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_symbol ON {table} ({idx})")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_symbol_{table}_ins AFTER INSERT ON {table}
+                         WHEN NEW.{col} IS NOT NULL BEGIN {_attach(table, col)} END""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_symbol_{table}_upd AFTER UPDATE OF {col} ON {table}
+                         WHEN NEW.{col} IS NOT NULL BEGIN {_attach(table, col)} END""")
+        conn.execute(f"""CREATE VIEW IF NOT EXISTS v_{table} AS
+                         SELECT t.*, s.stock_name AS symbol, s.stock_code AS secid
+                         FROM {table} t LEFT JOIN stock_info s ON s.id = t.symbol_id""")
+    if todo:
+        conn.commit()
+
+
+def symbol_id(conn, name: str):
+    row = conn.execute("SELECT id FROM stock_info WHERE stock_name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _name_columns(conn):
+    """[(表, 名称列, 是否有 symbol_id)]：所有带股票名称列的表（含检查点、日线、周期等派生表）"""
+    out = []
+    for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name <> 'stock_info'"):
+        cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+        col = SYMBOL_TABLES.get(table, "code")
+        if col in cols:
+            out.append((table, col, "symbol_id" in cols))
+    return out
+
+
+def symbol_usage(conn, sid: int) -> dict:
+    """{表: 行数}：阻止删除该股票的记录——带 symbol_id 的非配置类表、按名称存的决策历史、归档成交（trade_archive / trade_carry）"""
+    row = conn.execute("SELECT stock_name FROM stock_info WHERE id = ?", (sid,)).fetchone()
+    if not row:
+        return {}
+    name, out = row[0], {}
+    for table, col, keyed in _name_columns(conn):
+        if table in SYMBOL_SETTINGS or (not keyed and table != "decision_history"):
+            continue
+        where = "symbol_id = ?" if keyed else f"{col} = ?"
+        n = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", (sid if keyed else name,)).fetchone()[0]
+        if n:
+            out[table] = n
+    n = archived_trade_count(conn, name)
+    if n:
+        out["trade_archive"] = n
+    return out
+
+
+def delete_symbol(conn, sid: int) -> str:
+    """
+    删除股票（一个事务）：symbol_usage 有记录时抛 ValueError（附各表行数），
+    否则连同 SYMBOL_SETTINGS 各表的行一起删除；返回删除的名称，id 不存在时返回 None
+    """
+    row = conn.execute("SELECT stock_name FROM stock_info WHERE id = ?", (sid,)).fetchone()
+    if not row:
+        return None
+    usage = symbol_usage(conn, sid)
+    if usage:
+        raise ValueError("、".join(f"{t} {n} 条" for t, n in usage.items()))
+    try:
+        for table, col, keyed in _name_columns(conn):
+            if table in SYMBOL_SETTINGS:
+                conn.execute(f"DELETE FROM {table} WHERE {'symbol_id = ? OR ' if keyed else ''}{col} = ?",
+                             (sid, row[0]) if keyed else (row[0],))
+        conn.execute("DELETE FROM stock_info WHERE id = ?", (sid,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return row[0]
+
+
+def rename_symbol(conn, old: str, new: str) -> int:
+    """
+    把股票 old 改名为 new（一个事务）：stock_info 名称不变 id，带 symbol_id 的表按 id 更新，
+    其余按名称存的派生表按名称更新。new 已存在时抛 ValueError；返回更新的行数
+    """
+    new = (new or "").strip()
+    if not new or new == old:
+        raise ValueError("新名称为空或与原名称相同")
+    if symbol_id(conn, new) is not None:
+        raise ValueError(f"名称已存在：{new}")
+    ensure_symbol_keys(conn)
+    sid = symbol_id(conn, old)
+    if sid is None:
+        raise ValueError(f"未知股票：{old}")
+    n = 0
+    try:
+        conn.execute("UPDATE stock_info SET stock_name = ? WHERE id = ?", (new, sid))
+        for table, col, keyed in _name_columns(conn):
+            if keyed:
+                n += conn.execute(f"UPDATE {table} SET {col} = ? WHERE symbol_id = ?", (new, sid)).rowcount
+            else:
+                n += conn.execute(f"UPDATE {table} SET {col} = ? WHERE {col} = ?", (new, old)).rowcount
+        n += rename_archived(conn, old, new)          # 压缩归档里的成交
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return n
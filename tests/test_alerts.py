@@ -0,0 +1,92 @@
+"""
+提醒引擎：状态不变的规则不重写 alert_state，待命 / 冷却状态变化时才落库；
+后台线程的连接遇到页面连接正在写时等锁，而不是报 database is locked。
+
+    python -m pytest tests/test_alerts.py -q
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock21.alerts import AlertEngine, ensure_alert_tables  # noqa: E402
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""CREATE TABLE signals (code TEXT PRIMARY KEY, high_point REAL, low_point REAL,
+                                          up_threshold REAL, down_threshold REAL)""")
+    conn.execute("""CREATE TABLE strategy_notes (code TEXT PRIMARY KEY, buy_base_price REAL, buy_drop_pct REAL,
+                                                 sell_base_price REAL, sell_rise_pct REAL)""")
+    conn.executemany("INSERT INTO signals VALUES (?,?,?,?,?)",
+                     [("A", 12, 10, 30, 30), ("B", 24, 20, 30, 30)])
+    ensure_alert_tables(conn)
+    return conn
+
+
+def _state_writes(conn, engine, prices):
+    stmts = []
+    conn.set_trace_callback(stmts.append)
+    try:
+        engine.process(prices, conn)
+    finally:
+        conn.set_trace_callback(None)
+    return [s for s in stmts if "alert_state" in s and not s.lstrip().upper().startswith("SELECT")]
+
+
+def test_unchanged_rules_are_not_rewritten(conn):
+    engine = AlertEngine(":memory:", [])
+    # 两只都在阈值之间：规则未触发且仍待命，与默认状态一致，无需落库
+    assert _state_writes(conn, engine, {"A": 11, "B": 22}) == []
+    assert conn.execute("SELECT COUNT(*) FROM alert_state").fetchone()[0] == 0
+
+
+def test_only_changed_rule_is_persisted(conn):
+    engine = AlertEngine(":memory:", [])
+    engine.process({"A": 13.5, "B": 22}, conn)    # A 自低点上涨 35%，卖出规则触发并解除待命
+    assert conn.execute("SELECT rule, armed FROM alert_state").fetchall() == [("signal:A:sell", 0)]
+    assert conn.execute("SELECT COUNT(*) FROM alert_log").fetchone()[0] == 1
+    # 同样的行情再来一批：状态不变，不写 alert_state，也不重复记日志
+    assert _state_writes(conn, engine, {"A": 13.5, "B": 22}) == []
+    assert conn.execute("SELECT COUNT(*) FROM alert_log").fetchone()[0] == 1
+    # 回到阈值另一侧超过回差：只有 A 的卖出规则重新待命
+    engine.process({"A": 12, "B": 22}, conn)
+    assert conn.execute("SELECT rule, armed FROM alert_state").fetchall() == [("signal:A:sell", 1)]
+
+
+def test_engine_waits_for_page_write(tmp_path, capsys):
+    db = str(tmp_path / "alerts.db")
+    with sqlite3.connect(db) as c:
+        c.execute("CREATE TABLE signals (code TEXT PRIMARY KEY, high_point REAL, low_point REAL, "
+                  "up_threshold REAL, down_threshold REAL)")
+        c.execute("CREATE TABLE strategy_notes (code TEXT PRIMARY KEY, buy_base_price REAL, buy_drop_pct REAL, "
+                  "sell_base_price REAL, sell_rise_pct REAL)")
+        c.execute("INSERT INTO signals VALUES ('A', 12, 10, 30, 30)")
+        ensure_alert_tables(c)
+    engine = AlertEngine(db, []).start()
+    page = sqlite3.connect(db)
+    try:
+        # 页面连接持有写锁期间推入一批触发规则的行情；锁释放后引擎的写入应完成
+        page.execute("BEGIN IMMEDIATE")
+        page.execute("UPDATE signals SET high_point = 12 WHERE code = 'A'")
+        engine.submit({"A": 13.5})
+        time.sleep(0.5)
+        page.commit()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            if page.execute("SELECT COUNT(*) FROM alert_log").fetchone()[0]:
+                break
+            time.sleep(0.05)
+    finally:
+        engine.stop()
+        page.close()
+    with sqlite3.connect(db) as c:
+        assert c.execute("SELECT rule, armed FROM alert_state").fetchall() == [("signal:A:sell", 0)]
+    assert "process failed" not in capsys.readouterr().out
+    assert not [t for t in threading.enumerate() if t.name == "alert-engine"]
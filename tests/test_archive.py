@@ -0,0 +1,91 @@
+"""
+归档后补录结转日当天或之前的成交：账本与持仓不再从结转状态续算，而是恢复该股归档、按完整历史配对，结果与从未归档一致。
+
+    python -m pytest tests/test_archive.py -q
+"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock21.archive import archive_closed, archive_summary, load_carry  # noqa: E402
+from stock21.ledger import LedgerCache  # noqa: E402
+from stock21.matching import POLICIES, match  # noqa: E402
+from stock21.portfolio import iter_positions  # noqa: E402
+
+TRADES = [("2020-01-02", "A", "买入", 10, 100), ("2020-02-03", "A", "买入", 12, 100),
+          ("2020-03-02", "A", "卖出", 13, 200), ("2020-04-01", "B", "买入", 5, 100),
+          ("2020-05-06", "B", "卖出", 6, 100), ("2024-01-02", "A", "买入", 11, 100),
+          ("2024-02-01", "A", "卖出", 14, 50)]
+BACKDATED = ("2020-02-10", "A", "买入", 8, 100)    # 早于已归档的卖出：最低成本规则下会被它平掉
+
+
+def _db(path, trades):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, code TEXT, action TEXT, price REAL, quantity INTEGER, note TEXT)""")
+    conn.executemany("INSERT INTO trades (date, code, action, price, quantity) VALUES (?, ?, ?, ?, ?)", trades)
+    conn.commit()
+    return conn
+
+
+def _book(conn, cache=None):
+    ledger = (cache or LedgerCache()).current(conn)
+    out = {}
+    for code in ledger.codes:
+        for p in POLICIES:
+            m = match(ledger.rows(code), p, start=ledger.start(code))
+            out[code, p] = (round(m.realized, 6), m.buy_lots, m.sell_lots, round(m.max_occupied, 6))
+    return out
+
+
+@pytest.fixture
+def archived(tmp_path):
+    conn = _db(tmp_path / "t.db", TRADES)
+    cache = LedgerCache()
+    assert archive_closed(conn, "2021-01-01")["trades"] == 5
+    cache.current(conn)
+    yield conn, cache
+    conn.close()
+
+
+@pytest.mark.parametrize("via", ["same", "other"])
+def test_backdated_insert_matches_full_history(archived, tmp_path, via):
+    conn, cache = archived
+    writer = conn if via == "same" else sqlite3.connect(tmp_path / "t.db")
+    writer.execute("INSERT INTO trades (date, code, action, price, quantity) VALUES (?, ?, ?, ?, ?)", BACKDATED)
+    writer.commit()
+    full = _db(":memory:", TRADES + [BACKDATED])
+    assert _book(conn, cache) == _book(full)
+    # 只恢复了 A；B 的归档与结转保持不变
+    assert set(load_carry(conn)) == {"B"}
+    assert archive_summary(conn)["trades"] == 2
+
+
+def test_backdated_edit_matches_full_history(archived):
+    conn, cache = archived
+    conn.execute("UPDATE trades SET date = '2020-02-10' WHERE date = '2024-01-02'")
+    conn.commit()
+    full = _db(":memory:", TRADES[:5] + [("2020-02-10",) + TRADES[5][1:], TRADES[6]])
+    assert _book(conn, cache) == _book(full)
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+def test_positions_see_restored_history(archived, policy):
+    conn, _ = archived
+    conn.execute("INSERT INTO trades (date, code, action, price, quantity) VALUES (?, ?, ?, ?, ?)", BACKDATED)
+    conn.commit()
+    full = _db(":memory:", TRADES + [BACKDATED])
+    assert list(iter_positions(conn, {}, ["A"], policy)) == list(iter_positions(full, {}, ["A"], policy))
+
+
+def test_later_trade_keeps_archive(archived):
+    conn, cache = archived
+    conn.execute("INSERT INTO trades (date, code, action, price, quantity) VALUES ('2024-03-01', 'A', '买入', 9, 10)")
+    conn.commit()
+    full = _db(":memory:", TRADES + [("2024-03-01", "A", "买入", 9, 10)])
+    assert _book(conn, cache) == _book(full)
+    assert cache.appends == 1 and set(load_carry(conn)) == {"A", "B"}
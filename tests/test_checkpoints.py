@@ -0,0 +1,36 @@
+"""
+历史日期账本：检查点续算与回放的成交顺序与账本一致（date, id, rowid），整表替换后 id 与 rowid 不同也不漂移。
+
+    python -m pytest tests/test_checkpoints.py -q
+"""
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock21.checkpoints import book_as_of  # noqa: E402
+from stock21.ledger import LedgerCache  # noqa: E402
+from stock21.matching import POLICIES, match  # noqa: E402
+
+
+@pytest.fixture
+def conn():
+    """📜 保存后的样子：to_sql replace 建的表没有 INTEGER PRIMARY KEY，同一天的 id 与 rowid 顺序相反"""
+    conn = sqlite3.connect(":memory:")
+    pd.DataFrame([(3, "2024-01-02", "A", "买入", 10.0, 100, ""), (2, "2024-01-02", "A", "买入", 12.0, 100, ""),
+                  (1, "2024-01-02", "A", "卖出", 11.0, 150, ""), (4, "2024-01-03", "A", "卖出", 13.0, 30, "")],
+                 columns=["id", "date", "code", "action", "price", "quantity", "note"]).to_sql("trades", conn, index=False)
+    return conn
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+def test_book_as_of_matches_ledger_order(conn, policy):
+    ledger = LedgerCache().current(conn)
+    live = match(ledger.rows("A"), policy)
+    book = book_as_of(conn, "2024-01-03", policy)["A"]
+    assert book.realized == pytest.approx(live.realized)
+    assert book.buy_lots == live.buy_lots and book.sell_lots == live.sell_lots
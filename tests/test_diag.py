@@ -0,0 +1,58 @@
+"""
+TracedCursor：fetchone / fetchmany / fetchall 与直接迭代游标取回的行都计入本轮重跑的 sql_rows（页面行数预算依赖它）。
+
+    python -m pytest tests/test_diag.py -q
+"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock21.diag import Recorder, TracedConnection  # noqa: E402
+import stock21.diag as diag  # noqa: E402
+
+
+@pytest.fixture
+def rec(monkeypatch):
+    rec = Recorder()
+    monkeypatch.setattr(diag, "RECORDER", rec)
+    rec.begin_rerun()
+    return rec
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", factory=TracedConnection)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(5)])
+    return conn
+
+
+def _rows(rec):
+    return rec._local.run["sql_rows"]
+
+
+def test_iterating_cursor_counts_rows(rec, conn):
+    assert [r[0] for r in conn.execute("SELECT x FROM t")] == [0, 1, 2, 3, 4]
+    assert _rows(rec) == 5
+    for (x,) in conn.execute("SELECT x FROM t WHERE x < 3"):
+        pass
+    assert _rows(rec) == 8
+
+
+def test_partial_iteration_counts_on_next_statement(rec, conn):
+    cur = conn.cursor()
+    for _ in cur.execute("SELECT x FROM t"):
+        break
+    cur.execute("SELECT 1")
+    assert _rows(rec) == 1
+
+
+@pytest.mark.parametrize("fetch, n", [(lambda c: c.fetchone(), 1), (lambda c: c.fetchmany(2), 2),
+                                      (lambda c: c.fetchall(), 5)])
+def test_fetch_methods_count_rows(rec, conn, fetch, n):
+    fetch(conn.execute("SELECT x FROM t"))
+    assert _rows(rec) == n
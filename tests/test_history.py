@@ -0,0 +1,59 @@
+"""
+日线是否需要刷新：按上次成功刷新的时间对照最近一个工作日收盘判断，周末、节假日不会因为没有新日线而每次都重拉。
+
+    python -m pytest tests/test_history.py -q
+"""
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock21 import history  # noqa: E402
+from stock21.history import ensure_history_tables, history_is_stale, last_close, update_daily_history  # noqa: E402
+
+FRI_EVENING = datetime(2026, 10, 16, 20, 0)     # 周五收盘后
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    ensure_history_tables(conn)
+    return conn
+
+
+def _refresh(conn, at, rows):
+    with mock.patch.object(history, "_fetch_eastmoney_klines", return_value=rows), \
+            mock.patch.object(history, "datetime", wraps=datetime) as dt:
+        dt.now.return_value = at
+        return update_daily_history(conn, {"A": "1.600000"}, ["A"])
+
+
+@pytest.mark.parametrize("now, expected", [
+    (datetime(2026, 10, 16, 20, 0), datetime(2026, 10, 16, 16, 0)),   # 周五收盘后 → 当天
+    (datetime(2026, 10, 16, 10, 0), datetime(2026, 10, 15, 16, 0)),   # 周五盘中 → 周四
+    (datetime(2026, 10, 18, 12, 0), datetime(2026, 10, 16, 16, 0)),   # 周日 → 周五
+    (datetime(2026, 10, 19, 9, 0), datetime(2026, 10, 16, 16, 0)),    # 周一开盘前 → 周五
+])
+def test_last_close(now, expected):
+    assert last_close(now) == expected
+
+
+def test_never_refreshed_is_stale(conn):
+    assert history_is_stale(conn, FRI_EVENING)
+
+
+def test_weekend_is_not_stale_after_friday_refresh(conn):
+    # 最新日线停在周五，周日打开页面不再重拉
+    assert _refresh(conn, FRI_EVENING, [("2026-10-16", 10, 11, 9, 10.5, 1000)]) == 1
+    assert not history_is_stale(conn, datetime(2026, 10, 18, 12, 0))
+    assert history_is_stale(conn, datetime(2026, 10, 19, 16, 30))
+
+
+def test_failed_fetch_does_not_mark_refreshed(conn):
+    assert _refresh(conn, FRI_EVENING, []) == 0
+    assert history_is_stale(conn, datetime(2026, 10, 18, 12, 0))
@@ -0,0 +1,74 @@
+"""
+进程内账本的版本判断：其他连接的追加走增量并入，原地改动（改方向、改非最新日期、改备注）与整表替换都触发整表重读。
+
+    python -m pytest tests/test_ledger.py -q
+"""
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock21.ledger import LedgerCache  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """页面连接与 CLI 连接各一个，指向同一个库文件"""
+    path = tmp_path / "t.db"
+    app = sqlite3.connect(path)
+    app.execute("""CREATE TABLE trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, code TEXT, action TEXT, price REAL, quantity INTEGER, note TEXT)""")
+    app.executemany("INSERT INTO trades (date, code, action, price, quantity, note) VALUES (?, ?, ?, ?, ?, ?)",
+                    [("2024-01-02", "A", "买入", 10, 100, ""), ("2024-01-05", "A", "买入", 11, 100, ""),
+                     ("2024-01-09", "A", "卖出", 12, 100, "")])
+    app.commit()
+    other = sqlite3.connect(path)
+    yield app, other
+    app.close()
+    other.close()
+
+
+@pytest.mark.parametrize("sql", [
+    "UPDATE trades SET action = '卖出' WHERE id = 2",          # 方向互换，成交额合计不变
+    "UPDATE trades SET date = '2024-01-04' WHERE id = 2",      # 改非最新一笔的日期
+    "UPDATE trades SET note = 'x' WHERE id = 1",
+    "DELETE FROM trades WHERE id = 1",
+])
+def test_in_place_edit_from_other_connection_reloads(db, sql):
+    app, other = db
+    cache = LedgerCache()
+    before = cache.current(app)
+    other.execute(sql)
+    other.commit()
+    after = cache.current(app)
+    assert after is not before and cache.loads == 2 and cache.appends == 0
+    assert after.frame.drop(columns="_rowid").astype(str).values.tolist() == \
+        LedgerCache().current(app).frame.drop(columns="_rowid").astype(str).values.tolist()
+
+
+def test_append_from_other_connection_extends(db):
+    app, other = db
+    cache = LedgerCache()
+    cache.current(app)
+    other.execute("INSERT INTO trades (date, code, action, price, quantity) VALUES ('2024-02-01', 'B', '买入', 5, 10)")
+    other.commit()
+    ledger = cache.current(app)
+    assert (cache.loads, cache.appends) == (1, 1)
+    assert list(ledger.trades("B")["price"]) == [5.0]
+    assert cache.current(app) is ledger
+
+
+def test_table_replace_reloads(db):
+    app, other = db
+    cache = LedgerCache()
+    cache.current(app)
+    df = pd.read_sql("SELECT * FROM trades", other).assign(action=["卖出", "买入", "卖出"])
+    df.to_sql("trades", other, if_exists="replace", index=False)
+    other.commit()
+    ledger = cache.current(app)
+    assert cache.loads == 2
+    assert list(ledger.trades("A")["action"].astype(str)) == ["卖出", "买入", "卖出"]
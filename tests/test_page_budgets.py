@@ -0,0 +1,116 @@
+"""
+页面 SQL 预算：用合成账本 fixture 库（2000 笔 × 20 只，固定种子）逐页渲染，统计每次渲染执行的语句条数、取回行数与耗时，
+超出 PAGE_BUDGETS 即失败，并附上按语句归并的明细（重复执行的语句多半是 N+1）。
+
+    python -m pytest tests/test_page_budgets.py -q
+    STOCK21_BUDGET_TIME_SCALE=3 python -m pytest tests/test_page_budgets.py     # 慢机器上放宽耗时预算
+
+语句与行数由 stock21.diag 的 TracedConnection 记录（fetchone / fetchmany / fetchall 与
+直接迭代游标取回的行）。外部网络与 yfinance 一律断开，行情刷新按“5 分钟内已拉取”跳过。
+"""
+import os
+import sqlite3
+import sys
+import time
+import urllib.error
+from unittest import mock
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.ledger import make_ledger, make_prices, make_price_targets, make_db  # noqa: E402
+from stock21.diag import RECORDER  # noqa: E402
+
+APP = os.path.join(ROOT, "app.py")
+FIXTURE_SIZE = (2000, 20)
+TIME_SCALE = float(os.getenv("STOCK21_BUDGET_TIME_SCALE", "1"))
+
+# 页面: (语句条数, 取回行数, 耗时秒)；按 fixture 实测值留约一成余量（每只股票多一条语句就会超出），优化后同步收紧
+PAGE_BUDGETS = {
+    "🏠 股票详情中心": (60, 98, 3.0),
+    "📊 实时持仓": (48, 92, 3.0),
+    "💰 盈利账单": (56, 445, 3.0),
+    "🎯 价格目标管理": (92, 135, 3.0),
+    "📝 交易录入": (44, 105, 3.0),
+    "🔔 买卖信号": (52, 92, 3.0),
+    "📜 历史明细": (44, 2300, 3.0),
+    "📓 复盘日记": (46, 70, 3.0),
+}
+
+
+def _offline(*args, **kwargs):
+    raise urllib.error.URLError("network disabled in tests")
+
+
+def _make_fixture(path):
+    ledger = make_ledger(*FIXTURE_SIZE, seed=0)
+    prices = make_prices(ledger, seed=0)
+    mem = make_db(ledger, prices, make_price_targets(prices, seed=0))
+    dst = sqlite3.connect(path)
+    mem.backup(dst)
+    dst.close()
+    mem.close()
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    """共用一个 AppTest 会话（与真实用户一样在页面间切换）；首次渲染完成建表、缓存连接等一次性工作"""
+    from streamlit.testing.v1 import AppTest
+
+    data_dir = tmp_path_factory.mktemp("data")
+    _make_fixture(data_dir / "stock_data_v12.db")
+    env = {"STREAMLIT_DATA_DIR": str(data_dir), "METRICS_PORT": "0", "GITHUB_TOKEN": "", "REPO_URL": "",
+           "ALERT_FILE": str(data_dir / "alerts.jsonl")}
+    with mock.patch.dict(os.environ, env), mock.patch("urllib.request.urlopen", _offline), \
+            mock.patch("yfinance.Ticker", side_effect=_offline, create=True):
+        at = AppTest.from_file(APP, default_timeout=120)
+        at.session_state["_prices_fetch_ts"] = time.time()
+        at.run()
+        assert not at.exception, [e.value for e in at.exception]
+        yield at
+
+
+def _render(at, page):
+    """渲染一次页面：已在该页时原地重跑，否则从侧栏切换；返回 (语句明细, 条数, 行数, 秒)"""
+    RECORDER.reset()
+    t0 = time.perf_counter()
+    radio = at.sidebar.radio[0]
+    (at.run() if radio.value == page else radio.set_value(page).run())
+    seconds = time.perf_counter() - t0
+    assert not at.exception, [e.value for e in at.exception]
+    with RECORDER.lock:
+        queries = list(RECORDER.queries)
+    count = sum(q[3] == "execute" for q in queries)
+    rows = sum(q[4] for q in queries)
+    return queries, count, rows, seconds
+
+
+def _report(queries, top=25) -> str:
+    """按语句归并：执行次数、取回行数、总耗时，按次数降序"""
+    by = {}
+    for _, sql, sec, phase, rows in queries:
+        s = by.setdefault(sql, [0, 0, 0.0])
+        s[0] += phase == "execute"
+        s[1] += rows
+        s[2] += sec
+    lines = [f"{'次数':>6} {'行数':>8} {'毫秒':>9}  语句"]
+    for sql, (n, rows, sec) in sorted(by.items(), key=lambda kv: (-kv[1][0], -kv[1][2]))[:top]:
+        lines.append(f"{n:>6} {rows:>8} {sec * 1000:>9.1f}  {sql[:160]}")
+    return "\n".join(lines)
+
+
+@pytest.mark.parametrize("page", list(PAGE_BUDGETS))
+def test_page_within_budget(app, page):
+    max_queries, max_rows, max_seconds = PAGE_BUDGETS[page]
+    _render(app, page)                       # 先切到该页（页面自身的一次性初始化不计入）
+    queries, count, rows, seconds = _render(app, page)
+    over = []
+    if count > max_queries:
+        over.append(f"语句 {count} > {max_queries}")
+    if rows > max_rows:
+        over.append(f"行数 {rows} > {max_rows}")
+    if seconds > max_seconds * TIME_SCALE:
+        over.append(f"耗时 {seconds:.2f}s > {max_seconds * TIME_SCALE:.2f}s")
+    assert not over, f"{page} 超出预算：{'；'.join(over)}\n{_report(queries)}"
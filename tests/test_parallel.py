@@ -0,0 +1,48 @@
+"""
+进程池配对：工作进程不重新执行主模块（Streamlit 下即 app.py），结果与单进程逐只配对一致。
+
+    python -m pytest tests/test_parallel.py -q
+"""
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.ledger import make_ledger  # noqa: E402
+from stock21 import parallel  # noqa: E402
+from stock21.ledger import Ledger  # noqa: E402
+from stock21.matching import POLICIES  # noqa: E402
+
+
+@pytest.fixture
+def fake_main(tmp_path, monkeypatch):
+    """模拟 Streamlit：__main__ 是一个脚本文件，被执行时留下标记"""
+    marker = tmp_path / "main-ran"
+    script = tmp_path / "app.py"
+    script.write_text(f"open({str(marker)!r}, 'w').close()\n", encoding="utf-8")
+    main = types.ModuleType("__main__")
+    main.__file__ = str(script)
+    monkeypatch.setitem(sys.modules, "__main__", main)
+    yield main, marker
+    with parallel._pool_lock:
+        if parallel._pool is not None:
+            parallel._pool.shutdown(wait=True)
+            parallel._pool = None
+
+
+def _summary(res):
+    return {c: {p: (round(m.realized, 6), m.buy_lots, m.sell_lots) for p, m in r.items()} for c, r in res.items()}
+
+
+def test_pool_does_not_run_main_and_matches_serial(fake_main):
+    main, marker = fake_main
+    ledger = Ledger(make_ledger(600, 8, seed=1).assign(_rowid=lambda d: range(1, len(d) + 1)))
+    serial = parallel.match_symbols(ledger, None, POLICIES, keep_pairs=False, workers=1)
+    pooled = parallel.match_symbols(ledger, None, POLICIES, keep_pairs=False, workers=2, min_trades=0, min_symbols=0)
+    assert parallel._pool is not None, "进程池未能启动，走了单进程兜底"
+    assert _summary(pooled) == _summary(serial)
+    assert not marker.exists()
+    assert sys.modules["__main__"] is main
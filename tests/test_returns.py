@@ -0,0 +1,81 @@
+"""
+收益率引擎：批量 XIRR 的求根边界（根恰好落在利率网格点、无解），含外币持仓时账户时间加权收益的币种口径。
+
+    python -m pytest tests/test_returns.py -q
+"""
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock21.fx import ensure_fx_tables, load_fx  # noqa: E402
+from stock21.history import ensure_history_tables  # noqa: E402
+from stock21.nav import ensure_nav_tables, load_equity_curve  # noqa: E402
+from stock21.returns import compute_returns, xirr_matrix, PORTFOLIO  # noqa: E402
+
+
+def _xirr(*rows):
+    """rows 为 [(年数, 金额), ...]，补齐成矩阵后一次求解"""
+    width = max(len(r) for r in rows)
+    amounts, years = np.zeros((len(rows), width)), np.zeros((len(rows), width))
+    for i, r in enumerate(rows):
+        for j, (t, a) in enumerate(r):
+            years[i, j], amounts[i, j] = t, a
+    return xirr_matrix(amounts, years)
+
+
+@pytest.mark.parametrize("flows, expected", [
+    ([(0, -1000), (1, 1000)], 0.0),              # 持平：根在网格点 0
+    ([(0, -1000), (1, 1100)], 0.1),              # 根在网格点 0.1
+    ([(0, -1000), (1, 1300)], 0.3),              # 根在网格点 0.3
+    ([(0, -1000), (1, 1050)], 0.05),             # 根在两个网格点之间
+    ([(0, -1000), (0.5, 500), (1, 600)], None),  # 多笔现金流，与逐笔贴现的净现值为 0 对照
+])
+def test_xirr_roots(flows, expected):
+    r = _xirr(flows)[0]
+    if expected is None:
+        assert abs(sum(a / (1 + r) ** t for t, a in flows)) < 1e-6
+    else:
+        assert r == pytest.approx(expected, abs=1e-9)
+
+
+def test_xirr_no_root_is_nan():
+    r = _xirr([(0, -1000), (1, -5)], [(0, -1000), (1, 1000)])
+    assert np.isnan(r[0]) and r[1] == pytest.approx(0.0)
+
+
+def _usd_db():
+    """一只美股持仓：汇率 7.1、收盘价与现价始终 100、10 股不动"""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""CREATE TABLE trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, code TEXT, action TEXT, price REAL, quantity INTEGER, note TEXT)""")
+    conn.execute("CREATE TABLE prices (code TEXT PRIMARY KEY, current_price REAL, manual_cost REAL)")
+    conn.execute("CREATE TABLE stock_info (id INTEGER PRIMARY KEY AUTOINCREMENT, stock_name TEXT UNIQUE, stock_code TEXT)")
+    ensure_history_tables(conn)
+    ensure_nav_tables(conn)
+    ensure_fx_tables(conn)
+    conn.execute("INSERT INTO stock_info (stock_name, stock_code) VALUES ('USX', '105.USX')")
+    conn.execute("INSERT INTO trades (date, code, action, price, quantity) VALUES ('2024-01-02', 'USX', '买入', 100, 10)")
+    conn.execute("INSERT INTO prices VALUES ('USX', 100, 0)")
+    conn.execute("INSERT INTO fx_rates VALUES ('USD', '2024-01-01', 7.1, 'test', '2024-01-01 00:00:00')")
+    conn.executemany("INSERT INTO daily_prices (code, date, close) VALUES ('USX', ?, 100)",
+                     [(d,) for d in ("2024-01-02", "2024-01-03", "2024-01-04", "2024-06-28")])
+    conn.commit()
+    return conn
+
+
+def test_portfolio_twr_flat_foreign_holding():
+    conn = _usd_db()
+    out = compute_returns(conn, asof="2024-12-31")
+    assert out.loc["USX", "twr"] == pytest.approx(0.0, abs=1e-9)
+    assert out.loc[PORTFOLIO, "twr"] == pytest.approx(0.0, abs=1e-9)
+    assert out.loc[PORTFOLIO, "twr_annual"] == pytest.approx(0.0, abs=1e-9)
+    assert out.loc[PORTFOLIO, "value"] == pytest.approx(7100.0)
+
+    curve = load_equity_curve(conn, fx=load_fx(conn), currencies={"USX": "USD"})
+    assert curve["twr_index"].to_numpy() == pytest.approx(1.0)
+    assert curve["market_value"].iloc[-1] == pytest.approx(7100.0)
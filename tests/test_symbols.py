@@ -0,0 +1,144 @@
+"""
+股票删除：成交（含已归档）、复盘日记、决策历史仍引用时拒绝删除；外键开启后数据库本身也拒绝删除被引用的 stock_info 行；
+📝 交易录入页的“股票列表管理”走同一条路径（AppTest 渲染页面后点击添加 / 删除）。
+
+    python -m pytest tests/test_symbols.py -q
+"""
+import os
+import sqlite3
+import sys
+import time
+import urllib.error
+from unittest import mock
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.ledger import make_ledger, make_prices, make_price_targets, make_db  # noqa: E402
+from stock21.archive import archive_closed  # noqa: E402
+from stock21.symbols import ensure_symbol_keys, delete_symbol, symbol_id  # noqa: E402
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("CREATE TABLE stock_info (id INTEGER PRIMARY KEY AUTOINCREMENT, stock_name TEXT UNIQUE, stock_code TEXT)")
+    conn.execute("""CREATE TABLE trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, code TEXT, action TEXT, price REAL, quantity INTEGER, note TEXT)""")
+    conn.execute("CREATE TABLE prices (code TEXT PRIMARY KEY, current_price REAL, manual_cost REAL)")
+    conn.execute("CREATE TABLE journal (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, stock_name TEXT, content TEXT)")
+    conn.execute("CREATE TABLE decision_history (id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT, date TEXT, decision TEXT, reason TEXT)")
+    ensure_symbol_keys(conn)
+    conn.execute("INSERT INTO prices (code, current_price, manual_cost) VALUES ('A', 10, 0)")
+    conn.commit()
+    return conn
+
+
+def test_delete_unreferenced_symbol_removes_settings(conn):
+    sid = symbol_id(conn, "A")
+    assert delete_symbol(conn, sid) == "A"
+    assert symbol_id(conn, "A") is None
+    assert conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0] == 0
+
+
+@pytest.mark.parametrize("sql", [
+    "INSERT INTO trades (date, code, action, price, quantity) VALUES ('2024-01-02', 'A', '买入', 10, 100)",
+    "INSERT INTO journal (date, stock_name, content) VALUES ('2024-01-02', 'A', 'x')",
+    "INSERT INTO decision_history (code, date, decision) VALUES ('A', '2024-01-02', '持有')",
+])
+def test_referenced_symbol_is_kept(conn, sql):
+    conn.execute(sql)
+    conn.commit()
+    with pytest.raises(ValueError):
+        delete_symbol(conn, symbol_id(conn, "A"))
+    assert symbol_id(conn, "A") is not None
+
+
+def test_fully_archived_symbol_is_kept(conn):
+    conn.executemany("INSERT INTO trades (date, code, action, price, quantity) VALUES (?, 'A', ?, 10, 100)",
+                     [("2020-01-02", "买入"), ("2020-02-03", "卖出")])
+    conn.commit()
+    assert archive_closed(conn, "2021-01-01")["trades"] == 2
+    assert conn.execute("SELECT COUNT(*) FROM trades").fetchone()[0] == 0
+    with pytest.raises(ValueError, match="trade_archive 2"):
+        delete_symbol(conn, symbol_id(conn, "A"))
+
+
+def test_foreign_key_is_enforced(conn):
+    conn.execute("INSERT INTO journal (date, stock_name, content) VALUES ('2024-01-02', 'A', 'x')")
+    conn.commit()
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("DELETE FROM stock_info WHERE stock_name = 'A'")
+
+
+def _offline(*args, **kwargs):
+    raise urllib.error.URLError("network disabled in tests")
+
+
+@pytest.fixture(scope="module")
+def page(tmp_path_factory):
+    """小账本 fixture 库上的 📝 交易录入页；连接等按进程缓存，前后各清一次，免得与其他模块的 fixture 库串用"""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+    tmp_path = tmp_path_factory.mktemp("data")
+    ledger = make_ledger(200, 3, seed=0)
+    prices = make_prices(ledger, seed=0)
+    mem = make_db(ledger, prices, make_price_targets(prices, seed=0))
+    db = sqlite3.connect(tmp_path / "stock_data_v12.db")
+    mem.backup(db)
+    db.close()
+    mem.close()
+    env = {"STREAMLIT_DATA_DIR": str(tmp_path), "METRICS_PORT": "0", "GITHUB_TOKEN": "", "REPO_URL": "",
+           "ALERT_FILE": str(tmp_path / "alerts.jsonl")}
+    with mock.patch.dict(os.environ, env), mock.patch("urllib.request.urlopen", _offline), \
+            mock.patch("yfinance.Ticker", side_effect=_offline, create=True):
+        at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+        at.session_state["_prices_fetch_ts"] = time.time()
+        at.run()
+        at.sidebar.radio[0].set_value("📝 交易录入").run()
+        assert not at.exception, [e.value for e in at.exception]
+        yield at, tmp_path / "stock_data_v12.db"
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+
+def _button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def _delete(at, db, name):
+    with sqlite3.connect(db) as conn:
+        sid = symbol_id(conn, name)
+    at.selectbox(key="delete_stock_id").set_value(sid)
+    _button(at, "🗑️ 删除").click().run()
+    assert not at.exception, [e.value for e in at.exception]
+
+
+def _names(db):
+    with sqlite3.connect(db) as conn:
+        return {r[0] for r in conn.execute("SELECT stock_name FROM stock_info")}
+
+
+def test_page_adds_and_deletes_unreferenced_symbol(page):
+    at, db = page
+    at.text_input[[t.label for t in at.text_input].index("股票名称")].input("闲置股")
+    at.text_input[[t.label for t in at.text_input].index("股票代码（纯代码）")].input("00700")
+    _button(at, "➕ 添加股票").click().run()
+    assert "闲置股" in _names(db)
+    _delete(at, db, "闲置股")
+    assert "闲置股" not in _names(db)
+    assert any("已删除：闲置股" in s.value for s in at.success)
+
+
+def test_page_refuses_to_delete_referenced_symbol(page):
+    at, db = page
+    _delete(at, db, "股票0000")
+    assert "股票0000" in _names(db)
+    assert any("仍有记录" in w.value for w in at.warning)